@@ -1,51 +1,33 @@
-import datetime
 import socket
 
-import psutil
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .conntrack import aggregate_by_process, get_conntrack_source, read_conntrack_sudo
+from .connections_table import CONNECTIONS_MAX_LIMIT, CONNECTIONS_PAGE_LIMIT, connections_table, query_rows
+from .conntrack_sampler import CONNTRACK_TOP_N, ConntrackSampler, conntrack_samplers, stream_samples
+from .process_attribution import SocketIndex
 
 router = APIRouter()
 
 @router.get("/api/connections")
-async def get_connections():
-    connections = []
-    for conn in psutil.net_connections(kind="inet"):
-        laddr = f"{conn.laddr.ip}:{conn.laddr.port}" if conn.laddr else ""
-        raddr = f"{conn.raddr.ip}:{conn.raddr.port}" if conn.raddr else ""
-        proc_name = ""
-        create_time = ""
-        # Определяем протокол
-        if conn.type == socket.SOCK_STREAM:
-            protocol = "TCP"
-        elif conn.type == socket.SOCK_DGRAM:
-            protocol = "UDP"
-        elif conn.type == socket.SOCK_RAW:
-            protocol = "RAW"
-        else:
-            protocol = f"UNKNOWN ({conn.type})"
-        try:
-            if conn.pid:
-                proc = psutil.Process(conn.pid)
-                proc_name = proc.name()
-                # Получаем время запуска процесса (секунды с эпохи)
-                proc_create_time = proc.create_time()
-                # Переводим в человекочитаемый формат
-                create_time = datetime.datetime.fromtimestamp(proc_create_time).strftime("%d.%m.%Y %H:%M:%S")
-        except Exception:
-            proc_name = "Неизвестно"
-            create_time = ""
-        connections.append({
-            "process": proc_name if proc_name else "Неизвестно",
-            "protocol": protocol,
-            "local_address": conn.laddr.ip if conn.laddr else "",
-            "local_port": conn.laddr.port if conn.laddr else "",
-            "remote_address": conn.raddr.ip if conn.raddr else "",
-            "remote_port": conn.raddr.port if conn.raddr else "",
-            "status": conn.status,
-            "create_time": create_time  # Время запуска процесса
-        })
-    return JSONResponse(connections)
+async def get_connections(protocol: str | None = None, status: str | None = None, port: int | None = None,
+                          process: str | None = None, sort: str | None = None, order: str = "asc",
+                          offset: int = 0, limit: int = CONNECTIONS_PAGE_LIMIT):
+    """
+    Страница сетевых соединений с фильтрами (protocol, status, port, process)
+    и сортировкой. Общее число найденных соединений - в заголовке X-Total-Count.
+    """
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+    rows = await connections_table.snapshot()
+    try:
+        page, total = query_rows(rows, protocol=protocol, status=status, port=port, process=process, sort=sort,
+                                 descending=order == "desc", offset=max(0, offset),
+                                 limit=max(1, min(limit, CONNECTIONS_MAX_LIMIT)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(page, headers={"X-Total-Count": str(total)})
 
 @router.get("/api/adapters")
 async def get_adapters():
@@ -91,77 +73,12 @@ async def get_bandwidth():
     import psutil
     
     proc_stats = collections.defaultdict(lambda: {"connections": 0, "bytes_recv": 0, "bytes_sent": 0})
+    # Один снимок сокетов на запрос: процесс по адресу записи conntrack находится за O(1)
+    sockets = SocketIndex.snapshot()
     
-    # Попытка получить трафик из /proc/net/nf_conntrack (более точные данные)
+    # Попытка получить трафик из таблицы conntrack (более точные данные), источник - CONNTRACK_SOURCE
     try:
-        with open("/proc/net/nf_conntrack") as f:
-            for line in f:
-                if not line.strip():
-                    continue
-                
-                # Парсим строку nf_conntrack
-                parts = line.split()
-                if len(parts) < 10:
-                    continue
-                
-                try:
-                    protocol = parts[2]  # tcp, udp, icmp
-                    state = parts[5]     # ESTABLISHED, TIME_WAIT, etc.
-                    
-                    # Ищем src и dst адреса, порты и трафик
-                    src_addr = None
-                    dst_addr = None
-                    src_port = None
-                    dst_port = None
-                    packets_in = 0
-                    bytes_in = 0
-                    packets_out = 0
-                    bytes_out = 0
-                    
-                    for i, part in enumerate(parts):
-                        if part == "src=":
-                            src_addr = parts[i+1]
-                        elif part == "dst=":
-                            dst_addr = parts[i+1]
-                        elif part == "sport=":
-                            src_port = parts[i+1]
-                        elif part == "dport=":
-                            dst_port = parts[i+1]
-                        elif part == "packets=":
-                            if packets_in == 0:
-                                packets_in = int(parts[i+1])
-                            else:
-                                packets_out = int(parts[i+1])
-                        elif part == "bytes=":
-                            if bytes_in == 0:
-                                bytes_in = int(parts[i+1])
-                            else:
-                                bytes_out = int(parts[i+1])
-                    
-                    if src_addr and dst_addr:
-                        # Пытаемся найти процесс по адресу и порту
-                        process_name = "unknown"
-                        try:
-                            for conn in psutil.net_connections(kind="inet"):
-                                if (conn.laddr and conn.laddr.ip == src_addr and 
-                                    str(conn.laddr.port) == src_port):
-                                    if conn.pid:
-                                        proc = psutil.Process(conn.pid)
-                                        process_name = proc.name()
-                                    break
-                        except:
-                            pass
-                        
-                        if process_name not in proc_stats:
-                            proc_stats[process_name] = {"connections": 0, "bytes_recv": 0, "bytes_sent": 0}
-                        
-                        proc_stats[process_name]["connections"] += 1
-                        proc_stats[process_name]["bytes_recv"] += bytes_in
-                        proc_stats[process_name]["bytes_sent"] += bytes_out
-                        
-                except Exception:
-                    continue
-                    
+        proc_stats.update(aggregate_by_process(get_conntrack_source().entries(), sockets))
     except Exception:
         # Fallback к старому методу если nf_conntrack недоступен
         # Попытка получить трафик из /proc/net/dev (общий трафик по интерфейсам)
@@ -243,6 +160,21 @@ async def get_bandwidth():
     
     return result
 
+@router.get("/api/bandwidth/rates")
+async def get_bandwidth_rates(top: int = CONNTRACK_TOP_N):
+    """API для скоростей трафика: дельты conntrack с прошлого снимка, top-N соединений и процессов"""
+    try:
+        sample = await conntrack_samplers.local().sample()
+    except Exception as e:
+        return {"error": f"Ошибка чтения таблицы conntrack: {e!s}"}
+    return ConntrackSampler.top(sample, max(1, top))
+
+@router.get("/api/bandwidth/stream")
+async def stream_bandwidth_rates(top: int = CONNTRACK_TOP_N):
+    """Поток скоростей трафика (Server-Sent Events): один общий опрос таблицы на всех клиентов"""
+    return StreamingResponse(stream_samples(conntrack_samplers.local(), max(1, top)), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
 @router.get("/api/nf_conntrack")
 async def get_nf_conntrack():
     """API для получения данных из /proc/net/nf_conntrack с группировкой по процессам"""
@@ -258,168 +190,16 @@ async def get_nf_conntrack():
         "protocols": set(),
         "remote_ips": set()
     })
+    # Один снимок сокетов на запрос: процесс по адресу записи conntrack находится за O(1)
+    sockets = SocketIndex.snapshot()
     
-    # Попытка 1: Чтение /proc/net/nf_conntrack (требует root)
+    # Попытка 1: Дамп через netlink или чтение /proc/net/nf_conntrack (требует root), см. CONNTRACK_SOURCE
     try:
-        with open("/proc/net/nf_conntrack") as f:
-            for line in f:
-                if not line.strip():
-                    continue
-                
-                # Парсим строку nf_conntrack
-                parts = line.split()
-                if len(parts) < 10:
-                    continue
-                
-                try:
-                    protocol = parts[2]  # tcp, udp, icmp
-                    state = parts[5]     # ESTABLISHED, TIME_WAIT, etc.
-                    
-                    # Ищем src и dst адреса, порты и трафик
-                    src_addr = None
-                    dst_addr = None
-                    src_port = None
-                    dst_port = None
-                    packets_in = 0
-                    bytes_in = 0
-                    packets_out = 0
-                    bytes_out = 0
-                    
-                    for i, part in enumerate(parts):
-                        if part == "src=":
-                            src_addr = parts[i+1]
-                        elif part == "dst=":
-                            dst_addr = parts[i+1]
-                        elif part == "sport=":
-                            src_port = parts[i+1]
-                        elif part == "dport=":
-                            dst_port = parts[i+1]
-                        elif part == "packets=":
-                            if packets_in == 0:
-                                packets_in = int(parts[i+1])
-                            else:
-                                packets_out = int(parts[i+1])
-                        elif part == "bytes=":
-                            if bytes_in == 0:
-                                bytes_in = int(parts[i+1])
-                            else:
-                                bytes_out = int(parts[i+1])
-                    
-                    if src_addr and dst_addr:
-                        # Пытаемся найти процесс по адресу и порту
-                        process_name = "unknown"
-                        try:
-                            for conn in psutil.net_connections(kind="inet"):
-                                if (conn.laddr and conn.laddr.ip == src_addr and 
-                                    str(conn.laddr.port) == src_port):
-                                    if conn.pid:
-                                        proc = psutil.Process(conn.pid)
-                                        process_name = proc.name()
-                                    break
-                        except:
-                            pass
-                        
-                        if process_name not in proc_stats:
-                            proc_stats[process_name] = {
-                                "connections": 0, 
-                                "bytes_recv": 0, 
-                                "bytes_sent": 0,
-                                "protocols": set(),
-                                "remote_ips": set()
-                            }
-                        
-                        proc_stats[process_name]["connections"] += 1
-                        proc_stats[process_name]["bytes_recv"] += bytes_in
-                        proc_stats[process_name]["bytes_sent"] += bytes_out
-                        proc_stats[process_name]["protocols"].add(protocol.upper())
-                        proc_stats[process_name]["remote_ips"].add(dst_addr)
-                        
-                except Exception:
-                    continue
-    
+        proc_stats.update(aggregate_by_process(get_conntrack_source().entries(), sockets))
     except PermissionError:
         # Попытка 2: Используем sudo для чтения nf_conntrack
         try:
-            result = subprocess.run(["sudo", "cat", "/proc/net/nf_conntrack"], 
-                                  capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                for line in result.stdout.splitlines():
-                    if not line.strip():
-                        continue
-                    
-                    # Парсим строку nf_conntrack
-                    parts = line.split()
-                    if len(parts) < 10:
-                        continue
-                    
-                    try:
-                        protocol = parts[2]  # tcp, udp, icmp
-                        state = parts[5]     # ESTABLISHED, TIME_WAIT, etc.
-                        
-                        # Ищем src и dst адреса, порты и трафик
-                        src_addr = None
-                        dst_addr = None
-                        src_port = None
-                        dst_port = None
-                        packets_in = 0
-                        bytes_in = 0
-                        packets_out = 0
-                        bytes_out = 0
-                        
-                        for i, part in enumerate(parts):
-                            if part == "src=":
-                                src_addr = parts[i+1]
-                            elif part == "dst=":
-                                dst_addr = parts[i+1]
-                            elif part == "sport=":
-                                src_port = parts[i+1]
-                            elif part == "dport=":
-                                dst_port = parts[i+1]
-                            elif part == "packets=":
-                                if packets_in == 0:
-                                    packets_in = int(parts[i+1])
-                                else:
-                                    packets_out = int(parts[i+1])
-                            elif part == "bytes=":
-                                if bytes_in == 0:
-                                    bytes_in = int(parts[i+1])
-                                else:
-                                    bytes_out = int(parts[i+1])
-                        
-                        if src_addr and dst_addr:
-                            # Пытаемся найти процесс по адресу и порту
-                            process_name = "unknown"
-                            try:
-                                for conn in psutil.net_connections(kind="inet"):
-                                    if (conn.laddr and conn.laddr.ip == src_addr and 
-                                        str(conn.laddr.port) == src_port):
-                                        if conn.pid:
-                                            proc = psutil.Process(conn.pid)
-                                            process_name = proc.name()
-                                        break
-                            except:
-                                pass
-                            
-                            if process_name not in proc_stats:
-                                proc_stats[process_name] = {
-                                    "connections": 0, 
-                                    "bytes_recv": 0, 
-                                    "bytes_sent": 0,
-                                    "protocols": set(),
-                                    "remote_ips": set()
-                                }
-                            
-                            proc_stats[process_name]["connections"] += 1
-                            proc_stats[process_name]["bytes_recv"] += bytes_in
-                            proc_stats[process_name]["bytes_sent"] += bytes_out
-                            proc_stats[process_name]["protocols"].add(protocol.upper())
-                            proc_stats[process_name]["remote_ips"].add(dst_addr)
-                            
-                    except Exception:
-                        continue
-            else:
-                raise Exception("sudo cat /proc/net/nf_conntrack failed")
-                
+            proc_stats.update(aggregate_by_process(read_conntrack_sudo(), sockets))
         except Exception:
             # Попытка 3: Fallback к обычному методу через psutil и ss
             try:
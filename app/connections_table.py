@@ -0,0 +1,130 @@
+import asyncio
+import os
+import socket
+import time
+
+import psutil
+
+from .process_attribution import ProcessInfoCache, process_info_cache
+
+# Время жизни снимка сокетов (секунды): запросы страниц и фильтров в пределах
+# этого времени используют один вызов psutil.net_connections
+CONNECTIONS_SNAPSHOT_TTL = float(os.getenv("CONNECTIONS_SNAPSHOT_TTL", 2))
+# Размер страницы по умолчанию и максимальный
+CONNECTIONS_PAGE_LIMIT = int(os.getenv("CONNECTIONS_PAGE_LIMIT", 500))
+CONNECTIONS_MAX_LIMIT = int(os.getenv("CONNECTIONS_MAX_LIMIT", 5000))
+
+UNKNOWN_PROCESS = "Неизвестно"
+
+PROTOCOLS = {
+    socket.SOCK_STREAM: "TCP",
+    socket.SOCK_DGRAM: "UDP",
+    socket.SOCK_RAW: "RAW",
+}
+
+
+def _port_key(port) -> int:
+    return port if port != "" else -1
+
+
+# Ключи сортировки: время запуска сортируется по секундам с эпохи, а не по строке
+SORT_KEYS = {
+    "process": lambda row: row[0]["process"].lower(),
+    "protocol": lambda row: row[0]["protocol"],
+    "local_address": lambda row: row[0]["local_address"],
+    "local_port": lambda row: _port_key(row[0]["local_port"]),
+    "remote_address": lambda row: row[0]["remote_address"],
+    "remote_port": lambda row: _port_key(row[0]["remote_port"]),
+    "status": lambda row: row[0]["status"],
+    "create_time": lambda row: row[1],
+}
+
+
+def build_rows(connections, info_cache: ProcessInfoCache | None = None) -> list[tuple[dict, float]]:
+    """
+    Строки таблицы соединений: (словарь ответа, время запуска процесса).
+    Метаданные каждого PID запрашиваются один раз на снимок, а не на сокет.
+    """
+    info_cache = info_cache or process_info_cache
+    infos = {}
+    rows = []
+    for conn in connections:
+        info = None
+        if conn.pid:
+            if conn.pid in infos:
+                info = infos[conn.pid]
+            else:
+                info = infos[conn.pid] = info_cache.get(conn.pid)
+        rows.append(({
+            "process": info.name if info and info.name else UNKNOWN_PROCESS,
+            "protocol": PROTOCOLS.get(conn.type, f"UNKNOWN ({conn.type})"),
+            "local_address": conn.laddr.ip if conn.laddr else "",
+            "local_port": conn.laddr.port if conn.laddr else "",
+            "remote_address": conn.raddr.ip if conn.raddr else "",
+            "remote_port": conn.raddr.port if conn.raddr else "",
+            "status": conn.status,
+            "create_time": info.started if info else "",  # Время запуска процесса
+        }, info.create_time if info else 0.0))
+    return rows
+
+
+def query_rows(rows: list[tuple[dict, float]], protocol: str | None = None, status: str | None = None,
+               port: int | None = None, process: str | None = None, sort: str | None = None,
+               descending: bool = False, offset: int = 0, limit: int = CONNECTIONS_PAGE_LIMIT) -> tuple[list[dict], int]:
+    """
+    Фильтрация, сортировка и страница снимка. Протокол и состояние сравниваются
+    без учёта регистра, порт - локальный или удалённый, процесс - по подстроке.
+    Возвращает (страница, число строк после фильтрации).
+    """
+    if sort is not None and sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort field: {sort}, expected one of: {', '.join(SORT_KEYS)}")
+
+    protocol = protocol.upper() if protocol else None
+    status = status.upper() if status else None
+    process = process.lower() if process else None
+    if protocol or status or port is not None or process:
+        rows = [
+            row for row in rows
+            if (not protocol or row[0]["protocol"] == protocol)
+            and (not status or row[0]["status"].upper() == status)
+            and (port is None or row[0]["local_port"] == port or row[0]["remote_port"] == port)
+            and (not process or process in row[0]["process"].lower())
+        ]
+    if sort is not None:
+        rows = sorted(rows, key=SORT_KEYS[sort], reverse=descending)
+    return [row[0] for row in rows[offset:offset + limit]], len(rows)
+
+
+class ConnectionsTable:
+    """
+    Снимок соединений системы, общий для запросов в пределах ttl: фильтры,
+    сортировка и страницы работают по готовым строкам без повторного
+    обхода сокетов и /proc.
+    """
+
+    def __init__(self, ttl: float = CONNECTIONS_SNAPSHOT_TTL, info_cache: ProcessInfoCache | None = None):
+        self.ttl = ttl
+        self.info_cache = info_cache or process_info_cache
+        self.rows: list[tuple[dict, float]] | None = None
+        self.updated: float | None = None
+        self._lock = asyncio.Lock()
+
+    def _build(self) -> list[tuple[dict, float]]:
+        return build_rows(psutil.net_connections(kind="inet"), self.info_cache)
+
+    async def snapshot(self) -> list[tuple[dict, float]]:
+        """Строки снимка; устаревший снимок перестраивается вне event loop"""
+        async with self._lock:
+            now = time.monotonic()
+            if self.rows is None or now - self.updated >= self.ttl:
+                self.rows = await asyncio.to_thread(self._build)
+                self.updated = time.monotonic()
+            return self.rows
+
+    def clear(self):
+        self.rows = None
+        self.updated = None
+
+
+# Глобальный снимок соединений
+connections_table = ConnectionsTable()
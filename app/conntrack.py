@@ -0,0 +1,252 @@
+import os
+import re
+import subprocess
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+
+# Таблица соединений netfilter
+CONNTRACK_PATH = os.getenv("CONNTRACK_PATH", "/proc/net/nf_conntrack")
+# Источник записей: "auto" (netlink, при ошибке - файл), "netlink" или "proc"
+CONNTRACK_SOURCE = os.getenv("CONNTRACK_SOURCE", "auto").lower()
+
+# Пары key=value записи conntrack: src=1.2.3.4, sport=443, bytes=1024
+FIELD_RE = re.compile(r"(\w+)=(\S+)")
+# Флаги записи: [ASSURED], [UNREPLIED]
+FLAG_RE = re.compile(r"\[(\w+)\]")
+
+L3_PROTOCOLS = ("ipv4", "ipv6")
+
+
+class ConntrackTuple(NamedTuple):
+    """Одно направление соединения: адреса, порты и счётчики (при nf_conntrack_acct=1)"""
+    src: str
+    dst: str
+    sport: int | None
+    dport: int | None
+    packets: int
+    bytes: int
+
+
+class ConntrackEntry:
+    """Запись conntrack: исходное направление (original) и ответное (reply)"""
+    __slots__ = ("family", "protocol", "timeout", "state", "original", "reply", "flags")
+
+    def __init__(self, family: str, protocol: str, timeout: int, state: str | None,
+                 original: ConntrackTuple, reply: ConntrackTuple | None, flags: tuple[str, ...] = ()):
+        self.family = family
+        self.protocol = protocol
+        self.timeout = timeout
+        self.state = state
+        self.original = original
+        self.reply = reply
+        self.flags = flags
+
+    def to_dict(self) -> dict:
+        return {
+            "family": self.family,
+            "protocol": self.protocol,
+            "timeout": self.timeout,
+            "state": self.state,
+            "original": self.original._asdict(),
+            "reply": self.reply._asdict() if self.reply else None,
+            "flags": list(self.flags),
+        }
+
+
+def _direction(fields: dict) -> ConntrackTuple | None:
+    if "src" not in fields or "dst" not in fields:
+        return None
+    sport, dport = fields.get("sport"), fields.get("dport")
+    return ConntrackTuple(
+        fields["src"],
+        fields["dst"],
+        int(sport) if sport else None,
+        int(dport) if dport else None,
+        int(fields.get("packets", 0)),
+        int(fields.get("bytes", 0)),
+    )
+
+
+def parse_line(line: str) -> ConntrackEntry | None:
+    """
+    Разбор строки nf_conntrack, например:
+    ipv4 2 tcp 6 300 ESTABLISHED src=... dst=... sport=... dport=... packets=... bytes=...
+    src=... dst=... sport=... dport=... packets=... bytes=... [ASSURED] mark=0 use=2
+    Некорректные строки дают None.
+    """
+    start = line.find(" src=")
+    if start < 0:
+        return None
+    head = line[:start].split()
+    if head and head[0] in L3_PROTOCOLS:
+        family, head = head[0], head[2:]
+    else:
+        # Формат /proc/net/ip_conntrack без полей L3
+        family = "ipv4"
+    if len(head) < 3:
+        return None
+
+    # Первое вхождение src открывает направление original, второе - reply
+    directions = [{}, {}]
+    current = -1
+    for key, value in FIELD_RE.findall(line, start):
+        if key == "src":
+            current += 1
+            if current > 1:
+                break
+        if current >= 0 and key not in directions[current]:
+            directions[current][key] = value
+
+    try:
+        original = _direction(directions[0])
+        if original is None:
+            return None
+        return ConntrackEntry(
+            family,
+            head[0],
+            int(head[2]),
+            head[3] if len(head) > 3 else None,
+            original,
+            _direction(directions[1]),
+            tuple(FLAG_RE.findall(line, start)),
+        )
+    except ValueError:
+        return None
+
+
+def parse_conntrack(lines: Iterable[str]) -> Iterator[ConntrackEntry]:
+    """Потоковый разбор: строки читаются и разбираются по одной, память не зависит от размера таблицы"""
+    for line in lines:
+        entry = parse_line(line)
+        if entry is not None:
+            yield entry
+
+
+def read_conntrack(path: str = CONNTRACK_PATH) -> Iterator[ConntrackEntry]:
+    """Записи conntrack из файла; без прав чтения - PermissionError при первом чтении"""
+    with open(path) as f:
+        yield from parse_conntrack(f)
+
+
+def read_conntrack_sudo(path: str = CONNTRACK_PATH) -> Iterator[ConntrackEntry]:
+    """
+    Записи conntrack через sudo cat: вывод читается из канала построчно,
+    а не целиком в память. sudo -n не ждёт ввода пароля.
+    """
+    process = subprocess.Popen(["sudo", "-n", "cat", path], stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+    try:
+        yield from parse_conntrack(process.stdout)
+    finally:
+        process.stdout.close()
+        if process.wait(timeout=10) != 0:
+            raise RuntimeError(f"sudo cat {path} failed")
+
+
+class ConntrackSource:
+    """Источник записей conntrack"""
+    name = "base"
+
+    def entries(self) -> Iterator[ConntrackEntry]:
+        raise NotImplementedError
+
+
+class ProcConntrackSource(ConntrackSource):
+    """Текстовая таблица /proc/net/nf_conntrack"""
+    name = "proc"
+
+    def __init__(self, path: str = CONNTRACK_PATH):
+        self.path = path
+
+    def entries(self) -> Iterator[ConntrackEntry]:
+        return read_conntrack(self.path)
+
+
+class NetlinkConntrackSource(ConntrackSource):
+    """Бинарный дамп через NETLINK_NETFILTER (ctnetlink), без разбора текста и без sudo"""
+    name = "netlink"
+
+    def entries(self) -> Iterator[ConntrackEntry]:
+        from .conntrack_netlink import dump_conntrack
+        return dump_conntrack()
+
+
+class AutoConntrackSource(ConntrackSource):
+    """
+    Netlink, а если он недоступен (нет прав, модуль ядра не загружен или
+    не Linux) - текстовая таблица. Ошибка netlink запоминается, чтобы не
+    повторять неудачную попытку на каждом запросе.
+    """
+    name = "auto"
+
+    def __init__(self, path: str = CONNTRACK_PATH):
+        self.netlink = NetlinkConntrackSource()
+        self.proc = ProcConntrackSource(path)
+        self.netlink_error: Exception | None = None
+
+    def entries(self) -> Iterator[ConntrackEntry]:
+        if self.netlink_error is None:
+            try:
+                entries = self.netlink.entries()
+                first = next(entries, None)
+            except (OSError, AttributeError) as e:
+                # AttributeError: socket.AF_NETLINK отсутствует вне Linux
+                self.netlink_error = e
+            else:
+                return self._chain(first, entries)
+        return self.proc.entries()
+
+    @staticmethod
+    def _chain(first, entries) -> Iterator[ConntrackEntry]:
+        if first is not None:
+            yield first
+            yield from entries
+
+
+CONNTRACK_SOURCES = {
+    "auto": AutoConntrackSource,
+    "netlink": NetlinkConntrackSource,
+    "proc": ProcConntrackSource,
+}
+
+_source: ConntrackSource | None = None
+
+
+def get_conntrack_source(name: str | None = None) -> ConntrackSource:
+    """Источник записей conntrack по имени или по CONNTRACK_SOURCE"""
+    name = (name or CONNTRACK_SOURCE).lower()
+    if name not in CONNTRACK_SOURCES:
+        raise ValueError(f"Unknown conntrack source: {name}, expected one of: {', '.join(CONNTRACK_SOURCES)}")
+    global _source
+    if _source is None or _source.name != name:
+        _source = CONNTRACK_SOURCES[name]()
+    return _source
+
+
+def aggregate_by_process(entries: Iterable[ConntrackEntry], sockets) -> dict[str, dict]:
+    """
+    Группирует записи conntrack по процессам. Локальная сторона соединения -
+    источник исходного направления (исходящие) или его получатель (входящие).
+    """
+    stats = {}
+    for entry in entries:
+        original, reply = entry.original, entry.reply
+        process_name = sockets.process_name(original.src, original.sport, default="")
+        if process_name:
+            remote = original.dst
+            sent, recv = original.bytes, reply.bytes if reply else 0
+        else:
+            process_name = sockets.process_name(original.dst, original.dport)
+            remote = original.src
+            sent, recv = (reply.bytes if reply else 0), original.bytes
+
+        stat = stats.get(process_name)
+        if stat is None:
+            stat = stats[process_name] = {"connections": 0, "bytes_recv": 0, "bytes_sent": 0,
+                                          "protocols": set(), "remote_ips": set()}
+        stat["connections"] += 1
+        stat["bytes_recv"] += recv
+        stat["bytes_sent"] += sent
+        stat["protocols"].add(entry.protocol.upper())
+        stat["remote_ips"].add(remote)
+    return stats
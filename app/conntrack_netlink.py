@@ -0,0 +1,274 @@
+import os
+import socket
+import struct
+from collections.abc import Iterator
+
+from .conntrack import ConntrackEntry, ConntrackTuple
+
+# Размер буфера приёма: ядро отдаёт дамп пачками сообщений
+NETLINK_RECV_BUFFER = int(os.getenv("CONNTRACK_NETLINK_BUFFER", 1 << 20))
+
+NETLINK_NETFILTER = 12
+NFNL_SUBSYS_CTNETLINK = 1
+IPCTNL_MSG_CT_GET = 1
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLA_TYPE_MASK = 0x3FFF
+
+# Атрибуты ctnetlink (linux/netfilter/nfnetlink_conntrack.h)
+CTA_TUPLE_ORIG = 1
+CTA_TUPLE_REPLY = 2
+CTA_STATUS = 3
+CTA_PROTOINFO = 4
+CTA_TIMEOUT = 7
+CTA_COUNTERS_ORIG = 9
+CTA_COUNTERS_REPLY = 10
+CTA_TUPLE_IP = 1
+CTA_TUPLE_PROTO = 2
+CTA_IP_V4_SRC, CTA_IP_V4_DST, CTA_IP_V6_SRC, CTA_IP_V6_DST = 1, 2, 3, 4
+CTA_PROTO_NUM, CTA_PROTO_SRC_PORT, CTA_PROTO_DST_PORT = 1, 2, 3
+CTA_COUNTERS_PACKETS, CTA_COUNTERS_BYTES = 1, 2
+CTA_PROTOINFO_TCP = 1
+CTA_PROTOINFO_TCP_STATE = 1
+
+IPS_SEEN_REPLY = 1 << 1
+IPS_ASSURED = 1 << 2
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+NFGEN_HEADER = struct.Struct("=BBH")
+NLA_HEADER = struct.Struct("=HH")
+
+# Кортеж IPv4 с портами (TCP/UDP и т.п.) имеет фиксированную раскладку и разбирается
+# одним вызовом unpack: заголовок кортежа, CTA_TUPLE_IP с адресами, CTA_TUPLE_PROTO с портами
+TUPLE_V4_PORTS = struct.Struct("=HH HH HH4s HH4s HH HHB3x HH2s2x HH2s2x".replace(" ", ""))
+# Счётчики направления: CTA_COUNTERS_PACKETS и CTA_COUNTERS_BYTES (big-endian u64)
+COUNTERS = struct.Struct("=HH HH8s HH8s".replace(" ", ""))
+
+FAMILIES = {socket.AF_INET: "ipv4", socket.AF_INET6: "ipv6"}
+PROTOCOLS = {1: "icmp", 6: "tcp", 17: "udp", 33: "dccp", 47: "gre", 58: "icmpv6", 132: "sctp", 136: "udplite"}
+# Состояния TCP в том же виде, что и в /proc/net/nf_conntrack
+TCP_STATES = ("NONE", "SYN_SENT", "SYN_RECV", "ESTABLISHED", "FIN_WAIT", "CLOSE_WAIT",
+              "LAST_ACK", "TIME_WAIT", "CLOSE", "SYN_SENT2")
+
+
+def _path(*types: int) -> int:
+    """Ключ атрибута по пути вложенности: тип каждого уровня занимает 6 бит"""
+    key = 0
+    for kind in types:
+        key = (key << 6) | kind
+    return key
+
+
+# Вложенные атрибуты. Флаг NLA_F_NESTED старые ядра не выставляют,
+# поэтому вложенность определяется по схеме ctnetlink
+NESTED = {
+    _path(CTA_TUPLE_ORIG), _path(CTA_TUPLE_REPLY), _path(CTA_PROTOINFO),
+    _path(CTA_COUNTERS_ORIG), _path(CTA_COUNTERS_REPLY),
+    _path(CTA_TUPLE_ORIG, CTA_TUPLE_IP), _path(CTA_TUPLE_ORIG, CTA_TUPLE_PROTO),
+    _path(CTA_TUPLE_REPLY, CTA_TUPLE_IP), _path(CTA_TUPLE_REPLY, CTA_TUPLE_PROTO),
+    _path(CTA_PROTOINFO, CTA_PROTOINFO_TCP),
+}
+TCP_STATE_KEY = _path(CTA_PROTOINFO, CTA_PROTOINFO_TCP, CTA_PROTOINFO_TCP_STATE)
+STATUS_KEY = _path(CTA_STATUS)
+TIMEOUT_KEY = _path(CTA_TIMEOUT)
+
+
+def _direction_keys(tuple_type: int, counters_type: int) -> tuple[int, ...]:
+    ip, proto = _path(tuple_type, CTA_TUPLE_IP), _path(tuple_type, CTA_TUPLE_PROTO)
+    return (
+        (ip << 6) | CTA_IP_V4_SRC, (ip << 6) | CTA_IP_V4_DST, (ip << 6) | CTA_IP_V6_SRC, (ip << 6) | CTA_IP_V6_DST,
+        (proto << 6) | CTA_PROTO_NUM, (proto << 6) | CTA_PROTO_SRC_PORT, (proto << 6) | CTA_PROTO_DST_PORT,
+        _path(counters_type, CTA_COUNTERS_PACKETS), _path(counters_type, CTA_COUNTERS_BYTES),
+    )
+
+
+ORIG_KEYS = _direction_keys(CTA_TUPLE_ORIG, CTA_COUNTERS_ORIG)
+REPLY_KEYS = _direction_keys(CTA_TUPLE_REPLY, CTA_COUNTERS_REPLY)
+
+
+def _walk(data: bytes, offset: int, end: int, prefix: int, values: dict[int, bytes]):
+    """Один проход по атрибутам сообщения: значения листьев по ключу пути"""
+    unpack = NLA_HEADER.unpack_from
+    while offset + 4 <= end:
+        length, kind = unpack(data, offset)
+        if length < 4:
+            break
+        key = (prefix << 6) | (kind & NLA_TYPE_MASK)
+        if key in NESTED:
+            _walk(data, offset + 4, offset + length, key, values)
+        else:
+            values[key] = data[offset + 4:offset + length]
+        offset += (length + 3) & ~3
+
+
+def _tuple(values: dict[int, bytes], keys: tuple[int, ...]) -> tuple[int | None, ConntrackTuple | None]:
+    v4_src, v4_dst, v6_src, v6_dst, proto_num, sport_key, dport_key, packets_key, bytes_key = keys
+    if v4_src in values:
+        src, dst = socket.inet_ntoa(values[v4_src]), socket.inet_ntoa(values[v4_dst])
+    elif v6_src in values:
+        src, dst = socket.inet_ntop(socket.AF_INET6, values[v6_src]), socket.inet_ntop(socket.AF_INET6, values[v6_dst])
+    else:
+        return None, None
+    sport, dport = values.get(sport_key), values.get(dport_key)
+    packets, nbytes = values.get(packets_key), values.get(bytes_key)
+    protonum = values.get(proto_num)
+    return protonum[0] if protonum else None, ConntrackTuple(
+        src,
+        dst,
+        int.from_bytes(sport, "big") if sport is not None else None,
+        int.from_bytes(dport, "big") if dport is not None else None,
+        int.from_bytes(packets, "big") if packets is not None else 0,
+        int.from_bytes(nbytes, "big") if nbytes is not None else 0,
+    )
+
+def _tuple_v4_fast(data: bytes, offset: int) -> tuple[int, str, str, int, int] | None:
+    """Быстрый разбор кортежа IPv4 с портами; None, если раскладка другая"""
+    if offset + TUPLE_V4_PORTS.size > len(data):
+        return None
+    (length, _, ip_length, _, src_length, src_type, src, dst_length, dst_type, dst, proto_length, _,
+     num_length, num_type, protonum, sport_length, sport_type, sport, dport_length, dport_type, dport) = \
+        TUPLE_V4_PORTS.unpack_from(data, offset)
+    if (length != TUPLE_V4_PORTS.size or ip_length != 20 or src_length != 8 or dst_length != 8
+            or proto_length != 28 or num_length != 5 or sport_length != 6 or dport_length != 6
+            or (src_type & NLA_TYPE_MASK, dst_type & NLA_TYPE_MASK, num_type & NLA_TYPE_MASK,
+                sport_type & NLA_TYPE_MASK, dport_type & NLA_TYPE_MASK) != (1, 2, 1, 2, 3)):
+        return None
+    return protonum, socket.inet_ntoa(src), socket.inet_ntoa(dst), int.from_bytes(sport, "big"), int.from_bytes(dport, "big")
+
+
+def _counters_fast(data: bytes, offset: int) -> tuple[int, int] | None:
+    if offset + COUNTERS.size > len(data):
+        return None
+    length, _, packets_length, packets_type, packets, bytes_length, bytes_type, nbytes = COUNTERS.unpack_from(data, offset)
+    if (length != COUNTERS.size or packets_length != 12 or bytes_length != 12
+            or packets_type & NLA_TYPE_MASK != CTA_COUNTERS_PACKETS or bytes_type & NLA_TYPE_MASK != CTA_COUNTERS_BYTES):
+        return None
+    return int.from_bytes(packets, "big"), int.from_bytes(nbytes, "big")
+
+
+def _parse_entry_fast(data: bytes, offset: int, end: int, family: str) -> ConntrackEntry | None:
+    """
+    Разбор записи с кортежами IPv4 и портами без обхода вложенных атрибутов.
+    None, если запись нужно разбирать общим способом.
+    """
+    unpack = NLA_HEADER.unpack_from
+    tuples, counters = {}, {}
+    status = timeout = 0
+    state = None
+    while offset + 4 <= end:
+        length, kind = unpack(data, offset)
+        if length < 4:
+            break
+        kind &= NLA_TYPE_MASK
+        if kind == CTA_TUPLE_ORIG or kind == CTA_TUPLE_REPLY:
+            parsed = _tuple_v4_fast(data, offset)
+            if parsed is None:
+                return None
+            tuples[kind] = parsed
+        elif kind == CTA_COUNTERS_ORIG or kind == CTA_COUNTERS_REPLY:
+            parsed = _counters_fast(data, offset)
+            if parsed is None:
+                return None
+            counters[kind] = parsed
+        elif kind == CTA_STATUS:
+            status = int.from_bytes(data[offset + 4:offset + 8], "big")
+        elif kind == CTA_TIMEOUT:
+            timeout = int.from_bytes(data[offset + 4:offset + 8], "big")
+        elif kind == CTA_PROTOINFO:
+            # CTA_PROTOINFO -> CTA_PROTOINFO_TCP -> CTA_PROTOINFO_TCP_STATE первым атрибутом
+            if length >= 13 and unpack(data, offset + 8)[1] & NLA_TYPE_MASK == CTA_PROTOINFO_TCP_STATE:
+                code = data[offset + 12]
+                state = TCP_STATES[code] if code < len(TCP_STATES) else str(code)
+        offset += (length + 3) & ~3
+
+    if CTA_TUPLE_ORIG not in tuples:
+        return None
+    protonum, src, dst, sport, dport = tuples[CTA_TUPLE_ORIG]
+    packets, nbytes = counters.get(CTA_COUNTERS_ORIG, (0, 0))
+    original = ConntrackTuple(src, dst, sport, dport, packets, nbytes)
+    reply = None
+    if CTA_TUPLE_REPLY in tuples:
+        _, src, dst, sport, dport = tuples[CTA_TUPLE_REPLY]
+        packets, nbytes = counters.get(CTA_COUNTERS_REPLY, (0, 0))
+        reply = ConntrackTuple(src, dst, sport, dport, packets, nbytes)
+
+    flags = ()
+    if not status & IPS_SEEN_REPLY:
+        flags += ("UNREPLIED",)
+    if status & IPS_ASSURED:
+        flags += ("ASSURED",)
+    return ConntrackEntry(family, PROTOCOLS.get(protonum, str(protonum)), timeout, state, original, reply, flags)
+
+
+def parse_entry(data: bytes, offset: int, end: int) -> ConntrackEntry | None:
+    """Запись conntrack из сообщения ctnetlink (offset - начало nfgenmsg)"""
+    family = FAMILIES.get(data[offset])
+    if family == "ipv4":
+        entry = _parse_entry_fast(data, offset + NFGEN_HEADER.size, end, family)
+        if entry is not None:
+            return entry
+    values = {}
+    _walk(data, offset + NFGEN_HEADER.size, end, 0, values)
+    protonum, original = _tuple(values, ORIG_KEYS)
+    if family is None or original is None:
+        return None
+    _, reply = _tuple(values, REPLY_KEYS)
+
+    state = None
+    if TCP_STATE_KEY in values:
+        code = values[TCP_STATE_KEY][0]
+        state = TCP_STATES[code] if code < len(TCP_STATES) else str(code)
+
+    status = int.from_bytes(values[STATUS_KEY], "big") if STATUS_KEY in values else 0
+    flags = ()
+    if not status & IPS_SEEN_REPLY:
+        flags += ("UNREPLIED",)
+    if status & IPS_ASSURED:
+        flags += ("ASSURED",)
+    timeout = int.from_bytes(values[TIMEOUT_KEY], "big") if TIMEOUT_KEY in values else 0
+    return ConntrackEntry(family, PROTOCOLS.get(protonum, str(protonum)), timeout, state, original, reply, flags)
+
+
+def parse_messages(data: bytes) -> tuple[list[ConntrackEntry], bool]:
+    """Разбор пачки сообщений дампа: (записи, получен ли NLMSG_DONE)"""
+    entries = []
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, kind, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size:
+            break
+        if kind == NLMSG_DONE:
+            return entries, True
+        if kind == NLMSG_ERROR:
+            error = -struct.unpack_from("=i", data, offset + NLMSG_HEADER.size)[0]
+            if error:
+                raise OSError(error, f"ctnetlink dump failed: {os.strerror(error)}")
+        elif kind & 0xFF == 0 and kind >> 8 == NFNL_SUBSYS_CTNETLINK:
+            # IPCTNL_MSG_CT_NEW - запись таблицы
+            entry = parse_entry(data, offset + NLMSG_HEADER.size, offset + length)
+            if entry is not None:
+                entries.append(entry)
+        offset += (length + 3) & ~3
+    return entries, False
+
+
+def dump_conntrack(family: int = socket.AF_UNSPEC) -> Iterator[ConntrackEntry]:
+    """
+    Дамп таблицы conntrack через NETLINK_NETFILTER. Записи разбираются по мере
+    приёма пачек от ядра. Нужны права CAP_NET_ADMIN, без них - PermissionError.
+    """
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_NETFILTER) as sock:
+        sock.bind((0, 0))
+        request = NFGEN_HEADER.pack(family, 0, 0)
+        sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), (NFNL_SUBSYS_CTNETLINK << 8) | IPCTNL_MSG_CT_GET,
+                                    NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + request)
+        while True:
+            data = sock.recv(NETLINK_RECV_BUFFER)
+            if not data:
+                return
+            entries, done = parse_messages(data)
+            yield from entries
+            if done:
+                return
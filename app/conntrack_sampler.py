@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import datetime
+
+from .conntrack import ConntrackEntry, get_conntrack_source, parse_conntrack
+from .process_attribution import SocketIndex
+from .ssh_executor import ssh_executor
+from .ssh_pool import device_key
+
+# Минимальный интервал между снимками таблицы (секунды): более частые запросы
+# получают последний результат, не опрашивая источник повторно
+CONNTRACK_SAMPLE_MIN_INTERVAL = float(os.getenv("CONNTRACK_SAMPLE_MIN_INTERVAL", 1))
+# Число записей в top_flows и top_talkers по умолчанию
+CONNTRACK_TOP_N = int(os.getenv("CONNTRACK_TOP_N", 20))
+# Период опроса источника, пока есть подписчики потока (секунды)
+CONNTRACK_STREAM_INTERVAL = float(os.getenv("CONNTRACK_STREAM_INTERVAL", 2))
+# Команда чтения таблицы на устройстве
+DEVICE_CONNTRACK_COMMAND = "cat /proc/net/nf_conntrack 2>/dev/null"
+
+# Владелец соединения: (имя, локальная сторона - источник исходного направления)
+OwnerResolver = Callable[[ConntrackEntry], tuple[str, bool]]
+
+
+def flow_key(entry: ConntrackEntry) -> tuple:
+    """5-tuple исходного направления: протокол, адреса и порты"""
+    original = entry.original
+    return entry.protocol, original.src, original.dst, original.sport, original.dport
+
+
+def source_owner(entry: ConntrackEntry) -> tuple[str, bool]:
+    """Владелец соединения на маршрутизаторе: инициатор из локальной сети"""
+    return entry.original.src, True
+
+
+def process_owner(sockets: SocketIndex) -> OwnerResolver:
+    """Владелец соединения на этом хосте: процесс, владеющий локальным адресом"""
+    def resolve(entry: ConntrackEntry) -> tuple[str, bool]:
+        original = entry.original
+        name = sockets.process_name(original.src, original.sport, default="")
+        if name:
+            return name, True
+        return sockets.process_name(original.dst, original.dport), False
+    return resolve
+
+
+def _rate(value: int, interval: float) -> float:
+    return round(value / interval, 1) if interval > 0 else 0.0
+
+
+class ConntrackSampler:
+    """
+    Инкрементальные дельты счётчиков conntrack. Хранит предыдущий снимок
+    (5-tuple -> счётчики) и по каждому новому снимку считает приращение
+    байт и пакетов по соединениям и по их владельцам.
+    """
+
+    def __init__(self, read_entries: Callable[[], Awaitable[tuple[Iterable[ConntrackEntry], OwnerResolver]]],
+                 min_interval: float = CONNTRACK_SAMPLE_MIN_INTERVAL):
+        self.read_entries = read_entries
+        self.min_interval = min_interval
+        self.previous: dict[tuple, tuple[int, int, int, int]] = {}
+        self.previous_time: float | None = None
+        self.last_sample: dict | None = None
+        self.samples = 0
+        self._lock = asyncio.Lock()
+        self.stream = ConntrackStream(self)
+
+    def compute(self, entries: Iterable[ConntrackEntry], owner: OwnerResolver, now: float) -> dict:
+        """Дельты относительно предыдущего снимка; первый снимок только запоминается"""
+        interval = now - self.previous_time if self.previous_time is not None else 0.0
+        warmup = self.previous_time is None
+        previous = self.previous
+        current = {}
+        flows = []
+        talkers = {}
+        totals = [0, 0, 0, 0]
+
+        for entry in entries:
+            original, reply = entry.original, entry.reply
+            counters = (original.bytes, original.packets, reply.bytes if reply else 0, reply.packets if reply else 0)
+            key = flow_key(entry)
+            current[key] = counters
+            if warmup:
+                continue
+
+            last = previous.get(key)
+            if last is None or counters[0] < last[0] or counters[2] < last[2]:
+                # Новое соединение (или запись пересоздана): весь счётчик набран после прошлого снимка
+                delta = counters
+            else:
+                delta = (counters[0] - last[0], counters[1] - last[1], counters[2] - last[2], counters[3] - last[3])
+            if not any(delta):
+                continue
+
+            name, outbound = owner(entry)
+            # Для владельца исходящего соединения исходное направление - отправка
+            sent, sent_packets, recv, recv_packets = delta if outbound else (delta[2], delta[3], delta[0], delta[1])
+            flows.append((sent + recv, key, name, sent, recv, sent_packets, recv_packets))
+            talker = talkers.get(name)
+            if talker is None:
+                talker = talkers[name] = [0, 0, 0, 0, 0]
+            talker[0] += 1
+            talker[1] += sent
+            talker[2] += recv
+            talker[3] += sent_packets
+            talker[4] += recv_packets
+            totals[0] += sent
+            totals[1] += recv
+            totals[2] += sent_packets
+            totals[3] += recv_packets
+
+        self.previous = current
+        self.previous_time = now
+        self.samples += 1
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "warmup": warmup,
+            "interval": round(interval, 3),
+            "flows_total": len(current),
+            "active_flows": len(flows),
+            "totals": {
+                "bytes_sent": totals[0], "bytes_recv": totals[1],
+                "packets_sent": totals[2], "packets_recv": totals[3],
+                "rate_sent": _rate(totals[0], interval), "rate_recv": _rate(totals[1], interval),
+            },
+            "_flows": flows,
+            "_talkers": talkers,
+        }
+
+    async def sample(self) -> dict:
+        """Новый снимок или последний, если он моложе min_interval"""
+        async with self._lock:
+            now = time.monotonic()
+            if self.last_sample is not None and now - self.previous_time < self.min_interval:
+                return self.last_sample
+            entries, owner = await self.read_entries()
+            # Записи могут читаться потоково (файл, netlink) - разбор вне event loop
+            self.last_sample = await asyncio.to_thread(self.compute, entries, owner, time.monotonic())
+            return self.last_sample
+
+    @staticmethod
+    def top(sample: dict, n: int = CONNTRACK_TOP_N) -> dict:
+        """Публичный ответ: top-N соединений и владельцев по суммарному трафику за интервал"""
+        interval = sample["interval"]
+        flows = sorted(sample["_flows"], key=lambda flow: flow[0], reverse=True)[:n]
+        talkers = sorted(sample["_talkers"].items(), key=lambda item: item[1][1] + item[1][2], reverse=True)[:n]
+        result = {key: value for key, value in sample.items() if not key.startswith("_")}
+        result["top_flows"] = [
+            {
+                "protocol": protocol, "src": src, "dst": dst, "sport": sport, "dport": dport,
+                "owner": name, "bytes_sent": sent, "bytes_recv": recv,
+                "packets_sent": sent_packets, "packets_recv": recv_packets,
+                "rate_sent": _rate(sent, interval), "rate_recv": _rate(recv, interval),
+            }
+            for _, (protocol, src, dst, sport, dport), name, sent, recv, sent_packets, recv_packets in flows
+        ]
+        result["top_talkers"] = [
+            {
+                "name": name, "flows": flows_count, "bytes_sent": sent, "bytes_recv": recv,
+                "packets_sent": sent_packets, "packets_recv": recv_packets,
+                "rate_sent": _rate(sent, interval), "rate_recv": _rate(recv, interval),
+            }
+            for name, (flows_count, sent, recv, sent_packets, recv_packets) in talkers
+        ]
+        return result
+
+
+class ConntrackStream:
+    """
+    Рассылка снимков одного сэмплера всем подписчикам. Источник опрашивается
+    одной фоновой задачей, пока есть хотя бы один подписчик, поэтому N клиентов
+    стоят одного опроса. Медленный подписчик получает только последний снимок.
+    """
+
+    def __init__(self, sampler: "ConntrackSampler", interval: float | None = None):
+        self.sampler = sampler
+        self.interval = interval
+        self.subscribers: set[asyncio.Queue] = set()
+        self.task: asyncio.Task | None = None
+        self.polls = 0
+        self._encoded_sample: dict | None = None
+        self._encoded: dict[int, str] = {}
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        if self.sampler.last_sample is not None:
+            # Новый подписчик сразу получает последний снимок
+            queue.put_nowait({"sample": self.sampler.last_sample})
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, message: dict):
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def encode(self, sample: dict, top: int) -> str:
+        """JSON снимка для top-N, один раз на снимок и значение top"""
+        if sample is not self._encoded_sample:
+            self._encoded_sample = sample
+            self._encoded = {}
+        payload = self._encoded.get(top)
+        if payload is None:
+            payload = self._encoded[top] = json.dumps(ConntrackSampler.top(sample, top), ensure_ascii=False)
+        return payload
+
+    async def _run(self):
+        interval = self.interval if self.interval is not None else CONNTRACK_STREAM_INTERVAL
+        while self.subscribers:
+            try:
+                self.publish({"sample": await self.sampler.sample()})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"[CONNTRACK-LOG] Error sampling conntrack for stream: {e}")
+                self.publish({"error": str(e)})
+            self.polls += 1
+            await asyncio.sleep(interval)
+
+
+async def stream_samples(sampler: ConntrackSampler, top: int = CONNTRACK_TOP_N, keepalive: float = 15):
+    """Снимки сэмплера в формате Server-Sent Events до отключения клиента"""
+    stream = sampler.stream
+    queue = stream.subscribe()
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if "error" in message:
+                yield f"event: error\ndata: {json.dumps({'error': message['error']}, ensure_ascii=False)}\n\n"
+            else:
+                yield f"event: sample\ndata: {stream.encode(message['sample'], top)}\n\n"
+    finally:
+        stream.unsubscribe(queue)
+
+
+async def _read_local():
+    def read():
+        sockets = SocketIndex.snapshot()
+        return get_conntrack_source().entries(), process_owner(sockets)
+    return await asyncio.to_thread(read)
+
+
+def read_device_conntrack(ssh) -> list[ConntrackEntry]:
+    """Записи conntrack устройства одним вызовом cat"""
+    return list(parse_conntrack(ssh.send_command(DEVICE_CONNTRACK_COMMAND, read_timeout=30).splitlines()))
+
+
+def _device_reader(netmiko_device: dict):
+    async def read():
+        return await ssh_executor.run(netmiko_device, read_device_conntrack), source_owner
+    return read
+
+
+class ConntrackSamplerRegistry:
+    """Один сэмплер на источник: этот хост и каждое устройство"""
+
+    def __init__(self):
+        self.samplers: dict[str, ConntrackSampler] = {}
+
+    def local(self) -> ConntrackSampler:
+        sampler = self.samplers.get("local")
+        if sampler is None:
+            sampler = self.samplers["local"] = ConntrackSampler(_read_local)
+        return sampler
+
+    def device(self, device: dict) -> ConntrackSampler:
+        netmiko_device = {
+            "device_type": "linux",
+            "host": device["ip"],
+            "username": device["username"],
+            "password": device["password"],
+        }
+        key = f"device:{device_key(netmiko_device)}"
+        sampler = self.samplers.get(key)
+        if sampler is None:
+            sampler = self.samplers[key] = ConntrackSampler(_device_reader(netmiko_device))
+        return sampler
+
+    def remove(self, key: str):
+        self.samplers.pop(key, None)
+
+
+# Глобальный реестр сэмплеров
+conntrack_samplers = ConntrackSamplerRegistry()
@@ -1,83 +1,34 @@
 import asyncio
 import logging
+import os
 import socket
 import subprocess
 import sys
-import threading
 import time
 from datetime import datetime
 
-import asyncpg
-from netmiko import ConnectHandler
 
+from app.db_pool import acquire_connection, close_db_pool, get_pool_stats, init_db_pool
+from app.device_probe import (
+    PROBE_TIER_AUTH,
+    forget_device,
+    get_last_auth_result,
+    is_auth_check_due,
+    probe_device_reachability,
+    record_auth_check,
+)
+from app.dns_blocklist import forget_device_lock
+from app.ssh_executor import ssh_executor
+from app.ssh_pool import ssh_pool
 from app.utils import parse_ifconfig_output
-from db_config import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
 
 from .models import users
 
-# Кэш SSH соединений для переиспользования
-ssh_connections = {}
-ssh_connections_lock = threading.Lock()
-
-def get_ssh_connection(netmiko_device):
-    """Получает или создает SSH соединение для устройства"""
-    device_key = f"{netmiko_device['host']}:{netmiko_device['username']}"
-    
-    with ssh_connections_lock:
-        if device_key in ssh_connections:
-            ssh = ssh_connections[device_key]
-            try:
-                # Проверяем, что соединение еще живо
-                ssh.send_command("echo 'test'", read_timeout=5)
-                return ssh
-            except:
-                # Соединение мертво, удаляем из кэша
-                try:
-                    ssh.disconnect()
-                except:
-                    pass
-                del ssh_connections[device_key]
-        
-        # Создаем новое соединение
-        try:
-            ssh = ConnectHandler(**netmiko_device)
-            ssh_connections[device_key] = ssh
-            logging.info(f"[DB-LOG] Created new SSH connection to {netmiko_device['host']}")
-            return ssh
-        except Exception as e:
-            logging.error(f"[DB-LOG] Failed to create SSH connection to {netmiko_device['host']}: {e}")
-            raise
-
-def close_ssh_connection(device_ip, username):
-    """Закрывает SSH соединение для устройства"""
-    device_key = f"{device_ip}:{username}"
-    
-    with ssh_connections_lock:
-        if device_key in ssh_connections:
-            try:
-                ssh_connections[device_key].disconnect()
-                logging.info(f"[DB-LOG] Closed SSH connection to {device_ip}")
-            except:
-                pass
-            del ssh_connections[device_key]
-
-def cleanup_dead_connections():
-    """Очищает мертвые SSH соединения из кэша"""
-    with ssh_connections_lock:
-        dead_keys = []
-        for device_key, ssh in ssh_connections.items():
-            try:
-                ssh.send_command("echo 'test'", read_timeout=5)
-            except:
-                dead_keys.append(device_key)
-        
-        for key in dead_keys:
-            try:
-                ssh_connections[key].disconnect()
-            except:
-                pass
-            del ssh_connections[key]
-            logging.info(f"[DB-LOG] Cleaned up dead SSH connection: {key}")
+# Параметры опроса устройств: число одновременных лёгких проверок (TCP/баннер),
+# число одновременных SSH-авторизаций и таймаут авторизации на одно устройство
+DEVICE_POLL_CONCURRENCY = int(os.getenv("DEVICE_POLL_CONCURRENCY", 256))
+DEVICE_AUTH_CONCURRENCY = int(os.getenv("DEVICE_AUTH_CONCURRENCY", 20))
+DEVICE_POLL_TIMEOUT = float(os.getenv("DEVICE_POLL_TIMEOUT", 15))
 
 class ColorFormatter(logging.Formatter):
     COLORS = {
@@ -129,226 +80,243 @@ def convert_row_for_json(row_dict):
 async def create_users_table():
     logging.info("[DB-LOG] create_users_table called")
     """Создаёт таблицу пользователей, если она не существует"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(50) UNIQUE NOT NULL,
-            password VARCHAR(128) NOT NULL,
-            role VARCHAR(50) NOT NULL DEFAULT 'user'
-        );
-    """)
-    await conn.close()
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                password VARCHAR(128) NOT NULL,
+                role VARCHAR(50) NOT NULL DEFAULT 'user'
+            );
+        """)
 
 async def create_user_sessions_table():
     logging.info("[DB-LOG] create_user_sessions_table called")
     """Создаёт таблицу сессий пользователей для отслеживания авторизаций и онлайн статуса"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS user_sessions (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            session_token VARCHAR(255) UNIQUE NOT NULL,
-            login_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-            logout_time TIMESTAMP WITH TIME ZONE NULL,
-            is_online BOOLEAN DEFAULT TRUE,
-            ip_address INET,
-            user_agent TEXT,
-            last_activity TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-        );
-    """)
-    
-    # Создаём индексы для оптимизации запросов
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);")
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_online ON user_sessions(is_online);")
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_last_activity ON user_sessions(last_activity);")
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                session_token VARCHAR(255) UNIQUE NOT NULL,
+                login_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                logout_time TIMESTAMP WITH TIME ZONE NULL,
+                is_online BOOLEAN DEFAULT TRUE,
+                ip_address INET,
+                user_agent TEXT,
+                last_activity TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            );
+        """)
     
-    await conn.close()
+        # Создаём индексы для оптимизации запросов
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_online ON user_sessions(is_online);")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_last_activity ON user_sessions(last_activity);")
 
 async def create_firewall_devices_table():
     logging.info("[FIREWALL-LOG] create_firewall_devices_table called")
     """Создаёт таблицу firewall-устройств, если не существует"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS firewall_devices (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            ip VARCHAR(50) NOT NULL,
-            type VARCHAR(50) NOT NULL,
-            username VARCHAR(100) NOT NULL,
-            password VARCHAR(255) NOT NULL,
-            status VARCHAR(50) DEFAULT 'Неизвестно',
-            last_poll VARCHAR(50) DEFAULT '-'
-        );
-    """)
-    await conn.close()
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS firewall_devices (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                ip VARCHAR(50) NOT NULL,
+                type VARCHAR(50) NOT NULL,
+                username VARCHAR(100) NOT NULL,
+                password VARCHAR(255) NOT NULL,
+                status VARCHAR(50) DEFAULT 'Неизвестно',
+                last_poll VARCHAR(50) DEFAULT '-'
+            );
+        """)
+
+async def get_firewall_devices_list():
+    """Возвращает устройства с последними сохранёнными статусами, без опроса"""
+    logging.info("[FIREWALL-LOG] get_firewall_devices_list called")
+    async with acquire_connection() as conn:
+        rows = await conn.fetch("SELECT * FROM firewall_devices ORDER BY id")
+    return [dict(row) for row in rows]
 
 async def get_all_firewall_devices():
     logging.info("[FIREWALL-LOG] get_all_firewall_devices called")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    rows = await conn.fetch("SELECT * FROM firewall_devices ORDER BY id")
-    await conn.close()
-    devices = [dict(row) for row in rows]
-    updated_devices = []
+    devices = await get_firewall_devices_list()
     logging.info(devices)
-    for device in devices:
-        start = time.time()
-        logging.info("[FIREWALL-LOG] === Start polling device ===")
-        logging.info(f"[FIREWALL-LOG] Time: {time.strftime('%Y-%m-%d %X')}")
-        logging.info(f"[FIREWALL-LOG] Name: {device['name']}")
-        logging.info(f"[FIREWALL-LOG] IP: {device['ip']}")
-        logging.info(f"[FIREWALL-LOG] Type: {device['type']}")
-        logging.info(f"[FIREWALL-LOG] Status before: {device.get('status', '-')}")
-        try:
-            updated_device = await update_device_status(device)
-            duration = time.time() - start
-            logging.info(f"[FIREWALL-LOG] Status after: {updated_device.get('status', '-')}")
-            logging.info(f"[FIREWALL-LOG] Poll duration: {duration:.2f} seconds")
-            logging.info(f"[FIREWALL-LOG] Finished at: {time.strftime('%Y-%m-%d %X')}")
-        except Exception as e:
-            logging.error(f"[FIREWALL-LOG] ERROR polling device {device['name']} ({device['ip']}): {e}")
-            updated_device = device
-        logging.info("[FIREWALL-LOG] === End polling device ===\n")
-        updated_devices.append(updated_device)
+    if not devices:
+        return []
+    
+    # Опрашиваем устройства параллельно с ограничением числа одновременных проверок
+    semaphore = asyncio.Semaphore(DEVICE_POLL_CONCURRENCY)
+    auth_semaphore = asyncio.Semaphore(DEVICE_AUTH_CONCURRENCY)
+    start = time.time()
+    updated_devices = await asyncio.gather(*(poll_device_status(device, semaphore, auth_semaphore) for device in devices))
+    logging.info(f"[FIREWALL-LOG] Polled {len(devices)} devices in {time.time() - start:.2f} seconds "
+                 f"(concurrency={DEVICE_POLL_CONCURRENCY}, auth_concurrency={DEVICE_AUTH_CONCURRENCY}, "
+                 f"timeout={DEVICE_POLL_TIMEOUT}s)")
+    
+    # Сохраняем результаты одним запросом
+    try:
+        await save_devices_status(updated_devices)
+    except Exception as e:
+        logging.error(f"[FIREWALL-LOG] ERROR saving devices status: {e}")
     logging.info(updated_devices)
     return updated_devices
 
+async def poll_device_status(device, semaphore, auth_semaphore):
+    """
+    Проверяет доступность устройства по уровням: TCP-подключение и SSH-баннер
+    на каждом опросе, полная авторизация по SSH - раз в DEVICE_AUTH_CHECK_INTERVAL
+    или после неудачной авторизации.
+    """
+    start = time.time()
+    device_id = device.get("id")
+    logging.info(f"[FIREWALL-LOG] Start polling device {device['name']} ({device['ip']}), type: {device['type']}, "
+                 f"status before: {device.get('status', '-')}")
+    try:
+        async with semaphore:
+            probe = await probe_device_reachability(device.get("ip"))
+        tier = probe["tier"]
+        if not probe["reachable"]:
+            logging.info(f"[FIREWALL-LOG] Device {device['name']} ({device['ip']}) unreachable: {probe['error']}")
+            status = "Оффлайн"
+        elif device_id is None or is_auth_check_due(device_id):
+            tier = PROBE_TIER_AUTH
+            try:
+                async with auth_semaphore:
+                    online = await asyncio.wait_for(check_device_online_netmiko(device), timeout=DEVICE_POLL_TIMEOUT)
+            except TimeoutError:
+                logging.error(f"[FIREWALL-LOG] SSH login to {device['name']} ({device['ip']}) timed out after {DEVICE_POLL_TIMEOUT}s")
+                online = False
+            if online is None:
+                # Все сессии заняты операциями: устройство отвечает, сбой проверки не записывается
+                logging.info(f"[FIREWALL-LOG] Device {device['name']} ({device['ip']}) busy, auth check skipped")
+                last = get_last_auth_result(device_id) if device_id is not None else None
+                status = "Оффлайн" if last is False else "Онлайн"
+            else:
+                if device_id is not None:
+                    record_auth_check(device_id, online)
+                status = "Онлайн" if online else "Оффлайн"
+        else:
+            status = "Онлайн" if get_last_auth_result(device_id) else "Оффлайн"
+    except Exception as e:
+        logging.error(f"[FIREWALL-LOG] ERROR polling device {device['name']} ({device['ip']}): {e}")
+        return device
+    device["status"] = status
+    device["last_poll"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    logging.info(f"[FIREWALL-LOG] Finished polling device {device['name']}: {status} (tier={tier}), "
+                 f"duration: {time.time() - start:.2f} seconds")
+    return device
+
+async def save_devices_status(devices):
+    """Сохраняет статусы нескольких устройств одним UPDATE ... FROM UNNEST"""
+    ids, statuses, last_polls = [], [], []
+    for device in devices:
+        if device.get("status") is None or device.get("last_poll") is None:
+            continue
+        ids.append(int(device["id"]))
+        statuses.append(device["status"])
+        last_polls.append(device["last_poll"])
+    if not ids:
+        return
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            UPDATE firewall_devices AS d
+            SET status = u.status, last_poll = u.last_poll
+            FROM UNNEST($1::int[], $2::varchar[], $3::varchar[]) AS u(id, status, last_poll)
+            WHERE d.id = u.id
+        """, ids, statuses, last_polls)
+
 async def add_firewall_device(device):
     logging.info(f"[FIREWALL-LOG] add_firewall_device called with device={device}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("""
-        INSERT INTO firewall_devices (name, ip, type, username, password)
-        VALUES ($1, $2, $3, $4, $5)
-    """, device.name, device.ip, device.type, device.username, device.password)
-    await conn.close()
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            INSERT INTO firewall_devices (name, ip, type, username, password)
+            VALUES ($1, $2, $3, $4, $5)
+        """, device.name, device.ip, device.type, device.username, device.password)
 
 async def delete_firewall_device(device_id):
     logging.info(f"[FIREWALL-LOG] delete_firewall_device called with device_id={device_id}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("DELETE FROM firewall_devices WHERE id = $1", int(device_id))
-    await conn.close()
+    async with acquire_connection() as conn:
+        row = await conn.fetchrow("SELECT ip, username FROM firewall_devices WHERE id = $1", int(device_id))
+        await conn.execute("DELETE FROM firewall_devices WHERE id = $1", int(device_id))
+        await conn.execute("DELETE FROM dns_blocklist WHERE device_id = $1", int(device_id))
+        await conn.execute("DELETE FROM dns_blocklist_state WHERE device_id = $1", int(device_id))
+    forget_device(device_id)
+    forget_device_lock(device_id)
+    if row:
+        ssh_executor.forget_device({"host": row["ip"], "username": row["username"]})
 
 async def get_firewall_device_by_id(device_id):
     logging.info(f"[FIREWALL-LOG] get_firewall_device_by_id called with device_id={device_id}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    row = await conn.fetchrow("SELECT * FROM firewall_devices WHERE id = $1", int(device_id))
-    await conn.close()
+    async with acquire_connection() as conn:
+        row = await conn.fetchrow("SELECT * FROM firewall_devices WHERE id = $1", int(device_id))
     return dict(row) if row else None
 
 async def startup_event():
     logging.info("[DB-LOG] startup_event called")
-    """Событие запуска приложения - проверяет и создаёт таблицы"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
+    """Событие запуска приложения - создаёт пул соединений, проверяет и создаёт таблицы"""
+    await init_db_pool()
     
-    # Проверяем и создаём таблицу пользователей
-    users_table_exists = await conn.fetchval("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.tables 
-            WHERE table_name = 'users'
-        );
-    """)
-    if not users_table_exists:
-        await conn.execute("""
-            CREATE TABLE users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                password VARCHAR(128) NOT NULL,
-                role VARCHAR(50) NOT NULL DEFAULT 'user'
-            );
-        """)
-    else:
-        # Проверяем, есть ли поле role в таблице
-        role_column_exists = await conn.fetchval("""
+    async with acquire_connection() as conn:
+        # Проверяем и создаём таблицу пользователей
+        users_table_exists = await conn.fetchval("""
             SELECT EXISTS (
-                SELECT FROM information_schema.columns 
-                WHERE table_name = 'users' AND column_name = 'role'
+                SELECT FROM information_schema.tables 
+                WHERE table_name = 'users'
             );
         """)
-        if not role_column_exists:
-            await conn.execute("ALTER TABLE users ADD COLUMN role VARCHAR(50) NOT NULL DEFAULT 'user';")
+        if not users_table_exists:
+            await conn.execute("""
+                CREATE TABLE users (
+                    id SERIAL PRIMARY KEY,
+                    username VARCHAR(50) UNIQUE NOT NULL,
+                    password VARCHAR(128) NOT NULL,
+                    role VARCHAR(50) NOT NULL DEFAULT 'user'
+                );
+            """)
+        else:
+            # Проверяем, есть ли поле role в таблице
+            role_column_exists = await conn.fetchval("""
+                SELECT EXISTS (
+                    SELECT FROM information_schema.columns 
+                    WHERE table_name = 'users' AND column_name = 'role'
+                );
+            """)
+            if not role_column_exists:
+                await conn.execute("ALTER TABLE users ADD COLUMN role VARCHAR(50) NOT NULL DEFAULT 'user';")
     
-    # Проверяем и создаём таблицу сессий
-    sessions_table_exists = await conn.fetchval("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.tables 
-            WHERE table_name = 'user_sessions'
-        );
-    """)
-    if not sessions_table_exists:
-        await conn.execute("""
-            CREATE TABLE user_sessions (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                session_token VARCHAR(255) UNIQUE NOT NULL,
-                login_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                logout_time TIMESTAMP WITH TIME ZONE NULL,
-                is_online BOOLEAN DEFAULT TRUE,
-                ip_address INET,
-                user_agent TEXT,
-                last_activity TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        # Проверяем и создаём таблицу сессий
+        sessions_table_exists = await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT FROM information_schema.tables 
+                WHERE table_name = 'user_sessions'
             );
         """)
+        if not sessions_table_exists:
+            await conn.execute("""
+                CREATE TABLE user_sessions (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    session_token VARCHAR(255) UNIQUE NOT NULL,
+                    login_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    logout_time TIMESTAMP WITH TIME ZONE NULL,
+                    is_online BOOLEAN DEFAULT TRUE,
+                    ip_address INET,
+                    user_agent TEXT,
+                    last_activity TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                );
+            """)
         
-        # Создаём индексы для оптимизации запросов
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_online ON user_sessions(is_online);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_last_activity ON user_sessions(last_activity);")
+            # Создаём индексы для оптимизации запросов
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_online ON user_sessions(is_online);")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_last_activity ON user_sessions(last_activity);")
     
     # Создаём таблицу firewall-устройств
     await create_firewall_devices_table()
     await create_device_configs_table()
-    
-    await conn.close()
+    await create_dns_blocklist_tables()
     
     # Создаем индексы для оптимизации производительности
     try:
@@ -368,18 +336,40 @@ async def startup_event():
     # Очищаем аномальные сессии
     await cleanup_anomalous_sessions()
     
-    # Запускаем периодическую очистку SSH соединений
+    # Запускаем периодическое закрытие простаивающих SSH сессий
     async def cleanup_ssh_connections_periodic():
+        loop = asyncio.get_event_loop()
         while True:
             try:
-                cleanup_dead_connections()
-                await asyncio.sleep(300)  # Очищаем каждые 5 минут
+                await loop.run_in_executor(None, ssh_pool.evict_idle)
+                await asyncio.sleep(60)  # Проверяем каждую минуту
             except Exception as e:
                 logging.error(f"[DB-LOG] Error in SSH cleanup: {e}")
                 await asyncio.sleep(60)  # При ошибке ждем минуту
     
     # Запускаем задачу очистки в фоне
     asyncio.create_task(cleanup_ssh_connections_periodic())
+    
+    # Периодическая проверка расхождений DNS блок-листов устройств с БД
+    from app.dns_blocklist import DNS_DRIFT_CHECK_INTERVAL, check_all_drift
+    
+    async def dns_drift_check_periodic():
+        while True:
+            await asyncio.sleep(DNS_DRIFT_CHECK_INTERVAL)
+            try:
+                await check_all_drift()
+            except Exception as e:
+                logging.error(f"[DNS-LOG] Error in DNS drift check: {e}")
+    
+    if DNS_DRIFT_CHECK_INTERVAL > 0:
+        asyncio.create_task(dns_drift_check_periodic())
+
+async def shutdown_event():
+    logging.info("[DB-LOG] shutdown_event called")
+    """Событие остановки приложения - закрывает SSH сессии и пул соединений с БД"""
+    ssh_executor.shutdown()
+    ssh_pool.close_all()
+    await close_db_pool()
 
 # API endpoints для управления SSH соединениями
 from fastapi import APIRouter, HTTPException, Query
@@ -394,7 +384,7 @@ async def api_close_ssh_connection(device_id: int = Query(...)):
         if not device:
             raise HTTPException(status_code=404, detail="Device not found")
         
-        close_ssh_connection(device["ip"], device["username"])
+        ssh_pool.close_device(device["ip"], device["username"])
         return {"message": f"SSH connection closed for device {device['name']}"}
         
     except Exception as e:
@@ -403,96 +393,51 @@ async def api_close_ssh_connection(device_id: int = Query(...)):
 
 @router.get("/api/ssh_connections_status")
 async def api_get_ssh_connections_status():
-    """API для получения статуса SSH соединений"""
-    with ssh_connections_lock:
-        connections_info = []
-        for device_key, ssh in ssh_connections.items():
-            try:
-                # Проверяем, что соединение живо
-                ssh.send_command("echo 'test'", read_timeout=5)
-                status = "active"
-            except:
-                status = "dead"
-            
-            connections_info.append({
-                "device": device_key,
-                "status": status
-            })
-        
-        return {
-            "total_connections": len(ssh_connections),
-            "connections": connections_info
-        }
+    """API для получения статуса SSH сессий, здоровья устройств и очереди SSH-операций"""
+    status = ssh_pool.get_status()
+    status["executor"] = ssh_executor.get_stats()
+    return status
+
+@router.get("/api/db_pool_status")
+async def api_get_db_pool_status():
+    """API для получения состояния пула соединений с БД"""
+    return get_pool_stats()
 
 # Функции для работы с сессиями пользователей
 async def create_user_session(user_id: int, session_token: str, ip_address: str = None, user_agent: str = None):
     logging.info(f"[DB-LOG] create_user_session called with user_id={user_id}, session_token={session_token}, ip_address={ip_address}, user_agent={user_agent}")
     """Создаёт новую сессию пользователя"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         await conn.execute("""
             INSERT INTO user_sessions (user_id, session_token, ip_address, user_agent)
             VALUES ($1, $2, $3, $4)
         """, user_id, session_token, ip_address, user_agent)
-    finally:
-        await conn.close()
 
 async def update_user_activity(session_token: str):
     logging.info(f"[DB-LOG] update_user_activity called with session_token={session_token}")
     """Обновляет время последней активности пользователя"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         await conn.execute("""
             UPDATE user_sessions 
             SET last_activity = NOW()
             WHERE session_token = $1 AND is_online = TRUE
         """, session_token)
-    finally:
-        await conn.close()
 
 async def logout_user_session(session_token: str):
     logging.info(f"[DB-LOG] logout_user_session called with session_token={session_token}")
     """Завершает сессию пользователя (выход из системы)"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         await conn.execute("""
             UPDATE user_sessions 
             SET logout_time = NOW(), is_online = FALSE
             WHERE session_token = $1
         """, session_token)
-    finally:
-        await conn.close()
 
 async def get_online_users():
     logging.info("[DB-LOG] get_online_users called")
     """Возвращает список пользователей, которые сейчас онлайн"""
     try:
-        conn = await asyncpg.connect(
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        try:
+        async with acquire_connection() as conn:
             rows = await conn.fetch("""
                 SELECT u.username, us.login_time, us.last_activity, us.ip_address
                 FROM user_sessions us
@@ -506,8 +451,6 @@ async def get_online_users():
                 user_dict = convert_row_for_json(dict(row))
                 result.append(user_dict)
             return result
-        finally:
-            await conn.close()
     except Exception as e:
         logging.error(f"Ошибка при получении пользователей онлайн: {e}")
         return []
@@ -516,14 +459,7 @@ async def get_user_sessions(user_id: int):
     logging.info(f"[DB-LOG] get_user_sessions called with user_id={user_id}")
     """Возвращает все сессии конкретного пользователя"""
     try:
-        conn = await asyncpg.connect(
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        try:
+        async with acquire_connection() as conn:
             rows = await conn.fetch("""
                 SELECT session_token, login_time, logout_time, is_online, 
                        ip_address, user_agent, last_activity
@@ -537,8 +473,6 @@ async def get_user_sessions(user_id: int):
                 session_dict = convert_row_for_json(dict(row))
                 result.append(session_dict)
             return result
-        finally:
-            await conn.close()
     except Exception as e:
         logging.error(f"Ошибка при получении сессий пользователя {user_id}: {e}")
         return []
@@ -546,52 +480,27 @@ async def get_user_sessions(user_id: int):
 async def cleanup_old_sessions(hours_old: int = 24):
     logging.info(f"[DB-LOG] cleanup_old_sessions called with hours_old={hours_old}")
     """Удаляет старые сессии (по умолчанию старше 24 часов)"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         await conn.execute("""
             DELETE FROM user_sessions 
             WHERE created_at < NOW() - INTERVAL '$1 hours'
         """, hours_old)
-    finally:
-        await conn.close()
 
 async def mark_inactive_users_as_offline(minutes_inactive: int = 30):
     logging.info(f"[DB-LOG] mark_inactive_users_as_offline called with minutes_inactive={minutes_inactive}")
     """Помечает пользователей как оффлайн, если они неактивны более указанного времени"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         await conn.execute("""
             UPDATE user_sessions 
             SET is_online = FALSE, logout_time = NOW()
             WHERE is_online = TRUE 
             AND last_activity < NOW() - INTERVAL '$1 minutes'
         """, minutes_inactive)
-    finally:
-        await conn.close() 
 
 async def sync_users_to_database():
     logging.info("[DB-LOG] sync_users_to_database called")
     """Синхронизирует пользователей из models.py с базой данных"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         # Проверяем, есть ли пользователи в базе данных
         existing_users = await conn.fetch("SELECT username FROM users")
         existing_usernames = {row["username"] for row in existing_users}
@@ -610,36 +519,18 @@ async def sync_users_to_database():
                     UPDATE users SET role = $1 WHERE username = $2
                 """, user_data["role"].value, username)
                 logging.info(f"Обновлена роль пользователя: {username} -> {user_data['role'].value}")
-    finally:
-        await conn.close()
 
 async def get_user_id_by_username(username: str) -> int:
     logging.info(f"[DB-LOG] get_user_id_by_username called with username={username}")
     """Получает ID пользователя по имени пользователя"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         user_id = await conn.fetchval("SELECT id FROM users WHERE username = $1", username)
         return user_id
-    finally:
-        await conn.close() 
 
 async def cleanup_anomalous_sessions():
     logging.info("[DB-LOG] cleanup_anomalous_sessions called")
     """Очищает аномальные сессии без времени выхода, но помеченные как неактивные"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         # Устанавливаем время выхода для неактивных сессий без logout_time
         await conn.execute("""
             UPDATE user_sessions 
@@ -653,20 +544,11 @@ async def cleanup_anomalous_sessions():
             WHERE logout_time IS NULL 
             AND last_activity < NOW() - INTERVAL '1 hour'
         """)
-    finally:
-        await conn.close() 
 
 async def cleanup_user_sessions(user_id: int):
     logging.info(f"[DB-LOG] cleanup_user_sessions called with user_id={user_id}")
     """Очищает все сессии конкретного пользователя"""
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    try:
+    async with acquire_connection() as conn:
         # Сначала получаем количество сессий до очистки
         sessions_before = await conn.fetchval("""
             SELECT COUNT(*) FROM user_sessions 
@@ -701,226 +583,167 @@ async def cleanup_user_sessions(user_id: int):
         
         deleted_count = sessions_before - sessions_after
         return deleted_count
-    finally:
-        await conn.close() 
 
 async def create_firewall_rules_table():
     logging.info("[FIREWALL-LOG] create_firewall_rules_table called")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS firewall_rules (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(128) NOT NULL,
-            protocol VARCHAR(16) NOT NULL,
-            port VARCHAR(32),
-            direction VARCHAR(16) NOT NULL,
-            action VARCHAR(16) NOT NULL,
-            enabled BOOLEAN DEFAULT TRUE,
-            comment TEXT
-        );
-    """)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS audit_log (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(64),
-            user_role VARCHAR(32),
-            action VARCHAR(32),
-            details TEXT,
-            time TIMESTAMP DEFAULT NOW()
-        );
-    """)
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS firewall_rules (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(128) NOT NULL,
+                protocol VARCHAR(16) NOT NULL,
+                port VARCHAR(32),
+                direction VARCHAR(16) NOT NULL,
+                action VARCHAR(16) NOT NULL,
+                enabled BOOLEAN DEFAULT TRUE,
+                comment TEXT
+            );
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS audit_log (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(64),
+                user_role VARCHAR(32),
+                action VARCHAR(32),
+                details TEXT,
+                time TIMESTAMP DEFAULT NOW()
+            );
+        """)
     
-    # Миграция: добавляем поле user_role если его нет
-    try:
-        await conn.execute("ALTER TABLE audit_log ADD COLUMN IF NOT EXISTS user_role VARCHAR(32)")
-        # Обновляем существующие записи, устанавливая user_role = 'unknown' для старых записей
-        await conn.execute("UPDATE audit_log SET user_role = 'unknown' WHERE user_role IS NULL")
-    except Exception as e:
-        logging.error(f"Ошибка при миграции audit_log: {e}")
+        # Миграция: добавляем поле user_role если его нет
+        try:
+            await conn.execute("ALTER TABLE audit_log ADD COLUMN IF NOT EXISTS user_role VARCHAR(32)")
+            # Обновляем существующие записи, устанавливая user_role = 'unknown' для старых записей
+            await conn.execute("UPDATE audit_log SET user_role = 'unknown' WHERE user_role IS NULL")
+        except Exception as e:
+            logging.error(f"Ошибка при миграции audit_log: {e}")
     
-    # Проверяем, есть ли уже правила в таблице
-    rules_count = await conn.fetchval("SELECT COUNT(*) FROM firewall_rules")
+        # Проверяем, есть ли уже правила в таблице
+        rules_count = await conn.fetchval("SELECT COUNT(*) FROM firewall_rules")
     
-    # Если правил нет, создаем тестовые правила
-    if rules_count == 0:
-        logging.info("[FIREWALL-LOG] Creating sample firewall rules")
-        sample_rules = [
-            {
-                "name": "Разрешить HTTP",
-                "protocol": "tcp",
-                "port": "80",
-                "direction": "inbound",
-                "action": "allow",
-                "enabled": True,
-                "comment": "Разрешить входящий HTTP трафик"
-            },
-            {
-                "name": "Разрешить HTTPS",
-                "protocol": "tcp",
-                "port": "443",
-                "direction": "inbound",
-                "action": "allow",
-                "enabled": True,
-                "comment": "Разрешить входящий HTTPS трафик"
-            },
-            {
-                "name": "Разрешить SSH",
-                "protocol": "tcp",
-                "port": "22",
-                "direction": "inbound",
-                "action": "allow",
-                "enabled": True,
-                "comment": "Разрешить входящий SSH трафик"
-            },
-            {
-                "name": "Запретить Telnet",
-                "protocol": "tcp",
-                "port": "23",
-                "direction": "inbound",
-                "action": "deny",
-                "enabled": True,
-                "comment": "Запретить небезопасный Telnet"
-            },
-            {
-                "name": "Разрешить DNS",
-                "protocol": "udp",
-                "port": "53",
-                "direction": "outbound",
-                "action": "allow",
-                "enabled": True,
-                "comment": "Разрешить исходящие DNS запросы"
-            },
-            {
-                "name": "Запретить ICMP",
-                "protocol": "icmp",
-                "port": None,
-                "direction": "inbound",
-                "action": "deny",
-                "enabled": False,
-                "comment": "Запретить входящие ICMP пакеты (отключено)"
-            }
-        ]
+        # Если правил нет, создаем тестовые правила
+        if rules_count == 0:
+            logging.info("[FIREWALL-LOG] Creating sample firewall rules")
+            sample_rules = [
+                {
+                    "name": "Разрешить HTTP",
+                    "protocol": "tcp",
+                    "port": "80",
+                    "direction": "inbound",
+                    "action": "allow",
+                    "enabled": True,
+                    "comment": "Разрешить входящий HTTP трафик"
+                },
+                {
+                    "name": "Разрешить HTTPS",
+                    "protocol": "tcp",
+                    "port": "443",
+                    "direction": "inbound",
+                    "action": "allow",
+                    "enabled": True,
+                    "comment": "Разрешить входящий HTTPS трафик"
+                },
+                {
+                    "name": "Разрешить SSH",
+                    "protocol": "tcp",
+                    "port": "22",
+                    "direction": "inbound",
+                    "action": "allow",
+                    "enabled": True,
+                    "comment": "Разрешить входящий SSH трафик"
+                },
+                {
+                    "name": "Запретить Telnet",
+                    "protocol": "tcp",
+                    "port": "23",
+                    "direction": "inbound",
+                    "action": "deny",
+                    "enabled": True,
+                    "comment": "Запретить небезопасный Telnet"
+                },
+                {
+                    "name": "Разрешить DNS",
+                    "protocol": "udp",
+                    "port": "53",
+                    "direction": "outbound",
+                    "action": "allow",
+                    "enabled": True,
+                    "comment": "Разрешить исходящие DNS запросы"
+                },
+                {
+                    "name": "Запретить ICMP",
+                    "protocol": "icmp",
+                    "port": None,
+                    "direction": "inbound",
+                    "action": "deny",
+                    "enabled": False,
+                    "comment": "Запретить входящие ICMP пакеты (отключено)"
+                }
+            ]
         
-        for rule in sample_rules:
-            await conn.execute("""
-                INSERT INTO firewall_rules (name, protocol, port, direction, action, enabled, comment)
-                VALUES ($1, $2, $3, $4, $5, $6, $7)
-            """, rule["name"], rule["protocol"], rule["port"], rule["direction"], rule["action"], rule["enabled"], rule["comment"])
+            for rule in sample_rules:
+                await conn.execute("""
+                    INSERT INTO firewall_rules (name, protocol, port, direction, action, enabled, comment)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                """, rule["name"], rule["protocol"], rule["port"], rule["direction"], rule["action"], rule["enabled"], rule["comment"])
         
-        logging.info(f"[FIREWALL-LOG] Created {len(sample_rules)} sample firewall rules")
-    
-    await conn.close()
+            logging.info(f"[FIREWALL-LOG] Created {len(sample_rules)} sample firewall rules")
 
 async def get_all_firewall_rules():
     logging.info("[FIREWALL-LOG] get_all_firewall_rules called")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    rows = await conn.fetch("SELECT * FROM firewall_rules ORDER BY id")
-    await conn.close()
+    async with acquire_connection() as conn:
+        rows = await conn.fetch("SELECT * FROM firewall_rules ORDER BY id")
     return [dict(row) for row in rows]
 
 async def add_firewall_rule(rule):
     logging.info(f"[FIREWALL-LOG] add_firewall_rule called with rule={rule}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    row = await conn.fetchrow("""
-        INSERT INTO firewall_rules (name, protocol, port, direction, action, enabled, comment)
-        VALUES ($1, $2, $3, $4, $5, $6, $7)
-        RETURNING *
-    """, rule["name"], rule["protocol"], rule["port"], rule["direction"], rule["action"], rule["enabled"], rule["comment"])
-    await conn.close()
+    async with acquire_connection() as conn:
+        row = await conn.fetchrow("""
+            INSERT INTO firewall_rules (name, protocol, port, direction, action, enabled, comment)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            RETURNING *
+        """, rule["name"], rule["protocol"], rule["port"], rule["direction"], rule["action"], rule["enabled"], rule["comment"])
     return dict(row)
 
 async def update_firewall_rule(rule_id, rule):
     logging.info(f"[FIREWALL-LOG] update_firewall_rule called with rule_id={rule_id}, rule={rule}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    row = await conn.fetchrow("""
-        UPDATE firewall_rules SET
-            name=$1, protocol=$2, port=$3, direction=$4, action=$5, enabled=$6, comment=$7
-        WHERE id=$8 RETURNING *
-    """, rule["name"], rule["protocol"], rule["port"], rule["direction"], rule["action"], rule["enabled"], rule["comment"], rule_id)
-    await conn.close()
+    async with acquire_connection() as conn:
+        row = await conn.fetchrow("""
+            UPDATE firewall_rules SET
+                name=$1, protocol=$2, port=$3, direction=$4, action=$5, enabled=$6, comment=$7
+            WHERE id=$8 RETURNING *
+        """, rule["name"], rule["protocol"], rule["port"], rule["direction"], rule["action"], rule["enabled"], rule["comment"], rule_id)
     if row is None:
         raise ValueError(f"Firewall rule with id {rule_id} not found")
     return dict(row)
 
 async def delete_firewall_rule(rule_id):
     logging.info(f"[FIREWALL-LOG] delete_firewall_rule called with rule_id={rule_id}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("DELETE FROM firewall_rules WHERE id=$1", rule_id)
-    await conn.close()
+    async with acquire_connection() as conn:
+        await conn.execute("DELETE FROM firewall_rules WHERE id=$1", rule_id)
 
 async def toggle_firewall_rule(rule_id):
     logging.info(f"[FIREWALL-LOG] toggle_firewall_rule called with rule_id={rule_id}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    row = await conn.fetchrow("""
-        UPDATE firewall_rules SET enabled = NOT enabled WHERE id=$1 RETURNING *
-    """, rule_id)
-    await conn.close()
+    async with acquire_connection() as conn:
+        row = await conn.fetchrow("""
+            UPDATE firewall_rules SET enabled = NOT enabled WHERE id=$1 RETURNING *
+        """, rule_id)
     return dict(row)
 
 async def add_audit_log(username, user_role, action, details):
     try:
-        conn = await asyncpg.connect(
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        await conn.execute("""
-            INSERT INTO audit_log (username, user_role, action, details) VALUES ($1, $2, $3, $4)
-        """, username, user_role, action, details)
-        await conn.close()
+        async with acquire_connection() as conn:
+            await conn.execute("""
+                INSERT INTO audit_log (username, user_role, action, details) VALUES ($1, $2, $3, $4)
+            """, username, user_role, action, details)
     except Exception as e:
         logging.error(f"Ошибка при записи в audit_log: {e}")
         import traceback
         traceback.print_exc()
 
 async def get_audit_log():
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    rows = await conn.fetch("SELECT * FROM audit_log ORDER BY time DESC LIMIT 100")
-    await conn.close()
+    async with acquire_connection() as conn:
+        rows = await conn.fetch("SELECT * FROM audit_log ORDER BY time DESC LIMIT 100")
     return [dict(row) for row in rows] 
 
 def check_device_online_sync(ip, tcp_port=22):
@@ -929,7 +752,9 @@ def check_device_online_sync(ip, tcp_port=22):
         logging.info("IP is None")
         return False
     try:
-        result = subprocess.run(["ping", "-n", "1", str(ip)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        # Флаг количества пакетов: -n в Windows, -c в Linux/macOS
+        count_flag = "-n" if sys.platform.startswith("win") else "-c"
+        result = subprocess.run(["ping", count_flag, "1", str(ip)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=5)
         logging.info(f"Ping {ip} result: {result.returncode}, stdout: {result.stdout}, stderr: {result.stderr}")
         if result.returncode == 0:
             return True
@@ -952,20 +777,14 @@ async def check_device_online(ip, tcp_port=22):
 async def update_device_status(device):
     logging.info(f"[DB-LOG] update_device_status called with device={device}")
     online = await check_device_online_netmiko(device)
-    status = "Онлайн" if online else "Оффлайн"
+    # None - устройство занято операциями и отвечает
+    status = "Оффлайн" if online is False else "Онлайн"
     last_poll = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute(
-        "UPDATE firewall_devices SET status=$1, last_poll=$2 WHERE id=$3",
-        status, last_poll, int(device["id"])
-    )
-    await conn.close()
+    async with acquire_connection() as conn:
+        await conn.execute(
+            "UPDATE firewall_devices SET status=$1, last_poll=$2 WHERE id=$3",
+            status, last_poll, int(device["id"])
+        )
     device["status"] = status if status is not None else "Неизвестно"
     device["last_poll"] = last_poll if last_poll is not None else "-"
     logging.info("RETURN DEVICE:", device)
@@ -973,106 +792,140 @@ async def update_device_status(device):
 
 async def create_device_configs_table():
     logging.info("[DB-LOG] create_device_configs_table called")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS device_configs (
-            id SERIAL PRIMARY KEY,
-            device_id INTEGER NOT NULL,
-            config TEXT NOT NULL,
-            updated_at TIMESTAMP DEFAULT NOW()
-        );
-    """)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS device_config_backups (
-            id SERIAL PRIMARY KEY,
-            device_id INTEGER NOT NULL,
-            config TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT NOW()
-        );
-    """)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS device_config_audit (
-            id SERIAL PRIMARY KEY,
-            device_id INTEGER NOT NULL,
-            username VARCHAR(64),
-            action VARCHAR(32),
-            details TEXT,
-            time TIMESTAMP DEFAULT NOW()
-        );
-    """)
-    await conn.close()
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS device_configs (
+                id SERIAL PRIMARY KEY,
+                device_id INTEGER NOT NULL,
+                config TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT NOW()
+            );
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS device_config_backups (
+                id SERIAL PRIMARY KEY,
+                device_id INTEGER NOT NULL,
+                config TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
+            );
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS device_config_audit (
+                id SERIAL PRIMARY KEY,
+                device_id INTEGER NOT NULL,
+                username VARCHAR(64),
+                action VARCHAR(32),
+                details TEXT,
+                time TIMESTAMP DEFAULT NOW()
+            );
+        """)
 
 async def get_device_config(device_id):
     logging.info(f"[DB-LOG] get_device_config called with device_id={device_id}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    row = await conn.fetchrow("SELECT config FROM device_configs WHERE device_id=$1 ORDER BY updated_at DESC LIMIT 1", device_id)
-    await conn.close()
+    async with acquire_connection() as conn:
+        row = await conn.fetchrow("SELECT config FROM device_configs WHERE device_id=$1 ORDER BY updated_at DESC LIMIT 1", device_id)
     return row["config"] if row else ""
 
 async def save_device_config(device_id, config, username):
     logging.info(f"[DB-LOG] save_device_config called with device_id={device_id}, username={username}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("INSERT INTO device_configs (device_id, config) VALUES ($1, $2)", device_id, config)
-    await conn.execute("INSERT INTO device_config_audit (device_id, username, action, details) VALUES ($1, $2, $3, $4)", device_id, username, "save", "Сохранена новая конфигурация")
-    await conn.close()
+    async with acquire_connection() as conn:
+        await conn.execute("INSERT INTO device_configs (device_id, config) VALUES ($1, $2)", device_id, config)
+        await conn.execute("INSERT INTO device_config_audit (device_id, username, action, details) VALUES ($1, $2, $3, $4)", device_id, username, "save", "Сохранена новая конфигурация")
 
 async def backup_device_config(device_id, config, username):
     logging.info(f"[DB-LOG] backup_device_config called with device_id={device_id}, username={username}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    await conn.execute("INSERT INTO device_config_backups (device_id, config) VALUES ($1, $2)", device_id, config)
-    await conn.execute("INSERT INTO device_config_audit (device_id, username, action, details) VALUES ($1, $2, $3, $4)", device_id, username, "backup", "Создана резервная копия")
-    await conn.close()
+    async with acquire_connection() as conn:
+        await conn.execute("INSERT INTO device_config_backups (device_id, config) VALUES ($1, $2)", device_id, config)
+        await conn.execute("INSERT INTO device_config_audit (device_id, username, action, details) VALUES ($1, $2, $3, $4)", device_id, username, "backup", "Создана резервная копия")
 
 async def get_device_config_backups(device_id):
     logging.info(f"[DB-LOG] get_device_config_backups called with device_id={device_id}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    rows = await conn.fetch("SELECT id, created_at FROM device_config_backups WHERE device_id=$1 ORDER BY created_at DESC", device_id)
-    await conn.close()
+    async with acquire_connection() as conn:
+        rows = await conn.fetch("SELECT id, created_at FROM device_config_backups WHERE device_id=$1 ORDER BY created_at DESC", device_id)
     return [{"id": r["id"], "created_at": r["created_at"]} for r in rows]
 
 async def get_device_config_audit(device_id):
     logging.info(f"[DB-LOG] get_device_config_audit called with device_id={device_id}")
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    rows = await conn.fetch("SELECT username, action, time, details FROM device_config_audit WHERE device_id=$1 ORDER BY time DESC", device_id)
-    await conn.close()
+    async with acquire_connection() as conn:
+        rows = await conn.fetch("SELECT username, action, time, details FROM device_config_audit WHERE device_id=$1 ORDER BY time DESC", device_id)
     return [{"username": r["username"], "action": r["action"], "time": r["time"], "details": r["details"]} for r in rows] 
 
+async def create_dns_blocklist_tables():
+    logging.info("[DB-LOG] create_dns_blocklist_tables called")
+    """Создаёт таблицы DNS блок-листов устройств и состояния их синхронизации"""
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS dns_blocklist (
+                device_id INTEGER NOT NULL,
+                domain VARCHAR(253) NOT NULL,
+                added_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (device_id, domain)
+            );
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS dns_blocklist_state (
+                device_id INTEGER PRIMARY KEY,
+                pushed_hash VARCHAR(64),
+                domain_count INTEGER NOT NULL DEFAULT 0,
+                pushed_at TIMESTAMP,
+                checked_at TIMESTAMP,
+                drift_detected BOOLEAN NOT NULL DEFAULT FALSE
+            );
+        """)
+
+async def get_dns_blocklist(device_id) -> set[str]:
+    """Авторитетная копия DNS блок-листа устройства"""
+    async with acquire_connection() as conn:
+        rows = await conn.fetch("SELECT domain FROM dns_blocklist WHERE device_id = $1", int(device_id))
+    return {row["domain"] for row in rows}
+
+async def get_dns_blocklist_state(device_id):
+    async with acquire_connection() as conn:
+        row = await conn.fetchrow("SELECT * FROM dns_blocklist_state WHERE device_id = $1", int(device_id))
+    return dict(row) if row else None
+
+async def get_dns_blocklist_device_ids() -> list[int]:
+    async with acquire_connection() as conn:
+        rows = await conn.fetch("SELECT device_id FROM dns_blocklist_state ORDER BY device_id")
+    return [row["device_id"] for row in rows]
+
+async def update_dns_blocklist(device_id, added, removed):
+    """Применяет изменения блок-листа одной транзакцией"""
+    logging.info(f"[DB-LOG] update_dns_blocklist called with device_id={device_id}, +{len(added)} -{len(removed)}")
+    async with acquire_connection() as conn:
+        async with conn.transaction():
+            if removed:
+                await conn.execute(
+                    "DELETE FROM dns_blocklist WHERE device_id = $1 AND domain = ANY($2::text[])",
+                    int(device_id), list(removed)
+                )
+            if added:
+                await conn.execute(
+                    "INSERT INTO dns_blocklist (device_id, domain) SELECT $1, unnest($2::text[]) ON CONFLICT DO NOTHING",
+                    int(device_id), list(added)
+                )
+
+async def save_dns_blocklist_state(device_id, pushed_hash, domain_count, drift_detected=False):
+    """Запоминает хэш блок-листа, отправленного на устройство"""
+    async with acquire_connection() as conn:
+        await conn.execute("""
+            INSERT INTO dns_blocklist_state (device_id, pushed_hash, domain_count, pushed_at, checked_at, drift_detected)
+            VALUES ($1, $2, $3, NOW(), NOW(), $4)
+            ON CONFLICT (device_id) DO UPDATE SET
+                pushed_hash = EXCLUDED.pushed_hash,
+                domain_count = EXCLUDED.domain_count,
+                pushed_at = EXCLUDED.pushed_at,
+                checked_at = EXCLUDED.checked_at,
+                drift_detected = EXCLUDED.drift_detected
+        """, int(device_id), pushed_hash, domain_count, drift_detected)
+
+async def mark_dns_blocklist_checked(device_id, drift_detected):
+    async with acquire_connection() as conn:
+        await conn.execute(
+            "UPDATE dns_blocklist_state SET checked_at = NOW(), drift_detected = $2 WHERE device_id = $1",
+            int(device_id), drift_detected
+        )
+
 async def check_device_online_netmiko(device):
     logging.info(f"[DB-LOG] check_device_online_netmiko called with device={device}")
     try:
@@ -1081,16 +934,17 @@ async def check_device_online_netmiko(device):
             "host": device.get("ip"),
             "username": device.get("username"),
             "password": device.get("password"),
+            # Не даём потоку проверки пережить бюджет времени опроса
+            "conn_timeout": DEVICE_POLL_TIMEOUT,
+            "auth_timeout": DEVICE_POLL_TIMEOUT,
         }
-        loop = asyncio.get_event_loop()
-        def try_connect():
-            try:
-                with ConnectHandler(**netmiko_device) as ssh:
-                    return True
-            except Exception as e:
-                logging.error(f"[DB-LOG] netmiko connection failed: {e}")
-                return False
-        result = await loop.run_in_executor(None, try_connect)
+        # Сессия из общего пула: живая сессия переиспользуется без повторного логина.
+        # Проверка не стоит в очереди операций устройства; None - устройство занято
+        try:
+            result = await ssh_executor.check(netmiko_device)
+        except Exception as e:
+            logging.error(f"[DB-LOG] netmiko connection failed: {e}")
+            result = False
         logging.info(f"[DB-LOG] netmiko connection result: {result}")
         return result
     except Exception as e:
@@ -1,8 +1,6 @@
 import logging
 
-import asyncpg
-
-from db_config import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+from app.db_pool import acquire_connection
 
 
 async def create_database_indexes():
@@ -11,40 +9,31 @@ async def create_database_indexes():
     """
     logging.info("[DB-INDEXES] Starting database indexes creation")
     
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    
     try:
-        # Индексы для таблицы users
-        await create_users_indexes(conn)
+        async with acquire_connection() as conn:
+            # Индексы для таблицы users
+            await create_users_indexes(conn)
         
-        # Индексы для таблицы user_sessions
-        await create_user_sessions_indexes(conn)
+            # Индексы для таблицы user_sessions
+            await create_user_sessions_indexes(conn)
         
-        # Индексы для таблицы firewall_devices
-        await create_firewall_devices_indexes(conn)
+            # Индексы для таблицы firewall_devices
+            await create_firewall_devices_indexes(conn)
         
-        # Индексы для таблицы firewall_rules
-        await create_firewall_rules_indexes(conn)
+            # Индексы для таблицы firewall_rules
+            await create_firewall_rules_indexes(conn)
         
-        # Индексы для таблицы audit_log
-        await create_audit_log_indexes(conn)
+            # Индексы для таблицы audit_log
+            await create_audit_log_indexes(conn)
         
-        # Индексы для таблиц конфигураций устройств
-        await create_device_configs_indexes(conn)
+            # Индексы для таблиц конфигураций устройств
+            await create_device_configs_indexes(conn)
         
-        logging.info("[DB-INDEXES] All database indexes created successfully")
+            logging.info("[DB-INDEXES] All database indexes created successfully")
         
     except Exception as e:
         logging.error(f"[DB-INDEXES] Error creating indexes: {e}")
         raise
-    finally:
-        await conn.close()
 
 async def create_users_indexes(conn):
     """Создает индексы для таблицы users"""
@@ -299,33 +288,24 @@ async def analyze_table_statistics():
     """
     logging.info("[DB-INDEXES] Analyzing table statistics")
     
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    
     try:
-        # Анализируем все таблицы
-        tables = [
-            "users", "user_sessions", "firewall_devices", 
-            "firewall_rules", "audit_log", "device_configs",
-            "device_config_backups", "device_config_audit"
-        ]
+        async with acquire_connection() as conn:
+            # Анализируем все таблицы
+            tables = [
+                "users", "user_sessions", "firewall_devices", 
+                "firewall_rules", "audit_log", "device_configs",
+                "device_config_backups", "device_config_audit"
+            ]
         
-        for table in tables:
-            await conn.execute(f"ANALYZE {table};")
-            logging.info(f"[DB-INDEXES] Analyzed table: {table}")
+            for table in tables:
+                await conn.execute(f"ANALYZE {table};")
+                logging.info(f"[DB-INDEXES] Analyzed table: {table}")
         
-        logging.info("[DB-INDEXES] All table statistics updated")
+            logging.info("[DB-INDEXES] All table statistics updated")
         
     except Exception as e:
         logging.error(f"[DB-INDEXES] Error analyzing statistics: {e}")
         raise
-    finally:
-        await conn.close()
 
 async def get_index_usage_statistics():
     """
@@ -333,42 +313,33 @@ async def get_index_usage_statistics():
     """
     logging.info("[DB-INDEXES] Getting index usage statistics")
     
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    
     try:
-        # Запрос для получения статистики использования индексов
-        query = """
-        SELECT 
-            schemaname,
-            tablename,
-            indexname,
-            idx_scan as index_scans,
-            idx_tup_read as tuples_read,
-            idx_tup_fetch as tuples_fetched
-        FROM pg_stat_user_indexes 
-        WHERE schemaname = 'public'
-        ORDER BY idx_scan DESC;
-        """
+        async with acquire_connection() as conn:
+            # Запрос для получения статистики использования индексов
+            query = """
+            SELECT 
+                schemaname,
+                tablename,
+                indexname,
+                idx_scan as index_scans,
+                idx_tup_read as tuples_read,
+                idx_tup_fetch as tuples_fetched
+            FROM pg_stat_user_indexes 
+            WHERE schemaname = 'public'
+            ORDER BY idx_scan DESC;
+            """
         
-        rows = await conn.fetch(query)
+            rows = await conn.fetch(query)
         
-        logging.info("[DB-INDEXES] Index usage statistics:")
-        for row in rows:
-            logging.info(f"  {row['tablename']}.{row['indexname']}: {row['index_scans']} scans, {row['tuples_read']} reads")
+            logging.info("[DB-INDEXES] Index usage statistics:")
+            for row in rows:
+                logging.info(f"  {row['tablename']}.{row['indexname']}: {row['index_scans']} scans, {row['tuples_read']} reads")
         
-        return [dict(row) for row in rows]
+            return [dict(row) for row in rows]
         
     except Exception as e:
         logging.error(f"[DB-INDEXES] Error getting index statistics: {e}")
         raise
-    finally:
-        await conn.close()
 
 async def optimize_slow_queries():
     """
@@ -376,49 +347,40 @@ async def optimize_slow_queries():
     """
     logging.info("[DB-INDEXES] Optimizing slow queries")
     
-    conn = await asyncpg.connect(
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    
     try:
-        # Получаем медленные запросы
-        slow_queries_query = """
-        SELECT 
-            query,
-            calls,
-            total_time,
-            mean_time,
-            rows
-        FROM pg_stat_statements 
-        WHERE mean_time > 100  -- запросы медленнее 100ms
-        ORDER BY mean_time DESC
-        LIMIT 10;
-        """
+        async with acquire_connection() as conn:
+            # Получаем медленные запросы
+            slow_queries_query = """
+            SELECT 
+                query,
+                calls,
+                total_time,
+                mean_time,
+                rows
+            FROM pg_stat_statements 
+            WHERE mean_time > 100  -- запросы медленнее 100ms
+            ORDER BY mean_time DESC
+            LIMIT 10;
+            """
         
-        try:
-            rows = await conn.fetch(slow_queries_query)
-            logging.info("[DB-INDEXES] Slow queries detected:")
-            for row in rows:
-                logging.info(f"  Query: {row['query'][:100]}...")
-                logging.info(f"    Calls: {row['calls']}, Mean time: {row['mean_time']}ms")
-        except Exception as e:
-            logging.warning(f"[DB-INDEXES] Could not get slow queries (pg_stat_statements not available): {e}")
+            try:
+                rows = await conn.fetch(slow_queries_query)
+                logging.info("[DB-INDEXES] Slow queries detected:")
+                for row in rows:
+                    logging.info(f"  Query: {row['query'][:100]}...")
+                    logging.info(f"    Calls: {row['calls']}, Mean time: {row['mean_time']}ms")
+            except Exception as e:
+                logging.warning(f"[DB-INDEXES] Could not get slow queries (pg_stat_statements not available): {e}")
         
-        # Рекомендации по оптимизации
-        logging.info("[DB-INDEXES] Optimization recommendations:")
-        logging.info("  1. Consider adding composite indexes for frequently used WHERE clauses")
-        logging.info("  2. Review queries with high mean_time for optimization")
-        logging.info("  3. Consider partitioning large tables if needed")
+            # Рекомендации по оптимизации
+            logging.info("[DB-INDEXES] Optimization recommendations:")
+            logging.info("  1. Consider adding composite indexes for frequently used WHERE clauses")
+            logging.info("  2. Review queries with high mean_time for optimization")
+            logging.info("  3. Consider partitioning large tables if needed")
         
     except Exception as e:
         logging.error(f"[DB-INDEXES] Error optimizing queries: {e}")
         raise
-    finally:
-        await conn.close()
 
 # Функция для запуска всех оптимизаций
 async def optimize_database_performance():
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from db_config import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+
+# Параметры пула соединений с PostgreSQL
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+# Время жизни простаивающего соединения в секундах (0 - без ограничения)
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))
+# Максимальное время ожидания свободного соединения в секундах
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 10))
+
+# Глобальный пул соединений приложения
+db_pool: asyncpg.Pool | None = None
+
+
+class PoolStats:
+    """Статистика ожидания и загрузки пула соединений"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.acquire_count = 0
+        self.acquire_timeouts = 0
+        self.fallback_connections = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.recent_wait_times = deque(maxlen=window)
+
+    def record_wait(self, wait_time: float):
+        """Запись времени ожидания соединения из пула"""
+        with self._lock:
+            self.acquire_count += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.recent_wait_times.append(wait_time)
+
+    def record_timeout(self):
+        """Запись таймаута ожидания соединения"""
+        with self._lock:
+            self.acquire_timeouts += 1
+
+    def record_fallback(self):
+        """Запись одиночного соединения в обход пула"""
+        with self._lock:
+            self.fallback_connections += 1
+
+    def snapshot(self) -> dict:
+        """Возвращает копию счетчиков ожидания"""
+        with self._lock:
+            recent = list(self.recent_wait_times)
+            return {
+                "acquire_count": self.acquire_count,
+                "acquire_timeouts": self.acquire_timeouts,
+                "fallback_connections": self.fallback_connections,
+                "avg_wait_ms": round(self.total_wait_time / self.acquire_count * 1000, 3) if self.acquire_count else 0,
+                "recent_avg_wait_ms": round(sum(recent) / len(recent) * 1000, 3) if recent else 0,
+                "max_wait_ms": round(self.max_wait_time * 1000, 3),
+            }
+
+
+pool_stats = PoolStats()
+
+
+async def init_db_pool():
+    """Создаёт пул соединений приложения (вызывается при запуске)"""
+    global db_pool
+    if db_pool is not None:
+        return db_pool
+    logging.info(
+        f"[DB-POOL] Creating connection pool (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}, "
+        f"max_inactive_lifetime={DB_POOL_MAX_INACTIVE_LIFETIME}s)"
+    )
+    db_pool = await asyncpg.create_pool(
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        host=DB_HOST,
+        port=DB_PORT,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+    )
+    return db_pool
+
+
+async def close_db_pool():
+    """Закрывает пул соединений (вызывается при остановке)"""
+    global db_pool
+    if db_pool is None:
+        return
+    pool, db_pool = db_pool, None
+    try:
+        await pool.close()
+        logging.info("[DB-POOL] Connection pool closed")
+    except Exception as e:
+        logging.error(f"[DB-POOL] Error closing connection pool: {e}")
+        pool.terminate()
+
+
+@asynccontextmanager
+async def acquire_connection():
+    """
+    Выдаёт соединение из пула приложения.
+    Если пул ещё не создан (скрипты обслуживания, тесты без startup),
+    открывает одиночное соединение и закрывает его после использования.
+    """
+    pool = db_pool
+    if pool is None:
+        pool_stats.record_fallback()
+        conn = await asyncpg.connect(
+            user=DB_USER,
+            password=DB_PASSWORD,
+            database=DB_NAME,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        try:
+            yield conn
+        finally:
+            await conn.close()
+        return
+
+    start = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except TimeoutError:
+        pool_stats.record_timeout()
+        logging.error(f"[DB-POOL] Timed out waiting {DB_POOL_ACQUIRE_TIMEOUT}s for a free connection")
+        raise
+    pool_stats.record_wait(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def get_pool_stats() -> dict:
+    """Возвращает состояние пула: размер, занятость и время ожидания"""
+    stats = pool_stats.snapshot()
+    pool = db_pool
+    if pool is None:
+        stats.update({
+            "initialized": False,
+            "size": 0,
+            "idle": 0,
+            "in_use": 0,
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            "saturation": 0,
+        })
+        return stats
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    max_size = pool.get_max_size()
+    in_use = size - idle
+    stats.update({
+        "initialized": True,
+        "size": size,
+        "idle": idle,
+        "in_use": in_use,
+        "min_size": pool.get_min_size(),
+        "max_size": max_size,
+        "saturation": round(in_use / max_size, 3) if max_size else 0,
+    })
+    return stats
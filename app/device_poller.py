@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+from .prometheus_metrics import device_poll_duration
+
+# Интервал фонового опроса устройств и случайная добавка к нему (секунды)
+DEVICE_STATUS_POLL_INTERVAL = float(os.getenv("DEVICE_STATUS_POLL_INTERVAL", 60))
+DEVICE_STATUS_POLL_JITTER = float(os.getenv("DEVICE_STATUS_POLL_JITTER", 5))
+
+
+class DeviceStatusPoller:
+    """Фоновый опрос устройств с таблицей статусов в памяти"""
+
+    def __init__(self, interval: float = DEVICE_STATUS_POLL_INTERVAL, jitter: float = DEVICE_STATUS_POLL_JITTER):
+        self.interval = interval
+        self.jitter = jitter
+        # id устройства -> словарь устройства со status и last_poll
+        self.devices: dict[int, dict] = {}
+        self.loaded = False
+        self.sweep_count = 0
+        self.last_sweep_at: float | None = None
+        self.last_sweep_duration: float | None = None
+        self._sweep_lock: asyncio.Lock | None = None
+        self._task: asyncio.Task | None = None
+
+    def _lock(self) -> asyncio.Lock:
+        if self._sweep_lock is None:
+            self._sweep_lock = asyncio.Lock()
+        return self._sweep_lock
+
+    def _replace(self, devices: list[dict]):
+        self.devices = {int(device["id"]): device for device in devices}
+        self.loaded = True
+
+    async def load_devices(self) -> list[dict]:
+        """Загружает список устройств с сохранёнными статусами из БД без опроса"""
+        from .database import get_firewall_devices_list
+        self._replace(await get_firewall_devices_list())
+        return list(self.devices.values())
+
+    async def poll_once(self) -> list[dict]:
+        """Опрашивает все устройства; параллельные вызовы ждут текущий опрос"""
+        lock = self._lock()
+        if lock.locked():
+            async with lock:
+                return list(self.devices.values())
+        async with lock:
+            from .database import get_all_firewall_devices
+            start = time.time()
+            devices = await get_all_firewall_devices()
+            self.last_sweep_duration = time.time() - start
+            device_poll_duration.observe(self.last_sweep_duration)
+            self.last_sweep_at = time.time()
+            self.sweep_count += 1
+            self._replace(devices)
+            logging.info(f"[POLLER-LOG] Sweep #{self.sweep_count}: {len(devices)} devices in {self.last_sweep_duration:.2f} seconds")
+            return list(self.devices.values())
+
+    async def get_devices(self) -> list[dict]:
+        """Возвращает закэшированные статусы устройств"""
+        if not self.loaded:
+            await self.load_devices()
+        return list(self.devices.values())
+
+    def get_device(self, device_id: int) -> dict | None:
+        """Возвращает закэшированный статус устройства по id"""
+        return self.devices.get(int(device_id))
+
+    def invalidate(self):
+        """Помечает список устройств устаревшим (после добавления или удаления)"""
+        self.loaded = False
+
+    def get_status(self) -> dict:
+        """Состояние фонового опроса"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "devices": len(self.devices),
+            "sweep_count": self.sweep_count,
+            "last_sweep_at": self.last_sweep_at,
+            "last_sweep_duration": self.last_sweep_duration,
+        }
+
+    async def _run(self):
+        try:
+            await self.load_devices()
+        except Exception as e:
+            logging.error(f"[POLLER-LOG] Error loading devices: {e}")
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logging.error(f"[POLLER-LOG] Error polling devices: {e}")
+            await asyncio.sleep(self.interval + random.uniform(0, self.jitter))
+
+    def start(self):
+        """Запускает фоновый опрос"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        """Останавливает фоновый опрос"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+# Глобальный экземпляр фонового опроса устройств
+device_poller = DeviceStatusPoller()
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import time
+
+from .prometheus_metrics import device_probe_duration
+
+# Порт SSH для проверки доступности устройств
+DEVICE_PROBE_PORT = int(os.getenv("DEVICE_PROBE_PORT", 22))
+# Таймаут TCP-подключения и чтения SSH-баннера (секунды)
+DEVICE_PROBE_CONNECT_TIMEOUT = float(os.getenv("DEVICE_PROBE_CONNECT_TIMEOUT", 3))
+DEVICE_PROBE_BANNER_TIMEOUT = float(os.getenv("DEVICE_PROBE_BANNER_TIMEOUT", 3))
+# Как часто выполнять полную проверку с авторизацией по SSH (секунды)
+DEVICE_AUTH_CHECK_INTERVAL = float(os.getenv("DEVICE_AUTH_CHECK_INTERVAL", 600))
+
+# Уровни проверки
+PROBE_TIER_TCP = "tcp"
+PROBE_TIER_BANNER = "banner"
+PROBE_TIER_AUTH = "auth"
+
+# id устройства -> (время последней полной проверки, её результат)
+_auth_checks: dict[int, tuple[float, bool]] = {}
+
+
+async def probe_device_reachability(ip, port=None, connect_timeout=None, banner_timeout=None):
+    """
+    Лёгкая проверка доступности устройства без авторизации.
+    Уровень 1 - неблокирующее TCP-подключение к порту SSH,
+    уровень 2 - чтение SSH-баннера. Все проверки идут в одном event loop,
+    без отдельных потоков и процессов на устройство.
+    Возвращает словарь с полями reachable, tier, banner, latency_ms, error.
+    """
+    start = time.perf_counter()
+    result = await _probe(ip, port, connect_timeout, banner_timeout)
+    device_probe_duration.labels("reachable" if result["reachable"] else "unreachable").observe(time.perf_counter() - start)
+    return result
+
+
+async def _probe(ip, port, connect_timeout, banner_timeout):
+    port = port or DEVICE_PROBE_PORT
+    connect_timeout = connect_timeout if connect_timeout is not None else DEVICE_PROBE_CONNECT_TIMEOUT
+    banner_timeout = banner_timeout if banner_timeout is not None else DEVICE_PROBE_BANNER_TIMEOUT
+    result = {"reachable": False, "tier": PROBE_TIER_TCP, "banner": None, "latency_ms": None, "error": None}
+    if not ip:
+        result["error"] = "IP is empty"
+        return result
+
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=connect_timeout)
+    except (OSError, TimeoutError) as e:
+        result["error"] = f"TCP connect failed: {e!r}"
+        return result
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    result["tier"] = PROBE_TIER_BANNER
+    try:
+        line = await asyncio.wait_for(reader.readline(), timeout=banner_timeout)
+        banner = line.decode("ascii", errors="replace").strip()
+        result["banner"] = banner
+        if banner.startswith("SSH-"):
+            result["reachable"] = True
+        else:
+            result["error"] = f"Unexpected banner: {banner!r}"
+    except (OSError, TimeoutError) as e:
+        result["error"] = f"Banner read failed: {e!r}"
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+    return result
+
+
+def is_auth_check_due(device_id, now=None) -> bool:
+    """Нужна ли устройству полная проверка: впервые, после неудачи или по истечении интервала"""
+    last = _auth_checks.get(int(device_id))
+    if last is None or not last[1]:
+        return True
+    now = now if now is not None else time.time()
+    return now - last[0] >= DEVICE_AUTH_CHECK_INTERVAL
+
+
+def record_auth_check(device_id, success: bool, now=None):
+    """Запоминает результат полной проверки"""
+    _auth_checks[int(device_id)] = (now if now is not None else time.time(), success)
+
+
+def get_last_auth_result(device_id) -> bool | None:
+    """Результат последней полной проверки или None, если её ещё не было"""
+    last = _auth_checks.get(int(device_id))
+    return last[1] if last is not None else None
+
+
+def forget_device(device_id):
+    """Сбрасывает историю проверок устройства (после удаления или изменения)"""
+    _auth_checks.pop(int(device_id), None)
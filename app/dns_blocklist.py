@@ -0,0 +1,375 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+
+from .iptables_rules import printf_chunks
+from .ssh_executor import ssh_executor
+
+# Отдельный файл блок-листа dnsmasq, подключаемый через conf-file
+DNS_BLOCKLIST_PATH = os.getenv("DNS_BLOCKLIST_PATH", "/etc/dnsmasq.d/blocklist.conf")
+
+# Размер порции при передаче списка доменов на устройство (байт)
+DNS_SYNC_CHUNK_SIZE = int(os.getenv("DNS_SYNC_CHUNK_SIZE", 65536))
+
+# Временный файл со списком доменов на устройстве
+DNS_SYNC_TMP_PATH = "/tmp/fwmp_dns_blocklist.list"
+
+# Интервал проверки расхождений блок-листов устройств с БД (секунды, 0 - отключено)
+DNS_DRIFT_CHECK_INTERVAL = float(os.getenv("DNS_DRIFT_CHECK_INTERVAL", 3600))
+
+# Основной конфиг dnsmasq, куда раньше дописывались блокировки по одному домену
+DNSMASQ_CONF_PATH = "/etc/dnsmasq.conf"
+
+# Временный файл со строками dnsmasq.conf, перенесёнными в блок-лист
+DNS_LEGACY_TMP_PATH = "/tmp/fwmp_dns_legacy.list"
+
+DOMAIN_RE = re.compile(r"^(?=.{1,253}$)(?:[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9])?\.)+[a-z0-9-]{2,63}$")
+ADDRESS_RE = re.compile(r"^address=/([^/]+)/0\.0\.0\.0$")
+
+# Адреса, с которыми домены встречаются в hosts-фидах
+HOSTS_SINKHOLES = {"0.0.0.0", "127.0.0.1", "::", "::1"}
+
+
+def normalize_domain(entry: str) -> str | None:
+    """
+    Приводит строку фида к домену. Поддерживаются строки с одним доменом,
+    hosts-формат ("0.0.0.0 example.com") и address=/example.com/0.0.0.0.
+    Возвращает None для комментариев, пустых и некорректных строк.
+    """
+    entry = entry.split("#", 1)[0].strip().lower()
+    if not entry:
+        return None
+    match = ADDRESS_RE.match(entry)
+    if match:
+        entry = match.group(1)
+    else:
+        parts = entry.split()
+        if len(parts) == 2 and parts[0] in HOSTS_SINKHOLES:
+            entry = parts[1]
+        elif len(parts) != 1:
+            return None
+    entry = entry.rstrip(".")
+    if entry in ("localhost", "localhost.localdomain") or not DOMAIN_RE.match(entry):
+        return None
+    return entry
+
+
+def normalize_domains(entries) -> tuple[set[str], list[str]]:
+    """Домены списка без повторов и строки, которые не удалось разобрать"""
+    domains, invalid = set(), []
+    for entry in entries:
+        domain = normalize_domain(entry)
+        if domain:
+            domains.add(domain)
+        elif entry.split("#", 1)[0].strip():
+            invalid.append(entry.strip())
+    return domains, invalid
+
+
+def parse_blocklist(text: str) -> set[str]:
+    """Домены из содержимого файла блок-листа"""
+    domains = set()
+    for line in text.splitlines():
+        match = ADDRESS_RE.match(line.strip())
+        if match:
+            domains.add(match.group(1))
+    return domains
+
+
+def diff_blocklist(current: set[str], requested: set[str], replace: bool = True) -> tuple[set[str], set[str]]:
+    """
+    Разница между текущим и запрошенным списком: (добавить, удалить).
+    В режиме replace блок-лист становится равен запрошенному списку,
+    иначе запрошенные домены добавляются к текущим.
+    """
+    added = requested - current
+    removed = current - requested if replace else set()
+    return added, removed
+
+
+def build_write_commands(domains, append: bool = False, path: str = DNS_BLOCKLIST_PATH,
+                         chunk_size: int = DNS_SYNC_CHUNK_SIZE) -> list[str]:
+    """
+    Команды записи блок-листа на устройство. По SSH передаются только имена
+    доменов, строки address=/.../0.0.0.0 формирует sed на устройстве.
+    Полная перезапись идёт через временный файл и mv, поэтому dnsmasq не
+    увидит частично записанный файл. Последняя команда выводит число строк.
+    """
+    payload = "".join(f"{domain}\n" for domain in sorted(domains))
+    commands = [f"mkdir -p {os.path.dirname(path)}; : > {DNS_SYNC_TMP_PATH}"]
+    commands.extend(f"printf '{chunk}' >> {DNS_SYNC_TMP_PATH}" for chunk in printf_chunks(payload, chunk_size))
+    render = f"sed 's|.*|address=/&/0.0.0.0|' {DNS_SYNC_TMP_PATH}"
+    if append:
+        write = f"{render} >> {path}"
+    else:
+        write = f"{render} > {path}.tmp && mv {path}.tmp {path}"
+    commands.append(f"{write}; rm -f {DNS_SYNC_TMP_PATH}; {build_include_command(path)}; wc -l < {path}")
+    return commands
+
+
+def build_include_command(path: str = DNS_BLOCKLIST_PATH) -> str:
+    """Идемпотентно подключает блок-лист к конфигурации dnsmasq"""
+    return f"grep -q '^conf-file={path}$' {DNSMASQ_CONF_PATH} || echo 'conf-file={path}' >> {DNSMASQ_CONF_PATH}"
+
+
+def read_blocklist(ssh, path: str = DNS_BLOCKLIST_PATH) -> set[str]:
+    """Текущий блок-лист устройства"""
+    return parse_blocklist(ssh.send_command(f"cat {path} 2>/dev/null", read_timeout=60))
+
+
+def reload_dnsmasq(ssh) -> float:
+    """Перезапускает dnsmasq один раз; возвращает длительность в миллисекундах"""
+    start = time.perf_counter()
+    try:
+        ssh.send_command("/etc/init.d/dnsmasq restart", read_timeout=60)
+    except Exception:
+        ssh.send_command("/etc/init.d/dnsmasq reload", read_timeout=60)
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def sync_blocklist(ssh, requested: set[str], replace: bool = True, path: str = DNS_BLOCKLIST_PATH,
+                   current: set[str] | None = None) -> dict:
+    """
+    Синхронизирует блок-лист устройства с запрошенным списком: одно чтение,
+    одна запись (только добавленные домены, если удалять нечего) и один
+    перезапуск dnsmasq. Если список не изменился, устройство не трогаем.
+    Если содержимое устройства известно (current), чтение пропускается.
+    """
+    if current is None:
+        current = read_blocklist(ssh, path)
+    added, removed = diff_blocklist(current, requested, replace)
+    result = {
+        "added": len(added),
+        "removed": len(removed),
+        "unchanged": len(current & requested),
+        "reload_ms": 0,
+        "transfer_ms": 0,
+        "reloaded": False,
+    }
+    if not added and not removed:
+        result["total"] = len(current)
+        logging.info(f"[DNS-LOG] Blocklist {path} is up to date ({len(current)} domains)")
+        return result
+
+    target = (current - removed) | added
+    append = not removed
+    commands = build_write_commands(added if append else target, append=append, path=path)
+
+    start = time.perf_counter()
+    output = ""
+    for command in commands:
+        output = ssh.send_command(command, read_timeout=60)
+    result["transfer_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    line_count = output.strip().splitlines()[-1].strip() if output.strip() else ""
+    result["verified"] = line_count == str(len(target))
+    if not result["verified"]:
+        logging.warning(f"[DNS-LOG] Blocklist line count mismatch: expected {len(target)}, got '{line_count}'")
+
+    result["reload_ms"] = reload_dnsmasq(ssh)
+    result["reloaded"] = True
+    result["total"] = len(target)
+    result["ssh_commands"] = len(commands)
+    logging.info(f"[DNS-LOG] Blocklist synced: +{len(added)} -{len(removed)} ({len(target)} total), "
+                 f"transfer {result['transfer_ms']} ms in {len(commands)} commands, reload {result['reload_ms']} ms")
+    return result
+
+
+def blocklist_hash(domains) -> str:
+    """Хэш содержимого блок-листа, не зависящий от порядка доменов"""
+    return hashlib.sha256("".join(f"{domain}\n" for domain in sorted(domains)).encode()).hexdigest()
+
+
+def build_hash_command(path: str = DNS_BLOCKLIST_PATH) -> str:
+    """Команда вычисления того же хэша на устройстве: передаётся только хэш, а не файл"""
+    return (f"LC_ALL=C sed -n 's|^address=/\\(.*\\)/0\\.0\\.0\\.0$|\\1|p' {path} 2>/dev/null"
+            f" | LC_ALL=C sort -u | sha256sum")
+
+
+def read_device_hash(ssh, path: str = DNS_BLOCKLIST_PATH) -> str:
+    output = ssh.send_command(build_hash_command(path), read_timeout=60).strip()
+    return output.split()[0] if output else ""
+
+
+def build_legacy_cleanup_commands(lines, chunk_size: int = DNS_SYNC_CHUNK_SIZE) -> list[str]:
+    """
+    Команды удаления из dnsmasq.conf ровно этих строк (grep -vxF по списку).
+    Ошибка grep (код 2) оставляет файл без изменений.
+    """
+    payload = "".join(f"{line}\n" for line in sorted(lines))
+    commands = [f": > {DNS_LEGACY_TMP_PATH}"]
+    commands.extend(f"printf '{chunk}' >> {DNS_LEGACY_TMP_PATH}" for chunk in printf_chunks(payload, chunk_size))
+    commands.append(f"grep -vxFf {DNS_LEGACY_TMP_PATH} {DNSMASQ_CONF_PATH} > {DNSMASQ_CONF_PATH}.tmp; "
+                    f"[ $? -lt 2 ] && cat {DNSMASQ_CONF_PATH}.tmp > {DNSMASQ_CONF_PATH}; "
+                    f"rm -f {DNSMASQ_CONF_PATH}.tmp {DNS_LEGACY_TMP_PATH}")
+    return commands
+
+
+def adopt_blocklist(ssh, path: str = DNS_BLOCKLIST_PATH) -> tuple[set[str], list[str]]:
+    """
+    Первичная загрузка блок-листа устройства: домены из блок-листа и
+    блокировки, добавленные ранее в dnsmasq.conf, переносятся в блок-лист.
+    Из dnsmasq.conf удаляются только перенесённые строки и только после
+    записи и проверки блок-листа. Возвращает блок-лист и строки, которые
+    не удалось перенести (они остаются в dnsmasq.conf).
+    """
+    legacy, migrated, invalid = set(), [], []
+    for line in ssh.send_command(f"cat {DNSMASQ_CONF_PATH}", read_timeout=60).splitlines():
+        match = ADDRESS_RE.match(line)
+        if not match:
+            continue
+        domain = normalize_domain(match.group(1))
+        if domain:
+            legacy.add(domain)
+            migrated.append(line)
+        else:
+            invalid.append(line)
+    current = read_blocklist(ssh, path)
+    domains = current | legacy
+    result = sync_blocklist(ssh, domains, True, path, current)
+
+    if migrated and result.get("verified", True):
+        for command in build_legacy_cleanup_commands(migrated):
+            ssh.send_command(command, read_timeout=30)
+    elif migrated:
+        logging.warning(f"[DNS-LOG] Blocklist {path} not verified, legacy entries kept in {DNSMASQ_CONF_PATH}")
+    if invalid:
+        logging.warning(f"[DNS-LOG] {len(invalid)} legacy DNS entries not migrated, kept in {DNSMASQ_CONF_PATH}: {invalid[:5]}")
+    logging.info(f"[DNS-LOG] Adopted blocklist: {len(current)} from {path}, {len(legacy)} from {DNSMASQ_CONF_PATH}")
+    return domains, invalid
+
+
+# Блокировки устройств: чтение блок-листа, запись в БД и отправка на устройство
+# выполняются целиком, иначе параллельные изменения перезапишут друг друга
+_device_locks: dict[int, asyncio.Lock] = {}
+
+
+def device_lock(device_id: int) -> asyncio.Lock:
+    lock = _device_locks.get(device_id)
+    if lock is None:
+        lock = _device_locks[device_id] = asyncio.Lock()
+    return lock
+
+
+def forget_device_lock(device_id: int):
+    """Удаляет блокировку удалённого устройства, если она свободна"""
+    lock = _device_locks.get(int(device_id))
+    if lock is not None and not lock.locked():
+        del _device_locks[int(device_id)]
+
+
+async def load_device_blocklist(device: dict, netmiko_device: dict) -> set[str]:
+    """
+    Блок-лист устройства из БД. При первом обращении к устройству блок-лист
+    один раз читается с устройства и сохраняется в БД.
+    """
+    from .database import get_dns_blocklist, get_dns_blocklist_state, save_dns_blocklist_state, update_dns_blocklist
+    if await get_dns_blocklist_state(device["id"]) is not None:
+        return await get_dns_blocklist(device["id"])
+
+    domains, invalid = await ssh_executor.run(netmiko_device, adopt_blocklist)
+    if invalid:
+        logging.warning(f"[DNS-LOG] Device {device['id']}: {len(invalid)} legacy entries in {DNSMASQ_CONF_PATH} "
+                        f"not migrated to the blocklist")
+    await update_dns_blocklist(device["id"], domains, set())
+    await save_dns_blocklist_state(device["id"], blocklist_hash(domains), len(domains))
+    return domains
+
+
+async def push_device_blocklist(device: dict, netmiko_device: dict, domains: set[str],
+                                previous: set[str] | None = None) -> dict:
+    """
+    Отправляет блок-лист на устройство, только если его хэш отличается от
+    последнего отправленного или обнаружено расхождение. previous - список,
+    отправленный в прошлый раз: если его хэш совпадает с сохранённым,
+    разница считается без чтения файла с устройства.
+    """
+    from .database import get_dns_blocklist_state, save_dns_blocklist_state
+    state = await get_dns_blocklist_state(device["id"])
+    new_hash = blocklist_hash(domains)
+    trusted = state is not None and not state["drift_detected"]
+    if trusted and state["pushed_hash"] == new_hash:
+        logging.info(f"[DNS-LOG] Blocklist hash unchanged for device {device['id']}, push skipped")
+        return {"skipped": True, "added": 0, "removed": 0, "total": len(domains),
+                "reloaded": False, "reload_ms": 0, "transfer_ms": 0}
+
+    current = previous if trusted and previous is not None and blocklist_hash(previous) == state["pushed_hash"] else None
+    result = await ssh_executor.run(netmiko_device, sync_blocklist, domains, True, DNS_BLOCKLIST_PATH, current)
+    # Если число строк на устройстве не сошлось, следующая отправка перечитает файл
+    await save_dns_blocklist_state(device["id"], new_hash, len(domains), drift_detected=not result.get("verified", True))
+    result["skipped"] = False
+    return result
+
+
+async def update_device_blocklist(device: dict, netmiko_device: dict, add=(), remove=(), replace=None) -> dict:
+    """
+    Изменяет блок-лист устройства: новый список строится от копии в БД и
+    отправляется на устройство, в БД изменения записываются только после
+    успешной отправки. replace задаёт список целиком.
+    """
+    from .database import update_dns_blocklist
+    async with device_lock(device["id"]):
+        previous = await load_device_blocklist(device, netmiko_device)
+        target = set(replace) if replace is not None else (previous | set(add)) - set(remove)
+        added, removed = target - previous, previous - target
+
+        # Ошибка отправки оставляет БД без изменений: в ней нет доменов, которых нет на устройстве
+        result = await push_device_blocklist(device, netmiko_device, target, previous)
+        if added or removed:
+            await update_dns_blocklist(device["id"], added, removed)
+    result.update({"added": len(added), "removed": len(removed), "unchanged": len(previous & target), "total": len(target)})
+    return result
+
+
+async def check_device_drift(device: dict) -> dict:
+    """
+    Сравнивает хэш блок-листа на устройстве с хэшем списка в БД.
+    При расхождении (правки в обход платформы, прерванная синхронизация)
+    блок-лист из БД отправляется заново.
+    """
+    from .database import get_dns_blocklist, get_dns_blocklist_state, mark_dns_blocklist_checked
+    state = await get_dns_blocklist_state(device["id"])
+    if state is None:
+        return {"checked": False, "message": "Блок-лист устройства ещё не загружен"}
+
+    netmiko_device = {
+        "device_type": "linux",
+        "host": device["ip"],
+        "username": device["username"],
+        "password": device["password"],
+    }
+    async with device_lock(device["id"]):
+        state = await get_dns_blocklist_state(device["id"])
+        domains = await get_dns_blocklist(device["id"])
+        expected_hash = blocklist_hash(domains)
+        device_hash = await ssh_executor.run(netmiko_device, read_device_hash)
+        drift = device_hash != expected_hash
+        await mark_dns_blocklist_checked(device["id"], drift)
+        result = {"checked": True, "drift_detected": drift, "device_hash": device_hash,
+                  "expected_hash": expected_hash, "pushed_hash": state["pushed_hash"]}
+
+        if drift:
+            logging.warning(f"[DNS-LOG] Blocklist drift on device {device['id']}: device {device_hash[:12]}, expected {expected_hash[:12]}")
+            result["repair"] = await push_device_blocklist(device, netmiko_device, domains)
+    return result
+
+
+async def check_all_drift() -> dict:
+    """Проверка расхождений на всех устройствах с загруженным блок-листом"""
+    from .database import get_dns_blocklist_device_ids, get_firewall_device_by_id
+    devices = [device for device in [await get_firewall_device_by_id(device_id) for device_id in await get_dns_blocklist_device_ids()]
+               if device and device["type"] == "openwrt"]
+    results = await asyncio.gather(*(check_device_drift(device) for device in devices), return_exceptions=True)
+
+    drifted = failed = 0
+    for device, result in zip(devices, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logging.error(f"[DNS-LOG] Drift check failed for device {device['id']}: {result}")
+        elif result.get("drift_detected"):
+            drifted += 1
+    logging.info(f"[DNS-LOG] Drift check: {len(devices)} devices, {drifted} drifted, {failed} failed")
+    return {"checked": len(devices), "drifted": drifted, "failed": failed}
@@ -1,12 +1,27 @@
 import logging
 import re
+import time
 from datetime import datetime
 
-from fastapi import APIRouter, Body, HTTPException, Query
-from netmiko import ConnectHandler
+from fastapi import APIRouter, Body, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
 
 from .database import get_firewall_device_by_id
+from .conntrack_sampler import CONNTRACK_TOP_N, ConntrackSampler, conntrack_samplers, stream_samples
+from .db_pool import acquire_connection
+from . import dns_blocklist, ipset_blocklist
+from .device_poller import device_poller
+from .iptables_parser import BLOCK_CHAINS, build_delete_command, rule_index_cache
+from .iptables_rules import (
+    build_block_rules,
+    build_restore_commands,
+    build_restore_payload,
+    parse_restore_result,
+    validate_block_entry,
+)
 from .models import FirewallDeviceCreate, FirewallDeviceModel
+from .ssh_executor import ssh_executor
+from .ssh_pool import device_key
 
 router = APIRouter()
 
@@ -14,26 +29,6 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# SSH соединения
-ssh_connections = {}
-
-def get_ssh_connection(device_config):
-    """Получает или создает SSH соединение"""
-    key = f"{device_config['host']}_{device_config['username']}"
-    if key not in ssh_connections:
-        ssh_connections[key] = ConnectHandler(**device_config)
-    return ssh_connections[key]
-
-def close_ssh_connection(host, username):
-    """Закрывает SSH соединение"""
-    key = f"{host}_{username}"
-    if key in ssh_connections:
-        try:
-            ssh_connections[key].disconnect()
-        except:
-            pass
-        del ssh_connections[key]
-
 # === DNS БЛОКИРОВКА (DNSMASQ) ===
 
 @router.get("/api/device_dns_rules")
@@ -55,29 +50,17 @@ async def api_get_dns_rules(device_id: int = Query(...)):
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-            # Читаем содержимое dnsmasq.conf
-            dnsmasq_config = ssh.send_command("cat /etc/dnsmasq.conf", read_timeout=10)
-            
-            # Парсим заблокированные домены
-            domains = []
-            for line in dnsmasq_config.splitlines():
-                line = line.strip()
-                if line.startswith("address=/") and line.endswith("/0.0.0.0"):
-                    # Извлекаем домен из строки address=/domain.com/0.0.0.0
-                    domain = line[9:-8]  # Убираем 'address=/' и '/0.0.0.0'
-                    domains.append(domain)
-            
+            # Блок-лист читается из БД; с устройства - только при первом обращении
+            domains = sorted(await dns_blocklist.load_device_blocklist(device, netmiko_device))
             return {
                 "device_name": device["name"],
                 "domains": domains,
-                "total_count": len(domains)
+                "total_count": len(domains),
+                "source": "db"
             }
-            
+                
         except Exception as e:
             logging.error(f"[DNS-LOG] Error getting DNS rules: {e}")
-            close_ssh_connection(device["ip"], device["username"])
             raise HTTPException(status_code=500, detail=f"Error getting rules: {e!s}")
             
     except Exception as e:
@@ -98,6 +81,9 @@ async def api_add_dns_block(device_id: int = Query(...), request_data: dict = Bo
         domain = request_data.get("domain", "").strip()
         if not domain:
             raise HTTPException(status_code=400, detail="Domain is required")
+        domain = dns_blocklist.normalize_domain(domain)
+        if not domain:
+            raise HTTPException(status_code=400, detail="Invalid domain name")
         
         netmiko_device = {
             "device_type": "linux",
@@ -107,30 +93,18 @@ async def api_add_dns_block(device_id: int = Query(...), request_data: dict = Bo
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-            # Добавляем домен в dnsmasq.conf
-            ssh.send_command(f"echo 'address=/{domain}/0.0.0.0' >> /etc/dnsmasq.conf", read_timeout=10)
-            
-            # Перезапускаем dnsmasq
-            try:
-                ssh.send_command("/etc/init.d/dnsmasq restart", read_timeout=30)
-            except:
-                try:
-                    ssh.send_command("/etc/init.d/dnsmasq reload", read_timeout=30)
-                except:
-                    pass
-            
+            result = await dns_blocklist.update_device_blocklist(device, netmiko_device, add={domain})
             return {
                 "success": True,
                 "message": f"Домен {domain} заблокирован",
                 "blocked_domain": domain,
+                "pushed": not result["skipped"],
+                "reload_ms": result["reload_ms"],
                 "timestamp": datetime.now().isoformat()
             }
-            
+                
         except Exception as e:
             logging.error(f"[DNS-LOG] Error blocking domain {domain}: {e}")
-            close_ssh_connection(device["ip"], device["username"])
             raise HTTPException(status_code=500, detail=f"Error blocking domain: {e!s}")
             
     except Exception as e:
@@ -151,6 +125,9 @@ async def api_remove_dns_block(device_id: int = Query(...), request_data: dict =
         domain = request_data.get("domain", "").strip()
         if not domain:
             raise HTTPException(status_code=400, detail="Domain is required")
+        domain = dns_blocklist.normalize_domain(domain)
+        if not domain:
+            raise HTTPException(status_code=400, detail="Invalid domain name")
         
         netmiko_device = {
             "device_type": "linux",
@@ -160,32 +137,18 @@ async def api_remove_dns_block(device_id: int = Query(...), request_data: dict =
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-            # Удаляем строку с доменом из dnsmasq.conf
-            # Экранируем точку в домене для sed
-            escaped_domain = domain.replace(".", r"\.")
-            ssh.send_command(f"sed -i '/address=\\/{escaped_domain}\\/0\\.0\\.0\\.0/d' /etc/dnsmasq.conf", read_timeout=10)
-            
-            # Перезапускаем dnsmasq
-            try:
-                ssh.send_command("/etc/init.d/dnsmasq restart", read_timeout=30)
-            except:
-                try:
-                    ssh.send_command("/etc/init.d/dnsmasq reload", read_timeout=30)
-                except:
-                    pass
-            
+            result = await dns_blocklist.update_device_blocklist(device, netmiko_device, remove={domain})
             return {
                 "success": True,
-                "message": f"Домен {domain} разблокирован",
+                "message": f"Домен {domain} разблокирован" if result["removed"] else f"Домен {domain} не найден в блок-листе",
                 "unblocked_domain": domain,
+                "pushed": not result["skipped"],
+                "reload_ms": result["reload_ms"],
                 "timestamp": datetime.now().isoformat()
             }
-            
+                
         except Exception as e:
             logging.error(f"[DNS-LOG] Error unblocking domain {domain}: {e}")
-            close_ssh_connection(device["ip"], device["username"])
             raise HTTPException(status_code=500, detail=f"Error unblocking domain: {e!s}")
             
     except Exception as e:
@@ -211,35 +174,113 @@ async def api_clear_all_dns_blocks(device_id: int = Query(...)):
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-            # Удаляем все строки с address= из dnsmasq.conf
-            ssh.send_command("sed -i '/^address=\\/.*\\/0\\.0\\.0\\.0$/d' /etc/dnsmasq.conf", read_timeout=10)
-            
-            # Перезапускаем dnsmasq
-            try:
-                ssh.send_command("/etc/init.d/dnsmasq restart", read_timeout=30)
-            except:
-                try:
-                    ssh.send_command("/etc/init.d/dnsmasq reload", read_timeout=30)
-                except:
-                    pass
-            
+            result = await dns_blocklist.update_device_blocklist(device, netmiko_device, replace=set())
             return {
                 "success": True,
                 "message": "Все DNS блокировки удалены",
+                "removed_count": result["removed"],
                 "timestamp": datetime.now().isoformat()
             }
-            
+                
         except Exception as e:
             logging.error(f"[DNS-LOG] Error clearing all DNS blocks: {e}")
-            close_ssh_connection(device["ip"], device["username"])
             raise HTTPException(status_code=500, detail=f"Error clearing blocks: {e!s}")
             
     except Exception as e:
         logging.error(f"[DNS-LOG] Error in api_clear_all_dns_blocks: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {e!s}")
 
+async def sync_dns_blocklist(device_id: int, entries, mode: str, clear: bool = False) -> dict:
+    """
+    Общая часть пакетной синхронизации блок-листа из списка и из файла.
+    Пустой список в режиме replace очищает блок-лист только при clear=True.
+    """
+    device = await get_firewall_device_by_id(device_id)
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    
+    if device["type"] != "openwrt":
+        raise HTTPException(status_code=400, detail="Device type does not support DNS blocking")
+    
+    mode = (mode or "replace").strip().lower()
+    if mode not in ("replace", "merge"):
+        raise HTTPException(status_code=400, detail="Mode must be one of: replace, merge")
+    
+    domains, invalid = dns_blocklist.normalize_domains(entries)
+    if not domains and (invalid or mode == "merge"):
+        raise HTTPException(status_code=400, detail=f"No valid domains to block ({len(invalid)} invalid)")
+    if not domains and not clear:
+        raise HTTPException(status_code=400, detail="Empty blocklist; pass clear=true to remove all domains")
+    logging.info(f"[DNS-LOG] Bulk sync request: {len(domains)} domains, {len(invalid)} invalid, mode={mode}")
+    
+    netmiko_device = {
+        "device_type": "linux",
+        "host": device["ip"],
+        "username": device["username"],
+        "password": device["password"],
+    }
+    
+    try:
+        if mode == "replace":
+            result = await dns_blocklist.update_device_blocklist(device, netmiko_device, replace=domains)
+        else:
+            result = await dns_blocklist.update_device_blocklist(device, netmiko_device, add=domains)
+    except Exception as e:
+        logging.error(f"[DNS-LOG] Error syncing DNS blocklist: {e}")
+        raise HTTPException(status_code=500, detail=f"Error syncing blocklist: {e!s}")
+    
+    return {
+        "success": True,
+        "message": f"Блок-лист обновлён: добавлено {result['added']}, удалено {result['removed']}",
+        "device_name": device["name"],
+        "mode": mode,
+        "requested": len(domains),
+        "invalid_count": len(invalid),
+        "invalid_sample": invalid[:10],
+        **result,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.post("/api/device_dns_block_bulk")
+async def api_dns_block_bulk(device_id: int = Query(...), request_data: dict = Body(...)):
+    """
+    API для пакетной синхронизации блок-листа dnsmasq.
+    Тело: {"domains": [...], "mode": "replace" | "merge", "clear": false}.
+    """
+    domains = request_data.get("domains")
+    if not isinstance(domains, list):
+        raise HTTPException(status_code=400, detail="Domains list is required")
+    return await sync_dns_blocklist(device_id, [str(domain) for domain in domains], request_data.get("mode", "replace"),
+                                    clear=request_data.get("clear") is True)
+
+@router.post("/api/device_dns_block_upload")
+async def api_dns_block_upload(device_id: int = Query(...), mode: str = Query("replace"), clear: bool = Query(False),
+                               file: UploadFile = File(...)):
+    """API для загрузки блок-листа из файла (список доменов, hosts-формат или address=/.../0.0.0.0)"""
+    content = (await file.read()).decode("utf-8", errors="ignore")
+    logging.info(f"[DNS-LOG] Uploaded blocklist {file.filename}: {len(content)} bytes")
+    return await sync_dns_blocklist(device_id, content.splitlines(), mode, clear)
+
+@router.post("/api/device_dns_drift_check")
+async def api_dns_drift_check(device_id: int = Query(...)):
+    """API для проверки расхождения блок-листа на устройстве с БД (при расхождении блок-лист отправляется заново)"""
+    try:
+        device = await get_firewall_device_by_id(device_id)
+        if not device:
+            raise HTTPException(status_code=404, detail="Device not found")
+        
+        if device["type"] != "openwrt":
+            raise HTTPException(status_code=400, detail="Device type does not support DNS blocking")
+        
+        result = await dns_blocklist.check_device_drift(device)
+        return {"device_name": device["name"], **result, "timestamp": datetime.now().isoformat()}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"[DNS-LOG] Error in api_dns_drift_check: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {e!s}")
+
 # === IP БЛОКИРОВКА (IPTABLES) ===
 
 @router.get("/api/device_ip_rules")
@@ -261,136 +302,84 @@ async def api_get_ip_rules(device_id: int = Query(...), direction: str = Query(N
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-            # Получаем заблокированные IP из iptables
-            try:
-                # Проверяем все цепочки: FORWARD, INPUT, OUTPUT
-                chains = ["FORWARD", "INPUT", "OUTPUT"]
-                ips = []
-                raw_rules = []  # Для отладки
+            def read_ip_rules(ssh):
+                if ipset_blocklist.is_set_mode():
+                    # В режиме ipset список блокировок - это содержимое множеств
+                    direction_text = {"in": "входящий", "out": "исходящий"}
+                    ips = sorted({
+                        (f"{ip}:{port}" if port else ip) + f" ({direction_text[rule_direction]})"
+                        for ip, port, rule_direction in ipset_blocklist.read_blocked(ssh)
+                        if not direction or direction.lower() in ("both", rule_direction)
+                    })
+                    return {
+                        "device_name": device["name"],
+                        "ips": ips,
+                        "total_count": len(ips),
+                        "filter_direction": direction,
+                        "mode": "ipset"
+                    }
                 
-                for chain in chains:
-                    try:
-                        iptables_output = ssh.send_command(f"iptables -L {chain} -n -v --line-numbers", read_timeout=10)
-                        logging.info(f"[IP-LOG] Raw iptables output for {chain}: {iptables_output}")
+                # Получаем заблокированные IP из индекса правил (один вызов iptables-save)
+                try:
+                    index = rule_index_cache.get(device_key(netmiko_device), ssh)
+                    direction_text = {"in": "входящий", "out": "исходящий"}
+                    ips = set()
+                    raw_rules = []  # Для отладки
+                    
+                    for rule in index.drop_rules():
+                        raw_rules.append(f"{rule.chain}: {rule.spec}")
+                        if rule.blocked_ip:
+                            # Блокировка, созданная платформой: IP, порт и направление из комментария
+                            ip_info = f"{rule.blocked_ip}:{rule.blocked_port}" if rule.blocked_port else rule.blocked_ip
+                            ips.add(f"{ip_info} ({direction_text.get(rule.direction, 'неизвестно')})")
+                            continue
                         
-                        for line in iptables_output.splitlines():
-                            line = line.strip()
-                            if not line:  # Пропускаем пустые строки
-                                continue
-                                
-                            logging.info(f"[IP-LOG] Processing line in {chain}: {line}")
-                            raw_rules.append(f"{chain}: {line}")
-                            
-                            # Ищем все правила DROP (не только с комментарием blocked_ip)
-                            if "DROP" in line:
-                                logging.info(f"[IP-LOG] Found DROP rule in {chain}: {line}")
-                                
-                                # Сначала пробуем найти IP в комментарии blocked_ip
-                                # Ищем комментарий в формате /* blocked_ip:IP:PORT:direction */ или /* blocked_ip:IP:direction */
-                                comment_match = re.search(r"blocked_ip:(\d+\.\d+\.\d+\.\d+)(?::(\d+))?(?::(in|out))?", line)
-                                if comment_match:
-                                    ip = comment_match.group(1)
-                                    port = comment_match.group(2) if comment_match.group(2) else None
-                                    direction = comment_match.group(3) if comment_match.group(3) else None
-                                    
-                                    # Проверяем, что IP валидный (только числовой IP, не DNS-имя)
-                                    if re.match(r"^\d+\.\d+\.\d+\.\d+$", ip) and not re.search(r"[a-zA-Z]", ip):
-                                        # Формируем информацию о блокировке с направлением
-                                        direction_text = {
-                                            "in": "входящий",
-                                            "out": "исходящий",
-                                            "both": "весь трафик"
-                                        }.get(direction, "неизвестно")
-                                        
-                                        if port:
-                                            ip_info = f"{ip}:{port} ({direction_text})"
-                                        else:
-                                            ip_info = f"{ip} ({direction_text})"
-                                        
-                                        # Добавляем IP с информацией о направлении
-                                        ips.append(ip_info)
-                                        logging.info(f"[IP-LOG] Added IP from comment: {ip_info}")
-                                        continue  # Переходим к следующей строке, так как уже нашли IP
-                                
-                                # Если нет комментария, ищем IP в самой строке правила
-                                # Улучшенный поиск IP-адресов в строке
-                                ip_matches = re.findall(r"\b(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\b", line)
-                                logging.info(f"[IP-LOG] Found IP matches in line: {ip_matches}")
-                                
-                                for ip in ip_matches:
-                                    # Проверяем, что это не служебные IP и что это числовой IP
-                                    if (ip != "0.0.0.0" and ip != "127.0.0.1" and 
-                                        ip != "255.255.255.255" and ip != "224.0.0.0" and
-                                        re.match(r"^\d+\.\d+\.\d+\.\d+$", ip) and 
-                                        not re.search(r"[a-zA-Z]", ip)):
-                                        
-                                        # Определяем направление по содержимому строки и цепочке
-                                        rule_direction = "неизвестно"
-                                        if chain == "INPUT" or "-d " + ip in line:
-                                            rule_direction = "входящий"
-                                        elif chain == "OUTPUT" or "-s " + ip in line:
-                                            rule_direction = "исходящий"
-                                        elif chain == "FORWARD":
-                                            if "-d " + ip in line:
-                                                rule_direction = "входящий"
-                                            elif "-s " + ip in line:
-                                                rule_direction = "исходящий"
-                                        
-                                        ip_info = f"{ip} ({rule_direction})"
-                                        ips.append(ip_info)
-                                        logging.info(f"[IP-LOG] Added IP from rule: {ip_info}")
-                    except Exception as chain_error:
-                        logging.error(f"[IP-LOG] Error processing chain {chain}: {chain_error}")
-                        continue
-                
-                # Убираем дубликаты
-                ips = list(set(ips))
-                
-                # Фильтруем по направлению, если указано
-                if direction:
-                    filter_direction = direction.lower()
-                    filtered_ips = []
-                    for ip_info in ips:
-                        if (filter_direction == "in" and "входящий" in ip_info) or (filter_direction == "out" and "исходящий" in ip_info):
-                            filtered_ips.append(ip_info)
-                        elif filter_direction == "both":
-                            # Для 'both' показываем все IP, но группируем по направлению
-                            filtered_ips.append(ip_info)
-                    ips = filtered_ips
-                
-                logging.info(f"[IP-LOG] Total blocked IPs found: {len(ips)} (filtered by direction: {filter_direction if 'filter_direction' in locals() else direction})")
-                logging.info(f"[IP-LOG] All found IPs: {ips}")
-                logging.info(f"[IP-LOG] Raw rules processed: {raw_rules}")
-                
-                return {
-                    "device_name": device["name"],
-                    "ips": ips,
-                    "total_count": len(ips),
-                    "filter_direction": filter_direction if "filter_direction" in locals() else direction,
-                    "debug_info": {
-                        "raw_rules_count": len(raw_rules),
-                        "raw_rules_sample": raw_rules[:5] if raw_rules else []  # Первые 5 правил для отладки
+                        # Правило без комментария: направление по цепочке и полю адреса
+                        for ip in rule.addresses():
+                            if rule.chain == "INPUT" or (rule.chain == "FORWARD" and ip == (rule.destination or "").removesuffix("/32")):
+                                rule_direction = "входящий"
+                            else:
+                                rule_direction = "исходящий"
+                            ips.add(f"{ip} ({rule_direction})")
+                    
+                    ips = sorted(ips)
+                    
+                    # Фильтруем по направлению, если указано
+                    filter_direction = direction.lower() if direction else None
+                    if filter_direction in ("in", "out"):
+                        ips = [ip_info for ip_info in ips if direction_text[filter_direction] in ip_info]
+                    
+                    logging.info(f"[IP-LOG] Total blocked IPs found: {len(ips)} (filtered by direction: {filter_direction})")
+                    
+                    return {
+                        "device_name": device["name"],
+                        "ips": ips,
+                        "total_count": len(ips),
+                        "filter_direction": filter_direction,
+                        "index_version": index.version,
+                        "debug_info": {
+                            "raw_rules_count": len(raw_rules),
+                            "raw_rules_sample": raw_rules[:5]  # Первые 5 правил для отладки
+                        }
                     }
-                }
-                
-            except Exception as e:
-                logging.error(f"[IP-LOG] Error getting IP rules: {e}")
-                return {
-                    "device_name": device["name"],
-                    "ips": [],
-                    "error": f"Ошибка получения правил: {e!s}",
-                    "debug_info": {
-                        "error_details": str(e),
-                        "raw_rules_count": len(raw_rules),
-                        "raw_rules_sample": raw_rules[:5] if raw_rules else []
+                    
+                except Exception as e:
+                    logging.error(f"[IP-LOG] Error getting IP rules: {e}")
+                    return {
+                        "device_name": device["name"],
+                        "ips": [],
+                        "error": f"Ошибка получения правил: {e!s}",
+                        "debug_info": {
+                            "error_details": str(e),
+                            "raw_rules_count": 0,
+                            "raw_rules_sample": []
+                        }
                     }
-                }
-                
+
+            return await ssh_executor.run(netmiko_device, read_ip_rules)
+                    
         except Exception as e:
             logging.error(f"[IP-LOG] Error connecting to device: {e}")
-            close_ssh_connection(device["ip"], device["username"])
             raise HTTPException(status_code=500, detail=f"Error connecting to device: {e!s}")
             
     except Exception as e:
@@ -416,31 +405,24 @@ async def api_get_iptables_raw(device_id: int = Query(...)):
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-            # Получаем все правила iptables без фильтрации
-            chains = ["FORWARD", "INPUT", "OUTPUT"]
-            all_rules = {}
-            
-            for chain in chains:
-                try:
-                    iptables_output = ssh.send_command(f"iptables -L {chain} -n -v --line-numbers", read_timeout=10)
-                    all_rules[chain] = iptables_output.splitlines()
-                    logging.info(f"[IPTABLES-RAW] Chain {chain} rules: {len(all_rules[chain])} lines")
-                except Exception as e:
-                    logging.error(f"[IPTABLES-RAW] Error getting {chain} rules: {e}")
-                    all_rules[chain] = [f"Error: {e!s}"]
-            
-            return {
-                "device_name": device["name"],
-                "all_rules": all_rules,
-                "total_chains": len(chains),
-                "timestamp": datetime.now().isoformat()
-            }
-            
+            def read_iptables(ssh):
+                # Получаем все правила iptables без фильтрации одним вызовом iptables-save
+                index = rule_index_cache.get(device_key(netmiko_device), ssh)
+                all_rules = {chain: index.raw_lines.get(chain, []) for chain in BLOCK_CHAINS}
+                logging.info(f"[IPTABLES-RAW] Rule index version {index.version}: {index.rule_count} rules")
+                
+                return {
+                    "device_name": device["name"],
+                    "all_rules": all_rules,
+                    "policies": {chain: index.policies.get(chain) for chain in BLOCK_CHAINS},
+                    "total_chains": len(BLOCK_CHAINS),
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            return await ssh_executor.run(netmiko_device, read_iptables)
+                
         except Exception as e:
             logging.error(f"[IPTABLES-RAW] Error connecting to device: {e}")
-            close_ssh_connection(device["ip"], device["username"])
             raise HTTPException(status_code=500, detail=f"Error connecting to device: {e!s}")
             
     except Exception as e:
@@ -479,6 +461,11 @@ async def api_add_ip_block(device_id: int = Query(...), request_data: dict = Bod
             logging.error(f"[IP-LOG] DNS name detected: '{ip}'")
             raise HTTPException(status_code=400, detail="DNS names are not allowed. Please use numeric IP addresses only.")
         
+        entry_error = validate_block_entry(ip, port, direction)
+        if entry_error:
+            logging.error(f"[IP-LOG] Invalid block entry: {entry_error}")
+            raise HTTPException(status_code=400, detail=entry_error)
+        
         logging.info(f"[IP-LOG] IP validation passed: '{ip}'")
         
         netmiko_device = {
@@ -489,64 +476,172 @@ async def api_add_ip_block(device_id: int = Query(...), request_data: dict = Bod
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-            # Формируем команды iptables в зависимости от направления
-            
-            if port:
-                # Блокируем конкретный порт
-                if direction in ["in", "both"]:
-                    # Блокируем входящий трафик к IP на указанном порту
-                    cmd1 = f"iptables -I FORWARD 1 -d {ip} -p tcp --dport {port} -j DROP -m comment --comment 'blocked_ip:{ip}:{port}:in'"
-                    ssh.send_command(cmd1, read_timeout=10)
-                    logging.info(f"[IP-LOG] Added IN rule for IP {ip}:{port} with comment: blocked_ip:{ip}:{port}:in")
+            def block_ip(ssh):
+                if ipset_blocklist.is_set_mode():
+                    # Добавляем IP в множества, правила цепочек не растут
+                    ipset_blocklist.block(ssh, ip, port, direction)
+                else:
+                    # Формируем команды iptables в зависимости от направления
+                    for chain, spec in build_block_rules(ip, port, direction):
+                        ssh.send_command(f"iptables -I {chain} 1 {spec}", read_timeout=10)
+                    logging.info(f"[IP-LOG] Added {direction.upper()} rules for IP {ip}" + (f":{port}" if port else ""))
+                rule_index_cache.invalidate(device_key(netmiko_device))
                 
-                if direction in ["out", "both"]:
-                    # Блокируем исходящий трафик от IP с указанного порта
-                    cmd2 = f"iptables -I FORWARD 1 -s {ip} -p tcp --sport {port} -j DROP -m comment --comment 'blocked_ip:{ip}:{port}:out'"
-                    ssh.send_command(cmd2, read_timeout=10)
-                    logging.info(f"[IP-LOG] Added OUT rule for IP {ip}:{port} with comment: blocked_ip:{ip}:{port}:out")
-            else:
-                # Блокируем весь трафик
-                if direction in ["in", "both"]:
-                    # Блокируем весь входящий трафик к IP (FORWARD + INPUT)
-                    cmd1 = f"iptables -I FORWARD 1 -d {ip} -j DROP -m comment --comment 'blocked_ip:{ip}:in'"
-                    ssh.send_command(cmd1, read_timeout=10)
-                    cmd1_input = f"iptables -I INPUT 1 -d {ip} -j DROP -m comment --comment 'blocked_ip:{ip}:in'"
-                    ssh.send_command(cmd1_input, read_timeout=10)
-                    logging.info(f"[IP-LOG] Added IN rules for IP {ip} (FORWARD + INPUT)")
+                # Формируем сообщение в зависимости от направления
+                direction_text = {
+                    "in": "входящий трафик",
+                    "out": "исходящий трафик", 
+                    "both": "весь трафик"
+                }.get(direction, "весь трафик")
                 
-                if direction in ["out", "both"]:
-                    # Блокируем весь исходящий трафик от IP (FORWARD + OUTPUT)
-                    cmd2 = f"iptables -I FORWARD 1 -s {ip} -j DROP -m comment --comment 'blocked_ip:{ip}:out'"
-                    ssh.send_command(cmd2, read_timeout=10)
-                    cmd2_output = f"iptables -I OUTPUT 1 -d {ip} -j DROP -m comment --comment 'blocked_ip:{ip}:out'"
-                    ssh.send_command(cmd2_output, read_timeout=10)
-                    logging.info(f"[IP-LOG] Added OUT rules for IP {ip} (FORWARD + OUTPUT)")
-            
-            # Формируем сообщение в зависимости от направления
-            direction_text = {
-                "in": "входящий трафик",
-                "out": "исходящий трафик", 
-                "both": "весь трафик"
-            }.get(direction, "весь трафик")
+                return {
+                    "success": True,
+                    "message": f"IP {ip}" + (f":{port}" if port else "") + f" заблокирован ({direction_text})",
+                    "blocked_ip": ip,
+                    "blocked_port": port,
+                    "direction": direction,
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            return await ssh_executor.run(netmiko_device, block_ip)
+                
+        except Exception as e:
+            logging.error(f"[IP-LOG] Error blocking IP {ip}: {e}")
+            raise HTTPException(status_code=500, detail=f"Error blocking IP: {e!s}")
             
+    except Exception as e:
+        logging.error(f"[IP-LOG] Error in api_add_ip_block: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {e!s}")
+
+@router.post("/api/device_ip_block_bulk")
+async def api_add_ip_block_bulk(device_id: int = Query(...), request_data: dict = Body(...)):
+    """
+    API для пакетной блокировки IP одной транзакцией iptables-restore --noflush
+    (в режиме ipset - одной транзакцией ipset restore).
+    Тело: {"entries": [{"ip": ..., "port": ..., "direction": ...}, ...]}
+    или {"ips": [...], "port": ..., "direction": ...} с общими параметрами.
+    """
+    try:
+        device = await get_firewall_device_by_id(device_id)
+        if not device:
+            raise HTTPException(status_code=404, detail="Device not found")
+        
+        if device["type"] != "openwrt":
+            raise HTTPException(status_code=400, detail="Device type does not support IP blocking")
+        
+        entries = request_data.get("entries")
+        if entries is None:
+            ips = request_data.get("ips", [])
+            if not isinstance(ips, list):
+                raise HTTPException(status_code=400, detail="ips must be a list")
+            for i, ip in enumerate(ips):
+                if not isinstance(ip, str):
+                    raise HTTPException(status_code=400, detail=f"ips[{i}]: must be a string")
+            default_port = str(request_data.get("port", "") or "").strip()
+            default_direction = str(request_data.get("direction", "both")).strip().lower()
+            entries = [{"ip": ip, "port": default_port, "direction": default_direction} for ip in ips]
+        elif not isinstance(entries, list):
+            raise HTTPException(status_code=400, detail="entries must be a list")
+        if not entries:
+            raise HTTPException(status_code=400, detail="No entries to block")
+        for i, entry in enumerate(entries):
+            if not isinstance(entry, dict):
+                raise HTTPException(status_code=400, detail=f"entries[{i}]: must be an object")
+        
+        # Проверяем записи и собираем общий набор правил (или элементов множеств) без повторов
+        set_mode = ipset_blocklist.is_set_mode()
+        results = []
+        rules = []
+        seen = set()
+        for entry in entries:
+            ip = str(entry.get("ip", "")).strip()
+            port = str(entry.get("port", "") or "").strip()
+            direction = str(entry.get("direction", "both")).strip().lower()
+            error = validate_block_entry(ip, port, direction)
+            result = {"ip": ip, "port": port, "direction": direction}
+            if error:
+                result.update({"success": False, "error": error})
+            else:
+                entry_rules = ipset_blocklist.set_members_for(ip, port, direction) if set_mode else build_block_rules(ip, port, direction)
+                entry_rules = [rule for rule in entry_rules if rule not in seen]
+                seen.update(entry_rules)
+                rules.extend(entry_rules)
+                result.update({"success": True, "rules": len(entry_rules)})
+            results.append(result)
+        
+        logging.info(f"[IP-LOG] Bulk block request: {len(entries)} entries, {len(rules)} rules")
+        
+        if not rules:
             return {
-                "success": True,
-                "message": f"IP {ip}" + (f":{port}" if port else "") + f" заблокирован ({direction_text})",
-                "blocked_ip": ip,
-                "blocked_port": port,
-                "direction": direction,
+                "success": False,
+                "message": "Нет корректных записей для блокировки",
+                "applied": 0,
+                "failed": len(results),
+                "rules_count": 0,
+                "apply_time_ms": 0,
+                "results": results,
                 "timestamp": datetime.now().isoformat()
             }
+        
+        netmiko_device = {
+            "device_type": "linux",
+            "host": device["ip"],
+            "username": device["username"],
+            "password": device["password"],
+        }
+        if set_mode:
+            commands = [ipset_blocklist.build_ensure_command()]
+            commands.extend(build_restore_commands(ipset_blocklist.build_restore_payload(rules),
+                                                   restore_command="ipset restore -exist"))
+        else:
+            commands = build_restore_commands(build_restore_payload(rules))
+        
+        try:
+            def apply_ruleset(ssh):
+                output = ""
+                try:
+                    for command in commands:
+                        output = ssh.send_command(command, read_timeout=60)
+                finally:
+                    rule_index_cache.invalidate(device_key(netmiko_device))
+                return parse_restore_result(output)
             
-        except Exception as e:
-            logging.error(f"[IP-LOG] Error blocking IP {ip}: {e}")
-            close_ssh_connection(device["ip"], device["username"])
-            raise HTTPException(status_code=500, detail=f"Error blocking IP: {e!s}")
+            start = time.perf_counter()
+            applied, message = await ssh_executor.run(netmiko_device, apply_ruleset)
+            apply_time_ms = round((time.perf_counter() - start) * 1000, 3)
             
+        except Exception as e:
+            logging.error(f"[IP-LOG] Error applying bulk IP block: {e}")
+            raise HTTPException(status_code=500, detail=f"Error blocking IPs: {e!s}")
+        
+        if not applied:
+            # Транзакция атомарна: при ошибке ни одно правило не применено
+            restore_name = "ipset restore" if set_mode else "iptables-restore"
+            logging.error(f"[IP-LOG] {restore_name} failed: {message}")
+            for result in results:
+                if result["success"]:
+                    result.update({"success": False, "error": f"{restore_name} failed: {message}"})
+        
+        applied_count = sum(1 for result in results if result["success"])
+        logging.info(f"[IP-LOG] Bulk block applied: {applied_count}/{len(results)} entries, "
+                     f"{len(rules)} rules in {apply_time_ms} ms ({len(commands)} SSH commands)")
+        return {
+            "success": applied,
+            "message": f"Заблокировано {applied_count} из {len(results)} записей",
+            "applied": applied_count,
+            "failed": len(results) - applied_count,
+            "rules_count": len(rules) if applied else 0,
+            "apply_time_ms": apply_time_ms,
+            "ssh_commands": len(commands),
+            "mode": "ipset" if set_mode else "rules",
+            "results": results,
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"[IP-LOG] Error in api_add_ip_block: {e}")
+        logging.error(f"[IP-LOG] Error in api_add_ip_block_bulk: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {e!s}")
 
 @router.post("/api/device_ip_unblock")
@@ -588,64 +683,44 @@ async def api_remove_ip_block(device_id: int = Query(...), request_data: dict =
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-            # Удаляем правила iptables для этого IP из всех цепочек
-            
-            # Проверяем все цепочки: FORWARD, INPUT, OUTPUT
-            chains = ["FORWARD", "INPUT", "OUTPUT"]
-            total_removed = 0
-            
-            for chain in chains:
-                iptables_output = ssh.send_command(f"iptables -L {chain} -n -v --line-numbers", read_timeout=10)
-                logging.info(f"[IP-LOG] Looking for IP {ip} in {chain} chain")
-            
-                rule_numbers = []
-                for line in iptables_output.splitlines():
-                    line = line.strip()
-                    logging.info(f"[IP-LOG] Checking line in {chain}: {line}")
-                    
-                    # Ищем все правила DROP с нужным IP (не только с комментарием blocked_ip)
-                    if "DROP" in line:
-                        # Проверяем, есть ли IP в строке правила
-                        ip_matches = re.findall(r"\b(\d+\.\d+\.\d+\.\d+)\b", line)
-                        for rule_ip in ip_matches:
-                            # Проверяем, что это числовой IP, а не DNS-имя
-                            if rule_ip == ip and re.match(r"^\d+\.\d+\.\d+\.\d+$", rule_ip) and not re.search(r"[a-zA-Z]", rule_ip):
-                                # Извлекаем номер строки
-                                match = re.search(r"^(\d+)", line)
-                                if match:
-                                    rule_numbers.append((chain, match.group(1)))
-                                    logging.info(f"[IP-LOG] Found rule number {match.group(1)} for IP {ip} in {chain}")
-                                    break  # Нашли IP в этом правиле, переходим к следующему правилу
+            def unblock_ip(ssh):
+                if ipset_blocklist.is_set_mode():
+                    removed = ipset_blocklist.unblock(ssh, ip)
+                    return {
+                        "success": True,
+                        "message": f"IP {ip} разблокирован (удалено {removed} записей)" if removed
+                                   else f"IP {ip} не найден в правилах блокировки",
+                        "unblocked_ip": ip,
+                        "timestamp": datetime.now().isoformat()
+                    }
+                
+                # Находим правила этого IP по индексу и удаляем одной командой
+                key = device_key(netmiko_device)
+                rules = rule_index_cache.get(key, ssh).rules_for_ip(ip)
+                total_removed = len(rules)
+                if rules:
+                    ssh.send_command(build_delete_command(rules), read_timeout=30)
+                    rule_index_cache.invalidate(key)
+                    logging.info(f"[IP-LOG] Removed {total_removed} rules for IP {ip}: "
+                                 + ", ".join(f"{rule.chain}#{rule.number}" for rule in rules))
+                
+                if total_removed > 0:
+                    message = f"IP {ip} разблокирован (удалено {total_removed} правил)"
+                else:
+                    message = f"IP {ip} не найден в правилах блокировки"
+                    logging.warning(f"[IP-LOG] IP {ip} not found in rules")
+                
+                return {
+                    "success": True,
+                    "message": message,
+                    "unblocked_ip": ip,
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            return await ssh_executor.run(netmiko_device, unblock_ip)
                 
-                if rule_numbers:
-                    # Удаляем правила в обратном порядке (чтобы номера не сбились)
-                    rule_numbers.reverse()
-                    for chain_name, rule_num in rule_numbers:
-                        try:
-                            ssh.send_command(f"iptables -D {chain_name} {rule_num}", read_timeout=10)
-                            logging.info(f"[IP-LOG] Removed rule {rule_num} from {chain_name}")
-                            total_removed += 1
-                        except Exception as e:
-                            logging.error(f"[IP-LOG] Error removing rule {rule_num} from {chain_name}: {e}")
-            
-            if total_removed > 0:
-                message = f"IP {ip} разблокирован (удалено {total_removed} правил)"
-            else:
-                message = f"IP {ip} не найден в правилах блокировки"
-                logging.warning(f"[IP-LOG] IP {ip} not found in rules")
-            
-            return {
-                "success": True,
-                "message": message,
-                "unblocked_ip": ip,
-                "timestamp": datetime.now().isoformat()
-            }
-            
         except Exception as e:
             logging.error(f"[IP-LOG] Error unblocking IP {ip}: {e}")
-            close_ssh_connection(device["ip"], device["username"])
             raise HTTPException(status_code=500, detail=f"Error unblocking IP: {e!s}")
             
     except Exception as e:
@@ -673,83 +748,108 @@ async def api_clear_all_ip_blocks(device_id: int = Query(...)):
         }
         
         try:
-            ssh = get_ssh_connection(netmiko_device)
-            
-
-            
-            # Получаем все правила DROP из всех цепочек
-            chains = ["FORWARD", "INPUT", "OUTPUT"]
-            total_removed = 0
-            
-            for chain in chains:
-                iptables_output = ssh.send_command(f"iptables -L {chain} -n -v --line-numbers", read_timeout=10)
-                rule_numbers = []
+            def clear_ip_blocks(ssh):
+                if ipset_blocklist.is_set_mode():
+                    removed = ipset_blocklist.clear(ssh)
+                    return {
+                        "success": True,
+                        "message": f"Удалено {removed} IP блокировок",
+                        "removed_count": removed,
+                        "timestamp": datetime.now().isoformat()
+                    }
                 
-                for line in iptables_output.splitlines():
-                    line = line.strip()
-                    if "DROP" in line:
-                        # Извлекаем номер строки
-                        match = re.search(r"^(\d+)", line)
-                        if match:
-                            rule_numbers.append(match.group(1))
-                            logging.info(f"[IP-LOG] Found DROP rule number {match.group(1)} in {chain}: {line}")
+                # Получаем все правила DROP из всех цепочек по индексу и удаляем одной командой
+                key = device_key(netmiko_device)
+                rules = rule_index_cache.get(key, ssh).drop_rules()
+                total_removed = len(rules)
+                if rules:
+                    ssh.send_command(build_delete_command(rules), read_timeout=60)
+                    rule_index_cache.invalidate(key)
+                logging.info(f"[IP-LOG] Cleared {total_removed} DROP rules")
+                
+                return {
+                    "success": True,
+                    "message": f"Удалено {total_removed} IP блокировок",
+                    "removed_count": total_removed,
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            return await ssh_executor.run(netmiko_device, clear_ip_blocks)
                 
-                # Удаляем правила в обратном порядке (чтобы номера не сбились)
-                rule_numbers.reverse()
-                for rule_num in rule_numbers:
-                    try:
-                        ssh.send_command(f"iptables -D {chain} {rule_num}", read_timeout=10)
-                        total_removed += 1
-                    except:
-                        pass
-            
-            return {
-                "success": True,
-                "message": f"Удалено {total_removed} IP блокировок",
-                "removed_count": total_removed,
-                "timestamp": datetime.now().isoformat()
-            }
-            
         except Exception as e:
             logging.error(f"[IP-LOG] Error clearing all IP blocks: {e}")
-            close_ssh_connection(device["ip"], device["username"])
             raise HTTPException(status_code=500, detail=f"Error clearing blocks: {e!s}")
             
     except Exception as e:
         logging.error(f"[IP-LOG] Error in api_clear_all_ip_blocks: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {e!s}")
 
+# === МОНИТОРИНГ ТРАФИКА (CONNTRACK) ===
+
+@router.get("/api/device_nf_conntrack_rates")
+async def api_get_conntrack_rates(device_id: int = Query(...), top: int = Query(CONNTRACK_TOP_N)):
+    """
+    API для скоростей трафика устройства: дельты счётчиков conntrack с прошлого
+    снимка, top-N соединений и хостов. Снимок общий для всех клиентов и делается
+    не чаще CONNTRACK_SAMPLE_MIN_INTERVAL.
+    """
+    try:
+        device = await get_firewall_device_by_id(device_id)
+        if not device:
+            raise HTTPException(status_code=404, detail="Device not found")
+
+        if device["type"] != "openwrt":
+            raise HTTPException(status_code=400, detail="Device type does not support conntrack monitoring")
+
+        sample = await conntrack_samplers.device(device).sample()
+        result = ConntrackSampler.top(sample, max(1, top))
+        result.update({"device_name": device["name"], "device_ip": device["ip"]})
+        return result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"[CONNTRACK-LOG] Error sampling conntrack on device {device_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {e!s}")
+
+@router.get("/api/device_nf_conntrack_stream")
+async def api_stream_conntrack_rates(device_id: int = Query(...), top: int = Query(CONNTRACK_TOP_N)):
+    """
+    API для потока скоростей трафика устройства (Server-Sent Events). Все клиенты
+    одного устройства подписаны на один сэмплер: устройство опрашивается раз в
+    CONNTRACK_STREAM_INTERVAL независимо от числа открытых вкладок.
+    """
+    device = await get_firewall_device_by_id(device_id)
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    if device["type"] != "openwrt":
+        raise HTTPException(status_code=400, detail="Device type does not support conntrack monitoring")
+
+    return StreamingResponse(stream_samples(conntrack_samplers.device(device), max(1, top)),
+                             media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # === УПРАВЛЕНИЕ УСТРОЙСТВАМИ ===
 
 @router.get("/api/firewall_devices", response_model=list[FirewallDeviceModel])
-async def api_get_devices():
-    """API для получения списка устройств"""
-    from .database import get_all_firewall_devices
-    devices = await get_all_firewall_devices()
-    logging.info(f"[API-LOG] Returning {len(devices)} devices")
-    for i, device in enumerate(devices):
-        logging.info(f"[API-LOG] Device {i+1}: {device}")
-    result = [FirewallDeviceModel(**device) for device in devices]
-    logging.info(f"[API-LOG] Final result: {result}")
-    return result
+async def api_get_devices(refresh: bool = False):
+    """
+    API для получения списка устройств со статусами из фонового опроса.
+    refresh=true запускает опрос устройств немедленно.
+    """
+    if refresh:
+        devices = await device_poller.poll_once()
+    else:
+        devices = await device_poller.get_devices()
+    logging.info(f"[API-LOG] Returning {len(devices)} devices (refresh={refresh})")
+    return [FirewallDeviceModel(**device) for device in devices]
 
 @router.get("/api/firewall_devices_raw")
 async def api_get_devices_raw():
     """API для получения сырых данных устройств без обновления статуса"""
-    import asyncpg
-
-    from .db_config import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
-    
     try:
-        conn = await asyncpg.connect(
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        rows = await conn.fetch("SELECT * FROM firewall_devices ORDER BY id")
-        await conn.close()
+        async with acquire_connection() as conn:
+            rows = await conn.fetch("SELECT * FROM firewall_devices ORDER BY id")
         
         devices = [dict(row) for row in rows]
         logging.info(f"[API-LOG] Raw devices from DB: {devices}")
@@ -764,6 +864,7 @@ async def api_add_device(device: FirewallDeviceCreate):
     """API для добавления устройства"""
     from .database import add_firewall_device
     await add_firewall_device(device)
+    device_poller.invalidate()
     return {"message": "Device added successfully"}
 
 @router.delete("/api/firewall_devices/{device_id}")
@@ -771,6 +872,7 @@ async def api_delete_device(device_id: int):
     """API для удаления устройства"""
     from .database import delete_firewall_device
     await delete_firewall_device(device_id)
+    device_poller.invalidate()
     return {"message": "Device deleted successfully"}
 
  
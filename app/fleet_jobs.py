@@ -0,0 +1,433 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from fastapi import APIRouter, Body, HTTPException
+from fastapi.responses import StreamingResponse
+
+from . import dns_blocklist, ipset_blocklist
+from .iptables_parser import build_delete_command, rule_index_cache
+from .iptables_rules import (
+    build_block_rules,
+    build_restore_commands,
+    build_restore_payload,
+    parse_restore_result,
+    validate_block_entry,
+)
+from .ssh_executor import ssh_executor
+from .ssh_pool import device_key
+
+# Число устройств, обрабатываемых одновременно в одной задаче
+FLEET_JOB_CONCURRENCY = int(os.getenv("FLEET_JOB_CONCURRENCY", 32))
+# Верхняя граница concurrency, переданного в запросе
+FLEET_JOB_MAX_CONCURRENCY = int(os.getenv("FLEET_JOB_MAX_CONCURRENCY", 64))
+# Повторные попытки на устройство и базовая задержка между ними (секунды, растёт экспоненциально)
+FLEET_JOB_MAX_RETRIES = int(os.getenv("FLEET_JOB_MAX_RETRIES", 2))
+FLEET_JOB_RETRY_BACKOFF = float(os.getenv("FLEET_JOB_RETRY_BACKOFF", 2))
+FLEET_JOB_RETRY_BACKOFF_MAX = float(os.getenv("FLEET_JOB_RETRY_BACKOFF_MAX", 30))
+# Сколько завершённых задач хранится в памяти
+FLEET_JOB_HISTORY = int(os.getenv("FLEET_JOB_HISTORY", 100))
+
+# Действия, поддерживаемые задачами
+DNS_ACTIONS = ("dns_block", "dns_unblock")
+IP_ACTIONS = ("ip_block", "ip_unblock")
+
+# Устройства, поддерживающие DNS/IP блокировки
+SUPPORTED_DEVICE_TYPES = ("openwrt",)
+
+router = APIRouter()
+
+
+def validate_changes(changes: list) -> list[dict]:
+    """Проверяет и нормализует список изменений; ошибки - ValueError"""
+    if not isinstance(changes, list):
+        raise ValueError("Changes must be a list")
+    if not changes:
+        raise ValueError("No changes specified")
+    normalized = []
+    for i, change in enumerate(changes):
+        if not isinstance(change, dict):
+            raise ValueError(f"Change {i}: must be an object")
+        action = str(change.get("action", "")).strip().lower()
+        if action in DNS_ACTIONS:
+            domain = dns_blocklist.normalize_domain(str(change.get("domain", "")))
+            if not domain:
+                raise ValueError(f"Change {i}: invalid domain")
+            normalized.append({"action": action, "domain": domain})
+        elif action in IP_ACTIONS:
+            ip = str(change.get("ip", "")).strip()
+            port = str(change.get("port", "") or "").strip()
+            direction = str(change.get("direction", "both")).strip().lower()
+            error = validate_block_entry(ip, port, direction)
+            if error:
+                raise ValueError(f"Change {i}: {error}")
+            normalized.append({"action": action, "ip": ip, "port": port, "direction": direction})
+        else:
+            raise ValueError(f"Change {i}: action must be one of: {', '.join(DNS_ACTIONS + IP_ACTIONS)}")
+    return normalized
+
+
+def select_devices(devices: list[dict], selector: dict) -> list[dict]:
+    """
+    Выбирает устройства по селектору: {"all": true}, {"type": "openwrt"}
+    или {"device_ids": [1, 2, 3]}.
+    """
+    if not isinstance(selector, dict):
+        raise ValueError("Selector must be an object")
+    if selector.get("device_ids") is not None:
+        if not isinstance(selector["device_ids"], list):
+            raise ValueError("device_ids must be a list")
+        try:
+            wanted = {int(device_id) for device_id in selector["device_ids"]}
+        except (TypeError, ValueError):
+            raise ValueError("device_ids must contain integers")
+        return [device for device in devices if device["id"] in wanted]
+    if selector.get("type"):
+        return [device for device in devices if device["type"] == selector["type"]]
+    if selector.get("all"):
+        return list(devices)
+    raise ValueError("Selector must contain one of: all, type, device_ids")
+
+
+def apply_ip_changes(ssh, netmiko_device: dict, blocks: list[dict], unblocks: list[str]) -> dict:
+    """
+    Применяет IP изменения на устройстве в одной SSH-сессии. Блокировки
+    идемпотентны: уже существующие правила не добавляются повторно, поэтому
+    повтор после сбоя не создаёт дубликатов.
+    """
+    key = device_key(netmiko_device)
+    try:
+        if ipset_blocklist.is_set_mode():
+            removed = sum(ipset_blocklist.unblock(ssh, ip) for ip in unblocks)
+            members = [member for entry in blocks
+                       for member in ipset_blocklist.set_members_for(entry["ip"], entry["port"], entry["direction"])]
+            if members:
+                ssh.send_command(ipset_blocklist.build_ensure_command(), read_timeout=30)
+                output = ""
+                for command in build_restore_commands(ipset_blocklist.build_restore_payload(members),
+                                                      restore_command="ipset restore -exist"):
+                    output = ssh.send_command(command, read_timeout=60)
+                ok, message = parse_restore_result(output)
+                if not ok:
+                    raise RuntimeError(f"ipset restore failed: {message}")
+            return {"ip_added": len(members), "ip_removed": removed}
+
+        index = rule_index_cache.get(key, ssh)
+        removed_rules = [rule for ip in dict.fromkeys(unblocks) for rule in index.rules_for_ip(ip)]
+        if removed_rules:
+            ssh.send_command(build_delete_command(removed_rules), read_timeout=60)
+            rule_index_cache.invalidate(key)
+            index = rule_index_cache.get(key, ssh) if blocks else index
+
+        existing = {(rule.chain, rule.comment) for rules in index.by_blocked_ip.values() for rule in rules}
+        rules = []
+        for entry in blocks:
+            for chain, spec in build_block_rules(entry["ip"], entry["port"], entry["direction"]):
+                comment = spec.rsplit("--comment ", 1)[1]
+                if (chain, comment) not in existing and (chain, spec) not in rules:
+                    rules.append((chain, spec))
+        if rules:
+            output = ""
+            for command in build_restore_commands(build_restore_payload(rules)):
+                output = ssh.send_command(command, read_timeout=60)
+            ok, message = parse_restore_result(output)
+            if not ok:
+                raise RuntimeError(f"iptables-restore failed: {message}")
+        return {"ip_added": len(rules), "ip_removed": len(removed_rules)}
+    finally:
+        rule_index_cache.invalidate(key)
+
+
+async def apply_device_changes(device: dict, changes: list[dict]) -> dict:
+    """Применяет все изменения задачи к одному устройству: DNS одной отправкой, IP одной сессией"""
+    netmiko_device = {
+        "device_type": "linux",
+        "host": device["ip"],
+        "username": device["username"],
+        "password": device["password"],
+    }
+    result = {}
+    dns_add = {change["domain"] for change in changes if change["action"] == "dns_block"}
+    dns_remove = {change["domain"] for change in changes if change["action"] == "dns_unblock"}
+    if dns_add or dns_remove:
+        dns_result = await dns_blocklist.update_device_blocklist(device, netmiko_device, add=dns_add, remove=dns_remove)
+        result.update({"dns_added": dns_result["added"], "dns_removed": dns_result["removed"],
+                       "dns_pushed": not dns_result["skipped"]})
+
+    blocks = [change for change in changes if change["action"] == "ip_block"]
+    unblocks = [change["ip"] for change in changes if change["action"] == "ip_unblock"]
+    if blocks or unblocks:
+        result.update(await ssh_executor.run(netmiko_device, apply_ip_changes, netmiko_device, blocks, unblocks))
+    return result
+
+
+class FleetJob:
+    """Задача применения изменений к группе устройств с журналом событий для стриминга"""
+
+    def __init__(self, selector: dict, changes: list[dict], devices: list[dict], concurrency: int, max_retries: int):
+        self.id = uuid.uuid4().hex
+        self.selector = selector
+        self.changes = changes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.status = "pending"
+        self.created_at = datetime.now().isoformat()
+        self.started = None
+        self.finished = None
+        self.task: asyncio.Task | None = None
+        self.devices = {
+            device["id"]: {
+                "device_id": device["id"],
+                "name": device["name"],
+                "status": "pending" if device["type"] in SUPPORTED_DEVICE_TYPES else "skipped",
+                "attempts": 0,
+                "error": None if device["type"] in SUPPORTED_DEVICE_TYPES else f"Device type {device['type']} is not supported",
+                "result": None,
+                "duration_ms": None,
+            }
+            for device in devices
+        }
+        self.events: list[dict] = []
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def counts(self) -> dict:
+        counts = {"total": len(self.devices), "pending": 0, "running": 0, "retrying": 0,
+                  "succeeded": 0, "failed": 0, "skipped": 0, "cancelled": 0}
+        for state in self.devices.values():
+            counts[state["status"]] += 1
+        return counts
+
+    def emit(self, event: str, **data):
+        """Добавляет событие в журнал и будит ожидающие потоки прогресса"""
+        self.events.append({"seq": len(self.events), "event": event, "time": datetime.now().isoformat(),
+                            "progress": self.counts(), **data})
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_events(self, seq: int, timeout: float):
+        """Ждёт событий с номером >= seq или завершения задачи"""
+        if len(self.events) > seq or self.done:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def to_dict(self, include_devices: bool = True) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "selector": self.selector,
+            "changes": self.changes,
+            "concurrency": self.concurrency,
+            "max_retries": self.max_retries,
+            "created_at": self.created_at,
+            "duration_ms": round(((self.finished or time.monotonic()) - self.started) * 1000, 3) if self.started else None,
+            "progress": self.counts(),
+        }
+        if include_devices:
+            data["devices"] = list(self.devices.values())
+        return data
+
+
+def validate_limit(name: str, value, minimum: int) -> int | None:
+    """Целое значение параметра задачи или None; ошибки - ValueError"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"{name} must be an integer")
+    return max(minimum, value)
+
+
+def retry_delay(attempt: int, backoff: float | None = None, backoff_max: float | None = None) -> float:
+    """Экспоненциальная задержка перед повтором с джиттером, чтобы повторы не шли волной"""
+    backoff = FLEET_JOB_RETRY_BACKOFF if backoff is None else backoff
+    backoff_max = FLEET_JOB_RETRY_BACKOFF_MAX if backoff_max is None else backoff_max
+    delay = min(backoff * (2 ** (attempt - 1)), backoff_max)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class FleetJobManager:
+    """Запуск задач и хранение последних FLEET_JOB_HISTORY задач в памяти"""
+
+    def __init__(self, history: int = FLEET_JOB_HISTORY):
+        self.history = history
+        self.jobs: OrderedDict[str, FleetJob] = OrderedDict()
+
+    def get(self, job_id: str) -> FleetJob | None:
+        return self.jobs.get(job_id)
+
+    def list(self) -> list[FleetJob]:
+        return list(reversed(self.jobs.values()))
+
+    async def submit(self, selector: dict, changes: list, concurrency: int | None = None,
+                     max_retries: int | None = None) -> FleetJob:
+        from .database import get_firewall_devices_list
+        changes = validate_changes(changes)
+        concurrency = validate_limit("concurrency", concurrency, 1)
+        max_retries = validate_limit("max_retries", max_retries, 0)
+        devices = select_devices(await get_firewall_devices_list(), selector)
+        if not devices:
+            raise ValueError("No devices match the selector")
+
+        job = FleetJob(selector, changes, devices,
+                       concurrency=min(concurrency or FLEET_JOB_CONCURRENCY, FLEET_JOB_MAX_CONCURRENCY),
+                       max_retries=FLEET_JOB_MAX_RETRIES if max_retries is None else max_retries)
+        self.jobs[job.id] = job
+        self._trim()
+        job.task = asyncio.create_task(self._run(job, {device["id"]: device for device in devices}))
+        logging.info(f"[FLEET-LOG] Job {job.id} submitted: {len(devices)} devices, {len(changes)} changes, "
+                     f"concurrency={job.concurrency}")
+        return job
+
+    def _trim(self):
+        while len(self.jobs) > self.history:
+            oldest_id = next((job_id for job_id, job in self.jobs.items() if job.done), None)
+            if oldest_id is None:
+                break
+            del self.jobs[oldest_id]
+
+    async def _run_device(self, job: FleetJob, device: dict):
+        state = job.devices[device["id"]]
+        start = time.perf_counter()
+        while True:
+            state["attempts"] += 1
+            state["status"] = "running"
+            job.emit("device_started", device_id=device["id"], attempt=state["attempts"])
+            try:
+                state["result"] = await apply_device_changes(device, job.changes)
+                state["status"] = "succeeded"
+                state["error"] = None
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state["error"] = str(e)
+                if state["attempts"] > job.max_retries:
+                    state["status"] = "failed"
+                    logging.error(f"[FLEET-LOG] Job {job.id}: device {device['id']} failed after "
+                                  f"{state['attempts']} attempts: {e}")
+                    break
+                delay = retry_delay(state["attempts"])
+                state["status"] = "retrying"
+                job.emit("device_retry", device_id=device["id"], attempt=state["attempts"],
+                         error=str(e), retry_in=round(delay, 3))
+                await asyncio.sleep(delay)
+        state["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        job.emit("device_finished", device_id=device["id"], status=state["status"], error=state["error"])
+
+    async def _run(self, job: FleetJob, devices: dict[int, dict]):
+        job.status = "running"
+        job.started = time.monotonic()
+        job.emit("job_started")
+        # Не больше job.concurrency воркеров, каждый берёт следующее устройство из очереди:
+        # число одновременных операций и задач не растёт с размером группы
+        queue = deque(device_id for device_id, state in job.devices.items() if state["status"] == "pending")
+
+        async def worker():
+            while queue:
+                await self._run_device(job, devices[queue.popleft()])
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(job.concurrency, len(queue)))))
+            job.status = "failed" if job.counts()["failed"] else "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            for state in job.devices.values():
+                if state["status"] in ("pending", "running", "retrying"):
+                    state["status"] = "cancelled"
+        finally:
+            job.finished = time.monotonic()
+            job.emit("job_finished", status=job.status)
+            counts = job.counts()
+            logging.info(f"[FLEET-LOG] Job {job.id} {job.status} in {job.finished - job.started:.2f}s: "
+                         f"{counts['succeeded']} succeeded, {counts['failed']} failed, {counts['skipped']} skipped")
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.done or job.task is None:
+            return False
+        job.task.cancel()
+        return True
+
+
+# Глобальный менеджер задач
+fleet_jobs = FleetJobManager()
+
+
+@router.post("/api/fleet/jobs")
+async def api_create_fleet_job(request_data: dict = Body(...)):
+    """
+    API для применения DNS/IP изменений к группе устройств.
+    Тело: {"selector": {"all": true} | {"type": "openwrt"} | {"device_ids": [...]},
+           "changes": [{"action": "dns_block", "domain": ...}, {"action": "ip_block", "ip": ..., "port": ..., "direction": ...}, ...],
+           "concurrency": 32, "max_retries": 2}
+    """
+    try:
+        job = await fleet_jobs.submit(
+            request_data.get("selector") or {},
+            request_data.get("changes") or [],
+            concurrency=request_data.get("concurrency"),
+            max_retries=request_data.get("max_retries"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict(include_devices=False)
+
+
+@router.get("/api/fleet/jobs")
+async def api_list_fleet_jobs():
+    """API для списка последних задач"""
+    return {"jobs": [job.to_dict(include_devices=False) for job in fleet_jobs.list()]}
+
+
+@router.get("/api/fleet/jobs/{job_id}")
+async def api_get_fleet_job(job_id: str):
+    """API для состояния задачи с результатами по устройствам"""
+    job = fleet_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.post("/api/fleet/jobs/{job_id}/cancel")
+async def api_cancel_fleet_job(job_id: str):
+    """API для отмены задачи: устройства, ещё не обработанные, пропускаются"""
+    if fleet_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "cancelled": fleet_jobs.cancel(job_id)}
+
+
+async def stream_job_events(job: FleetJob, last_seq: int = -1, keepalive: float = 15):
+    """События задачи в формате Server-Sent Events, начиная после last_seq"""
+    seq = last_seq + 1
+    while True:
+        while seq < len(job.events):
+            event = job.events[seq]
+            yield f"id: {event['seq']}\nevent: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            seq += 1
+        if job.done and seq >= len(job.events):
+            return
+        await job.wait_for_events(seq, keepalive)
+        if seq >= len(job.events) and not job.done:
+            yield ": keepalive\n\n"
+
+
+@router.get("/api/fleet/jobs/{job_id}/stream")
+async def api_stream_fleet_job(job_id: str, last_event_id: int = -1):
+    """API для потока прогресса задачи (Server-Sent Events)"""
+    job = fleet_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(stream_job_events(job, last_event_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
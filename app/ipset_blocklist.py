@@ -0,0 +1,130 @@
+import logging
+import os
+
+# Режим блокировки IP: "rules" - отдельное правило DROP на каждый IP,
+# "ipset" - IP добавляются в хэш-множества, на которые ссылается одно правило на цепочку
+IP_BLOCK_MODE = os.getenv("IP_BLOCK_MODE", "rules").strip().lower()
+
+# Параметры создаваемых множеств
+IPSET_MAXELEM = int(os.getenv("IPSET_MAXELEM", 1048576))
+IPSET_HASHSIZE = int(os.getenv("IPSET_HASHSIZE", 4096))
+
+# Множества блокировок: имя -> (тип множества, направление)
+SET_IN = "fwmp_block_in"
+SET_OUT = "fwmp_block_out"
+SET_PORT_IN = "fwmp_block_port_in"
+SET_PORT_OUT = "fwmp_block_port_out"
+
+BLOCK_SETS = {
+    SET_IN: ("hash:ip", "in"),
+    SET_OUT: ("hash:ip", "out"),
+    SET_PORT_IN: ("hash:ip,port", "in"),
+    SET_PORT_OUT: ("hash:ip,port", "out"),
+}
+
+# Правила, ссылающиеся на множества: по одному на цепочку и направление
+SET_RULES = [
+    ("FORWARD", f"-m set --match-set {SET_IN} dst -j DROP -m comment --comment blocked_set:{SET_IN}"),
+    ("INPUT", f"-m set --match-set {SET_IN} dst -j DROP -m comment --comment blocked_set:{SET_IN}"),
+    ("FORWARD", f"-m set --match-set {SET_OUT} src -j DROP -m comment --comment blocked_set:{SET_OUT}"),
+    ("OUTPUT", f"-m set --match-set {SET_OUT} dst -j DROP -m comment --comment blocked_set:{SET_OUT}"),
+    ("FORWARD", f"-p tcp -m set --match-set {SET_PORT_IN} dst,dst -j DROP -m comment --comment blocked_set:{SET_PORT_IN}"),
+    ("FORWARD", f"-p tcp -m set --match-set {SET_PORT_OUT} src,src -j DROP -m comment --comment blocked_set:{SET_PORT_OUT}"),
+]
+
+
+def is_set_mode() -> bool:
+    """Включён ли режим блокировки через ipset"""
+    return IP_BLOCK_MODE == "ipset"
+
+
+def build_ensure_command() -> str:
+    """
+    Идемпотентная команда подготовки устройства: создаёт множества и
+    правила-ссылки, если их ещё нет (например, после перезагрузки роутера).
+    """
+    commands = [
+        f"ipset -exist create {name} {set_type} hashsize {IPSET_HASHSIZE} maxelem {IPSET_MAXELEM}"
+        for name, (set_type, _) in BLOCK_SETS.items()
+    ]
+    commands.extend(
+        f"(iptables -C {chain} {spec} 2>/dev/null || iptables -I {chain} 1 {spec})"
+        for chain, spec in SET_RULES
+    )
+    return "; ".join(commands)
+
+
+def set_members_for(ip: str, port: str = "", direction: str = "both") -> list[tuple[str, str]]:
+    """Элементы множеств для блокировки: список (множество, элемент)"""
+    members = []
+    if direction in ("in", "both"):
+        members.append((SET_PORT_IN, f"{ip},tcp:{port}") if port else (SET_IN, ip))
+    if direction in ("out", "both"):
+        members.append((SET_PORT_OUT, f"{ip},tcp:{port}") if port else (SET_OUT, ip))
+    return members
+
+
+def build_add_command(members: list[tuple[str, str]]) -> str:
+    return "; ".join(f"ipset -exist add {name} {member}" for name, member in members)
+
+
+def build_del_command(members: list[tuple[str, str]]) -> str:
+    return "; ".join(f"ipset -exist del {name} {member} 2>/dev/null" for name, member in members)
+
+
+def build_restore_payload(members: list[tuple[str, str]]) -> str:
+    """Вход ipset restore -exist: все элементы одной командой"""
+    return "".join(f"add {name} {member}\n" for name, member in members)
+
+
+def parse_ipset_save(output: str) -> dict[str, list[str]]:
+    """Разбирает вывод ipset save: элементы только наших множеств"""
+    sets: dict[str, list[str]] = {name: [] for name in BLOCK_SETS}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[0] == "add" and parts[1] in sets:
+            sets[parts[1]].append(parts[2])
+    return sets
+
+
+def parse_member(name: str, member: str) -> tuple[str, str, str]:
+    """Элемент множества -> (ip, порт, направление)"""
+    direction = BLOCK_SETS[name][1]
+    if "," in member:
+        ip, proto_port = member.split(",", 1)
+        return ip, proto_port.split(":")[-1], direction
+    return member, "", direction
+
+
+def read_blocked(ssh) -> list[tuple[str, str, str]]:
+    """Все заблокированные записи устройства: список (ip, порт, направление)"""
+    sets = parse_ipset_save(ssh.send_command("ipset save 2>/dev/null", read_timeout=30))
+    return [parse_member(name, member) for name, members in sets.items() for member in members]
+
+
+def block(ssh, ip: str, port: str = "", direction: str = "both") -> int:
+    """Добавляет IP в множества; возвращает число добавленных элементов"""
+    members = set_members_for(ip, port, direction)
+    ssh.send_command(f"{build_ensure_command()}; {build_add_command(members)}", read_timeout=30)
+    logging.info(f"[IP-LOG] Added {ip}" + (f":{port}" if port else "") + f" to ipsets ({direction})")
+    return len(members)
+
+
+def unblock(ssh, ip: str) -> int:
+    """Удаляет все элементы множеств с данным IP; возвращает их число"""
+    sets = parse_ipset_save(ssh.send_command("ipset save 2>/dev/null", read_timeout=30))
+    members = [(name, member) for name, entries in sets.items() for member in entries
+               if parse_member(name, member)[0] == ip]
+    if members:
+        ssh.send_command(build_del_command(members), read_timeout=30)
+    logging.info(f"[IP-LOG] Removed {len(members)} ipset entries for {ip}")
+    return len(members)
+
+
+def clear(ssh) -> int:
+    """Очищает все множества блокировок; правила-ссылки остаются"""
+    sets = parse_ipset_save(ssh.send_command("ipset save 2>/dev/null", read_timeout=30))
+    total = sum(len(members) for members in sets.values())
+    ssh.send_command("; ".join(f"ipset flush {name} 2>/dev/null" for name in BLOCK_SETS), read_timeout=30)
+    logging.info(f"[IP-LOG] Flushed ipsets ({total} entries)")
+    return total
@@ -0,0 +1,222 @@
+import logging
+import os
+import re
+import threading
+import time
+
+# Время жизни индекса правил устройства (секунды): защищает от изменений,
+# сделанных на устройстве в обход платформы
+IPTABLES_INDEX_TTL = float(os.getenv("IPTABLES_INDEX_TTL", 30))
+
+# Цепочки, в которых платформа создаёт правила блокировки
+BLOCK_CHAINS = ("FORWARD", "INPUT", "OUTPUT")
+
+# Команда чтения правил таблицы filter одним вызовом
+IPTABLES_SAVE_COMMAND = "iptables-save -t filter"
+
+# Токены правила iptables-save: строки в кавычках или слова
+TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|\S+')
+BLOCKED_COMMENT_RE = re.compile(r"^blocked_ip:(\d+\.\d+\.\d+\.\d+)(?::(\d+))?(?::(in|out))?$")
+
+# Опции правила, значения которых попадают в поля IptablesRule
+OPTION_FIELDS = {
+    "-s": "source",
+    "--source": "source",
+    "-d": "destination",
+    "--destination": "destination",
+    "-p": "protocol",
+    "--protocol": "protocol",
+    "--sport": "sport",
+    "--dport": "dport",
+    "-j": "target",
+    "--jump": "target",
+    "--comment": "comment",
+}
+
+
+class IptablesRule:
+    """Правило iptables с разобранными условиями, целью и комментарием"""
+    __slots__ = ("chain", "number", "spec", "source", "destination", "protocol", "sport", "dport",
+                 "target", "comment", "blocked_ip", "blocked_port", "direction")
+
+    def __init__(self, chain: str, number: int, spec: str):
+        self.chain = chain
+        self.number = number
+        self.spec = spec
+        self.source = None
+        self.destination = None
+        self.protocol = None
+        self.sport = None
+        self.dport = None
+        self.target = None
+        self.comment = None
+        self.blocked_ip = None
+        self.blocked_port = None
+        self.direction = None
+
+    def addresses(self) -> list[str]:
+        """Адреса правила без маски /32"""
+        return [address.removesuffix("/32") for address in (self.source, self.destination)
+                if address and not address.startswith("!")]
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+def _parse_rule(chain: str, number: int, spec: str) -> IptablesRule:
+    rule = IptablesRule(chain, number, spec)
+    tokens = TOKEN_RE.findall(spec)
+    negate = False
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == "!":
+            negate = True
+        elif token in OPTION_FIELDS and i + 1 < len(tokens):
+            value = tokens[i + 1].strip('"')
+            setattr(rule, OPTION_FIELDS[token], f"!{value}" if negate else value)
+            negate = False
+            i += 1
+        else:
+            negate = False
+        i += 1
+
+    if rule.comment:
+        match = BLOCKED_COMMENT_RE.match(rule.comment)
+        if match:
+            rule.blocked_ip, rule.blocked_port, rule.direction = match.groups()
+    return rule
+
+
+class RuleIndex:
+    """
+    Индекс правил таблицы filter устройства: цепочка -> номер правила -> правило,
+    плюс поиск правил блокировки по IP из комментария blocked_ip.
+    """
+
+    def __init__(self):
+        self.chains: dict[str, dict[int, IptablesRule]] = {}
+        self.policies: dict[str, str] = {}
+        self.by_blocked_ip: dict[str, list[IptablesRule]] = {}
+        self.raw_lines: dict[str, list[str]] = {}
+        self.version = 0
+        self.loaded_at = 0.0
+
+    def rules(self, chain: str) -> list[IptablesRule]:
+        return list(self.chains.get(chain, {}).values())
+
+    def get(self, chain: str, number: int) -> IptablesRule | None:
+        return self.chains.get(chain, {}).get(number)
+
+    def drop_rules(self, chains=BLOCK_CHAINS) -> list[IptablesRule]:
+        """Все правила DROP в указанных цепочках"""
+        return [rule for chain in chains for rule in self.rules(chain) if rule.target == "DROP"]
+
+    def rules_for_ip(self, ip: str) -> list[IptablesRule]:
+        """
+        Правила блокировки IP: по комментарию blocked_ip и правила DROP
+        без комментария, в адресах которых есть этот IP.
+        """
+        rules = list(self.by_blocked_ip.get(ip, []))
+        rules.extend(rule for rule in self.drop_rules()
+                     if rule.blocked_ip is None and ip in rule.addresses())
+        return rules
+
+    @property
+    def rule_count(self) -> int:
+        return sum(len(rules) for rules in self.chains.values())
+
+
+def parse_iptables_save(output: str) -> RuleIndex:
+    """Однопроходный разбор вывода iptables-save (таблица filter)"""
+    index = RuleIndex()
+    table = None
+    for line in output.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("*"):
+            table = line[1:]
+            continue
+        if table != "filter":
+            continue
+        if line.startswith(":"):
+            # :CHAIN POLICY [packets:bytes]
+            parts = line[1:].split()
+            index.chains.setdefault(parts[0], {})
+            index.raw_lines.setdefault(parts[0], [])
+            if len(parts) > 1:
+                index.policies[parts[0]] = parts[1]
+        elif line.startswith("-A "):
+            chain, _, spec = line[3:].partition(" ")
+            chain_rules = index.chains.setdefault(chain, {})
+            rule = _parse_rule(chain, len(chain_rules) + 1, spec)
+            chain_rules[rule.number] = rule
+            index.raw_lines.setdefault(chain, []).append(line)
+            if rule.blocked_ip:
+                index.by_blocked_ip.setdefault(rule.blocked_ip, []).append(rule)
+    return index
+
+
+def build_delete_command(rules: list[IptablesRule]) -> str:
+    """
+    Одна команда удаления правил по их спецификации. Удаление по спецификации
+    не зависит от сдвига номеров правил после предыдущих удалений.
+    """
+    return "; ".join(f"iptables -D {rule.chain} {rule.spec}" for rule in rules)
+
+
+class RuleIndexCache:
+    """
+    Кэш индексов правил по устройствам с версиями. Собственные изменения
+    правил увеличивают версию устройства и сбрасывают индекс; индекс,
+    прочитанный до изменения, в кэш не попадает.
+    """
+
+    def __init__(self, ttl: float = IPTABLES_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._indexes: dict[str, RuleIndex] = {}
+        self._versions: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, ssh) -> RuleIndex:
+        """Индекс правил устройства из кэша или одним вызовом iptables-save"""
+        now = time.monotonic()
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None and now - index.loaded_at < self.ttl:
+                self.hits += 1
+                return index
+            self.misses += 1
+            version = self._versions.get(key, 0)
+
+        index = parse_iptables_save(ssh.send_command(IPTABLES_SAVE_COMMAND, read_timeout=30))
+        index.version = version
+        index.loaded_at = time.monotonic()
+        logging.debug(f"[IP-LOG] Loaded rule index for {key}: {index.rule_count} rules (version {version})")
+
+        with self._lock:
+            if self._versions.get(key, 0) == version:
+                self._indexes[key] = index
+        return index
+
+    def invalidate(self, key: str):
+        """Сбрасывает индекс устройства после изменения его правил"""
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._indexes.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._versions.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"devices": len(self._indexes), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+# Глобальный кэш индексов правил устройств
+rule_index_cache = RuleIndexCache()
@@ -0,0 +1,105 @@
+import ipaddress
+import re
+
+# Допустимые направления блокировки
+BLOCK_DIRECTIONS = ("in", "out", "both")
+
+# Максимальный размер одной порции данных для передачи ruleset по SSH (байт)
+RESTORE_CHUNK_SIZE = 8192
+
+# Маркер кода возврата iptables-restore в выводе команды
+RESTORE_RC_MARKER = "IPTABLES_RESTORE_RC="
+
+IP_RE = re.compile(r"^\d+\.\d+\.\d+\.\d+$")
+PORT_RE = re.compile(r"^\d{1,5}$")
+
+
+def validate_block_entry(ip: str, port: str = "", direction: str = "both") -> str | None:
+    """Проверяет параметры блокировки; возвращает текст ошибки или None"""
+    if not ip:
+        return "IP address is required"
+    if not IP_RE.match(ip):
+        return "Invalid IP address format. Only numeric IP addresses are allowed."
+    try:
+        ipaddress.IPv4Address(ip)
+    except ValueError:
+        return "Invalid IP address"
+    if port and (not PORT_RE.match(port) or not 0 < int(port) <= 65535):
+        return "Invalid port"
+    if direction not in BLOCK_DIRECTIONS:
+        return "Direction must be one of: in, out, both"
+    return None
+
+
+def build_block_rules(ip: str, port: str = "", direction: str = "both") -> list[tuple[str, str]]:
+    """
+    Формирует правила блокировки IP в виде списка (цепочка, спецификация правила).
+    Спецификация используется как в iptables -I <цепочка> 1 <spec>, так и в iptables-restore.
+    """
+    rules = []
+    if port:
+        # Блокируем конкретный порт
+        if direction in ("in", "both"):
+            rules.append(("FORWARD", f"-d {ip} -p tcp --dport {port} -j DROP -m comment --comment blocked_ip:{ip}:{port}:in"))
+        if direction in ("out", "both"):
+            rules.append(("FORWARD", f"-s {ip} -p tcp --sport {port} -j DROP -m comment --comment blocked_ip:{ip}:{port}:out"))
+    else:
+        # Блокируем весь трафик
+        if direction in ("in", "both"):
+            rules.append(("FORWARD", f"-d {ip} -j DROP -m comment --comment blocked_ip:{ip}:in"))
+            rules.append(("INPUT", f"-d {ip} -j DROP -m comment --comment blocked_ip:{ip}:in"))
+        if direction in ("out", "both"):
+            rules.append(("FORWARD", f"-s {ip} -j DROP -m comment --comment blocked_ip:{ip}:out"))
+            rules.append(("OUTPUT", f"-d {ip} -j DROP -m comment --comment blocked_ip:{ip}:out"))
+    return rules
+
+
+def build_restore_payload(rules: list[tuple[str, str]]) -> str:
+    """Формирует вход iptables-restore --noflush: все правила одной транзакцией таблицы filter"""
+    lines = ["*filter"]
+    lines.extend(f"-I {chain} 1 {spec}" for chain, spec in rules)
+    lines.append("COMMIT")
+    return "\n".join(lines) + "\n"
+
+
+def printf_chunks(payload: str, chunk_size: int = RESTORE_CHUNK_SIZE) -> list[str]:
+    """Режет payload по строкам на порции для printf (в payload только безопасные символы)"""
+    chunks, current, size = [], [], 0
+    for line in payload.splitlines(keepends=True):
+        line = line.replace("\n", "\\n")
+        if current and size + len(line) > chunk_size:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def build_restore_commands(payload: str, tmp_path: str = "/tmp/fwmp_restore.rules",
+                           chunk_size: int = RESTORE_CHUNK_SIZE,
+                           restore_command: str = "iptables-restore --noflush") -> list[str]:
+    """
+    Команды применения ruleset на устройстве. Небольшой ruleset передаётся и
+    применяется одной командой; большой сначала дописывается во временный файл
+    порциями, затем применяется одним вызовом restore_command
+    (iptables-restore или ipset restore).
+    """
+    chunks = printf_chunks(payload, chunk_size)
+    rc = f'; echo "{RESTORE_RC_MARKER}$?"'
+    if len(chunks) == 1:
+        return [f"printf '{chunks[0]}' | {restore_command}{rc}"]
+    commands = [f"printf '{chunks[0]}' > {tmp_path}"]
+    commands.extend(f"printf '{chunk}' >> {tmp_path}" for chunk in chunks[1:])
+    commands.append(f"{restore_command} < {tmp_path}{rc}; rm -f {tmp_path}")
+    return commands
+
+
+def parse_restore_result(output: str) -> tuple[bool, str]:
+    """Возвращает (успех, вывод без маркера) по выводу команды применения"""
+    match = re.search(rf"{RESTORE_RC_MARKER}(\d+)", output)
+    message = re.sub(rf"{RESTORE_RC_MARKER}\d+", "", output).strip()
+    if match is None:
+        return False, message or "iptables-restore exit code not found"
+    return match.group(1) == "0", message
@@ -0,0 +1,162 @@
+import math
+import os
+import time
+from array import array
+
+# Окно, за которое считаются перцентили (секунды), и число слотов в нём:
+# старые слоты обнуляются по мере сдвига окна
+METRICS_LATENCY_WINDOW = float(os.getenv("METRICS_LATENCY_WINDOW", 3600))
+METRICS_LATENCY_SLOTS = int(os.getenv("METRICS_LATENCY_SLOTS", 6))
+# Максимальное число рядов (маршрут, класс статуса); остальные попадают в OVERFLOW_ROUTE
+METRICS_LATENCY_MAX_SERIES = int(os.getenv("METRICS_LATENCY_MAX_SERIES", 500))
+
+OVERFLOW_ROUTE = "other"
+
+# Логарифмические корзины: нижняя граница 0.1 мс, 8 корзин на удвоение
+# (относительная погрешность около 9%), верхняя граница около 28 минут
+LATENCY_MIN = 1e-4
+SUB_BUCKETS = 8
+BUCKETS = 200
+
+PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))
+
+
+def bucket_index(seconds: float) -> int:
+    if seconds < LATENCY_MIN:
+        return 0
+    return min(int(math.log2(seconds / LATENCY_MIN) * SUB_BUCKETS) + 1, BUCKETS - 1)
+
+
+def bucket_upper(index: int) -> float:
+    """Верхняя граница корзины: перцентиль не занижается"""
+    return LATENCY_MIN * 2 ** (index / SUB_BUCKETS)
+
+
+def status_class(status_code: int | None) -> str:
+    return f"{status_code // 100}xx" if status_code else "unknown"
+
+
+class LatencyHistogram:
+    """Гистограмма времени ответа с фиксированной памятью: BUCKETS счётчиков, сумма и максимум"""
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = array("q", bytes(8 * BUCKETS))
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bucket_index(seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "LatencyHistogram"):
+        if not other.count:
+            return
+        counts = self.counts
+        for index, value in enumerate(other.counts):
+            if value:
+                counts[index] += value
+        self.count += other.count
+        self.sum += other.sum
+        if other.max > self.max:
+            self.max = other.max
+
+    def reset(self):
+        self.counts = array("q", bytes(8 * BUCKETS))
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def percentile(self, q: float) -> float:
+        """Значение, не меньше которого q-я доля запросов (с точностью корзины)"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, value in enumerate(self.counts):
+            seen += value
+            if seen >= rank:
+                return min(bucket_upper(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def to_dict(self) -> dict:
+        result = {"count": self.count, "avg": round(self.mean, 6), "max": round(self.max, 6)}
+        for name, q in PERCENTILES:
+            result[name] = round(self.percentile(q), 6)
+        return result
+
+
+class WindowedLatencyHistogram:
+    """
+    Гистограмма за скользящее окно: кольцо из slots гистограмм по window/slots
+    секунд. Запись идёт в слот текущего времени, устаревший слот обнуляется
+    при повторном использовании, запрос сливает слоты внутри окна.
+    """
+
+    def __init__(self, window: float = METRICS_LATENCY_WINDOW, slots: int = METRICS_LATENCY_SLOTS):
+        self.slot_seconds = window / slots
+        self.histograms = [LatencyHistogram() for _ in range(slots)]
+        self.slot_ids = [-1] * slots
+
+    def record(self, seconds: float, now: float | None = None):
+        slot_id = int((time.time() if now is None else now) // self.slot_seconds)
+        index = slot_id % len(self.histograms)
+        if self.slot_ids[index] != slot_id:
+            self.histograms[index].reset()
+            self.slot_ids[index] = slot_id
+        self.histograms[index].record(seconds)
+
+    def snapshot(self, now: float | None = None) -> LatencyHistogram:
+        current = int((time.time() if now is None else now) // self.slot_seconds)
+        merged = LatencyHistogram()
+        for slot_id, histogram in zip(self.slot_ids, self.histograms):
+            if 0 <= current - slot_id < len(self.histograms):
+                merged.merge(histogram)
+        return merged
+
+
+class LatencyTracker:
+    """Гистограммы времени ответа: общая и по рядам (маршрут, класс статуса)"""
+
+    def __init__(self, window: float = METRICS_LATENCY_WINDOW, slots: int = METRICS_LATENCY_SLOTS,
+                 max_series: int = METRICS_LATENCY_MAX_SERIES):
+        self.window = window
+        self.slots = slots
+        self.max_series = max_series
+        self.total = WindowedLatencyHistogram(window, slots)
+        self.series: dict[tuple[str, str], WindowedLatencyHistogram] = {}
+
+    def record(self, seconds: float, route: str = OVERFLOW_ROUTE, status: str = "unknown", now: float | None = None):
+        now = time.time() if now is None else now
+        self.total.record(seconds, now)
+        key = (route, status)
+        histogram = self.series.get(key)
+        if histogram is None:
+            if len(self.series) >= self.max_series:
+                # Число рядов ограничено: новые маршруты учитываются вместе
+                key = (OVERFLOW_ROUTE, status)
+                histogram = self.series.get(key)
+            if histogram is None:
+                histogram = self.series[key] = WindowedLatencyHistogram(self.window, self.slots)
+        histogram.record(seconds, now)
+
+    def overall(self, now: float | None = None) -> LatencyHistogram:
+        return self.total.snapshot(now)
+
+    def by_route(self, now: float | None = None, top: int | None = None) -> list[dict]:
+        """Ряды с запросами в окне, по убыванию числа запросов"""
+        routes = []
+        for (route, status), histogram in self.series.items():
+            snapshot = histogram.snapshot(now)
+            if snapshot.count:
+                routes.append({"route": route, "status_class": status, **snapshot.to_dict()})
+        routes.sort(key=lambda item: item["count"], reverse=True)
+        return routes[:top] if top is not None else routes
@@ -0,0 +1,183 @@
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from dataclasses import fields
+from datetime import datetime
+
+# Шаг свёртки истории для длинных периодов (секунды) и число свёрнутых точек:
+# по умолчанию 5 минут × 8640 = 30 суток
+METRICS_ROLLUP_SECONDS = float(os.getenv("METRICS_ROLLUP_SECONDS", 300))
+METRICS_ROLLUP_POINTS = int(os.getenv("METRICS_ROLLUP_POINTS", 8640))
+
+
+class MetricSeries:
+    """
+    Ряд метрик в кольцевом буфере с колонками array: время (epoch-секунды)
+    и по колонке на каждое числовое поле dataclass. Память фиксирована,
+    окно по времени находится двоичным поиском, выборка - срезы колонок.
+
+    Снаружи ряд ведёт себя как deque(maxlen=capacity) записей: append,
+    len, индексация и итерация возвращают экземпляры record_type.
+    Время записей не убывает: запись с более ранним временем ставится
+    на время последней.
+
+    При rollup_seconds > 0 средние значения за каждые rollup_seconds
+    пишутся во вложенный ряд rollup: им отвечают запросы за период,
+    начало которого старше самой ранней записи заполненного основного ряда.
+    """
+
+    def __init__(self, record_type, capacity: int, rollup_seconds: float = 0, rollup_capacity: int = 0):
+        self.record_type = record_type
+        self.names = [field.name for field in fields(record_type) if field.name != "timestamp"]
+        self.capacity = max(1, capacity)
+        self.timestamps = array("d", bytes(8 * self.capacity))
+        self.columns = {
+            field.name: array("q" if field.type in (int, "int") else "d", bytes(8 * self.capacity))
+            for field in fields(record_type) if field.name != "timestamp"
+        }
+        self.head = 0
+        self.size = 0
+        self._lock = threading.Lock()
+
+        self.rollup_seconds = rollup_seconds
+        self.rollup = MetricSeries(record_type, rollup_capacity) if rollup_seconds > 0 and rollup_capacity > 0 else None
+        self._pending_slot = None
+        self._pending_sums = [0.0] * len(self.names)
+        self._pending_count = 0
+
+    @property
+    def maxlen(self) -> int:
+        return self.capacity
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, record):
+        timestamp = record.timestamp.timestamp()
+        values = [getattr(record, name) for name in self.names]
+        with self._lock:
+            if self.size and timestamp < self.timestamps[self.head - 1]:
+                timestamp = self.timestamps[self.head - 1]
+            self.timestamps[self.head] = timestamp
+            for name, value in zip(self.names, values):
+                self.columns[name][self.head] = value
+            self.head = (self.head + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+            if self.rollup is not None:
+                self._accumulate(timestamp, values)
+
+    def _accumulate(self, timestamp: float, values: list):
+        slot = int(timestamp // self.rollup_seconds)
+        if self._pending_slot is not None and slot != self._pending_slot:
+            self._flush()
+        self._pending_slot = slot
+        self._pending_count += 1
+        for index, value in enumerate(values):
+            self._pending_sums[index] += value
+
+    def _flush(self):
+        """Среднее за завершённую корзину - точка свёрнутого ряда"""
+        values = {}
+        for name, total in zip(self.names, self._pending_sums):
+            mean = total / self._pending_count
+            values[name] = round(mean) if self.columns[name].typecode == "q" else mean
+        timestamp = datetime.fromtimestamp(self._pending_slot * self.rollup_seconds)
+        self.rollup.append(self.record_type(timestamp=timestamp, **values))
+        self._pending_sums = [0.0] * len(self.names)
+        self._pending_count = 0
+
+    def clear(self):
+        with self._lock:
+            self.head = 0
+            self.size = 0
+            self._pending_slot = None
+            self._pending_sums = [0.0] * len(self.names)
+            self._pending_count = 0
+        if self.rollup is not None:
+            self.rollup.clear()
+
+    def _segments(self) -> list[tuple[int, int]]:
+        """Физические диапазоны буфера в порядке времени"""
+        if self.size < self.capacity:
+            return [(0, self.size)]
+        return [(self.head, self.capacity), (0, self.head)]
+
+    def _position(self, index: int) -> int:
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("MetricSeries index out of range")
+        return (self.head - self.size + index) % self.capacity
+
+    def __getitem__(self, index: int):
+        with self._lock:
+            position = self._position(index)
+            values = {name: column[position] for name, column in self.columns.items()}
+            timestamp = self.timestamps[position]
+        return self.record_type(timestamp=datetime.fromtimestamp(timestamp), **values)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def _oldest(self) -> float:
+        return self.timestamps[self._position(0)]
+
+    def select(self, start: float | None = None, end: float | None = None) -> dict[str, array]:
+        """
+        Колонки записей со временем в (start, end] - копии срезов буфера.
+        Если буфер заполнен и start старше самой ранней записи, выборка
+        берётся из свёрнутого ряда.
+        """
+        if self.rollup is not None and start is not None and len(self.rollup):
+            with self._lock:
+                # Пока буфер не заполнен, в нём вся история
+                truncated = self.size == self.capacity and start < self._oldest()
+            if truncated:
+                return self.rollup.select(start, end)
+
+        with self._lock:
+            result = {"timestamp": array("d")}
+            result.update({name: array(column.typecode) for name, column in self.columns.items()})
+            for lo, hi in self._segments():
+                if start is not None:
+                    lo = bisect_right(self.timestamps, start, lo, hi)
+                if end is not None:
+                    hi = bisect_right(self.timestamps, end, lo, hi)
+                if lo >= hi:
+                    continue
+                result["timestamp"].extend(self.timestamps[lo:hi])
+                for name, column in self.columns.items():
+                    result[name].extend(column[lo:hi])
+        return result
+
+
+def mean(values: array) -> float:
+    return sum(values) / len(values) if len(values) else 0.0
+
+
+def downsample(data: dict[str, array], start: float, end: float, buckets: int) -> dict[str, list]:
+    """
+    Средние по buckets равным интервалам (start, end]: время корзины - её
+    начало, пустые корзины пропускаются. Границы корзин ищутся двоичным
+    поиском по колонке времени, суммы считаются по срезам колонок.
+    """
+    timestamps = data["timestamp"]
+    names = [name for name in data if name != "timestamp"]
+    result = {name: [] for name in data}
+    step = (end - start) / buckets if buckets > 0 else 0
+    if step <= 0:
+        return result
+    lo = bisect_right(timestamps, start)
+    for bucket in range(buckets):
+        bucket_start = start + bucket * step
+        hi = bisect_right(timestamps, bucket_start + step, lo)
+        if hi > lo:
+            result["timestamp"].append(bucket_start)
+            count = hi - lo
+            for name in names:
+                value = sum(data[name][lo:hi]) / count
+                result[name].append(round(value) if data[name].typecode == "q" else value)
+        lo = hi
+    return result
@@ -1,10 +1,26 @@
 import asyncio
-from collections import Counter, deque
+import math
+import os
+import time
+from collections import Counter
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import psutil
 
+from .latency import PERCENTILES, LatencyTracker, status_class
+from .metric_store import METRICS_ROLLUP_POINTS, METRICS_ROLLUP_SECONDS, MetricSeries, downsample, mean
+from .metrics_aggregation import multiprocess_aggregator
+from .prometheus_metrics import blocked_ips, multiprocess_enabled, observe_request, security_events
+
+# Интервал сбора системных метрик (секунды), допускаются доли секунды
+METRICS_SYSTEM_INTERVAL = float(os.getenv("METRICS_SYSTEM_INTERVAL", 30))
+# Окно учёта кодов ошибок (секунды) и число корзин в нём
+METRICS_ERROR_WINDOW = float(os.getenv("METRICS_ERROR_WINDOW", 86400))
+METRICS_ERROR_SLOTS = int(os.getenv("METRICS_ERROR_SLOTS", 24))
+# Максимальное число точек графика: более длинные периоды усредняются по корзинам
+METRICS_CHART_POINTS = int(os.getenv("METRICS_CHART_POINTS", 288))
+
 
 @dataclass
 class SystemMetrics:
@@ -26,6 +42,8 @@ class ApplicationMetrics:
     avg_response_time: float
     firewall_rules_count: int
     active_sessions: int
+    p50_response_time: float = 0.0
+    p99_response_time: float = 0.0
 
 @dataclass
 class SecurityMetrics:
@@ -36,32 +54,76 @@ class SecurityMetrics:
     suspicious_activities: int
     firewall_blocks: int
 
+class WindowedCounter:
+    """
+    Счётчики по ключам за скользящее окно: кольцо из slots корзин по
+    window/slots секунд. Память - O(slots × число ключей), сводка - O(slots)
+    независимо от числа событий.
+    """
+
+    def __init__(self, window: float = METRICS_ERROR_WINDOW, slots: int = METRICS_ERROR_SLOTS):
+        self.window = window
+        self.slot_seconds = window / slots
+        self.buckets: list[Counter] = [Counter() for _ in range(slots)]
+        self.slot_ids = [-1] * slots
+
+    def add(self, key, count: int = 1, now: float | None = None):
+        slot_id = int((time.time() if now is None else now) // self.slot_seconds)
+        index = slot_id % len(self.buckets)
+        if self.slot_ids[index] != slot_id:
+            self.buckets[index].clear()
+            self.slot_ids[index] = slot_id
+        self.buckets[index][key] += count
+
+    def totals(self, seconds: float | None = None, now: float | None = None) -> Counter:
+        """Суммы по ключам за последние seconds секунд (с точностью корзины), по умолчанию - за окно"""
+        current = int((time.time() if now is None else now) // self.slot_seconds)
+        slots = len(self.buckets)
+        if seconds is not None:
+            slots = max(1, min(slots, math.ceil(seconds / self.slot_seconds)))
+        result = Counter()
+        for slot_id, bucket in zip(self.slot_ids, self.buckets):
+            if 0 <= current - slot_id < slots:
+                result.update(bucket)
+        return result
+
+
 class MetricsCollector:
     """Сборщик метрик"""
     
     def __init__(self, max_history: int = 1000):
         self.max_history = max_history
-        self.system_metrics: deque = deque(maxlen=max_history)
-        self.app_metrics: deque = deque(maxlen=max_history)
-        self.security_metrics: deque = deque(maxlen=max_history)
+        # История - колонки в кольцевых буферах; для периодов длиннее буфера
+        # хранятся средние за METRICS_ROLLUP_SECONDS
+        self.system_metrics = self._series(SystemMetrics)
+        self.app_metrics = self._series(ApplicationMetrics)
+        self.security_metrics = self._series(SecurityMetrics)
         
         # Счетчики для приложения
         self.request_count = 0
         self.error_count = 0
-        self.response_times = deque(maxlen=100)
+        # Время ответа: гистограммы за скользящее окно, общая и по маршрутам
+        self.latency = LatencyTracker()
         self.failed_logins = 0
         self.blocked_ips = set()
         self.suspicious_activities = 0
         self.firewall_blocks = 0
-        self.error_codes = []  # список кодов ошибок
+        # Коды ошибок: счётчики по часовым корзинам за окно, память не растёт с числом ошибок
+        self.error_codes = WindowedCounter()
         
         # Сетевые метрики
         self.last_network_stats = None
+
+    def _series(self, record_type) -> MetricSeries:
+        return MetricSeries(record_type, self.max_history, METRICS_ROLLUP_SECONDS, METRICS_ROLLUP_POINTS)
         
     def collect_system_metrics(self) -> SystemMetrics | None:
-        """Сбор системных метрик"""
+        """
+        Сбор системных метрик. CPU - без ожидания: cpu_percent(interval=None)
+        возвращает загрузку с предыдущего вызова, то есть за интервал сбора.
+        """
         try:
-            cpu_percent = psutil.cpu_percent(interval=1)
+            cpu_percent = psutil.cpu_percent(interval=None)
             memory = psutil.virtual_memory()
             disk = psutil.disk_usage("/")
             
@@ -94,18 +156,18 @@ class MetricsCollector:
     
     def collect_app_metrics(self, active_users: int, firewall_rules_count: int, active_sessions: int) -> ApplicationMetrics:
         """Сбор метрик приложения"""
-        avg_response_time = 0
-        if self.response_times:
-            avg_response_time = sum(self.response_times) / len(self.response_times)
+        latency = self.latency.overall()
         
         metrics = ApplicationMetrics(
             timestamp=datetime.now(),
             active_users=active_users,
             total_requests=self.request_count,
             error_requests=self.error_count,
-            avg_response_time=avg_response_time,
+            avg_response_time=latency.mean,
             firewall_rules_count=firewall_rules_count,
-            active_sessions=active_sessions
+            active_sessions=active_sessions,
+            p50_response_time=latency.percentile(0.5),
+            p99_response_time=latency.percentile(0.99)
         )
         
         self.app_metrics.append(metrics)
@@ -124,40 +186,44 @@ class MetricsCollector:
         self.security_metrics.append(metrics)
         return metrics
     
-    def record_request(self, response_time: float, is_error: bool = False, error_code: int | None = None):
-        """Запись метрик запроса"""
+    def record_request(self, response_time: float, is_error: bool = False, error_code: int | None = None,
+                       route: str = "other", status_code: int | None = None):
+        """Запись метрик запроса; route - шаблон маршрута, а не фактический путь"""
         self.request_count += 1
         if is_error:
             self.error_count += 1
             if error_code:
-                self.error_codes.append(error_code)
-        self.response_times.append(response_time)
+                self.error_codes.add(error_code)
+        status_code = status_code or error_code
+        status = status_class(status_code)
+        self.latency.record(response_time, route, status)
+        observe_request(route, status_code, status, response_time)
     
     def record_failed_login(self, ip: str):
         """Запись неудачной попытки входа"""
         self.failed_logins += 1
         self.blocked_ips.add(ip)
+        security_events.labels("failed_login").inc()
+        blocked_ips.set(len(self.blocked_ips))
     
     def record_suspicious_activity(self):
         """Запись подозрительной активности"""
         self.suspicious_activities += 1
+        security_events.labels("suspicious_activity").inc()
     
     def record_firewall_block(self):
         """Запись блокировки брандмауэра"""
         self.firewall_blocks += 1
+        security_events.labels("firewall_block").inc()
     
     def get_metrics_summary(self, hours: int = 24) -> dict:
         """Получение сводки метрик за указанное время"""
-        cutoff_time = datetime.now() - timedelta(hours=hours)
+        # Окно по времени - двоичный поиск по колонке времени
+        recent_system = self.system_metrics.select(time.time() - hours * 3600)
         
-        # Фильтруем метрики по времени
-        recent_system = [m for m in self.system_metrics if m.timestamp > cutoff_time]
-        recent_app = [m for m in self.app_metrics if m.timestamp > cutoff_time]
-        recent_security = [m for m in self.security_metrics if m.timestamp > cutoff_time]
-        
-        if not recent_system:
+        if not recent_system["timestamp"]:
             print("[METRICS] Нет данных системных метрик, возвращаю нули")
-            return {
+            return self._with_workers({
                 "system": {
                     "avg_cpu_percent": 0,
                     "avg_memory_percent": 0,
@@ -170,6 +236,7 @@ class MetricsCollector:
                     "total_requests": 0,
                     "error_rate": 0,
                     "avg_response_time": 0,
+                    "response_time_percentiles": {name: 0 for name, _ in PERCENTILES},
                     "failed_logins": 0,
                     "blocked_ips": 0,
                     "suspicious_activities": 0,
@@ -180,40 +247,41 @@ class MetricsCollector:
                     "errors_per_hour": 0,
                     "failed_logins_per_hour": 0
                 },
-                "errors_detail": []
-            }
+                "errors_detail": [],
+                "latency_by_route": []
+            }, hours)
         
         # Системные метрики
-        avg_cpu = sum(m.cpu_percent for m in recent_system) / len(recent_system)
-        avg_memory = sum(m.memory_percent for m in recent_system) / len(recent_system)
-        avg_disk = sum(m.disk_usage_percent for m in recent_system) / len(recent_system)
+        avg_cpu = mean(recent_system["cpu_percent"])
+        avg_memory = mean(recent_system["memory_percent"])
+        avg_disk = mean(recent_system["disk_usage_percent"])
         
         # Метрики приложения
         total_requests = self.request_count
         error_rate = (self.error_count / total_requests * 100) if total_requests > 0 else 0
-        avg_response_time = sum(self.response_times) / len(self.response_times) if self.response_times else 0
+        latency = self.latency.overall()
         
         # Метрики безопасности
         total_failed_logins = self.failed_logins
         unique_blocked_ips = len(self.blocked_ips)
         
         # Детализация ошибок
-        error_counter = Counter(self.error_codes)
-        top_errors = error_counter.most_common(5)
+        top_errors = self.error_codes.totals(hours * 3600).most_common(5)
         
-        return {
+        return self._with_workers({
             "system": {
                 "avg_cpu_percent": round(avg_cpu, 2),
                 "avg_memory_percent": round(avg_memory, 2),
                 "avg_disk_percent": round(avg_disk, 2),
-                "current_cpu": recent_system[-1].cpu_percent if recent_system else 0,
-                "current_memory": recent_system[-1].memory_percent if recent_system else 0,
-                "current_disk": recent_system[-1].disk_usage_percent if recent_system else 0
+                "current_cpu": recent_system["cpu_percent"][-1],
+                "current_memory": recent_system["memory_percent"][-1],
+                "current_disk": recent_system["disk_usage_percent"][-1]
             },
             "application": {
                 "total_requests": total_requests,
                 "error_rate": round(error_rate, 2),
-                "avg_response_time": round(avg_response_time, 3),
+                "avg_response_time": round(latency.mean, 3),
+                "response_time_percentiles": {name: round(latency.percentile(q), 4) for name, q in PERCENTILES},
                 "failed_logins": total_failed_logins,
                 "blocked_ips": unique_blocked_ips,
                 "suspicious_activities": self.suspicious_activities,
@@ -226,45 +294,108 @@ class MetricsCollector:
             },
             "errors_detail": [
                 {"code": code, "count": count} for code, count in top_errors
-            ]
-        }
+            ],
+            "latency_by_route": self.latency.by_route(top=20)
+        }, hours)
+
+    def _with_workers(self, summary: dict, hours: int) -> dict:
+        """
+        При нескольких воркерах (PROMETHEUS_MULTIPROC_DIR) счётчики этого
+        процесса - лишь часть запросов: запросы, ошибки, время ответа и события
+        безопасности берутся из общих файлов метрик всех воркеров.
+        blocked_ips остаётся числом уникальных IP этого воркера (blocked_ips_scope):
+        сумма по воркерам считала бы один IP несколько раз
+        """
+        if not multiprocess_enabled():
+            return summary
+        try:
+            workers = multiprocess_aggregator.summary()
+        except Exception as e:
+            print(f"[METRICS] Ошибка сводки по воркерам: {e}")
+            return summary
+        latency = workers["latency"]
+        security = workers["security"]
+        summary["application"].update({
+            "total_requests": workers["requests"],
+            "error_rate": round(workers["errors"] / workers["requests"] * 100, 2) if workers["requests"] else 0,
+            "avg_response_time": round(latency["avg"], 3),
+            "response_time_percentiles": {name: round(latency[name], 4) for name, _ in PERCENTILES},
+            "failed_logins": security.get("failed_login", 0),
+            "blocked_ips_scope": "worker",
+            "suspicious_activities": security.get("suspicious_activity", 0),
+            "firewall_blocks": security.get("firewall_block", 0),
+        })
+        if hours > 0:
+            summary["trends"] = {
+                "requests_per_hour": workers["requests"] / hours,
+                "errors_per_hour": workers["errors"] / hours,
+                "failed_logins_per_hour": security.get("failed_login", 0) / hours,
+            }
+        summary["errors_detail"] = [
+            {"code": code, "count": count} for code, count in workers["error_codes"].most_common(5)
+        ]
+        summary["latency_by_route"] = workers["latency_by_route"][:20]
+        summary["workers_window_seconds"] = workers["window_seconds"]
+        return summary
     
     def get_chart_data(self, hours: int = 24) -> dict:
-        """Получение данных для графиков"""
-        cutoff_time = datetime.now() - timedelta(hours=hours)
-        
-        # Фильтруем метрики
-        system_data = [m for m in self.system_metrics if m.timestamp > cutoff_time]
-        app_data = [m for m in self.app_metrics if m.timestamp > cutoff_time]
+        """
+        Получение данных для графиков. Периоды, где точек больше
+        METRICS_CHART_POINTS (например, 7 или 30 суток), усредняются по корзинам.
+        """
+        end = time.time()
+        start = end - hours * 3600
+        system_data = self._chart_series(self.system_metrics, start, end)
+        app_data = self._chart_series(self.app_metrics, start, end)
         
         return {
             "system": {
-                "labels": [m.timestamp.strftime("%H:%M") for m in system_data],
-                "cpu": [m.cpu_percent for m in system_data],
-                "memory": [m.memory_percent for m in system_data],
-                "disk": [m.disk_usage_percent for m in system_data]
+                "labels": self._chart_labels(system_data["timestamp"], hours),
+                "cpu": list(system_data["cpu_percent"]),
+                "memory": list(system_data["memory_percent"]),
+                "disk": list(system_data["disk_usage_percent"])
             },
             "application": {
-                "labels": [m.timestamp.strftime("%H:%M") for m in app_data],
-                "active_users": [m.active_users for m in app_data],
-                "response_time": [m.avg_response_time for m in app_data],
-                "requests": [m.total_requests for m in app_data]
+                "labels": self._chart_labels(app_data["timestamp"], hours),
+                "active_users": list(app_data["active_users"]),
+                "response_time_p50": [round(value * 1000, 1) for value in app_data["p50_response_time"]],
+                "response_time_p99": [round(value * 1000, 1) for value in app_data["p99_response_time"]],
+                "requests": list(app_data["total_requests"])
             }
         }
 
+    @staticmethod
+    def _chart_series(series: MetricSeries, start: float, end: float) -> dict:
+        data = series.select(start)
+        if len(data["timestamp"]) > METRICS_CHART_POINTS:
+            return downsample(data, start, end, METRICS_CHART_POINTS)
+        return data
+
+    @staticmethod
+    def _chart_labels(timestamps, hours: int) -> list[str]:
+        label_format = "%H:%M" if hours <= 24 else "%d.%m %H:%M"
+        return [datetime.fromtimestamp(timestamp).strftime(label_format) for timestamp in timestamps]
+
 # Глобальный экземпляр сборщика метрик
 metrics_collector = MetricsCollector()
 
-async def start_metrics_collection():
-    """Запуск сбора метрик в фоновом режиме"""
+async def start_metrics_collection(interval: float | None = None):
+    """
+    Запуск сбора метрик в фоновом режиме. Чтение /proc выполняется в пуле
+    потоков, поэтому сбор с любой частотой не задерживает обработку запросов.
+    """
+    interval = interval if interval is not None else METRICS_SYSTEM_INTERVAL
+    # Первый вызов cpu_percent(interval=None) только задаёт точку отсчёта
+    psutil.cpu_percent(interval=None)
+    await asyncio.sleep(min(interval, 1))
     while True:
         try:
             # Собираем системные метрики
-            metrics_collector.collect_system_metrics()
+            await asyncio.to_thread(metrics_collector.collect_system_metrics)
             
-            # Ждем 30 секунд перед следующим сбором
-            await asyncio.sleep(30)
+            # Ждем до следующего сбора
+            await asyncio.sleep(interval)
             
         except Exception as e:
             print(f"Ошибка при сборе метрик: {e}")
-            await asyncio.sleep(60)  # Ждем дольше при ошибке 
\ No newline at end of file
+            await asyncio.sleep(max(interval, 60))  # Ждем дольше при ошибке
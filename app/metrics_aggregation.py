@@ -0,0 +1,171 @@
+import math
+import threading
+import time
+from collections import Counter, deque
+
+from prometheus_client import CollectorRegistry, multiprocess
+
+from .latency import METRICS_LATENCY_WINDOW, PERCENTILES
+from .prometheus_metrics import PROMETHEUS_MULTIPROC_DIR
+
+# Как часто сохранять снимок общих счётчиков для расчёта значений за окно (секунды)
+METRICS_AGGREGATION_SNAPSHOT_INTERVAL = 60
+
+REQUESTS = "firewall_http_requests_total"
+DURATION = "firewall_http_request_duration_seconds"
+SECURITY_EVENTS = "firewall_security_events_total"
+
+
+def read_samples(path: str | None = None) -> dict[tuple, float]:
+    """
+    Значения счётчиков всех воркеров, слитые из mmap-файлов каталога метрик:
+    (имя сэмпла, метки) -> значение. Чтение файлов, без обращения к воркерам.
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=path or PROMETHEUS_MULTIPROC_DIR)
+    values = {}
+    for metric in registry.collect():
+        for sample in metric.samples:
+            values[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+    return values
+
+
+def subtract(current: dict[tuple, float], base: dict[tuple, float]) -> dict[tuple, float]:
+    """Приращение счётчиков с момента base; перезапуск воркеров (счётчик уменьшился) - значение целиком"""
+    result = {}
+    for key, value in current.items():
+        delta = value - base.get(key, 0.0)
+        result[key] = delta if delta >= 0 else value
+    return result
+
+
+def windowed_samples(values: dict[tuple, float]) -> dict[tuple, float]:
+    """Счётчики, нужные для значений за окно: запросы с ошибкой и гистограмма времени ответа"""
+    result = {}
+    for key, value in values.items():
+        name, labels = key
+        if name.startswith(DURATION) or (name == REQUESTS and _is_error(dict(labels)["status"])):
+            result[key] = value
+    return result
+
+
+def _is_error(status: str) -> bool:
+    return status.isdigit() and int(status) >= 400
+
+
+def bucket_quantile(q: float, buckets: list[tuple[float, float]]) -> float:
+    """
+    Перцентиль по накопительным корзинам (le, число) с линейной интерполяцией
+    внутри корзины, как histogram_quantile в Prometheus
+    """
+    if not buckets or buckets[-1][1] <= 0:
+        return 0.0
+    rank = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if math.isinf(bound):
+                # Выше последней конечной границы - оценка сверху недоступна
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def _latency(buckets: dict[float, float], count: float, total: float) -> dict:
+    ordered = sorted(buckets.items())
+    result = {"count": int(count), "avg": round(total / count, 6) if count else 0.0}
+    for name, q in PERCENTILES:
+        result[name] = round(bucket_quantile(q, ordered), 6)
+    return result
+
+
+def summarize(values: dict[tuple, float]) -> dict:
+    """Запросы, ошибки, время ответа и события безопасности из слитых значений"""
+    requests = 0.0
+    errors = Counter()
+    security = Counter()
+    series: dict[tuple[str, str], dict] = {}
+    overall = {"buckets": Counter(), "count": 0.0, "sum": 0.0}
+
+    for (name, labels), value in values.items():
+        labels = dict(labels)
+        if name == REQUESTS:
+            requests += value
+            if _is_error(labels["status"]):
+                errors[int(labels["status"])] += value
+        elif name.startswith(DURATION):
+            key = (labels["route"], labels["status_class"])
+            item = series.setdefault(key, {"buckets": Counter(), "count": 0.0, "sum": 0.0})
+            if name == DURATION + "_bucket":
+                bound = float(labels["le"])
+                item["buckets"][bound] += value
+                overall["buckets"][bound] += value
+            elif name == DURATION + "_count":
+                item["count"] += value
+                overall["count"] += value
+            elif name == DURATION + "_sum":
+                item["sum"] += value
+                overall["sum"] += value
+        elif name == SECURITY_EVENTS:
+            security[labels["event"]] += value
+
+    routes = [
+        {"route": route, "status_class": status, **_latency(item["buckets"], item["count"], item["sum"])}
+        for (route, status), item in series.items() if item["count"]
+    ]
+    routes.sort(key=lambda item: item["count"], reverse=True)
+    return {
+        "requests": int(requests),
+        "errors": int(sum(errors.values())),
+        "error_codes": Counter({code: int(count) for code, count in errors.items() if count}),
+        "latency": _latency(overall["buckets"], overall["count"], overall["sum"]),
+        "latency_by_route": routes,
+        "security": {event: int(count) for event, count in security.items()},
+    }
+
+
+class MultiprocessAggregator:
+    """
+    Сводка по всем воркерам. Счётчики накопительные, поэтому значения за окно
+    (время ответа, коды ошибок) - разница с сохранённым снимком возрастом
+    не больше окна. Снимки берутся не чаще snapshot_interval и хранят только
+    счётчики, нужные для значений за окно (windowed_samples).
+    Чтение файлов блокирующее: из async-кода summary вызывается через asyncio.to_thread.
+    """
+
+    def __init__(self, path: str | None = None, window: float = METRICS_LATENCY_WINDOW,
+                 snapshot_interval: float = METRICS_AGGREGATION_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.window = window
+        self.snapshot_interval = snapshot_interval
+        self.history: deque[tuple[float, dict]] = deque()
+        self._lock = threading.Lock()
+
+    def summary(self, now: float | None = None) -> dict:
+        now = time.time() if now is None else now
+        current = read_samples(self.path)
+        windowed_current = windowed_samples(current)
+        with self._lock:
+            if not self.history or now - self.history[-1][0] >= self.snapshot_interval:
+                self.history.append((now, windowed_current))
+            # Самый старый нужный снимок - последний, который не моложе начала окна
+            while len(self.history) > 1 and now - self.history[1][0] >= self.window:
+                self.history.popleft()
+            base_time, base = self.history[0]
+
+        lifetime = summarize(current)
+        windowed = summarize(subtract(windowed_current, base)) if now > base_time else lifetime
+        return {
+            **lifetime,
+            "window_seconds": round(now - base_time, 1) if now > base_time else 0.0,
+            "latency": windowed["latency"],
+            "latency_by_route": windowed["latency_by_route"],
+            "error_codes": windowed["error_codes"],
+        }
+
+
+# Глобальный агрегатор сводки по воркерам
+multiprocess_aggregator = MultiprocessAggregator()
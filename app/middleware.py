@@ -8,6 +8,14 @@ from .database import update_user_activity
 from .metrics import metrics_collector
 
 
+def route_name(request: Request, status_code: int) -> str:
+    """Шаблон маршрута (GET /api/devices/{id}), чтобы число рядов гистограмм не зависело от путей"""
+    route = getattr(request, "scope", {}).get("route")
+    if route is not None and hasattr(route, "path"):
+        return f"{request.method} {route.path}"
+    return "unmatched" if status_code == 404 else "other"
+
+
 class ActivityTrackingMiddleware(BaseHTTPMiddleware):
     """Middleware для отслеживания активности пользователей"""
     
@@ -47,7 +55,9 @@ class ActivityTrackingMiddleware(BaseHTTPMiddleware):
         error_code = response.status_code if is_error else None
         
         try:
-            metrics_collector.record_request(response_time, is_error, error_code)
+            metrics_collector.record_request(response_time, is_error, error_code,
+                                             route=route_name(request, response.status_code),
+                                             status_code=response.status_code)
         except Exception as e:
             print(f"Ошибка при записи метрик запроса: {e}")
         
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
-from netmiko import ConnectHandler
+
+from .ssh_executor import ssh_executor
 
 router = APIRouter()
 
@@ -12,7 +13,7 @@ async def device_bandwidth(ip: str, username: str, password: str, device_type: s
         "password": password,
     }
     try:
-        with ConnectHandler(**device) as ssh:
+        def read_interfaces(ssh):
             if "cisco" in device_type:
                 output = ssh.send_command("show interfaces summary")
                 # output приводим к строке
@@ -78,5 +79,8 @@ async def device_bandwidth(ip: str, username: str, password: str, device_type: s
                                 "out_traffic": parts[5],
                             })
                 return {"interfaces": interfaces}
+
+        # Сессия из общего пула, команды выполняются в пуле потоков SSH
+        return await ssh_executor.run(device, read_interfaces)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
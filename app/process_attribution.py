@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple
+
+import psutil
+
+# Время жизни имени процесса в кэше (секунды): PID переиспользуется редко,
+# а psutil.Process(pid).name() - системный вызов на каждую запись conntrack
+PROCESS_NAME_TTL = float(os.getenv("PROCESS_NAME_TTL", 10))
+# После какого числа записей из кэша имён убираются устаревшие
+PROCESS_NAME_CACHE_SIZE = int(os.getenv("PROCESS_NAME_CACHE_SIZE", 4096))
+
+# Максимальное число процессов в кэше метаданных
+PROCESS_INFO_CACHE_SIZE = int(os.getenv("PROCESS_INFO_CACHE_SIZE", 4096))
+
+# Адреса сокетов, слушающих на всех интерфейсах
+WILDCARD_ADDRESSES = ("0.0.0.0", "::")
+
+
+class ProcessNameCache:
+    """Кэш имён процессов по PID с коротким временем жизни"""
+
+    def __init__(self, ttl: float = PROCESS_NAME_TTL, max_size: int = PROCESS_NAME_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._names: dict[int, tuple[str | None, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pid: int) -> str | None:
+        """Имя процесса или None, если процесс завершился или недоступен"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._names.get(pid)
+            if cached is not None and now - cached[1] < self.ttl:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        try:
+            name = psutil.Process(pid).name()
+        except Exception:
+            name = None
+
+        with self._lock:
+            self._names[pid] = (name, now)
+            if len(self._names) > self.max_size:
+                # Убираем устаревшие записи, чтобы кэш не рос с числом PID
+                self._names = {p: entry for p, entry in self._names.items() if now - entry[1] < self.ttl}
+        return name
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._names), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+# Глобальный кэш имён процессов
+process_name_cache = ProcessNameCache()
+
+
+class ProcessInfo(NamedTuple):
+    """Метаданные процесса: имя и время запуска (секунды с эпохи и для отображения)"""
+    name: str
+    create_time: float
+    started: str
+
+
+class ProcessInfoCache:
+    """
+    Кэш метаданных процессов по (pid, create_time). Время запуска читается
+    при каждом обращении и отличает процесс от нового с тем же PID: при
+    переиспользовании PID запись вытесняется. Имя и форматированное время
+    запуска вычисляются один раз на процесс.
+    """
+
+    def __init__(self, max_size: int = PROCESS_INFO_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, ProcessInfo] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, pid: int) -> ProcessInfo | None:
+        """Метаданные процесса или None, если процесс завершился или недоступен"""
+        try:
+            proc = psutil.Process(pid)
+            create_time = proc.create_time()
+        except Exception:
+            return None
+
+        with self._lock:
+            cached = self._entries.get(pid)
+            if cached is not None:
+                if cached.create_time == create_time:
+                    self._entries.move_to_end(pid)
+                    self.hits += 1
+                    return cached
+                # PID занят новым процессом
+                del self._entries[pid]
+                self.evictions += 1
+            self.misses += 1
+
+        try:
+            name = proc.name()
+        except Exception:
+            return None
+        info = ProcessInfo(name, create_time, datetime.fromtimestamp(create_time).strftime("%d.%m.%Y %H:%M:%S"))
+
+        with self._lock:
+            self._entries[pid] = info
+            self._entries.move_to_end(pid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return info
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "max_size": self.max_size}
+
+
+# Глобальный кэш метаданных процессов
+process_info_cache = ProcessInfoCache()
+
+
+def _normalize_ip(ip: str) -> str:
+    # IPv4-адреса в IPv6-сокетах приходят как ::ffff:1.2.3.4
+    return ip[7:] if ip.startswith("::ffff:") else ip
+
+
+class SocketIndex:
+    """
+    Снимок локальных сокетов: (ip, port) -> pid. Строится одним вызовом
+    psutil.net_connections на запрос, поиск процесса по адресу - O(1).
+    """
+
+    def __init__(self, connections, name_cache: ProcessNameCache | None = None):
+        self.name_cache = name_cache or process_name_cache
+        self.by_address: dict[tuple[str, int], int] = {}
+        self.by_port: dict[int, int] = {}
+        for conn in connections:
+            if not conn.laddr or not conn.pid:
+                continue
+            ip, port = _normalize_ip(conn.laddr.ip), conn.laddr.port
+            self.by_address.setdefault((ip, port), conn.pid)
+            if ip in WILDCARD_ADDRESSES:
+                self.by_port.setdefault(port, conn.pid)
+
+    @classmethod
+    def snapshot(cls, name_cache: ProcessNameCache | None = None) -> "SocketIndex":
+        """Индекс по текущим сокетам системы"""
+        try:
+            connections = psutil.net_connections(kind="inet")
+        except Exception:
+            connections = []
+        return cls(connections, name_cache)
+
+    def pid_for(self, ip: str, port) -> int | None:
+        """PID процесса, владеющего локальным адресом; слушающие на всех интерфейсах учитываются"""
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            return None
+        pid = self.by_address.get((_normalize_ip(ip), port))
+        return pid if pid is not None else self.by_port.get(port)
+
+    def process_name(self, ip: str, port, default: str = "unknown") -> str:
+        """Имя процесса, владеющего локальным адресом, или default"""
+        pid = self.pid_for(ip, port)
+        if pid is None:
+            return default
+        return self.name_cache.get(pid) or default
+
+    def __len__(self) -> int:
+        return len(self.by_address)
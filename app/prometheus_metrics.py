@@ -0,0 +1,145 @@
+import hmac
+import os
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Токен для сбора метрик (Authorization: Bearer ...); пустой - без проверки
+PROMETHEUS_METRICS_TOKEN = os.getenv("PROMETHEUS_METRICS_TOKEN", "")
+# Каталог файлов метрик воркеров (uvicorn --workers N). prometheus_client читает
+# его при импорте: значения счётчиков каждого процесса пишутся в свой mmap-файл
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Единый реестр метрик приложения (не глобальный реестр prometheus_client,
+# чтобы в выдачу не попадали метрики сторонних библиотек)
+registry = CollectorRegistry()
+
+# Границы через множитель sqrt(2) от 1 мс до 65 с: по ним же считаются
+# перцентили сводки при нескольких воркерах
+REQUEST_BUCKETS = tuple(round(0.001 * 2 ** (k / 2), 6) for k in range(33))
+POLL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+http_requests = Counter(
+    "firewall_http_requests", "HTTP-запросы по шаблону маршрута и коду ответа",
+    ["route", "status"], registry=registry,
+)
+http_request_duration = Histogram(
+    "firewall_http_request_duration_seconds", "Время ответа по шаблону маршрута и классу статуса",
+    ["route", "status_class"], buckets=REQUEST_BUCKETS, registry=registry,
+)
+device_poll_duration = Histogram(
+    "firewall_device_poll_duration_seconds", "Длительность фонового опроса всех устройств",
+    buckets=POLL_BUCKETS, registry=registry,
+)
+device_probe_duration = Histogram(
+    "firewall_device_probe_duration_seconds", "Длительность проверки доступности устройства",
+    ["result"], buckets=POLL_BUCKETS, registry=registry,
+)
+rate_limit_decisions = Counter(
+    "firewall_rate_limit_decisions", "Решения rate limiting: allowed, blocked, error",
+    ["decision"], registry=registry,
+)
+security_events = Counter(
+    "firewall_security_events", "События безопасности: failed_login, suspicious_activity, firewall_block",
+    ["event"], registry=registry,
+)
+blocked_ips = Gauge(
+    "firewall_blocked_ips", "IP-адреса с неудачными входами (при нескольких воркерах - значение каждого воркера, метка pid)",
+    multiprocess_mode="liveall", registry=registry,
+)
+
+
+class StateCollector:
+    """
+    Состояние пулов и фонового опроса на момент сбора: читаются только
+    счётчики в памяти, без запросов к БД, устройствам и без подпроцессов.
+    """
+
+    def collect(self):
+        # Ленивые импорты: модули пулов сами пишут метрики в этот реестр
+        from .db_pool import get_pool_stats
+        from .device_poller import device_poller
+        from .ssh_executor import ssh_executor
+        from .ssh_pool import ssh_pool
+
+        ssh = ssh_pool.get_status()
+        yield GaugeMetricFamily("firewall_ssh_pool_sessions", "Открытые SSH-сессии", value=ssh["total_connections"])
+        yield GaugeMetricFamily("firewall_ssh_pool_sessions_in_use", "SSH-сессии, выданные операциям",
+                                value=sum(device["in_use"] for device in ssh["connections"]))
+        yield GaugeMetricFamily("firewall_ssh_pool_devices", "Устройства в пуле SSH", value=len(ssh["connections"]))
+        for name in ("created", "reused", "evicted", "lease_timeouts"):
+            yield CounterMetricFamily(f"firewall_ssh_pool_{name}", f"SSH-сессии: {name}", value=ssh[name])
+
+        executor = ssh_executor.get_stats()
+        yield GaugeMetricFamily("firewall_ssh_executor_queue_depth", "Операции в очереди к устройствам",
+                                value=executor["queue_depth"])
+        yield GaugeMetricFamily("firewall_ssh_executor_running", "Выполняемые операции", value=executor["running"])
+        yield GaugeMetricFamily("firewall_ssh_executor_workers", "Размер пула потоков", value=executor["max_workers"])
+        jobs = CounterMetricFamily("firewall_ssh_executor_jobs", "Операции с устройствами по результату", labels=["result"])
+        jobs.add_metric(["completed"], executor["completed"])
+        jobs.add_metric(["failed"], executor["failed"])
+        yield jobs
+
+        db = get_pool_stats()
+        yield GaugeMetricFamily("firewall_db_pool_size", "Соединения в пуле БД", value=db["size"])
+        yield GaugeMetricFamily("firewall_db_pool_in_use", "Занятые соединения пула БД", value=db["in_use"])
+        yield GaugeMetricFamily("firewall_db_pool_max_size", "Максимальный размер пула БД", value=db["max_size"])
+        yield CounterMetricFamily("firewall_db_pool_acquires", "Выдачи соединений из пула", value=db["acquire_count"])
+        yield CounterMetricFamily("firewall_db_pool_acquire_timeouts", "Таймауты ожидания соединения",
+                                  value=db["acquire_timeouts"])
+
+        poller = device_poller.get_status()
+        yield GaugeMetricFamily("firewall_devices", "Устройства в таблице статусов", value=poller["devices"])
+        if poller["last_sweep_at"] is not None:
+            yield GaugeMetricFamily("firewall_device_poll_last_timestamp_seconds", "Время последнего опроса устройств",
+                                    value=poller["last_sweep_at"])
+
+
+state_collector = StateCollector()
+registry.register(state_collector)
+
+
+def multiprocess_enabled() -> bool:
+    return bool(PROMETHEUS_MULTIPROC_DIR)
+
+
+def exposition_registry() -> CollectorRegistry:
+    """
+    Реестр для выдачи: в многопроцессном режиме счётчики и гистограммы
+    сливаются из файлов всех воркеров, состояние пулов - этого воркера
+    """
+    if not multiprocess_enabled():
+        return registry
+    merged = CollectorRegistry()
+    multiprocess.MultiProcessCollector(merged, path=PROMETHEUS_MULTIPROC_DIR)
+    merged.register(state_collector)
+    return merged
+
+
+def mark_process_dead(pid: int | None = None):
+    """Убирает значения gauge завершившегося воркера (при остановке приложения)"""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid or os.getpid(), PROMETHEUS_MULTIPROC_DIR)
+
+
+def observe_request(route: str, status_code: int | None, status_class: str, seconds: float):
+    """Запрос в счётчики и гистограмму Prometheus"""
+    http_requests.labels(route, str(status_code) if status_code else "unknown").inc()
+    http_request_duration.labels(route, status_class).observe(seconds)
+
+
+router = APIRouter()
+
+
+@router.get("/api/metrics/prometheus")
+def prometheus_metrics(request: Request):
+    """
+    Метрики в текстовом формате Prometheus; сбор не обращается к БД и не запускает процессы.
+    Обычная функция: FastAPI выполняет её в пуле потоков, чтение файлов воркеров не блокирует event loop.
+    """
+    if PROMETHEUS_METRICS_TOKEN:
+        authorization = request.headers.get("authorization", "")
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {PROMETHEUS_METRICS_TOKEN}".encode()):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=generate_latest(exposition_registry()), media_type=CONTENT_TYPE_LATEST)
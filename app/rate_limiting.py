@@ -5,6 +5,8 @@ import redis.asyncio as redis
 from fastapi import HTTPException, Request
 from fastapi.responses import JSONResponse
 
+from .prometheus_metrics import rate_limit_decisions
+
 
 class RateLimiter:
     """Rate Limiter с использованием Redis"""
@@ -111,6 +113,7 @@ async def rate_limit_middleware(
             window_seconds
         )
         
+        rate_limit_decisions.labels("allowed" if is_allowed else "blocked").inc()
         if not is_allowed:
             # Превышен лимит запросов
             retry_after = rate_limit_info["reset"] - int(time.time())
@@ -144,6 +147,7 @@ async def rate_limit_middleware(
     except Exception as e:
         # В случае ошибки Redis, пропускаем Rate Limiting
         print(f"Rate Limiting error: {e}")
+        rate_limit_decisions.labels("error").inc()
         return await call_next(request)
 
 def rate_limit(
@@ -178,6 +182,7 @@ def rate_limit(
                     window_seconds
                 )
                 
+                rate_limit_decisions.labels("allowed" if is_allowed else "blocked").inc()
                 if not is_allowed:
                     retry_after = rate_limit_info["reset"] - int(time.time())
                     
@@ -199,6 +204,7 @@ def rate_limit(
             except Exception as e:
                 # В случае ошибки Redis, пропускаем Rate Limiting
                 print(f"Rate Limiting error: {e}")
+                rate_limit_decisions.labels("error").inc()
                 return await func(request, *args, **kwargs)
         
         return wrapper
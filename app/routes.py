@@ -1,8 +1,6 @@
 from fastapi import FastAPI, Form, Request, HTTPException
 from fastapi.responses import RedirectResponse, FileResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
-import asyncpg
-from db_config import DB_USER, DB_PASSWORD, DB_NAME, DB_HOST, DB_PORT
 from .security import (
     check_login_attempts, 
     authenticate_user, 
@@ -24,7 +22,9 @@ from .database import (
     get_all_firewall_rules, add_firewall_rule, update_firewall_rule, delete_firewall_rule, toggle_firewall_rule,
     add_audit_log, get_audit_log, create_firewall_rules_table, get_all_network_interfaces_info
 )
+from .db_pool import acquire_connection, get_pool_stats
 from .metrics import metrics_collector, start_metrics_collection
+import asyncio
 import datetime
 import re
 import psutil
@@ -187,16 +187,8 @@ def setup_routes(app: FastAPI):
         
         # Получаем пользователей из базы данных
         try:
-            conn = await asyncpg.connect(
-                user=DB_USER,
-                password=DB_PASSWORD,
-                database=DB_NAME,
-                host=DB_HOST,
-                port=DB_PORT
-            )
-            
-            db_users = await conn.fetch('SELECT id, username, password FROM users ORDER BY id')
-            await conn.close()
+            async with acquire_connection() as conn:
+                db_users = await conn.fetch('SELECT id, username, password FROM users ORDER BY id')
             
             # Подготавливаем данные пользователей для шаблона
             user_list = []
@@ -234,16 +226,8 @@ def setup_routes(app: FastAPI):
         logging.info(f"[ROUTE] get_users called")
         """API для получения списка пользователей"""
         try:
-            conn = await asyncpg.connect(
-                user=DB_USER,
-                password=DB_PASSWORD,
-                database=DB_NAME,
-                host=DB_HOST,
-                port=DB_PORT
-            )
-            
-            db_users = await conn.fetch('SELECT id, username, password, role FROM users ORDER BY id')
-            await conn.close()
+            async with acquire_connection() as conn:
+                db_users = await conn.fetch('SELECT id, username, password, role FROM users ORDER BY id')
             
             user_list = []
             for db_user in db_users:
@@ -289,27 +273,18 @@ def setup_routes(app: FastAPI):
             return JSONResponse(content={"error": "Некорректная роль"}, status_code=400)
         
         try:
-            conn = await asyncpg.connect(
-                user=DB_USER,
-                password=DB_PASSWORD,
-                database=DB_NAME,
-                host=DB_HOST,
-                port=DB_PORT
-            )
-            
-            # Проверяем, существует ли пользователь
-            existing_user = await conn.fetchval('SELECT id FROM users WHERE username = $1', login)
-            if existing_user:
-                await conn.close()
-                return JSONResponse(content={"error": "Пользователь с таким логином уже существует"}, status_code=400)
+            async with acquire_connection() as conn:
+                # Проверяем, существует ли пользователь
+                existing_user = await conn.fetchval('SELECT id FROM users WHERE username = $1', login)
+                if existing_user:
+                    return JSONResponse(content={"error": "Пользователь с таким логином уже существует"}, status_code=400)
+                
+                # Добавляем пользователя в базу данных
+                await conn.execute('''
+                    INSERT INTO users (username, password, role)
+                    VALUES ($1, $2, $3)
+                ''', login, password, role)
             
-            # Добавляем пользователя в базу данных
-            await conn.execute('''
-                INSERT INTO users (username, password, role)
-                VALUES ($1, $2, $3)
-            ''', login, password, role)
-            
-            await conn.close()
             return JSONResponse(content={"success": True})
             
         except Exception as e:
@@ -327,20 +302,11 @@ def setup_routes(app: FastAPI):
             return JSONResponse(content={"error": "Некорректная роль"}, status_code=400)
         
         try:
-            conn = await asyncpg.connect(
-                user=DB_USER,
-                password=DB_PASSWORD,
-                database=DB_NAME,
-                host=DB_HOST,
-                port=DB_PORT
-            )
-            
-            # Обновляем роль пользователя в базе данных
-            result = await conn.execute('''
-                UPDATE users SET role = $1 WHERE id = $2
-            ''', role, user_id)
-            
-            await conn.close()
+            async with acquire_connection() as conn:
+                # Обновляем роль пользователя в базе данных
+                result = await conn.execute('''
+                    UPDATE users SET role = $1 WHERE id = $2
+                ''', role, user_id)
             
             if result == "UPDATE 0":
                 return JSONResponse(content={"error": "Пользователь не найден"}, status_code=404)
@@ -356,20 +322,11 @@ def setup_routes(app: FastAPI):
         logging.info(f"[ROUTE] delete_user called with user_id={user_id}")
         """API для удаления пользователя"""
         try:
-            conn = await asyncpg.connect(
-                user=DB_USER,
-                password=DB_PASSWORD,
-                database=DB_NAME,
-                host=DB_HOST,
-                port=DB_PORT
-            )
-            
-            # Удаляем пользователя из базы данных
-            result = await conn.execute('''
-                DELETE FROM users WHERE id = $1
-            ''', user_id)
-            
-            await conn.close()
+            async with acquire_connection() as conn:
+                # Удаляем пользователя из базы данных
+                result = await conn.execute('''
+                    DELETE FROM users WHERE id = $1
+                ''', user_id)
             
             if result == "DELETE 0":
                 return JSONResponse(content={"error": "Пользователь не найден"}, status_code=404)
@@ -633,22 +590,16 @@ def setup_routes(app: FastAPI):
             firewall_rules_count = len(rules)
             
             # Получаем активные сессии
-            conn = await asyncpg.connect(
-                user=DB_USER,
-                password=DB_PASSWORD,
-                database=DB_NAME,
-                host=DB_HOST,
-                port=DB_PORT
-            )
-            active_sessions = await conn.fetchval('SELECT COUNT(*) FROM user_sessions WHERE is_online = true')
-            await conn.close()
+            async with acquire_connection() as conn:
+                active_sessions = await conn.fetchval('SELECT COUNT(*) FROM user_sessions WHERE is_online = true')
             
             # Собираем метрики приложения
             metrics_collector.collect_app_metrics(active_users, firewall_rules_count, active_sessions)
             metrics_collector.collect_security_metrics()
             
             # Получаем сводку
-            summary = metrics_collector.get_metrics_summary()
+            # В многопроцессном режиме сводка читает файлы метрик воркеров - вне event loop
+            summary = await asyncio.to_thread(metrics_collector.get_metrics_summary)
 
             # Добавляем информацию о сетевых интерфейсах
             try:
@@ -657,6 +608,9 @@ def setup_routes(app: FastAPI):
                 interfaces_info = []
             summary["network_interfaces"] = interfaces_info
 
+            # Добавляем состояние пула соединений с БД
+            summary["db_pool"] = get_pool_stats()
+
             return JSONResponse(content=summary)
             
         except Exception as e:
@@ -677,7 +631,13 @@ def setup_routes(app: FastAPI):
             return JSONResponse(content={"error": "Доступ запрещен"}, status_code=403)
         
         try:
-            chart_data = metrics_collector.get_chart_data()
+            # Период графиков в часах: от часа до 30 суток
+            hours = min(max(int(request.query_params.get("hours", 24)), 1), 720)
+        except ValueError:
+            return JSONResponse(content={"error": "Некорректный период"}, status_code=400)
+        
+        try:
+            chart_data = metrics_collector.get_chart_data(hours)
             return JSONResponse(content=chart_data)
         except Exception as e:
             print(f"Ошибка при получении данных графиков: {e}")
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .ssh_pool import SSHPoolTimeout, device_key, ssh_pool
+
+# Число потоков для блокирующих операций netmiko
+SSH_EXECUTOR_WORKERS = int(os.getenv("SSH_EXECUTOR_WORKERS", 16))
+# Сколько проверка доступности ждёт свободную сессию устройства (секунды)
+SSH_HEALTH_LEASE_TIMEOUT = float(os.getenv("SSH_HEALTH_LEASE_TIMEOUT", 2))
+# Отдельные потоки для проверок доступности: массовый опрос не занимает потоки операций
+SSH_HEALTH_CHECK_WORKERS = int(os.getenv("SSH_HEALTH_CHECK_WORKERS", 4))
+
+
+class SSHExecutor:
+    """
+    Выделенный пул потоков ограниченного размера для операций с устройствами.
+    Блокирующие вызовы netmiko выполняются вне event loop, а операции с одним
+    устройством выполняются строго по очереди.
+    """
+
+    def __init__(self, max_workers: int = SSH_EXECUTOR_WORKERS, window: int = 1000,
+                 health_workers: int = SSH_HEALTH_CHECK_WORKERS):
+        self.max_workers = max_workers
+        self.health_workers = health_workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._health_executor: ThreadPoolExecutor | None = None
+        self._device_locks: dict[str, asyncio.Lock] = {}
+        self._stats_lock = threading.Lock()
+        # Ожидают своей очереди к устройству или свободного потока
+        self.waiting = 0
+        self.running = 0
+        self.max_waiting = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.started_count = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.recent_wait_times = deque(maxlen=window)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ssh-io")
+        return self._executor
+
+    def _get_health_executor(self) -> ThreadPoolExecutor:
+        if self._health_executor is None:
+            self._health_executor = ThreadPoolExecutor(max_workers=self.health_workers, thread_name_prefix="ssh-health")
+        return self._health_executor
+
+    def _device_lock(self, key: str) -> asyncio.Lock:
+        lock = self._device_locks.get(key)
+        if lock is None:
+            lock = self._device_locks[key] = asyncio.Lock()
+        return lock
+
+    def forget_device(self, netmiko_device: dict):
+        """Удаляет очередь операций удалённого устройства, если она свободна"""
+        key = device_key(netmiko_device)
+        lock = self._device_locks.get(key)
+        if lock is not None and not lock.locked():
+            del self._device_locks[key]
+
+    def _on_submit(self):
+        with self._stats_lock:
+            self.submitted += 1
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def _on_start(self, state: dict, wait_time: float):
+        with self._stats_lock:
+            if state["finished"]:
+                # Вызывающий уже отменил ожидание - задача учтена как завершённая
+                return
+            state["started"] = True
+            self.waiting -= 1
+            self.running += 1
+            self.started_count += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.recent_wait_times.append(wait_time)
+
+    def _on_finish(self, state: dict, success: bool):
+        with self._stats_lock:
+            state["finished"] = True
+            if state["started"]:
+                self.running -= 1
+            else:
+                self.waiting -= 1
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    async def run(self, netmiko_device: dict, func, *args):
+        """
+        Выполняет func(ssh, *args) в потоке SSH-пула с арендованной сессией устройства.
+        Операции с одним устройством сериализуются.
+        """
+        key = device_key(netmiko_device)
+        submitted_at = time.perf_counter()
+        state = {"started": False, "finished": False}
+        self._on_submit()
+
+        def job():
+            wait_time = time.perf_counter() - submitted_at
+            self._on_start(state, wait_time)
+            if wait_time > 1:
+                logging.info(f"[SSH-EXECUTOR] Job for {key} waited {wait_time:.2f}s in queue")
+            with ssh_pool.lease(netmiko_device) as ssh:
+                return func(ssh, *args)
+
+        success = False
+        try:
+            async with self._device_lock(key):
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._get_executor(), job)
+            success = True
+            return result
+        finally:
+            self._on_finish(state, success)
+
+    async def check(self, netmiko_device: dict, lease_timeout: float | None = None) -> bool | None:
+        """
+        Проверка авторизации на устройстве вне очереди операций устройства:
+        сессия берётся из пула напрямую с коротким ожиданием, поэтому долгая
+        операция (выгрузка правил, чтение conntrack) не задерживает проверку.
+        Проверки выполняются в своём пуле потоков размером health_workers и
+        не занимают потоки операций.
+        Если все сессии устройства заняты операциями, возвращается None
+        (устройство занято), а не False. Ошибки подключения пробрасываются.
+        """
+        lease_timeout = SSH_HEALTH_LEASE_TIMEOUT if lease_timeout is None else lease_timeout
+
+        def job():
+            with ssh_pool.lease(netmiko_device, timeout=lease_timeout):
+                return True
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_health_executor(), job)
+        except SSHPoolTimeout:
+            logging.info(f"[SSH-EXECUTOR] Health check for {device_key(netmiko_device)} skipped: device busy")
+            return None
+
+    def get_stats(self) -> dict:
+        """Глубина очереди, занятость потоков и время ожидания"""
+        with self._stats_lock:
+            recent = list(self.recent_wait_times)
+            return {
+                "max_workers": self.max_workers,
+                "health_workers": self.health_workers,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+                "running": self.running,
+                "saturation": round(self.running / self.max_workers, 3) if self.max_workers else 0,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(self.total_wait_time / self.started_count * 1000, 3) if self.started_count else 0,
+                "recent_avg_wait_ms": round(sum(recent) / len(recent) * 1000, 3) if recent else 0,
+                "max_wait_ms": round(self.max_wait_time * 1000, 3),
+            }
+
+    def shutdown(self):
+        """Останавливает пулы потоков (при остановке приложения)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._health_executor is not None:
+            self._health_executor.shutdown(wait=False, cancel_futures=True)
+            self._health_executor = None
+
+
+# Глобальный исполнитель операций с устройствами
+ssh_executor = SSHExecutor()
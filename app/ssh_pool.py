@@ -0,0 +1,338 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from netmiko import ConnectHandler
+from netmiko.exceptions import ReadException
+from paramiko.ssh_exception import SSHException
+
+# Максимум одновременных SSH-сессий к одному устройству
+SSH_POOL_MAX_PER_DEVICE = int(os.getenv("SSH_POOL_MAX_PER_DEVICE", 2))
+# Через сколько секунд простоя сессия закрывается
+SSH_POOL_IDLE_TIMEOUT = float(os.getenv("SSH_POOL_IDLE_TIMEOUT", 300))
+# Сколько ждать свободную сессию, если все сессии устройства заняты
+SSH_POOL_LEASE_TIMEOUT = float(os.getenv("SSH_POOL_LEASE_TIMEOUT", 30))
+# После какого простоя проверять сессию перед выдачей (is_alive)
+SSH_POOL_VALIDATE_AFTER = float(os.getenv("SSH_POOL_VALIDATE_AFTER", 30))
+
+# Состояния здоровья устройства
+HEALTH_UNKNOWN = "unknown"
+HEALTH_HEALTHY = "healthy"
+HEALTH_DEGRADED = "degraded"
+HEALTH_UNREACHABLE = "unreachable"
+
+# Сколько ошибок подряд переводят устройство в unreachable
+UNREACHABLE_AFTER_FAILURES = 3
+
+# Ошибки канала SSH: таймауты чтения netmiko, ошибки paramiko (в том числе
+# NetmikoTimeoutException и NetmikoAuthenticationException) и сокета.
+# Только после них сессия закрывается и учитывается в здоровье устройства;
+# ошибки кода вызывающего (команда, разбор вывода) сессию не портят
+TRANSPORT_ERRORS = (ReadException, SSHException, OSError, EOFError)
+
+
+class SSHPoolTimeout(TimeoutError):
+    """Не удалось получить сессию за отведённое время"""
+
+
+def device_key(netmiko_device: dict) -> str:
+    """Единый ключ устройства в пуле: host:port:username"""
+    return f"{netmiko_device['host']}:{netmiko_device.get('port', 22)}:{netmiko_device['username']}"
+
+
+class SSHSession:
+    """Одна SSH-сессия netmiko в пуле"""
+
+    __slots__ = ("key", "conn", "created_at", "last_used", "last_success", "in_use", "use_count", "discard")
+
+    def __init__(self, key: str, conn):
+        self.key = key
+        self.conn = conn
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        # Время последнего успешного использования - по нему судим о живости без проверок
+        self.last_success = self.created_at
+        self.in_use = False
+        self.use_count = 0
+        # Сессию нужно закрыть при возврате (устройство закрыто принудительно)
+        self.discard = False
+
+
+class DeviceHealth:
+    """Состояние здоровья устройства по результатам работы с сессиями"""
+
+    __slots__ = ("state", "consecutive_failures", "last_success", "last_failure", "last_error")
+
+    def __init__(self):
+        self.state = HEALTH_UNKNOWN
+        self.consecutive_failures = 0
+        self.last_success: float | None = None
+        self.last_failure: float | None = None
+        self.last_error: str | None = None
+
+    def record_success(self, now: float | None = None):
+        self.state = HEALTH_HEALTHY
+        self.consecutive_failures = 0
+        self.last_success = now if now is not None else time.time()
+
+    def record_failure(self, error: Exception, now: float | None = None):
+        self.consecutive_failures += 1
+        self.last_failure = now if now is not None else time.time()
+        self.last_error = str(error)
+        self.state = HEALTH_UNREACHABLE if self.consecutive_failures >= UNREACHABLE_AFTER_FAILURES else HEALTH_DEGRADED
+
+    def to_dict(self, now: float | None = None) -> dict:
+        now = now if now is not None else time.time()
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_success": self.last_success,
+            "last_success_age": round(now - self.last_success, 1) if self.last_success is not None else None,
+            "last_failure": self.last_failure,
+            "last_error": self.last_error,
+        }
+
+
+class DeviceSlot:
+    """Сессии одного устройства под собственной блокировкой"""
+
+    __slots__ = ("key", "cond", "sessions", "connecting", "health", "created", "reused", "evicted", "lease_timeouts")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.cond = threading.Condition()
+        self.sessions: list[SSHSession] = []
+        # Подключения, которые устанавливаются прямо сейчас (учитываются в лимите)
+        self.connecting = 0
+        self.health = DeviceHealth()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self.lease_timeouts = 0
+
+    def remove(self, session: SSHSession):
+        if session in self.sessions:
+            self.sessions.remove(session)
+
+
+class SSHSessionPool:
+    """
+    Общий пул SSH-сессий для всех API устройств.
+    Сессия выдаётся в аренду одному запросу (lease), поэтому параллельные запросы
+    никогда не делят один канал netmiko. У каждого устройства своя блокировка;
+    общая блокировка защищает только словарь устройств. Подключение, проверка
+    и закрытие сессий выполняются вне любых блокировок.
+    """
+
+    def __init__(self, max_per_device: int = SSH_POOL_MAX_PER_DEVICE, idle_timeout: float = SSH_POOL_IDLE_TIMEOUT,
+                 lease_timeout: float = SSH_POOL_LEASE_TIMEOUT, validate_after: float = SSH_POOL_VALIDATE_AFTER):
+        self.max_per_device = max_per_device
+        self.idle_timeout = idle_timeout
+        self.lease_timeout = lease_timeout
+        self.validate_after = validate_after
+        self._lock = threading.Lock()
+        self._devices: dict[str, DeviceSlot] = {}
+
+    def _connect(self, netmiko_device: dict):
+        return ConnectHandler(**netmiko_device)
+
+    @staticmethod
+    def _disconnect(session: SSHSession):
+        try:
+            session.conn.disconnect()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_alive(session: SSHSession) -> bool:
+        try:
+            return bool(session.conn.is_alive())
+        except Exception:
+            return False
+
+    def _slot(self, key: str) -> DeviceSlot:
+        slot = self._devices.get(key)
+        if slot is None:
+            with self._lock:
+                slot = self._devices.get(key)
+                if slot is None:
+                    slot = self._devices[key] = DeviceSlot(key)
+        return slot
+
+    def _slots(self) -> list[DeviceSlot]:
+        with self._lock:
+            return list(self._devices.values())
+
+    def acquire(self, netmiko_device: dict, timeout: float | None = None) -> SSHSession:
+        """Берёт свободную сессию устройства или открывает новую в пределах лимита"""
+        key = device_key(netmiko_device)
+        slot = self._slot(key)
+        timeout = self.lease_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with slot.cond:
+                while True:
+                    idle = next((s for s in slot.sessions if not s.in_use), None)
+                    if idle is not None:
+                        idle.in_use = True
+                        break
+                    if len(slot.sessions) + slot.connecting < self.max_per_device:
+                        slot.connecting += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        slot.lease_timeouts += 1
+                        raise SSHPoolTimeout(f"No free SSH session for {key} within {timeout}s")
+                    slot.cond.wait(remaining)
+
+            if idle is not None:
+                # Недавно успешно использованной сессии доверяем без проверки
+                if time.time() - idle.last_success < self.validate_after or self._is_alive(idle):
+                    with slot.cond:
+                        idle.use_count += 1
+                        slot.reused += 1
+                    return idle
+                with slot.cond:
+                    slot.remove(idle)
+                    slot.cond.notify_all()
+                self._disconnect(idle)
+                logging.info(f"[SSH-POOL] Dropped stale SSH session to {key}")
+                continue
+
+            try:
+                conn = self._connect(netmiko_device)
+            except Exception as e:
+                with slot.cond:
+                    slot.connecting -= 1
+                    slot.health.record_failure(e)
+                    slot.cond.notify_all()
+                logging.error(f"[SSH-POOL] Failed to create SSH session to {key}: {e}")
+                raise
+            session = SSHSession(key, conn)
+            session.in_use = True
+            session.use_count = 1
+            with slot.cond:
+                slot.connecting -= 1
+                slot.sessions.append(session)
+                slot.health.record_success(session.created_at)
+                slot.created += 1
+            logging.info(f"[SSH-POOL] Created new SSH session to {key}")
+            return session
+
+    def release(self, session: SSHSession, error: Exception | None = None):
+        """Возвращает сессию в пул; после ошибки сессия закрывается"""
+        slot = self._slot(session.key)
+        drop = error is not None or session.discard
+        now = time.time()
+        with slot.cond:
+            session.in_use = False
+            session.last_used = now
+            if error is not None:
+                slot.health.record_failure(error, now)
+            else:
+                session.last_success = now
+                slot.health.record_success(now)
+            if drop:
+                slot.remove(session)
+            slot.cond.notify_all()
+        if drop:
+            self._disconnect(session)
+            logging.info(f"[SSH-POOL] Closed SSH session to {session.key}" + (f" after error: {error}" if error else ""))
+
+    @contextmanager
+    def lease(self, netmiko_device: dict, timeout: float | None = None):
+        """
+        Аренда сессии на время блока with: with ssh_pool.lease(device) as ssh: ...
+        После ошибки канала (TRANSPORT_ERRORS) сессия закрывается, после
+        прочих ошибок возвращается в пул.
+        """
+        session = self.acquire(netmiko_device, timeout)
+        error = None
+        try:
+            yield session.conn
+        except TRANSPORT_ERRORS as e:
+            error = e
+            raise
+        finally:
+            self.release(session, error=error)
+
+    def _detach(self, slot: DeviceSlot, expired_only: bool = False, now: float | None = None) -> list[SSHSession]:
+        """Убирает из слота свободные сессии (все или простаивающие); занятые помечает на закрытие"""
+        with slot.cond:
+            if expired_only:
+                detached = [s for s in slot.sessions if not s.in_use and now - s.last_used >= self.idle_timeout]
+                slot.evicted += len(detached)
+            else:
+                for session in slot.sessions:
+                    session.discard = True
+                detached = [s for s in slot.sessions if not s.in_use]
+            for session in detached:
+                slot.remove(session)
+            slot.cond.notify_all()
+        return detached
+
+    def close_device(self, host: str, username: str, port: int = 22):
+        """Закрывает сессии устройства: свободные сразу, занятые - после возврата"""
+        key = device_key({"host": host, "username": username, "port": port})
+        idle = self._detach(self._slot(key))
+        for session in idle:
+            self._disconnect(session)
+        if idle:
+            logging.info(f"[SSH-POOL] Closed {len(idle)} SSH sessions to {key}")
+        return len(idle)
+
+    def evict_idle(self) -> int:
+        """Закрывает сессии, простаивающие дольше idle_timeout"""
+        now = time.time()
+        expired = [s for slot in self._slots() for s in self._detach(slot, expired_only=True, now=now)]
+        for session in expired:
+            self._disconnect(session)
+        if expired:
+            logging.info(f"[SSH-POOL] Evicted {len(expired)} idle SSH sessions")
+        return len(expired)
+
+    def close_all(self):
+        """Закрывает все сессии (при остановке приложения)"""
+        for slot in self._slots():
+            for session in self._detach(slot):
+                self._disconnect(session)
+
+    def get_health(self, host: str, username: str, port: int = 22) -> dict:
+        """Закэшированное состояние здоровья устройства (без обращения к устройству)"""
+        slot = self._slot(device_key({"host": host, "username": username, "port": port}))
+        with slot.cond:
+            return slot.health.to_dict()
+
+    def get_status(self) -> dict:
+        """Состояние пула по закэшированным данным: сессии, здоровье и счетчики"""
+        now = time.time()
+        devices = []
+        totals = {"created": 0, "reused": 0, "evicted": 0, "lease_timeouts": 0}
+        for slot in sorted(self._slots(), key=lambda s: s.key):
+            with slot.cond:
+                idle = [s for s in slot.sessions if not s.in_use]
+                devices.append({
+                    "device": slot.key,
+                    "sessions": len(slot.sessions),
+                    "in_use": len(slot.sessions) - len(idle),
+                    "connecting": slot.connecting,
+                    "max_idle_seconds": round(max((now - s.last_used for s in idle), default=0), 1),
+                    "health": slot.health.to_dict(now),
+                })
+                totals["created"] += slot.created
+                totals["reused"] += slot.reused
+                totals["evicted"] += slot.evicted
+                totals["lease_timeouts"] += slot.lease_timeouts
+        return {
+            "total_connections": sum(d["sessions"] for d in devices),
+            "max_per_device": self.max_per_device,
+            "idle_timeout": self.idle_timeout,
+            **totals,
+            "connections": devices,
+        }
+
+
+# Глобальный пул SSH-сессий приложения
+ssh_pool = SSHSessionPool()
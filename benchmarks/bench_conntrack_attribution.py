@@ -0,0 +1,108 @@
+"""
+Бенчмарк привязки записей nf_conntrack к процессам.
+
+Сравнивает старый способ (psutil.net_connections и линейный поиск на каждую
+запись) с индексом сокетов SocketIndex на синтетическом файле conntrack.
+
+Запуск: python benchmarks/bench_conntrack_attribution.py [--lines 100000] [--sockets 5000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.process_attribution import ProcessNameCache, SocketIndex  # noqa: E402
+
+Addr = namedtuple("Addr", "ip port")
+Conn = namedtuple("Conn", "laddr raddr pid")
+ORIGINAL_RE = re.compile(r"src=(\S+) dst=\S+ sport=(\d+)")
+
+
+class FakeProcess:
+    """Процесс без системных вызовов: измеряется только поиск"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def name(self) -> str:
+        return f"proc{self.pid}"
+
+
+def make_sockets(count: int) -> list[Conn]:
+    return [Conn(Addr(f"192.168.{i // 250 % 250}.{i % 250 + 1}", 20000 + i), Addr("8.8.8.8", 443), 1000 + i % 300)
+            for i in range(count)]
+
+
+def write_conntrack(path: str, lines: int, sockets: list[Conn]):
+    rnd = random.Random(42)
+    with open(path, "w") as f:
+        for _ in range(lines):
+            conn = rnd.choice(sockets)
+            src, sport = conn.laddr.ip, conn.laddr.port
+            f.write(f"ipv4     2 tcp      6 431999 ESTABLISHED src={src} dst=93.184.216.34 sport={sport} dport=443 "
+                    f"packets=10 bytes=1024 src=93.184.216.34 dst={src} sport=443 dport={sport} packets=8 bytes=4096 "
+                    f"[ASSURED] mark=0 zone=0 use=2\n")
+
+
+def read_tuples(path: str) -> list[tuple[str, str]]:
+    with open(path) as f:
+        return [match.groups() for match in map(ORIGINAL_RE.search, f) if match]
+
+
+def attribute_linear(tuples, sockets) -> int:
+    """Старый способ: список сокетов заново и линейный поиск на каждую запись"""
+    found = 0
+    for src, sport in tuples:
+        for conn in list(sockets):
+            if conn.laddr and conn.laddr.ip == src and str(conn.laddr.port) == sport:
+                if conn.pid:
+                    FakeProcess(conn.pid).name()
+                    found += 1
+                break
+    return found
+
+
+def attribute_indexed(tuples, sockets, name_cache) -> int:
+    index = SocketIndex(sockets, name_cache)
+    return sum(index.process_name(src, sport, default="") != "" for src, sport in tuples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--sockets", type=int, default=5_000)
+    parser.add_argument("--linear-sample", type=int, default=2_000,
+                        help="записей для старого способа (результат экстраполируется)")
+    args = parser.parse_args()
+
+    sockets = make_sockets(args.sockets)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "nf_conntrack")
+        write_conntrack(path, args.lines, sockets)
+        tuples = read_tuples(path)
+
+    with patch("app.process_attribution.psutil.Process", FakeProcess):
+        sample = tuples[:args.linear_sample]
+        start = time.perf_counter()
+        attribute_linear(sample, sockets)
+        linear = (time.perf_counter() - start) * len(tuples) / max(len(sample), 1)
+
+        start = time.perf_counter()
+        found = attribute_indexed(tuples, sockets, ProcessNameCache(ttl=60))
+        indexed = time.perf_counter() - start
+
+    print(f"conntrack entries: {len(tuples)}, sockets: {len(sockets)}, attributed: {found}")
+    print(f"linear scan (extrapolated from {len(sample)}): {linear:.2f}s")
+    print(f"socket index: {indexed:.3f}s ({len(tuples) / indexed:,.0f} entries/s)")
+    print(f"speedup: {linear / indexed:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
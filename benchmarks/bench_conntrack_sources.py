@@ -0,0 +1,105 @@
+"""
+Бенчмарк источников записей conntrack: разбор текста /proc/net/nf_conntrack
+и бинарного дампа ctnetlink.
+
+По умолчанию сравнивается разбор одинаковых синтетических записей в обоих
+форматах. С --live дополнительно читается реальная таблица хоста каждым
+источником (нужны права на чтение таблицы и CAP_NET_ADMIN для netlink).
+
+Запуск: python benchmarks/bench_conntrack_sources.py [--entries 100000] [--live]
+"""
+import argparse
+import io
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.conntrack import get_conntrack_source, parse_conntrack  # noqa: E402
+from app.conntrack_netlink import NETLINK_RECV_BUFFER, parse_messages  # noqa: E402
+
+
+def nla(kind: int, payload: bytes, nested: bool = False) -> bytes:
+    data = struct.pack("=HH", 4 + len(payload), kind | (0x8000 if nested else 0)) + payload
+    return data + b"\0" * (-len(data) % 4)
+
+
+def ct_tuple(src: str, dst: str, sport: int, dport: int) -> bytes:
+    ip = nla(1, socket.inet_aton(src)) + nla(2, socket.inet_aton(dst))
+    ports = nla(1, bytes([6])) + nla(2, sport.to_bytes(2, "big")) + nla(3, dport.to_bytes(2, "big"))
+    return nla(1, ip, nested=True) + nla(2, ports, nested=True)
+
+
+def counters(packets: int, nbytes: int) -> bytes:
+    return nla(1, packets.to_bytes(8, "big")) + nla(2, nbytes.to_bytes(8, "big"))
+
+
+def make_entries(count: int):
+    for i in range(count):
+        yield f"192.168.{i // 250 % 250}.{i % 250 + 1}", "93.184.216.34", 20000 + i % 40000, 443
+
+
+def text_dump(count: int) -> str:
+    return "".join(
+        f"ipv4     2 tcp      6 431999 ESTABLISHED src={src} dst={dst} sport={sport} dport={dport} "
+        f"packets=10 bytes=1024 src={dst} dst={src} sport={dport} dport={sport} packets=8 bytes=4096 "
+        f"[ASSURED] mark=0 zone=0 use=2\n"
+        for src, dst, sport, dport in make_entries(count)
+    )
+
+
+def netlink_dump(count: int) -> list[bytes]:
+    """Сообщения IPCTNL_MSG_CT_NEW, сгруппированные в пачки размером с буфер приёма"""
+    batches, batch = [], bytearray()
+    for src, dst, sport, dport in make_entries(count):
+        attrs = (nla(1, ct_tuple(src, dst, sport, dport), nested=True) + nla(2, ct_tuple(dst, src, dport, sport), nested=True)
+                 + nla(3, (0x6).to_bytes(4, "big")) + nla(7, (431999).to_bytes(4, "big"))
+                 + nla(4, nla(1, nla(1, bytes([3])), nested=True), nested=True)
+                 + nla(9, counters(10, 1024), nested=True) + nla(10, counters(8, 4096), nested=True))
+        body = struct.pack("=BBH", socket.AF_INET, 0, 0) + attrs
+        message = struct.pack("=IHHII", 16 + len(body), 0x100, 2, 1, 0) + body
+        if len(batch) + len(message) > NETLINK_RECV_BUFFER:
+            batches.append(bytes(batch))
+            batch.clear()
+        batch += message
+    batches.append(bytes(batch + struct.pack("=IHHII", 20, 3, 2, 1, 0) + b"\0" * 4))
+    return batches
+
+
+def measure(name: str, entries) -> None:
+    start = time.perf_counter()
+    count = sum(1 for _ in entries)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed else 0
+    print(f"{name:<22} {count:>9} entries  {elapsed:8.3f}s  {rate:>12,.0f} entries/s")
+
+
+def parse_batches(batches):
+    for batch in batches:
+        yield from parse_messages(batch)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--live", action="store_true", help="также прочитать реальную таблицу хоста")
+    args = parser.parse_args()
+
+    text = text_dump(args.entries)
+    batches = netlink_dump(args.entries)
+    measure("text (proc format)", parse_conntrack(io.StringIO(text)))
+    measure("binary (ctnetlink)", parse_batches(batches))
+
+    if args.live:
+        for name in ("proc", "netlink"):
+            try:
+                measure(f"live {name}", get_conntrack_source(name).entries())
+            except OSError as e:
+                print(f"live {name}: unavailable ({e})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,17 @@
 from fastapi import FastAPI
 from fastapi import Response
 import db_config
-from app.database import startup_event, router as database_router
+from app.database import startup_event, shutdown_event, router as database_router
 from app.middleware import setup_middleware
 from app.routes import setup_routes
 from app.metrics import start_metrics_collection
 from app.connections_api import router as connections_router
 from app.network_monitor import router as network_monitor_router
 from app.firewall_devices_api import router as firewall_devices_router
+from app.fleet_jobs import router as fleet_jobs_router
+from app.prometheus_metrics import mark_process_dead, router as prometheus_router
 from app.rate_limiting import setup_rate_limiting
+from app.device_poller import device_poller
 
 # Создаём приложение
 app = FastAPI()
@@ -23,6 +26,8 @@ setup_routes(app)
 app.include_router(connections_router)
 app.include_router(network_monitor_router)
 app.include_router(firewall_devices_router)
+app.include_router(fleet_jobs_router)
+app.include_router(prometheus_router)
 app.include_router(database_router)
 
 # Заглушка для favicon.ico, чтобы не было 404
@@ -50,6 +55,16 @@ async def startup():
     # Запускаем сбор метрик в фоновом режиме
     import asyncio
     asyncio.create_task(start_metrics_collection())
+    # Запускаем фоновый опрос статусов устройств
+    device_poller.start()
+
+# Останавливаем опрос устройств и закрываем пул соединений с БД
+@app.on_event("shutdown")
+async def shutdown():
+    await device_poller.stop()
+    await shutdown_event()
+    # Значения gauge этого воркера больше не учитываются в общей выдаче
+    mark_process_dead()
 
 if __name__ == "__main__":
     import uvicorn
@@ -4,6 +4,7 @@ import os
 import asyncio
 import signal
 from pathlib import Path
+from unittest.mock import patch
 
 # Добавляем корневую директорию проекта в PYTHONPATH
 project_root = Path(__file__).parent.parent
@@ -20,6 +21,7 @@ from app.database import (
     create_firewall_devices_table,
     create_firewall_rules_table,
     create_device_configs_table,
+    create_dns_blocklist_tables,
 )
 from app.database_indexes import create_database_indexes, analyze_table_statistics
 
@@ -31,6 +33,7 @@ def init_db_schema():
     loop.run_until_complete(create_firewall_devices_table())
     loop.run_until_complete(create_firewall_rules_table())
     loop.run_until_complete(create_device_configs_table())
+    loop.run_until_complete(create_dns_blocklist_tables())
     loop.run_until_complete(create_database_indexes())
     loop.run_until_complete(analyze_table_statistics())
 
@@ -79,6 +82,41 @@ def clear_login_attempts():
     yield
     login_attempts.clear()
 
+@pytest.fixture
+def dns_db():
+    """Фикстура: DNS блок-листы и состояние синхронизации хранятся в памяти вместо БД"""
+    blocklists, states = {}, {}
+
+    async def get_dns_blocklist(device_id):
+        return set(blocklists.get(device_id, set()))
+
+    async def get_dns_blocklist_state(device_id):
+        return dict(states[device_id]) if device_id in states else None
+
+    async def get_dns_blocklist_device_ids():
+        return sorted(states)
+
+    async def update_dns_blocklist(device_id, added, removed):
+        blocklists[device_id] = (blocklists.get(device_id, set()) - set(removed)) | set(added)
+
+    async def save_dns_blocklist_state(device_id, pushed_hash, domain_count, drift_detected=False):
+        states[device_id] = {"device_id": device_id, "pushed_hash": pushed_hash,
+                             "domain_count": domain_count, "drift_detected": drift_detected}
+
+    async def mark_dns_blocklist_checked(device_id, drift_detected):
+        states[device_id]["drift_detected"] = drift_detected
+
+    with patch.multiple(
+        'app.database',
+        get_dns_blocklist=get_dns_blocklist,
+        get_dns_blocklist_state=get_dns_blocklist_state,
+        get_dns_blocklist_device_ids=get_dns_blocklist_device_ids,
+        update_dns_blocklist=update_dns_blocklist,
+        save_dns_blocklist_state=save_dns_blocklist_state,
+        mark_dns_blocklist_checked=mark_dns_blocklist_checked,
+    ):
+        yield blocklists, states
+
 @pytest.fixture
 def mock_time(monkeypatch):
     """Фикстура для мокирования времени"""
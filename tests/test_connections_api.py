@@ -11,6 +11,26 @@ from app.connections_api import (
 import psutil
 import socket
 import datetime
+from app.connections_table import connections_table
+from app.process_attribution import process_info_cache, process_name_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_process_name_cache():
+    process_name_cache.clear()
+    process_info_cache.clear()
+    connections_table.clear()
+    yield
+    process_name_cache.clear()
+    process_info_cache.clear()
+    connections_table.clear()
+
+
+@pytest.fixture(autouse=True)
+def proc_conntrack_source():
+    """Записи conntrack читаются из мока файла, а не через netlink хоста"""
+    with patch('app.conntrack.CONNTRACK_SOURCE', 'proc'):
+        yield
 
 
 class TestConnections:
@@ -338,6 +358,37 @@ ipv4     2 tcp      6 300 ESTABLISHED src=192.168.1.100 dst=8.8.8.8 sport=12345
                         assert isinstance(result, list)
                         # Не проверяем длину, так как может быть пустой список
 
+    @pytest.mark.asyncio
+    async def test_get_nf_conntrack_groups_by_process(self):
+        """Записи группируются по процессу, владеющему локальным адресом"""
+        mock_nf_conntrack_content = (
+            "ipv4     2 tcp      6 300 ESTABLISHED src=192.168.1.100 dst=8.8.8.8 sport=12345 dport=53 packets=10 bytes=1024 "
+            "src=8.8.8.8 dst=192.168.1.100 sport=53 dport=12345 packets=5 bytes=512 [ASSURED] mark=0 use=1\n"
+            "ipv4     2 udp      17 30 src=192.168.1.100 dst=1.1.1.1 sport=12345 dport=53 packets=1 bytes=60 "
+            "src=1.1.1.1 dst=192.168.1.100 sport=53 dport=12345 packets=1 bytes=120 mark=0 use=1\n"
+        )
+        mock_connection = Mock()
+        mock_connection.laddr = Mock(ip="192.168.1.100", port=12345)
+        mock_connection.pid = 1234
+
+        with patch('builtins.open', mock_open(read_data=mock_nf_conntrack_content)):
+            with patch('psutil.net_connections', return_value=[mock_connection]) as mock_net_connections:
+                with patch('psutil.Process') as mock_process:
+                    mock_process.return_value.name.return_value = "test_process"
+                    result = await get_nf_conntrack()
+
+        assert len(result) == 1
+        assert set(result[0].pop("protocols")) == {"TCP", "UDP"}
+        assert result[0] == {
+            "process": "test_process",
+            "connections": 2,
+            "in_traffic": 632,
+            "out_traffic": 1084,
+            "remote_ips_count": 2,
+        }
+        mock_net_connections.assert_called_once()
+        mock_process.assert_called_once_with(1234)
+
     @pytest.mark.asyncio
     async def test_get_nf_conntrack_file_not_found(self):
         """Тест обработки отсутствия файла nf_conntrack"""
@@ -0,0 +1,159 @@
+import json
+import socket
+from unittest.mock import Mock, patch
+
+import psutil
+import pytest
+from fastapi import HTTPException
+
+from app.connections_api import get_connections
+from app.connections_table import ConnectionsTable, build_rows, connections_table, query_rows
+from app.process_attribution import ProcessInfoCache, process_info_cache
+
+
+def connection(pid, lport, rport=None, type_=socket.SOCK_STREAM, status="ESTABLISHED"):
+    return Mock(pid=pid, type=type_, status=status,
+                laddr=Mock(ip="127.0.0.1", port=lport),
+                raddr=Mock(ip="10.0.0.1", port=rport) if rport else None)
+
+
+def process(name, create_time):
+    proc = Mock()
+    proc.name.return_value = name
+    proc.create_time.return_value = create_time
+    return proc
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    process_info_cache.clear()
+    connections_table.clear()
+    yield
+    process_info_cache.clear()
+    connections_table.clear()
+
+
+class TestProcessInfoCache:
+    """Тесты кэша метаданных процессов"""
+
+    def test_name_cached_per_process(self):
+        """Имя процесса запрашивается один раз, пока процесс жив"""
+        proc = process("nginx", 1000.0)
+        cache = ProcessInfoCache()
+        with patch('psutil.Process', return_value=proc):
+            first = cache.get(10)
+            second = cache.get(10)
+
+        assert first is second
+        assert first.name == "nginx"
+        proc.name.assert_called_once()
+        assert cache.get_stats()["hits"] == 1
+
+    def test_pid_reuse_evicts_entry(self):
+        """Новый процесс с тем же PID вытесняет запись"""
+        cache = ProcessInfoCache()
+        with patch('psutil.Process', return_value=process("old", 1000.0)):
+            assert cache.get(10).name == "old"
+        with patch('psutil.Process', return_value=process("new", 2000.0)):
+            assert cache.get(10).name == "new"
+
+        assert cache.get_stats()["evictions"] == 1
+        assert cache.get_stats()["entries"] == 1
+
+    def test_dead_process(self):
+        """Завершившийся процесс - None"""
+        with patch('psutil.Process', side_effect=psutil.NoSuchProcess(10)):
+            assert ProcessInfoCache().get(10) is None
+
+    def test_size_bounded(self):
+        """Кэш не растёт больше max_size"""
+        cache = ProcessInfoCache(max_size=2)
+        with patch('psutil.Process', return_value=process("p", 1000.0)):
+            for pid in range(5):
+                cache.get(pid)
+        assert cache.get_stats()["entries"] == 2
+
+
+class TestConnectionsQuery:
+    """Тесты фильтрации, сортировки и страниц соединений"""
+
+    def rows(self):
+        procs = {1: process("nginx", 1000.0), 2: process("sshd", 500.0)}
+        with patch('psutil.Process', side_effect=lambda pid: procs[pid]):
+            return build_rows([
+                connection(1, 80, 50000),
+                connection(1, 443, 50001),
+                connection(2, 22, status="LISTEN"),
+                connection(None, 53, type_=socket.SOCK_DGRAM, status="NONE"),
+            ], ProcessInfoCache())
+
+    def test_metadata_once_per_pid(self):
+        """Метаданные процесса запрашиваются один раз на PID, а не на сокет"""
+        proc = process("nginx", 1000.0)
+        with patch('psutil.Process', return_value=proc) as mock_process:
+            rows = build_rows([connection(1, port) for port in range(100)], ProcessInfoCache())
+
+        assert len(rows) == 100
+        assert mock_process.call_count == 1
+        assert rows[0][0]["create_time"] != ""
+
+    def test_filters(self):
+        """Фильтры по протоколу, состоянию, порту и процессу"""
+        rows = self.rows()
+
+        assert query_rows(rows, protocol="udp")[1] == 1
+        assert query_rows(rows, status="listen")[0][0]["process"] == "sshd"
+        assert query_rows(rows, port=50001)[0][0]["local_port"] == 443
+        assert query_rows(rows, process="NGI")[1] == 2
+        assert query_rows(rows, protocol="tcp", process="ssh")[1] == 1
+
+    def test_sort_and_pagination(self):
+        """Сортировка и страница; total - число строк до разбиения на страницы"""
+        rows = self.rows()
+
+        page, total = query_rows(rows, sort="local_port", descending=True, offset=1, limit=2)
+        assert total == 4
+        assert [row["local_port"] for row in page] == [80, 53]
+
+        page, _ = query_rows(rows, sort="create_time")
+        assert page[0]["process"] == "Неизвестно"
+        assert page[1]["process"] == "sshd"
+
+    def test_unknown_sort_field(self):
+        """Неизвестное поле сортировки - ValueError"""
+        with pytest.raises(ValueError):
+            query_rows([], sort="pid")
+
+
+class TestConnectionsTable:
+    """Тесты снимка соединений"""
+
+    @pytest.mark.asyncio
+    async def test_snapshot_shared_within_ttl(self):
+        """Запросы в пределах ttl используют один обход сокетов"""
+        table = ConnectionsTable(ttl=60, info_cache=ProcessInfoCache())
+        with patch('psutil.net_connections', return_value=[connection(None, 80)]) as mock_connections:
+            first = await table.snapshot()
+            second = await table.snapshot()
+
+        assert first is second
+        mock_connections.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_endpoint_page_and_total(self):
+        """API возвращает страницу и общее число в X-Total-Count"""
+        connections = [connection(None, port) for port in range(10)]
+        with patch('psutil.net_connections', return_value=connections):
+            result = await get_connections(sort="local_port", order="desc", limit=3)
+
+        page = json.loads(result.body)
+        assert [row["local_port"] for row in page] == [9, 8, 7]
+        assert result.headers["X-Total-Count"] == "10"
+
+    @pytest.mark.asyncio
+    async def test_endpoint_invalid_sort(self):
+        """Неизвестное поле сортировки - ошибка 400"""
+        with patch('psutil.net_connections', return_value=[]):
+            with pytest.raises(HTTPException) as exc:
+                await get_connections(sort="pid")
+        assert exc.value.status_code == 400
@@ -0,0 +1,203 @@
+import errno
+import itertools
+import socket
+import struct
+from collections import namedtuple
+from unittest.mock import MagicMock, Mock, mock_open, patch
+
+import pytest
+
+from app.conntrack import (
+    AutoConntrackSource,
+    ProcConntrackSource,
+    aggregate_by_process,
+    get_conntrack_source,
+    parse_conntrack,
+    parse_line,
+    read_conntrack,
+)
+from app.conntrack_netlink import parse_messages
+from app.process_attribution import SocketIndex
+
+Addr = namedtuple("Addr", "ip port")
+Conn = namedtuple("Conn", "laddr raddr pid")
+
+TCP_LINE = ("ipv4     2 tcp      6 431999 ESTABLISHED src=192.168.1.100 dst=8.8.8.8 sport=12345 dport=443 "
+            "packets=10 bytes=1024 src=8.8.8.8 dst=192.168.1.100 sport=443 dport=12345 packets=8 bytes=4096 "
+            "[ASSURED] mark=0 zone=0 use=2\n")
+UDP_LINE = ("ipv4     2 udp      17 29 src=10.0.0.5 dst=192.168.1.100 sport=5353 dport=53 "
+            "src=192.168.1.100 dst=10.0.0.5 sport=53 dport=5353 [UNREPLIED] mark=0 use=2\n")
+
+
+class TestParseLine:
+    """Тесты разбора строк nf_conntrack"""
+
+    def test_tcp_entry(self):
+        """Оба направления, состояние, счётчики и флаги"""
+        entry = parse_line(TCP_LINE)
+
+        assert (entry.family, entry.protocol, entry.timeout, entry.state) == ("ipv4", "tcp", 431999, "ESTABLISHED")
+        assert entry.original == ("192.168.1.100", "8.8.8.8", 12345, 443, 10, 1024)
+        assert entry.reply == ("8.8.8.8", "192.168.1.100", 443, 12345, 8, 4096)
+        assert entry.flags == ("ASSURED",)
+
+    def test_udp_without_state_and_counters(self):
+        """UDP без состояния, без учёта трафика счётчики нулевые"""
+        entry = parse_line(UDP_LINE)
+
+        assert entry.state is None
+        assert entry.original.bytes == 0
+        assert entry.reply.src == "192.168.1.100"
+        assert entry.flags == ("UNREPLIED",)
+
+    def test_icmp_and_legacy_format(self):
+        """ICMP без портов и формат ip_conntrack без полей L3"""
+        entry = parse_line("icmp     1 29 src=10.0.0.1 dst=10.0.0.2 type=8 code=0 id=1 src=10.0.0.2 dst=10.0.0.1 type=0 code=0 id=1")
+
+        assert (entry.family, entry.protocol) == ("ipv4", "icmp")
+        assert entry.original.sport is None
+
+    def test_malformed(self):
+        """Некорректные строки пропускаются"""
+        assert parse_line("") is None
+        assert parse_line("invalid_line_without_enough_parts") is None
+        assert parse_line("ipv4 2 tcp 6 x ESTABLISHED src=1.1.1.1 dst=2.2.2.2") is None
+        assert len(list(parse_conntrack(["garbage\n", TCP_LINE, "\n"]))) == 1
+
+    def test_streaming(self):
+        """Строки читаются по мере обработки, а не целиком"""
+        lines = itertools.repeat(TCP_LINE)
+        entries = parse_conntrack(lines)
+        assert [next(entries).protocol for _ in range(3)] == ["tcp"] * 3
+
+    def test_read_conntrack(self):
+        """Чтение из файла"""
+        with patch("builtins.open", mock_open(read_data=TCP_LINE + UDP_LINE)):
+            assert [entry.protocol for entry in read_conntrack()] == ["tcp", "udp"]
+
+
+class TestAggregateByProcess:
+    """Тесты группировки записей по процессам"""
+
+    def test_outgoing_and_incoming(self):
+        """Локальная сторона - источник исходящего и получатель входящего соединения"""
+        cache = Mock()
+        cache.get.side_effect = lambda pid: {1: "curl", 2: "dnsmasq"}[pid]
+        sockets = SocketIndex([
+            Conn(Addr("192.168.1.100", 12345), Addr("8.8.8.8", 443), 1),
+            Conn(Addr("0.0.0.0", 53), None, 2),
+        ], cache)
+
+        stats = aggregate_by_process(parse_conntrack([TCP_LINE, UDP_LINE]), sockets)
+
+        assert stats["curl"]["bytes_sent"] == 1024
+        assert stats["curl"]["bytes_recv"] == 4096
+        assert stats["curl"]["remote_ips"] == {"8.8.8.8"}
+        assert stats["dnsmasq"]["connections"] == 1
+        assert stats["dnsmasq"]["protocols"] == {"UDP"}
+        assert stats["dnsmasq"]["remote_ips"] == {"10.0.0.5"}
+
+    def test_unknown_process(self):
+        """Соединения без локального сокета относятся к unknown"""
+        stats = aggregate_by_process(parse_conntrack([TCP_LINE]), SocketIndex([]))
+        assert stats["unknown"]["connections"] == 1
+
+
+def nla(kind: int, payload: bytes, nested: bool = False) -> bytes:
+    data = struct.pack("=HH", 4 + len(payload), kind | (0x8000 if nested else 0)) + payload
+    return data + b"\0" * (-len(data) % 4)
+
+
+def ct_tuple(src: str, dst: str, sport: int, dport: int, proto: int = 6) -> bytes:
+    if ":" in src:
+        ip = nla(3, socket.inet_pton(socket.AF_INET6, src)) + nla(4, socket.inet_pton(socket.AF_INET6, dst))
+    else:
+        ip = nla(1, socket.inet_pton(socket.AF_INET, src)) + nla(2, socket.inet_pton(socket.AF_INET, dst))
+    ports = nla(1, bytes([proto])) + nla(2, sport.to_bytes(2, "big")) + nla(3, dport.to_bytes(2, "big"))
+    return nla(1, ip, nested=True) + nla(2, ports, nested=True)
+
+
+def ct_message(orig: tuple, reply: tuple, status: int = 0x6, state: int = 3, counters=None,
+               family: int = socket.AF_INET) -> bytes:
+    attrs = nla(1, ct_tuple(*orig), nested=True) + nla(2, ct_tuple(*reply), nested=True)
+    attrs += nla(3, status.to_bytes(4, "big")) + nla(7, (300).to_bytes(4, "big"))
+    attrs += nla(4, nla(1, nla(1, bytes([state])), nested=True), nested=True)
+    if counters:
+        for kind, (packets, nbytes) in zip((9, 10), counters):
+            attrs += nla(kind, nla(1, packets.to_bytes(8, "big")) + nla(2, nbytes.to_bytes(8, "big")), nested=True)
+    body = struct.pack("=BBH", family, 0, 0) + attrs
+    return struct.pack("=IHHII", 16 + len(body), 0x100, 2, 1, 0) + body
+
+
+NLMSG_DONE = struct.pack("=IHHII", 20, 3, 2, 1, 0) + b"\0" * 4
+
+
+class TestNetlinkSource:
+    """Тесты разбора дампа ctnetlink"""
+
+    def test_parse_messages(self):
+        """Записи из бинарного дампа совпадают с записями текстового формата"""
+        data = ct_message(("192.168.1.100", "8.8.8.8", 12345, 443), ("8.8.8.8", "192.168.1.100", 443, 12345),
+                          counters=((10, 1024), (8, 4096)))
+        data += ct_message(("10.0.0.5", "192.168.1.100", 5353, 53, 17), ("192.168.1.100", "10.0.0.5", 53, 5353, 17),
+                           status=0)
+        entries, done = parse_messages(data + NLMSG_DONE)
+
+        assert done is True
+        tcp, udp = entries
+        expected = parse_line(TCP_LINE)
+        assert (tcp.family, tcp.protocol, tcp.state) == (expected.family, expected.protocol, expected.state)
+        assert (tcp.original, tcp.reply, tcp.flags) == (expected.original, expected.reply, expected.flags)
+        assert udp.protocol == "udp"
+        assert udp.flags == ("UNREPLIED",)
+        assert udp.original.bytes == 0
+
+    def test_ipv6_entry(self):
+        """Записи IPv6 разбираются общим обходом атрибутов"""
+        data = ct_message(("2001:db8::1", "2001:db8::2", 40000, 443), ("2001:db8::2", "2001:db8::1", 443, 40000),
+                          counters=((3, 300), (2, 200)), family=socket.AF_INET6)
+        (entry,), done = parse_messages(data)
+
+        assert done is False
+        assert (entry.family, entry.protocol, entry.state) == ("ipv6", "tcp", "ESTABLISHED")
+        assert entry.original == ("2001:db8::1", "2001:db8::2", 40000, 443, 3, 300)
+        assert entry.reply.bytes == 200
+
+    def test_error_message(self):
+        """Ошибка ядра (например, нет CAP_NET_ADMIN) - PermissionError"""
+        error = struct.pack("=IHHII", 36, 2, 0, 1, 0) + struct.pack("=i", -errno.EPERM) + b"\0" * 16
+        with pytest.raises(PermissionError):
+            parse_messages(error)
+
+
+class TestConntrackSource:
+    """Тесты выбора источника записей conntrack"""
+
+    def test_select_by_config(self):
+        """Источник выбирается по CONNTRACK_SOURCE"""
+        with patch("app.conntrack.CONNTRACK_SOURCE", "proc"):
+            assert isinstance(get_conntrack_source(), ProcConntrackSource)
+        assert get_conntrack_source("netlink").name == "netlink"
+        with pytest.raises(ValueError):
+            get_conntrack_source("pcap")
+
+    def test_auto_falls_back_to_proc(self):
+        """Без доступа к netlink записи читаются из файла, повторная попытка не делается"""
+        source = AutoConntrackSource()
+        with patch("app.conntrack_netlink.socket.socket", side_effect=PermissionError) as mock_socket:
+            with patch("builtins.open", mock_open(read_data=TCP_LINE)):
+                assert [entry.protocol for entry in source.entries()] == ["tcp"]
+                assert [entry.protocol for entry in source.entries()] == ["tcp"]
+        mock_socket.assert_called_once()
+        assert isinstance(source.netlink_error, PermissionError)
+
+    def test_auto_uses_netlink(self):
+        """Доступный netlink используется вместо файла"""
+        sock = MagicMock()
+        sock.__enter__.return_value = sock
+        data = ct_message(("192.168.1.100", "8.8.8.8", 12345, 443), ("8.8.8.8", "192.168.1.100", 443, 12345)) + NLMSG_DONE
+        sock.recv.return_value = data
+        with patch("app.conntrack_netlink.socket.socket", return_value=sock):
+            with patch("builtins.open", side_effect=AssertionError("file must not be read")):
+                entries = list(AutoConntrackSource().entries())
+        assert [entry.original.sport for entry in entries] == [12345]
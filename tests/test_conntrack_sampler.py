@@ -0,0 +1,247 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.conntrack import parse_line
+from app.conntrack_sampler import ConntrackSampler, conntrack_samplers, source_owner, stream_samples
+from app.connections_api import get_bandwidth_rates
+from app.firewall_devices_api import api_get_conntrack_rates, api_stream_conntrack_rates
+
+DEVICE = {'id': 1, 'name': 'TestDevice', 'type': 'openwrt', 'ip': '192.168.1.1', 'username': 'admin', 'password': 'password'}
+
+
+def line(src: str, sport: int, sent: int, recv: int, dst: str = "8.8.8.8", dport: int = 443) -> str:
+    return (f"ipv4     2 tcp      6 300 ESTABLISHED src={src} dst={dst} sport={sport} dport={dport} "
+            f"packets={sent // 100} bytes={sent} src={dst} dst={src} sport={dport} dport={sport} "
+            f"packets={recv // 100} bytes={recv} [ASSURED] mark=0 use=1")
+
+
+def entries(*lines):
+    return [parse_line(text) for text in lines]
+
+
+def lease_of(ssh):
+    lease = MagicMock()
+    lease.__enter__.return_value = ssh
+    lease.__exit__.return_value = False
+    return lease
+
+
+@pytest.fixture(autouse=True)
+def clear_samplers():
+    conntrack_samplers.samplers.clear()
+    yield
+    conntrack_samplers.samplers.clear()
+
+
+class TestConntrackSampler:
+    """Тесты расчёта дельт между снимками conntrack"""
+
+    def test_first_sample_is_warmup(self):
+        """Первый снимок только запоминает счётчики"""
+        sampler = ConntrackSampler(AsyncMock())
+        sample = sampler.compute(entries(line("10.0.0.2", 1000, 5000, 9000)), source_owner, now=100.0)
+
+        assert sample["warmup"] is True
+        assert sample["flows_total"] == 1
+        assert sample["active_flows"] == 0
+
+    def test_deltas_and_rates(self):
+        """Дельты по соединениям и владельцам, скорость - на интервал между снимками"""
+        sampler = ConntrackSampler(AsyncMock())
+        sampler.compute(entries(line("10.0.0.2", 1000, 5000, 9000), line("10.0.0.3", 2000, 100, 100)),
+                        source_owner, now=100.0)
+        sample = sampler.compute(entries(
+            line("10.0.0.2", 1000, 7000, 19000),   # +2000 / +10000
+            line("10.0.0.3", 2000, 100, 100),      # без изменений
+            line("10.0.0.2", 1001, 400, 600),      # новое соединение
+        ), source_owner, now=102.0)
+
+        result = ConntrackSampler.top(sample, 10)
+        assert result["warmup"] is False
+        assert result["interval"] == 2.0
+        assert result["active_flows"] == 2
+        assert result["totals"]["bytes_sent"] == 2400
+        assert result["totals"]["rate_recv"] == 5300.0
+        assert result["top_flows"][0]["sport"] == 1000
+        assert result["top_flows"][0]["rate_recv"] == 5000.0
+        assert result["top_talkers"] == [{
+            "name": "10.0.0.2", "flows": 2, "bytes_sent": 2400, "bytes_recv": 10600,
+            "packets_sent": 24, "packets_recv": 106, "rate_sent": 1200.0, "rate_recv": 5300.0,
+        }]
+        assert "_flows" not in result
+
+    def test_expired_flows_forgotten_and_counter_reset(self):
+        """Закрытые соединения не хранятся, пересозданная запись считается новой"""
+        sampler = ConntrackSampler(AsyncMock())
+        sampler.compute(entries(line("10.0.0.2", 1000, 5000, 9000), line("10.0.0.3", 2000, 100, 100)),
+                        source_owner, now=100.0)
+        sample = sampler.compute(entries(line("10.0.0.2", 1000, 300, 200)), source_owner, now=101.0)
+
+        assert list(sampler.previous) == [("tcp", "10.0.0.2", "8.8.8.8", 1000, 443)]
+        assert sample["totals"]["bytes_sent"] == 300
+
+    def test_incoming_flow_direction(self):
+        """Для входящего соединения исходное направление - приём"""
+        sampler = ConntrackSampler(AsyncMock())
+        owner = Mock(return_value=("nginx", False))
+        sampler.compute([], owner, now=100.0)
+        sample = sampler.compute(entries(line("1.2.3.4", 5000, 800, 6000, dst="10.0.0.1", dport=80)), owner, now=101.0)
+
+        assert sample["totals"]["bytes_recv"] == 800
+        assert sample["totals"]["bytes_sent"] == 6000
+
+    @pytest.mark.asyncio
+    async def test_shared_sample_within_min_interval(self):
+        """Частые запросы получают последний снимок без повторного чтения"""
+        read = AsyncMock(return_value=(entries(line("10.0.0.2", 1000, 5000, 9000)), source_owner))
+        sampler = ConntrackSampler(read, min_interval=60)
+
+        first = await sampler.sample()
+        assert await sampler.sample() is first
+        read.assert_called_once()
+
+
+class TestConntrackStream:
+    """Тесты рассылки снимков подписчикам потока"""
+
+    @pytest.mark.asyncio
+    async def test_subscribers_share_one_poll(self):
+        """Несколько подписчиков получают один и тот же снимок одного опроса"""
+        read = AsyncMock(return_value=(entries(line("10.0.0.2", 1000, 5000, 9000)), source_owner))
+        sampler = ConntrackSampler(read, min_interval=0)
+        sampler.stream.interval = 60
+
+        queues = [sampler.stream.subscribe() for _ in range(3)]
+        messages = [await asyncio.wait_for(queue.get(), 1) for queue in queues]
+
+        assert read.call_count == 1
+        assert all(message["sample"] is messages[0]["sample"] for message in messages)
+        for queue in queues:
+            sampler.stream.unsubscribe(queue)
+
+    @pytest.mark.asyncio
+    async def test_slow_subscriber_gets_latest(self):
+        """Непрочитанный снимок заменяется новым, очередь не растёт"""
+        sampler = ConntrackSampler(AsyncMock())
+        queue = asyncio.Queue(maxsize=1)
+        sampler.stream.subscribers.add(queue)
+
+        sampler.stream.publish({"sample": 1})
+        sampler.stream.publish({"sample": 2})
+
+        assert queue.qsize() == 1
+        assert queue.get_nowait() == {"sample": 2}
+
+    @pytest.mark.asyncio
+    async def test_poll_stops_after_last_unsubscribe(self):
+        """Опрос идёт, только пока есть подписчики"""
+        read = AsyncMock(return_value=(entries(line("10.0.0.2", 1000, 5000, 9000)), source_owner))
+        sampler = ConntrackSampler(read, min_interval=0)
+        sampler.stream.interval = 0.01
+
+        first, second = sampler.stream.subscribe(), sampler.stream.subscribe()
+        await asyncio.wait_for(first.get(), 1)
+        sampler.stream.unsubscribe(first)
+        assert sampler.stream.task is not None
+
+        task = sampler.stream.task
+        sampler.stream.unsubscribe(second)
+        await asyncio.sleep(0.05)
+        assert task.cancelled()
+        calls = read.call_count
+        await asyncio.sleep(0.05)
+        assert read.call_count == calls
+
+    @pytest.mark.asyncio
+    async def test_stream_samples_events(self):
+        """Снимки и ошибки передаются событиями SSE, отключение снимает подписку"""
+        read = AsyncMock(side_effect=[(entries(line("10.0.0.2", 1000, 5000, 9000)), source_owner),
+                                      ConnectionError("timeout")])
+        sampler = ConntrackSampler(read, min_interval=0)
+        sampler.stream.interval = 0.01
+
+        events = stream_samples(sampler, top=5)
+        sample_event = await events.__anext__()
+        error_event = await events.__anext__()
+        await events.aclose()
+
+        assert sample_event.startswith("event: sample\n")
+        assert json.loads(sample_event.split("data: ", 1)[1])["warmup"] is True
+        assert error_event.startswith("event: error\n")
+        assert "timeout" in error_event
+        assert not sampler.stream.subscribers
+
+    @pytest.mark.asyncio
+    async def test_stream_keepalive(self):
+        """Без новых снимков поток отправляет комментарий keepalive"""
+        async def hang():
+            await asyncio.sleep(60)
+
+        sampler = ConntrackSampler(hang)
+        events = stream_samples(sampler, keepalive=0.01)
+        assert await events.__anext__() == ": keepalive\n\n"
+        await events.aclose()
+
+
+class TestRatesEndpoints:
+    """Тесты API скоростей трафика"""
+
+    @pytest.mark.asyncio
+    async def test_device_rates(self):
+        """Скорости устройства считаются по двум снимкам таблицы"""
+        mock_ssh = Mock()
+        mock_ssh.send_command.side_effect = [line("10.0.0.2", 1000, 5000, 9000), line("10.0.0.2", 1000, 6000, 9500)]
+
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=DEVICE):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                conntrack_samplers.device(DEVICE).min_interval = 0
+                first = await api_get_conntrack_rates(device_id=1, top=5)
+                second = await api_get_conntrack_rates(device_id=1, top=5)
+
+        assert first["warmup"] is True
+        assert second["device_name"] == "TestDevice"
+        assert second["top_talkers"][0]["name"] == "10.0.0.2"
+        assert second["totals"]["bytes_sent"] == 1000
+        assert second["totals"]["bytes_recv"] == 500
+        assert mock_ssh.send_command.call_args[0][0].startswith("cat /proc/net/nf_conntrack")
+
+    @pytest.mark.asyncio
+    async def test_device_rates_unsupported_type(self):
+        """Устройство без conntrack - ошибка 400"""
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value={**DEVICE, 'type': 'mikrotik'}):
+            with pytest.raises(HTTPException) as exc:
+                await api_get_conntrack_rates(device_id=1, top=5)
+        assert exc.value.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_local_rates(self):
+        """Скорости трафика этого хоста по процессам"""
+        sampler = ConntrackSampler(AsyncMock(return_value=(entries(line("10.0.0.2", 1000, 5000, 9000)), source_owner)))
+        with patch.object(conntrack_samplers, 'local', return_value=sampler):
+            result = await get_bandwidth_rates(top=3)
+
+        assert result["warmup"] is True
+        assert result["top_flows"] == []
+
+    @pytest.mark.asyncio
+    async def test_device_stream_one_sampler_per_device(self):
+        """Все потоки одного устройства используют один сэмплер"""
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=DEVICE):
+            first = await api_stream_conntrack_rates(device_id=1, top=5)
+            second = await api_stream_conntrack_rates(device_id=1, top=5)
+
+        assert first.media_type == "text/event-stream"
+        assert second.media_type == "text/event-stream"
+        assert len(conntrack_samplers.samplers) == 1
+
+    @pytest.mark.asyncio
+    async def test_device_stream_not_found(self):
+        """Поток для несуществующего устройства - ошибка 404"""
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=None):
+            with pytest.raises(HTTPException) as exc:
+                await api_stream_conntrack_rates(device_id=1, top=5)
+        assert exc.value.status_code == 404
@@ -108,7 +108,7 @@ class TestDatabaseTables:
     @pytest.mark.asyncio
     async def test_create_users_table(self):
         """Тест создания таблицы пользователей"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -122,7 +122,7 @@ class TestDatabaseTables:
     @pytest.mark.asyncio
     async def test_create_user_sessions_table(self):
         """Тест создания таблицы сессий пользователей"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -137,7 +137,7 @@ class TestDatabaseTables:
     @pytest.mark.asyncio
     async def test_create_firewall_devices_table(self):
         """Тест создания таблицы устройств брандмауэра"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -160,7 +160,7 @@ class TestFirewallDevices:
             {'id': 2, 'name': 'Router2', 'ip': '192.168.1.2', 'type': 'mikrotik'}
         ]
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetch.return_value = mock_devices
             mock_connect.return_value = mock_conn
@@ -177,6 +177,68 @@ class TestFirewallDevices:
             assert 'last_poll' in result[0]
             mock_conn.fetch.assert_called_once()
 
+    @pytest.mark.asyncio
+    async def test_get_all_firewall_devices_concurrent_batch_update(self):
+        """Тест параллельного опроса устройств с одним пакетным UPDATE"""
+        mock_devices = [
+            {'id': i, 'name': f'Router{i}', 'ip': f'10.0.0.{i}', 'type': 'openwrt'}
+            for i in range(1, 7)
+        ]
+        in_flight = 0
+        max_in_flight = 0
+
+        async def fake_check(device):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return device['id'] % 2 == 0
+
+        with patch('app.db_pool.asyncpg.connect') as mock_connect, \
+             patch('app.database.probe_device_reachability', new_callable=AsyncMock, return_value={'reachable': True, 'tier': 'banner', 'banner': 'SSH-2.0-OpenSSH_9.6', 'latency_ms': 1.0, 'error': None}), \
+             patch.dict('app.device_probe._auth_checks', clear=True), \
+             patch('app.database.check_device_online_netmiko', side_effect=fake_check), \
+             patch('app.database.DEVICE_AUTH_CONCURRENCY', 3):
+            mock_conn = AsyncMock()
+            mock_conn.fetch.return_value = mock_devices
+            mock_connect.return_value = mock_conn
+
+            result = await get_all_firewall_devices()
+
+            # Не больше 3 одновременных SSH-авторизаций, но больше одной
+            assert 1 < max_in_flight <= 3
+            assert [d['status'] for d in result] == ['Оффлайн', 'Онлайн'] * 3
+            # Все статусы записаны одним запросом
+            mock_conn.execute.assert_called_once()
+            sql, ids, statuses, last_polls = mock_conn.execute.call_args.args
+            assert 'UNNEST' in sql
+            assert ids == [1, 2, 3, 4, 5, 6]
+            assert statuses == ['Оффлайн', 'Онлайн'] * 3
+
+    @pytest.mark.asyncio
+    async def test_get_all_firewall_devices_timeout(self):
+        """Тест таймаута опроса одного устройства"""
+        mock_devices = [{'id': 1, 'name': 'Slow', 'ip': '10.0.0.1', 'type': 'openwrt'}]
+
+        async def slow_check(device):
+            await asyncio.sleep(1)
+            return True
+
+        with patch('app.db_pool.asyncpg.connect') as mock_connect, \
+             patch('app.database.probe_device_reachability', new_callable=AsyncMock, return_value={'reachable': True, 'tier': 'banner', 'banner': 'SSH-2.0-OpenSSH_9.6', 'latency_ms': 1.0, 'error': None}), \
+             patch.dict('app.device_probe._auth_checks', clear=True), \
+             patch('app.database.check_device_online_netmiko', side_effect=slow_check), \
+             patch('app.database.DEVICE_POLL_TIMEOUT', 0.05):
+            mock_conn = AsyncMock()
+            mock_conn.fetch.return_value = mock_devices
+            mock_connect.return_value = mock_conn
+
+            result = await get_all_firewall_devices()
+
+            assert result[0]['status'] == 'Оффлайн'
+            assert result[0]['last_poll'] != '-'
+
     @pytest.mark.asyncio
     async def test_add_firewall_device(self):
         """Тест добавления устройства брандмауэра"""
@@ -191,7 +253,7 @@ class TestFirewallDevices:
         
         device = MockDevice()
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -203,14 +265,32 @@ class TestFirewallDevices:
     @pytest.mark.asyncio
     async def test_delete_firewall_device(self):
         """Тест удаления устройства брандмауэра"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
             await delete_firewall_device(1)
             
-            # Проверяем, что команда удаления выполнена
-            mock_conn.execute.assert_called_once()
+            # Проверяем, что удалено устройство и его DNS блок-лист
+            statements = [call[0][0] for call in mock_conn.execute.call_args_list]
+            assert statements[0] == "DELETE FROM firewall_devices WHERE id = $1"
+            assert any("dns_blocklist " in statement for statement in statements)
+            assert any("dns_blocklist_state" in statement for statement in statements)
+
+    @pytest.mark.asyncio
+    async def test_delete_firewall_device_forgets_locks(self):
+        """После удаления устройства его очереди операций не хранятся"""
+        with patch('app.db_pool.asyncpg.connect') as mock_connect, \
+             patch('app.database.ssh_executor') as mock_executor, \
+             patch('app.database.forget_device_lock') as mock_forget_lock:
+            mock_conn = AsyncMock()
+            mock_conn.fetchrow.return_value = {'ip': '192.168.1.1', 'username': 'admin'}
+            mock_connect.return_value = mock_conn
+            
+            await delete_firewall_device(1)
+            
+            mock_executor.forget_device.assert_called_once_with({'host': '192.168.1.1', 'username': 'admin'})
+            mock_forget_lock.assert_called_once_with(1)
 
     @pytest.mark.asyncio
     async def test_get_firewall_device_by_id(self):
@@ -222,7 +302,7 @@ class TestFirewallDevices:
             'type': 'cisco'
         }
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetchrow.return_value = mock_device
             mock_connect.return_value = mock_conn
@@ -240,7 +320,7 @@ class TestUserSessions:
     @pytest.mark.asyncio
     async def test_create_user_session(self):
         """Тест создания сессии пользователя"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -257,7 +337,7 @@ class TestUserSessions:
     @pytest.mark.asyncio
     async def test_update_user_activity(self):
         """Тест обновления активности пользователя"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -269,7 +349,7 @@ class TestUserSessions:
     @pytest.mark.asyncio
     async def test_logout_user_session(self):
         """Тест выхода из сессии"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -286,7 +366,7 @@ class TestUserSessions:
             {'id': 2, 'username': 'user2', 'last_activity': datetime.now()}
         ]
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetch.return_value = mock_users
             mock_connect.return_value = mock_conn
@@ -307,7 +387,7 @@ class TestUserSessions:
             {'id': 2, 'session_token': 'token2', 'login_time': datetime.now()}
         ]
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetch.return_value = mock_sessions
             mock_connect.return_value = mock_conn
@@ -323,7 +403,7 @@ class TestUserSessions:
     @pytest.mark.asyncio
     async def test_cleanup_old_sessions(self):
         """Тест очистки старых сессий"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -335,7 +415,7 @@ class TestUserSessions:
     @pytest.mark.asyncio
     async def test_mark_inactive_users_as_offline(self):
         """Тест пометки неактивных пользователей как офлайн"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -347,7 +427,7 @@ class TestUserSessions:
     @pytest.mark.asyncio
     async def test_get_user_id_by_username(self):
         """Тест получения ID пользователя по имени"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetchval.return_value = 1
             mock_connect.return_value = mock_conn
@@ -361,7 +441,7 @@ class TestUserSessions:
     @pytest.mark.asyncio
     async def test_cleanup_user_sessions(self):
         """Тест очистки сессий пользователя"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -377,7 +457,7 @@ class TestFirewallRules:
     @pytest.mark.asyncio
     async def test_create_firewall_rules_table(self):
         """Тест создания таблицы правил брандмауэра"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -394,7 +474,7 @@ class TestFirewallRules:
             {'id': 2, 'name': 'Rule2', 'protocol': 'udp', 'port': '53'}
         ]
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetch.return_value = mock_rules
             mock_connect.return_value = mock_conn
@@ -418,7 +498,7 @@ class TestFirewallRules:
             'comment': 'Test rule'
         }
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetchrow.return_value = {'id': 1, **rule}
             mock_connect.return_value = mock_conn
@@ -443,7 +523,7 @@ class TestFirewallRules:
             'comment': 'Updated rule'
         }
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetchrow.return_value = {'id': 1, **rule}
             mock_connect.return_value = mock_conn
@@ -458,7 +538,7 @@ class TestFirewallRules:
     @pytest.mark.asyncio
     async def test_delete_firewall_rule(self):
         """Тест удаления правила брандмауэра"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -470,7 +550,7 @@ class TestFirewallRules:
     @pytest.mark.asyncio
     async def test_toggle_firewall_rule(self):
         """Тест переключения состояния правила"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetchrow.return_value = {
                 'id': 1,
@@ -493,7 +573,7 @@ class TestAuditLog:
     @pytest.mark.asyncio
     async def test_add_audit_log(self):
         """Тест добавления записи в журнал аудита"""
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_connect.return_value = mock_conn
             
@@ -515,7 +595,7 @@ class TestAuditLog:
             {'id': 2, 'username': 'user2', 'action': 'logout', 'timestamp': datetime.now()}
         ]
         
-        with patch('app.database.asyncpg.connect') as mock_connect:
+        with patch('app.db_pool.asyncpg.connect') as mock_connect:
             mock_conn = AsyncMock()
             mock_conn.fetch.return_value = mock_logs
             mock_connect.return_value = mock_conn
@@ -606,7 +686,7 @@ class TestDeviceOnlineCheck:
         }
         
         with patch('app.database.check_device_online') as mock_check:
-            with patch('app.database.asyncpg.connect') as mock_connect:
+            with patch('app.db_pool.asyncpg.connect') as mock_connect:
                 mock_check.return_value = True
                 mock_conn = AsyncMock()
                 mock_connect.return_value = mock_conn
@@ -0,0 +1,128 @@
+import pytest
+from unittest.mock import Mock, patch, AsyncMock
+
+import app.db_pool as db_pool_module
+from app.db_pool import (
+    PoolStats,
+    acquire_connection,
+    close_db_pool,
+    get_pool_stats,
+    init_db_pool,
+)
+
+
+@pytest.fixture
+def mock_pool():
+    """Фикстура для подмены глобального пула соединений"""
+    pool = Mock()
+    pool.acquire = AsyncMock(return_value=Mock())
+    pool.release = AsyncMock()
+    pool.close = AsyncMock()
+    pool.get_size.return_value = 4
+    pool.get_idle_size.return_value = 1
+    pool.get_min_size.return_value = 2
+    pool.get_max_size.return_value = 10
+    with patch.object(db_pool_module, 'db_pool', pool):
+        yield pool
+
+
+class TestAcquireConnection:
+    """Тесты для контекстного менеджера acquire_connection"""
+
+    @pytest.mark.asyncio
+    async def test_acquire_from_pool(self, mock_pool):
+        """Соединение берётся из пула и возвращается в него"""
+        async with acquire_connection() as conn:
+            assert conn is mock_pool.acquire.return_value
+
+        mock_pool.acquire.assert_called_once()
+        mock_pool.release.assert_called_once_with(conn)
+
+    @pytest.mark.asyncio
+    async def test_release_on_error(self, mock_pool):
+        """Соединение возвращается в пул даже при ошибке запроса"""
+        with pytest.raises(RuntimeError):
+            async with acquire_connection():
+                raise RuntimeError("query failed")
+
+        mock_pool.release.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_acquire_timeout_counted(self, mock_pool):
+        """Таймаут ожидания соединения учитывается в статистике"""
+        mock_pool.acquire.side_effect = TimeoutError()
+        before = db_pool_module.pool_stats.acquire_timeouts
+
+        with pytest.raises(TimeoutError):
+            async with acquire_connection():
+                pass
+
+        assert db_pool_module.pool_stats.acquire_timeouts == before + 1
+
+    @pytest.mark.asyncio
+    async def test_fallback_without_pool(self):
+        """Без пула открывается одиночное соединение, которое затем закрывается"""
+        with patch.object(db_pool_module, 'db_pool', None), \
+             patch('app.db_pool.asyncpg.connect') as mock_connect:
+            mock_conn = AsyncMock()
+            mock_connect.return_value = mock_conn
+
+            async with acquire_connection() as conn:
+                assert conn is mock_conn
+
+            mock_connect.assert_called_once()
+            mock_conn.close.assert_called_once()
+
+
+class TestPoolLifecycle:
+    """Тесты создания и закрытия пула"""
+
+    @pytest.mark.asyncio
+    async def test_init_and_close_pool(self):
+        """Пул создаётся один раз и закрывается при остановке"""
+        pool = Mock()
+        pool.close = AsyncMock()
+        with patch.object(db_pool_module, 'db_pool', None), \
+             patch('app.db_pool.asyncpg.create_pool', new_callable=AsyncMock, return_value=pool) as mock_create:
+            assert await init_db_pool() is pool
+            assert await init_db_pool() is pool
+            mock_create.assert_called_once()
+            kwargs = mock_create.call_args.kwargs
+            assert kwargs['min_size'] == db_pool_module.DB_POOL_MIN_SIZE
+            assert kwargs['max_size'] == db_pool_module.DB_POOL_MAX_SIZE
+            assert kwargs['max_inactive_connection_lifetime'] == db_pool_module.DB_POOL_MAX_INACTIVE_LIFETIME
+
+            await close_db_pool()
+            pool.close.assert_called_once()
+            assert db_pool_module.db_pool is None
+
+
+class TestPoolStats:
+    """Тесты статистики пула"""
+
+    def test_get_pool_stats_saturation(self, mock_pool):
+        """Загрузка пула считается как занятые / максимум"""
+        stats = get_pool_stats()
+        assert stats['initialized'] is True
+        assert stats['size'] == 4
+        assert stats['idle'] == 1
+        assert stats['in_use'] == 3
+        assert stats['saturation'] == 0.3
+
+    def test_get_pool_stats_without_pool(self):
+        """Без пула возвращаются нулевые значения"""
+        with patch.object(db_pool_module, 'db_pool', None):
+            stats = get_pool_stats()
+        assert stats['initialized'] is False
+        assert stats['in_use'] == 0
+        assert stats['saturation'] == 0
+
+    def test_wait_time_accounting(self):
+        """Среднее и максимальное время ожидания"""
+        stats = PoolStats()
+        stats.record_wait(0.002)
+        stats.record_wait(0.004)
+        snapshot = stats.snapshot()
+        assert snapshot['acquire_count'] == 2
+        assert snapshot['avg_wait_ms'] == 3.0
+        assert snapshot['max_wait_ms'] == 4.0
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from unittest.mock import patch, AsyncMock
+
+from app.device_poller import DeviceStatusPoller
+
+
+MOCK_DEVICES = [
+    {'id': 1, 'name': 'Router1', 'ip': '192.168.1.1', 'type': 'cisco', 'username': 'admin', 'password': 'password', 'status': 'Онлайн'},
+    {'id': 2, 'name': 'Router2', 'ip': '192.168.1.2', 'type': 'mikrotik', 'username': 'admin', 'password': 'password', 'status': 'Оффлайн'},
+]
+
+
+class TestDeviceStatusPoller:
+    """Тесты фонового опроса устройств"""
+
+    @pytest.mark.asyncio
+    async def test_get_devices_loads_once(self):
+        """Список загружается из БД один раз и дальше отдаётся из памяти"""
+        poller = DeviceStatusPoller()
+        with patch('app.database.get_firewall_devices_list', new_callable=AsyncMock, return_value=MOCK_DEVICES) as mock_list:
+            assert len(await poller.get_devices()) == 2
+            assert len(await poller.get_devices()) == 2
+            mock_list.assert_called_once()
+            assert poller.get_device(2)['status'] == 'Оффлайн'
+
+            poller.invalidate()
+            await poller.get_devices()
+            assert mock_list.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_poll_once_updates_table(self):
+        """Опрос заменяет таблицу статусов и обновляет счетчики"""
+        poller = DeviceStatusPoller()
+        with patch('app.database.get_all_firewall_devices', new_callable=AsyncMock, return_value=MOCK_DEVICES):
+            devices = await poller.poll_once()
+
+        assert len(devices) == 2
+        status = poller.get_status()
+        assert status['sweep_count'] == 1
+        assert status['devices'] == 2
+        assert status['last_sweep_duration'] is not None
+
+    @pytest.mark.asyncio
+    async def test_concurrent_refresh_single_sweep(self):
+        """Одновременные запросы refresh ждут один общий опрос"""
+        poller = DeviceStatusPoller()
+
+        async def slow_poll():
+            await asyncio.sleep(0.05)
+            return MOCK_DEVICES
+
+        with patch('app.database.get_all_firewall_devices', side_effect=slow_poll) as mock_poll:
+            results = await asyncio.gather(*(poller.poll_once() for _ in range(5)))
+
+        assert mock_poll.call_count == 1
+        assert all(len(r) == 2 for r in results)
+
+    @pytest.mark.asyncio
+    async def test_start_and_stop(self):
+        """Фоновая задача запускается и корректно останавливается"""
+        poller = DeviceStatusPoller(interval=0.01, jitter=0)
+        with patch('app.database.get_firewall_devices_list', new_callable=AsyncMock, return_value=[]), \
+             patch('app.database.get_all_firewall_devices', new_callable=AsyncMock, return_value=MOCK_DEVICES):
+            poller.start()
+            await asyncio.sleep(0.05)
+            assert poller.get_status()['running'] is True
+            await poller.stop()
+
+        assert poller.get_status()['running'] is False
+        assert poller.sweep_count >= 1
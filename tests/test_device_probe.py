@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import pytest
+from unittest.mock import Mock, patch, AsyncMock
+
+import app.device_probe as device_probe
+from app.database import poll_device_status
+from app.ssh_executor import SSHExecutor
+from app.ssh_pool import SSHSessionPool
+from app.device_probe import (
+    PROBE_TIER_BANNER,
+    PROBE_TIER_TCP,
+    get_last_auth_result,
+    is_auth_check_due,
+    probe_device_reachability,
+    record_auth_check,
+)
+
+
+async def start_server(banner: bytes | None):
+    """Локальный TCP-сервер, который отправляет баннер (или молчит)"""
+    async def handle(reader, writer):
+        if banner is not None:
+            writer.write(banner)
+            await writer.drain()
+        await asyncio.sleep(0.2)
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+@pytest.fixture
+def clean_auth_checks():
+    """Фикстура для очистки истории полных проверок"""
+    with patch.dict(device_probe._auth_checks, clear=True):
+        yield
+
+
+class TestProbeDeviceReachability:
+    """Тесты лёгкой проверки доступности (TCP и SSH-баннер)"""
+
+    @pytest.mark.asyncio
+    async def test_ssh_banner(self):
+        """Устройство с SSH-баннером доступно"""
+        server, port = await start_server(b"SSH-2.0-OpenSSH_9.6\r\n")
+        async with server:
+            result = await probe_device_reachability("127.0.0.1", port)
+        assert result["reachable"] is True
+        assert result["tier"] == PROBE_TIER_BANNER
+        assert result["banner"] == "SSH-2.0-OpenSSH_9.6"
+        assert result["latency_ms"] is not None
+
+    @pytest.mark.asyncio
+    async def test_not_ssh_banner(self):
+        """Открытый порт без SSH-баннера не считается доступным"""
+        server, port = await start_server(b"HTTP/1.1 400 Bad Request\r\n")
+        async with server:
+            result = await probe_device_reachability("127.0.0.1", port)
+        assert result["reachable"] is False
+        assert "Unexpected banner" in result["error"]
+
+    @pytest.mark.asyncio
+    async def test_banner_timeout(self):
+        """Сервер молчит - таймаут чтения баннера"""
+        server, port = await start_server(None)
+        async with server:
+            result = await probe_device_reachability("127.0.0.1", port, banner_timeout=0.05)
+        assert result["reachable"] is False
+        assert result["tier"] == PROBE_TIER_BANNER
+
+    @pytest.mark.asyncio
+    async def test_connection_refused(self):
+        """Закрытый порт - ошибка на уровне TCP"""
+        server, port = await start_server(None)
+        server.close()
+        await server.wait_closed()
+        result = await probe_device_reachability("127.0.0.1", port)
+        assert result["reachable"] is False
+        assert result["tier"] == PROBE_TIER_TCP
+
+    @pytest.mark.asyncio
+    async def test_many_devices_single_loop(self):
+        """Сотни проверок выполняются параллельно в одном event loop"""
+        server, port = await start_server(b"SSH-2.0-test\r\n")
+        async with server:
+            results = await asyncio.gather(*(probe_device_reachability("127.0.0.1", port) for _ in range(200)))
+        assert all(r["reachable"] for r in results)
+
+
+class TestAuthCadence:
+    """Тесты периодичности полной проверки с авторизацией"""
+
+    def test_auth_check_due(self, clean_auth_checks):
+        """Полная проверка нужна впервые, после ошибки и по истечении интервала"""
+        assert is_auth_check_due(1) is True
+        record_auth_check(1, True, now=1000)
+        assert is_auth_check_due(1, now=1001) is False
+        assert is_auth_check_due(1, now=1000 + device_probe.DEVICE_AUTH_CHECK_INTERVAL) is True
+        record_auth_check(1, False, now=1000)
+        assert get_last_auth_result(1) is False
+        assert is_auth_check_due(1, now=1001) is True
+
+    @pytest.mark.asyncio
+    async def test_poll_skips_login_between_auth_checks(self, clean_auth_checks):
+        """Между полными проверками статус определяется без SSH-логина"""
+        device = {'id': 7, 'name': 'Router7', 'ip': '10.0.0.7', 'type': 'openwrt'}
+        probe = {'reachable': True, 'tier': PROBE_TIER_BANNER, 'banner': 'SSH-2.0-x', 'latency_ms': 1.0, 'error': None}
+        with patch('app.database.probe_device_reachability', new_callable=AsyncMock, return_value=probe), \
+             patch('app.database.check_device_online_netmiko', new_callable=AsyncMock, return_value=True) as mock_login:
+            semaphore, auth_semaphore = asyncio.Semaphore(1), asyncio.Semaphore(1)
+            await poll_device_status(dict(device), semaphore, auth_semaphore)
+            result = await poll_device_status(dict(device), semaphore, auth_semaphore)
+
+        mock_login.assert_called_once()
+        assert result['status'] == 'Онлайн'
+        assert get_last_auth_result(7) is True
+
+    @pytest.mark.asyncio
+    async def test_poll_unreachable_skips_login(self, clean_auth_checks):
+        """Недоступное по TCP устройство не авторизуется и помечается оффлайн"""
+        device = {'id': 8, 'name': 'Router8', 'ip': '10.0.0.8', 'type': 'openwrt'}
+        probe = {'reachable': False, 'tier': PROBE_TIER_TCP, 'banner': None, 'latency_ms': None, 'error': 'refused'}
+        with patch('app.database.probe_device_reachability', new_callable=AsyncMock, return_value=probe), \
+             patch('app.database.check_device_online_netmiko', new_callable=AsyncMock) as mock_login:
+            result = await poll_device_status(device, asyncio.Semaphore(1), asyncio.Semaphore(1))
+
+        mock_login.assert_not_called()
+        assert result['status'] == 'Оффлайн'
+
+    @pytest.mark.asyncio
+    async def test_poll_busy_device_not_offline(self, clean_auth_checks):
+        """Долгая операция с устройством не делает его оффлайн при опросе"""
+        device = {'id': 9, 'name': 'Router9', 'ip': '10.0.0.9', 'type': 'openwrt',
+                  'username': 'root', 'password': 'secret'}
+        probe = {'reachable': True, 'tier': PROBE_TIER_BANNER, 'banner': 'SSH-2.0-x', 'latency_ms': 1.0, 'error': None}
+        netmiko_device = {'device_type': 'linux', 'host': '10.0.0.9', 'username': 'root', 'password': 'secret'}
+        executor = SSHExecutor(max_workers=4)
+        job_started = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def long_job(ssh):
+            loop.call_soon_threadsafe(job_started.set)
+            time.sleep(0.5)
+
+        with patch('app.ssh_pool.ConnectHandler', side_effect=lambda **kwargs: Mock()), \
+             patch('app.ssh_executor.ssh_pool', SSHSessionPool(max_per_device=1)), \
+             patch('app.ssh_executor.SSH_HEALTH_LEASE_TIMEOUT', 0.05), \
+             patch('app.database.ssh_executor', executor), \
+             patch('app.database.DEVICE_POLL_TIMEOUT', 0.3), \
+             patch('app.database.probe_device_reachability', new_callable=AsyncMock, return_value=probe):
+            job = asyncio.create_task(executor.run(netmiko_device, long_job))
+            await job_started.wait()
+            result = await poll_device_status(dict(device), asyncio.Semaphore(1), asyncio.Semaphore(1))
+            await job
+
+        assert result['status'] == 'Онлайн'
+        # Пропущенная проверка не записывается как неудачная
+        assert get_last_auth_result(9) is None
+        executor.shutdown()
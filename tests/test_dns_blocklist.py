@@ -0,0 +1,316 @@
+import asyncio
+from unittest.mock import MagicMock, Mock, patch
+
+import pytest
+
+from app.database import (
+    delete_firewall_device,
+    get_dns_blocklist,
+    get_dns_blocklist_state,
+    save_dns_blocklist_state,
+    update_dns_blocklist,
+)
+from app.dns_blocklist import (
+    DNSMASQ_CONF_PATH,
+    adopt_blocklist,
+    blocklist_hash,
+    build_write_commands,
+    check_device_drift,
+    diff_blocklist,
+    normalize_domain,
+    normalize_domains,
+    parse_blocklist,
+    push_device_blocklist,
+    sync_blocklist,
+    update_device_blocklist,
+)
+
+
+DEVICE = {'id': 1, 'name': 'TestDevice', 'type': 'openwrt', 'ip': '192.168.1.1', 'username': 'admin', 'password': 'password'}
+NETMIKO_DEVICE = {'device_type': 'linux', 'host': '192.168.1.1', 'username': 'admin', 'password': 'password'}
+
+
+def lease_of(ssh):
+    lease = MagicMock()
+    lease.__enter__.return_value = ssh
+    lease.__exit__.return_value = False
+    return lease
+
+
+def device_ssh(blocklist: str, line_count: int):
+    """Мок SSH-сессии: чтение блок-листа, запись и перезапуск dnsmasq"""
+    ssh = Mock()
+
+    def send_command(command, **kwargs):
+        if command.startswith('cat '):
+            return blocklist
+        if 'wc -l' in command:
+            return f"{line_count}\n"
+        return ""
+
+    ssh.send_command.side_effect = send_command
+    return ssh
+
+
+class TestDomainParsing:
+    """Тесты разбора доменов из фидов"""
+
+    def test_normalize_formats(self):
+        """Поддерживаются домены, hosts-формат и строки dnsmasq"""
+        assert normalize_domain('Example.COM.') == 'example.com'
+        assert normalize_domain('0.0.0.0 ads.example.com') == 'ads.example.com'
+        assert normalize_domain('127.0.0.1 tracker.example.net # comment') == 'tracker.example.net'
+        assert normalize_domain('address=/malware.example.org/0.0.0.0') == 'malware.example.org'
+
+    def test_rejects_invalid(self):
+        """Комментарии, localhost и строки с опасными символами отбрасываются"""
+        assert normalize_domain('# comment') is None
+        assert normalize_domain('0.0.0.0 localhost') is None
+        assert normalize_domain("evil.com'; reboot") is None
+        assert normalize_domain('nodot') is None
+
+    def test_normalize_domains(self):
+        """Повторы убираются, некорректные строки возвращаются отдельно"""
+        domains, invalid = normalize_domains(['a.com', 'A.com', '# x', 'bad domain here', ''])
+        assert domains == {'a.com'}
+        assert invalid == ['bad domain here']
+
+    def test_parse_and_diff(self):
+        """Разница между текущим и запрошенным блок-листом"""
+        current = parse_blocklist("address=/a.com/0.0.0.0\naddress=/b.com/0.0.0.0\n# other\n")
+        assert current == {'a.com', 'b.com'}
+        assert diff_blocklist(current, {'b.com', 'c.com'}) == ({'c.com'}, {'a.com'})
+        assert diff_blocklist(current, {'b.com', 'c.com'}, replace=False) == ({'c.com'}, set())
+
+
+class TestBlocklistSync:
+    """Тесты синхронизации блок-листа с устройством"""
+
+    def test_write_commands_chunked(self):
+        """Большой список передаётся порциями, файл заменяется атомарно"""
+        domains = {f'domain{i}.example.com' for i in range(5000)}
+        commands = build_write_commands(domains, path='/etc/dnsmasq.d/blocklist.conf', chunk_size=16384)
+
+        assert len(commands) > 3
+        assert all(len(command) < 16384 + 100 for command in commands)
+        assert 'mv /etc/dnsmasq.d/blocklist.conf.tmp /etc/dnsmasq.d/blocklist.conf' in commands[-1]
+        assert 'conf-file=/etc/dnsmasq.d/blocklist.conf' in commands[-1]
+        transferred = ''.join(command.split("'")[1] for command in commands[1:-1]).replace('\\n', '\n')
+        assert set(transferred.split()) == domains
+
+    def test_sync_single_reload(self):
+        """Одна запись и один перезапуск dnsmasq на пакет"""
+        ssh = device_ssh("address=/a.com/0.0.0.0\naddress=/b.com/0.0.0.0\n", line_count=3)
+        result = sync_blocklist(ssh, {'b.com', 'c.com', 'd.com'})
+
+        assert (result['added'], result['removed'], result['total']) == (2, 1, 3)
+        assert result['verified'] is True
+        assert result['reloaded'] is True
+        commands = [call[0][0] for call in ssh.send_command.call_args_list]
+        assert sum('dnsmasq restart' in command for command in commands) == 1
+
+    def test_merge_appends_only_added(self):
+        """Без удалений передаются только новые домены"""
+        ssh = device_ssh("address=/a.com/0.0.0.0\n", line_count=2)
+        result = sync_blocklist(ssh, {'c.com'}, replace=False)
+
+        assert (result['added'], result['removed'], result['total']) == (1, 0, 2)
+        commands = [call[0][0] for call in ssh.send_command.call_args_list]
+        assert any("printf 'c.com\\n'" in command for command in commands)
+        assert any('>> /etc/dnsmasq.d/blocklist.conf' in command for command in commands)
+
+    def test_no_changes_no_reload(self):
+        """Неизменный список не трогает устройство"""
+        ssh = device_ssh("address=/a.com/0.0.0.0\n", line_count=1)
+        result = sync_blocklist(ssh, {'a.com'})
+
+        assert result['reloaded'] is False
+        ssh.send_command.assert_called_once()
+
+
+class TestBlocklistAdoption:
+    """Тесты переноса блокировок из dnsmasq.conf в блок-лист"""
+
+    @staticmethod
+    def adoption_ssh(conf: str, line_count: int):
+        ssh = Mock()
+
+        def send_command(command, **kwargs):
+            if command == f"cat {DNSMASQ_CONF_PATH}":
+                return conf
+            if command.startswith('cat '):
+                return ""
+            if 'wc -l' in command:
+                return f"{line_count}\n"
+            return ""
+
+        ssh.send_command.side_effect = send_command
+        return ssh
+
+    def test_cleanup_after_verified_write(self):
+        """Из dnsmasq.conf удаляются только перенесённые строки и только после записи блок-листа"""
+        conf = "address=/Ads.Example.com/0.0.0.0\naddress=/intranet/0.0.0.0\nserver=8.8.8.8\n"
+        ssh = self.adoption_ssh(conf, 1)
+
+        domains, invalid = adopt_blocklist(ssh)
+
+        assert domains == {'ads.example.com'}
+        assert invalid == ['address=/intranet/0.0.0.0']
+        commands = [call.args[0] for call in ssh.send_command.call_args_list]
+        write = next(i for i, command in enumerate(commands) if 'wc -l' in command)
+        cleanup = next(i for i, command in enumerate(commands) if 'grep -vxFf' in command)
+        assert write < cleanup
+        assert not any("sed -i" in command for command in commands)
+        payload = "".join(command for command in commands if 'fwmp_dns_legacy' in command and 'printf' in command)
+        assert 'address=/Ads.Example.com/0.0.0.0' in payload
+        assert 'intranet' not in payload
+
+    def test_no_cleanup_when_not_verified(self):
+        """Блок-лист не прошёл проверку - dnsmasq.conf не меняется"""
+        ssh = self.adoption_ssh("address=/ads.example.com/0.0.0.0\n", 0)
+
+        adopt_blocklist(ssh)
+
+        commands = [call.args[0] for call in ssh.send_command.call_args_list]
+        assert not any(DNSMASQ_CONF_PATH in command and 'grep -vxFf' in command for command in commands)
+
+
+class TestBlocklistState:
+    """Тесты хранения блок-листа в БД и отправки по хэшу"""
+
+    def test_hash_order_independent(self):
+        """Хэш не зависит от порядка доменов"""
+        assert blocklist_hash(['b.com', 'a.com']) == blocklist_hash({'a.com', 'b.com'})
+        assert blocklist_hash(['a.com']) != blocklist_hash(['a.com', 'b.com'])
+
+    @pytest.mark.asyncio
+    async def test_push_skipped_when_hash_matches(self, dns_db):
+        """Неизменный блок-лист не отправляется на устройство"""
+        _, states = dns_db
+        states[1] = {'device_id': 1, 'pushed_hash': blocklist_hash({'a.com'}), 'drift_detected': False}
+        ssh = Mock()
+
+        with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(ssh)):
+            result = await push_device_blocklist(DEVICE, NETMIKO_DEVICE, {'a.com'})
+
+        assert result['skipped'] is True
+        ssh.send_command.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_drift_repaired(self, dns_db):
+        """Правки в обход платформы обнаруживаются по хэшу и исправляются"""
+        blocklists, states = dns_db
+        blocklists[1] = {'a.com', 'b.com'}
+        states[1] = {'device_id': 1, 'pushed_hash': blocklist_hash(blocklists[1]), 'drift_detected': False}
+        ssh = Mock()
+        ssh.send_command.side_effect = lambda command, **kwargs: (
+            f"{blocklist_hash({'a.com'})}  -" if 'sha256sum' in command
+            else "address=/a.com/0.0.0.0\n" if command.startswith('cat ')
+            else "2" if 'wc -l' in command else ""
+        )
+
+        with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(ssh)):
+            result = await check_device_drift(DEVICE)
+
+        assert result['drift_detected'] is True
+        assert result['repair']['added'] == 1
+        assert states[1]['drift_detected'] is False
+
+    @pytest.mark.asyncio
+    async def test_no_drift(self, dns_db):
+        """Проверка без расхождений передаёт только хэш"""
+        blocklists, states = dns_db
+        blocklists[1] = {'a.com'}
+        states[1] = {'device_id': 1, 'pushed_hash': blocklist_hash({'a.com'}), 'drift_detected': False}
+        ssh = Mock()
+        ssh.send_command.return_value = f"{blocklist_hash({'a.com'})}  -"
+
+        with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(ssh)):
+            result = await check_device_drift(DEVICE)
+
+        assert result['drift_detected'] is False
+        ssh.send_command.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_updates(self, dns_db):
+        """Параллельные изменения одного устройства: на устройстве и в БД один и тот же список"""
+        blocklists, states = dns_db
+        states[1] = {'device_id': 1, 'pushed_hash': blocklist_hash(set()), 'drift_detected': False}
+        pushed = []
+
+        async def slow_get_dns_blocklist(device_id):
+            # Медленное чтение из БД: без блокировки оба изменения прочитали бы пустой список
+            domains = set(blocklists.get(device_id, set()))
+            await asyncio.sleep(0.01)
+            return domains
+
+        def fake_sync(ssh, domains, reload, path, current):
+            pushed.append(set(domains))
+            return {"added": 0, "removed": 0, "total": len(domains), "reloaded": True,
+                    "reload_ms": 0, "transfer_ms": 0, "verified": True}
+
+        with patch('app.database.get_dns_blocklist', slow_get_dns_blocklist), \
+             patch('app.dns_blocklist.sync_blocklist', fake_sync), \
+             patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(Mock())):
+            await asyncio.gather(
+                update_device_blocklist(DEVICE, NETMIKO_DEVICE, add=['a.com']),
+                update_device_blocklist(DEVICE, NETMIKO_DEVICE, add=['b.com']),
+            )
+
+        assert blocklists[1] == {'a.com', 'b.com'}
+        assert pushed[-1] == {'a.com', 'b.com'}
+        assert states[1]['pushed_hash'] == blocklist_hash({'a.com', 'b.com'})
+
+    @pytest.mark.asyncio
+    async def test_failed_push_keeps_database(self, dns_db):
+        """Ошибка отправки на устройство не меняет список в БД"""
+        blocklists, states = dns_db
+        blocklists[1] = {'a.com'}
+        states[1] = {'device_id': 1, 'pushed_hash': blocklist_hash({'a.com'}), 'drift_detected': False}
+        ssh = Mock()
+        ssh.send_command.side_effect = OSError("connection reset")
+
+        with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(ssh)):
+            with pytest.raises(OSError):
+                await update_device_blocklist(DEVICE, NETMIKO_DEVICE, add=['b.com'])
+
+        assert blocklists[1] == {'a.com'}
+        assert states[1]['pushed_hash'] == blocklist_hash({'a.com'})
+
+    @pytest.mark.asyncio
+    async def test_drift_against_database(self, dns_db):
+        """Устройство совпадает с последней отправкой, но не с БД - блок-лист из БД отправляется заново"""
+        blocklists, states = dns_db
+        blocklists[1] = {'a.com', 'b.com'}
+        states[1] = {'device_id': 1, 'pushed_hash': blocklist_hash({'a.com'}), 'drift_detected': False}
+        ssh = Mock()
+        ssh.send_command.side_effect = lambda command, **kwargs: (
+            f"{blocklist_hash({'a.com'})}  -" if 'sha256sum' in command
+            else "address=/a.com/0.0.0.0\n" if command.startswith('cat ')
+            else "2" if 'wc -l' in command else ""
+        )
+
+        with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(ssh)):
+            result = await check_device_drift(DEVICE)
+
+        assert result['drift_detected'] is True
+        assert result['repair']['added'] == 1
+        assert states[1]['pushed_hash'] == blocklist_hash({'a.com', 'b.com'})
+
+    @pytest.mark.asyncio
+    async def test_database_roundtrip(self):
+        """Изменения блок-листа и состояние синхронизации сохраняются в БД"""
+        device_id = 990001
+        await delete_firewall_device(device_id)
+        try:
+            await update_dns_blocklist(device_id, {'a.com', 'b.com'}, set())
+            await update_dns_blocklist(device_id, {'c.com'}, {'a.com'})
+            assert await get_dns_blocklist(device_id) == {'b.com', 'c.com'}
+
+            await save_dns_blocklist_state(device_id, blocklist_hash({'b.com', 'c.com'}), 2)
+            state = await get_dns_blocklist_state(device_id)
+            assert state['pushed_hash'] == blocklist_hash({'b.com', 'c.com'})
+            assert state['drift_detected'] is False
+        finally:
+            await delete_firewall_device(device_id)
+        assert await get_dns_blocklist_state(device_id) is None
@@ -1,18 +1,19 @@
 import pytest
-from unittest.mock import Mock, patch, AsyncMock
+from unittest.mock import Mock, patch, AsyncMock, MagicMock
 from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from app.firewall_devices_api import (
     router,
-    get_ssh_connection,
-    close_ssh_connection,
     api_get_dns_rules,
     api_add_dns_block,
     api_remove_dns_block,
     api_clear_all_dns_blocks,
+    api_dns_block_bulk,
+    api_dns_block_upload,
     api_get_ip_rules,
     api_get_iptables_raw,
     api_add_ip_block,
+    api_add_ip_block_bulk,
     api_remove_ip_block,
     api_clear_all_ip_blocks,
     api_get_devices,
@@ -20,69 +21,32 @@ from app.firewall_devices_api import (
     api_add_device,
     api_delete_device
 )
+from app.device_poller import DeviceStatusPoller
+from app.dns_blocklist import blocklist_hash
+from app.iptables_parser import rule_index_cache
 from app.models import FirewallDeviceCreate
 
 
-class TestSSHConnections:
-    """Тесты для управления SSH соединениями"""
+@pytest.fixture(autouse=True)
+def clear_rule_index_cache():
+    """Индексы правил не переносятся между тестами"""
+    rule_index_cache.clear()
+    yield
+    rule_index_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def dns_store(dns_db):
+    """DNS блок-листы устройств хранятся в памяти"""
+    yield dns_db
 
-    def test_get_ssh_connection_new(self):
-        """Тест создания нового SSH соединения"""
-        device_config = {
-            'device_type': 'linux',
-            'host': '192.168.1.1',
-            'username': 'admin',
-            'password': 'password'
-        }
-        
-        mock_ssh = Mock()
-        with patch('app.firewall_devices_api.ConnectHandler', return_value=mock_ssh):
-            result = get_ssh_connection(device_config)
-            
-            # Проверяем, что соединение создано
-            assert result == mock_ssh
-
-    def test_get_ssh_connection_existing(self):
-        """Тест получения существующего SSH соединения"""
-        device_config = {
-            'device_type': 'linux',
-            'host': '192.168.1.1',
-            'username': 'admin',
-            'password': 'password'
-        }
-        
-        mock_ssh = Mock()
-        with patch('app.firewall_devices_api.ConnectHandler', return_value=mock_ssh):
-            # Создаем первое соединение
-            first_connection = get_ssh_connection(device_config)
-            
-            # Получаем то же соединение
-            second_connection = get_ssh_connection(device_config)
-            
-            # Проверяем, что это одно и то же соединение
-            assert first_connection is second_connection
-
-    def test_close_ssh_connection(self):
-        """Тест закрытия SSH соединения"""
-        device_config = {
-            'device_type': 'linux',
-            'host': '192.168.1.1',
-            'username': 'admin',
-            'password': 'password'
-        }
-        
-        mock_ssh = Mock()
-        
-        with patch('app.firewall_devices_api.ConnectHandler', return_value=mock_ssh):
-            with patch('app.firewall_devices_api.ssh_connections', {'192.168.1.1_admin': mock_ssh}):
-                # Создаем соединение
-                get_ssh_connection(device_config)
-                
-                # Закрываем соединение
-                close_ssh_connection('192.168.1.1', 'admin')
-                
-                # Проверяем, что соединение закрыто
-                mock_ssh.disconnect.assert_called_once()
+
+def lease_of(ssh):
+    """Контекстный менеджер аренды SSH-сессии, выдающий мок соединения"""
+    lease = MagicMock()
+    lease.__enter__.return_value = ssh
+    lease.__exit__.return_value = False
+    return lease
 
 
 class TestDNSRules:
@@ -108,10 +72,12 @@ address=/blocked.com/0.0.0.0
         """
         
         mock_ssh = Mock()
-        mock_ssh.send_command.return_value = mock_dnsmasq_config
+        mock_ssh.send_command.side_effect = lambda command, **kwargs: (
+            mock_dnsmasq_config if command == 'cat /etc/dnsmasq.conf' else '3' if 'wc -l' in command else ''
+        )
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 result = await api_get_dns_rules(device_id=1)
                 
                 # Проверяем результат
@@ -120,6 +86,13 @@ address=/blocked.com/0.0.0.0
                 assert 'test.com' in result['domains']
                 assert 'blocked.com' in result['domains']
                 assert result['total_count'] == 3
+                
+                # Повторное чтение обслуживается из БД без обращения к устройству
+                calls = mock_ssh.send_command.call_count
+                again = await api_get_dns_rules(device_id=1)
+                assert again['domains'] == result['domains']
+                assert again['source'] == 'db'
+                assert mock_ssh.send_command.call_count == calls
 
     @pytest.mark.asyncio
     async def test_api_get_dns_rules_device_not_found(self):
@@ -163,9 +136,10 @@ address=/blocked.com/0.0.0.0
         }
         
         mock_ssh = Mock()
+        mock_ssh.send_command.return_value = ""
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 result = await api_add_dns_block(
                     device_id=1,
                     request_data={'domain': 'example.com'}
@@ -202,8 +176,11 @@ address=/blocked.com/0.0.0.0
             assert "Domain is required" in str(exc_info.value.detail)
 
     @pytest.mark.asyncio
-    async def test_api_remove_dns_block_success(self):
+    async def test_api_remove_dns_block_success(self, dns_store):
         """Тест успешного удаления DNS блокировки"""
+        blocklists, states = dns_store
+        blocklists[1] = {'example.com', 'other.com'}
+        states[1] = {'device_id': 1, 'pushed_hash': blocklist_hash(blocklists[1]), 'drift_detected': False}
         mock_device = {
             'id': 1,
             'name': 'TestDevice',
@@ -214,9 +191,10 @@ address=/blocked.com/0.0.0.0
         }
         
         mock_ssh = Mock()
+        mock_ssh.send_command.return_value = ""
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 result = await api_remove_dns_block(
                     device_id=1,
                     request_data={'domain': 'example.com'}
@@ -226,9 +204,13 @@ address=/blocked.com/0.0.0.0
                 assert result['success'] is True
                 assert result['unblocked_domain'] == 'example.com'
                 assert 'разблокирован' in result['message']
+                assert dns_store[0][1] == {'other.com'}
                 
-                # Проверяем, что команды выполнены
-                assert mock_ssh.send_command.call_count >= 2
+                # Содержимое устройства известно по хэшу: файл не читается, только запись и перезапуск
+                commands = [call[0][0] for call in mock_ssh.send_command.call_args_list]
+                assert not any(command.startswith('cat ') for command in commands)
+                assert any("printf 'other.com\\n'" in command for command in commands)
+                assert sum('dnsmasq restart' in command for command in commands) == 1
 
     @pytest.mark.asyncio
     async def test_api_clear_all_dns_blocks_success(self):
@@ -243,9 +225,10 @@ address=/blocked.com/0.0.0.0
         }
         
         mock_ssh = Mock()
+        mock_ssh.send_command.return_value = ""
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 result = await api_clear_all_dns_blocks(device_id=1)
                 
                 # Проверяем результат
@@ -256,6 +239,101 @@ address=/blocked.com/0.0.0.0
                 assert mock_ssh.send_command.call_count >= 2
 
 
+class TestDNSBulk:
+    """Тесты пакетной синхронизации блок-листа DNS"""
+
+    mock_device = {
+        'id': 1,
+        'name': 'TestDevice',
+        'type': 'openwrt',
+        'ip': '192.168.1.1',
+        'username': 'admin',
+        'password': 'password'
+    }
+
+    @staticmethod
+    def device_ssh():
+        mock_ssh = Mock()
+        mock_ssh.send_command.side_effect = lambda command, **kwargs: (
+            "address=/old.com/0.0.0.0\n" if command.startswith('cat ') else "2\n" if 'wc -l' in command else ""
+        )
+        return mock_ssh
+
+    @pytest.mark.asyncio
+    async def test_bulk_from_list(self):
+        """Пакетная синхронизация из списка доменов"""
+        mock_ssh = self.device_ssh()
+        
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                result = await api_dns_block_bulk(
+                    device_id=1,
+                    request_data={'domains': ['ads.example.com', 'tracker.example.com', 'not a domain']}
+                )
+        
+        assert result['success'] is True
+        assert result['added'] == 2
+        assert result['removed'] == 1
+        assert result['invalid_count'] == 1
+        assert result['reloaded'] is True
+        assert 'reload_ms' in result
+
+    @pytest.mark.asyncio
+    async def test_bulk_from_file(self):
+        """Загрузка блок-листа из файла в hosts-формате"""
+        mock_ssh = self.device_ssh()
+        upload = Mock()
+        upload.filename = 'hosts.txt'
+        upload.read = AsyncMock(return_value=b"# feed\n0.0.0.0 ads.example.com\n0.0.0.0 old.com\n")
+        
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                result = await api_dns_block_upload(device_id=1, mode='merge', file=upload)
+        
+        assert result['added'] == 1
+        assert result['removed'] == 0
+        assert result['unchanged'] == 1
+
+    @pytest.mark.asyncio
+    async def test_bulk_invalid_mode(self):
+        """Некорректный режим синхронизации"""
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+            with pytest.raises(HTTPException) as exc_info:
+                await api_dns_block_bulk(device_id=1, request_data={'domains': ['a.com'], 'mode': 'append'})
+        
+        assert exc_info.value.status_code == 400
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('request_data', [
+        {'domains': ['not a domain', 'localhost']},
+        {'domains': ['not a domain'], 'clear': True},
+        {'domains': []},
+    ])
+    async def test_bulk_replace_never_empties_implicitly(self, request_data):
+        """Replace без валидных доменов не очищает блок-лист - 400, устройство не трогается"""
+        mock_ssh = self.device_ssh()
+        
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                with pytest.raises(HTTPException) as exc_info:
+                    await api_dns_block_bulk(device_id=1, request_data=request_data)
+        
+        assert exc_info.value.status_code == 400
+        mock_ssh.send_command.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_bulk_explicit_clear(self):
+        """Пустой список с clear=true очищает блок-лист"""
+        mock_ssh = self.device_ssh()
+        
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                result = await api_dns_block_bulk(device_id=1, request_data={'domains': [], 'clear': True})
+        
+        assert result['success'] is True
+        assert result['removed'] == 1
+
+
 class TestIPRules:
     """Тесты для IP правил"""
 
@@ -272,24 +350,27 @@ class TestIPRules:
         }
         
         mock_iptables_output = """
-Chain INPUT (policy ACCEPT)
-target     prot opt source               destination
-DROP       all  --  192.168.1.100        anywhere
-ACCEPT     all  --  anywhere             anywhere
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+-A INPUT -s 192.168.1.100/32 -j DROP
+-A INPUT -j ACCEPT
+COMMIT
         """
         
         mock_ssh = Mock()
         mock_ssh.send_command.return_value = mock_iptables_output
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
-                result = await api_get_ip_rules(device_id=1)
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                result = await api_get_ip_rules(device_id=1, direction=None)
                 
                 # Проверяем результат
                 assert result['device_name'] == 'TestDevice'
-                # Проверяем, что есть либо правила, либо ошибка
-                assert 'rules' in result or 'error' in result
-                assert 'ips' in result
+                assert result['ips'] == ['192.168.1.100 (входящий)']
+                # Правила читаются одним вызовом iptables-save
+                mock_ssh.send_command.assert_called_once_with("iptables-save -t filter", read_timeout=30)
 
     @pytest.mark.asyncio
     async def test_api_get_iptables_raw_success(self):
@@ -304,23 +385,27 @@ ACCEPT     all  --  anywhere             anywhere
         }
         
         mock_iptables_output = """
-Chain INPUT (policy ACCEPT)
-target     prot opt source               destination
-DROP       all  --  192.168.1.100        anywhere
-ACCEPT     all  --  anywhere             anywhere
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+-A INPUT -s 192.168.1.100/32 -j DROP
+-A INPUT -j ACCEPT
+COMMIT
         """
         
         mock_ssh = Mock()
         mock_ssh.send_command.return_value = mock_iptables_output
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 result = await api_get_iptables_raw(device_id=1)
                 
                 # Проверяем результат
                 assert 'all_rules' in result
                 assert 'device_name' in result
                 assert result['device_name'] == 'TestDevice'
+                assert result['all_rules']['INPUT'][0] == '-A INPUT -s 192.168.1.100/32 -j DROP'
 
     @pytest.mark.asyncio
     async def test_api_add_ip_block_success(self):
@@ -338,7 +423,7 @@ ACCEPT     all  --  anywhere             anywhere
         mock_ssh.send_command.return_value = "success"
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 result = await api_add_ip_block(
                     device_id=1,
                     request_data={'ip': '192.168.1.100'}
@@ -374,6 +459,117 @@ ACCEPT     all  --  anywhere             anywhere
             assert exc_info.value.status_code == 500
             assert "Invalid IP address format" in str(exc_info.value.detail)
 
+    @pytest.mark.asyncio
+    async def test_api_add_ip_block_bulk_success(self):
+        """Тест пакетной блокировки IP одной транзакцией iptables-restore"""
+        mock_device = {
+            'id': 1,
+            'name': 'TestDevice',
+            'type': 'openwrt',
+            'ip': '192.168.1.1',
+            'username': 'admin',
+            'password': 'password'
+        }
+        
+        mock_ssh = Mock()
+        mock_ssh.send_command.return_value = "IPTABLES_RESTORE_RC=0"
+        
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                result = await api_add_ip_block_bulk(
+                    device_id=1,
+                    request_data={'entries': [
+                        {'ip': '10.0.0.1'},
+                        {'ip': '10.0.0.2', 'port': '443', 'direction': 'in'},
+                        {'ip': 'bad_ip'},
+                        {'ip': '10.0.0.1'}
+                    ]}
+                )
+                
+                assert result['success'] is True
+                assert result['applied'] == 3
+                assert result['failed'] == 1
+                # Повторяющиеся правила в транзакцию не попадают
+                assert result['rules_count'] == 5
+                assert result['results'][2]['success'] is False
+                assert result['apply_time_ms'] >= 0
+                
+                # Все правила применены одной командой
+                mock_ssh.send_command.assert_called_once()
+                command = mock_ssh.send_command.call_args[0][0]
+                assert 'iptables-restore --noflush' in command
+                assert command.count('-I ') == 5
+
+    @pytest.mark.asyncio
+    async def test_api_add_ip_block_bulk_restore_failed(self):
+        """Тест пакетной блокировки при ошибке iptables-restore"""
+        mock_device = {
+            'id': 1,
+            'name': 'TestDevice',
+            'type': 'openwrt',
+            'ip': '192.168.1.1',
+            'username': 'admin',
+            'password': 'password'
+        }
+        
+        mock_ssh = Mock()
+        mock_ssh.send_command.return_value = "iptables-restore: line 2 failed\nIPTABLES_RESTORE_RC=1"
+        
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                result = await api_add_ip_block_bulk(
+                    device_id=1,
+                    request_data={'ips': ['10.0.0.1', '10.0.0.2'], 'direction': 'out'}
+                )
+                
+                assert result['success'] is False
+                assert result['applied'] == 0
+                assert result['failed'] == 2
+                assert 'line 2 failed' in result['results'][0]['error']
+
+    @pytest.mark.asyncio
+    async def test_api_add_ip_block_bulk_empty(self):
+        """Тест пакетной блокировки без записей"""
+        mock_device = {
+            'id': 1,
+            'name': 'TestDevice',
+            'type': 'openwrt',
+            'ip': '192.168.1.1',
+            'username': 'admin',
+            'password': 'password'
+        }
+        
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
+            with pytest.raises(HTTPException) as exc_info:
+                await api_add_ip_block_bulk(device_id=1, request_data={'entries': []})
+            
+            assert exc_info.value.status_code == 400
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('request_data, detail', [
+        ({'entries': '1.2.3.4'}, 'entries must be a list'),
+        ({'entries': [{'ip': '1.2.3.4'}, '5.6.7.8']}, 'entries[1]'),
+        ({'ips': '1.2.3.4'}, 'ips must be a list'),
+        ({'ips': ['1.2.3.4', {'ip': '5.6.7.8'}]}, 'ips[1]'),
+    ])
+    async def test_api_add_ip_block_bulk_invalid_body(self, request_data, detail):
+        """Тело неверной формы - 400 с номером записи, а не 500"""
+        mock_device = {
+            'id': 1,
+            'name': 'TestDevice',
+            'type': 'openwrt',
+            'ip': '192.168.1.1',
+            'username': 'admin',
+            'password': 'password'
+        }
+        
+        with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
+            with pytest.raises(HTTPException) as exc_info:
+                await api_add_ip_block_bulk(device_id=1, request_data=request_data)
+            
+            assert exc_info.value.status_code == 400
+            assert detail in exc_info.value.detail
+
     @pytest.mark.asyncio
     async def test_api_remove_ip_block_success(self):
         """Тест успешного удаления IP блокировки"""
@@ -387,17 +583,20 @@ ACCEPT     all  --  anywhere             anywhere
         }
         
         mock_iptables_output = """
-Chain INPUT (policy ACCEPT)
-target     prot opt source               destination
-DROP       all  --  192.168.1.100        anywhere
-ACCEPT     all  --  anywhere             anywhere
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+-A INPUT -s 192.168.1.100/32 -j DROP
+-A INPUT -j ACCEPT
+COMMIT
         """
         
         mock_ssh = Mock()
         mock_ssh.send_command.return_value = mock_iptables_output
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 result = await api_remove_ip_block(
                     device_id=1,
                     request_data={'ip': '192.168.1.100'}
@@ -409,8 +608,10 @@ ACCEPT     all  --  anywhere             anywhere
                 # Проверяем, что сообщение содержит информацию об IP
                 assert '192.168.1.100' in result['message']
                 
-                # Проверяем, что команды выполнены
-                assert mock_ssh.send_command.call_count >= 1
+                # Чтение индекса и одна команда удаления найденного правила
+                assert mock_ssh.send_command.call_count == 2
+                assert mock_ssh.send_command.call_args[0][0] == 'iptables -D INPUT -s 192.168.1.100/32 -j DROP'
+
 
     @pytest.mark.asyncio
     async def test_api_clear_all_ip_blocks_success(self):
@@ -425,27 +626,121 @@ ACCEPT     all  --  anywhere             anywhere
         }
         
         mock_iptables_output = """
-Chain INPUT (policy ACCEPT)
-target     prot opt source               destination
-DROP       all  --  192.168.1.100        anywhere
-DROP       all  --  192.168.1.101        anywhere
-ACCEPT     all  --  anywhere             anywhere
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+-A INPUT -s 192.168.1.100/32 -j DROP
+-A INPUT -s 192.168.1.101/32 -j DROP
+-A INPUT -j ACCEPT
+COMMIT
         """
         
         mock_ssh = Mock()
         mock_ssh.send_command.return_value = mock_iptables_output
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 result = await api_clear_all_ip_blocks(device_id=1)
                 
                 # Проверяем результат
                 assert result['success'] is True
                 # Проверяем, что сообщение содержит информацию об удалении
-                assert 'удалено' in result['message'] or 'очищено' in result['message'] or '0' in result['message']
+                assert 'Удалено 2' in result['message']
+                assert result['removed_count'] == 2
                 
                 # Проверяем, что команды выполнены
-                assert mock_ssh.send_command.call_count >= 1
+                assert mock_ssh.send_command.call_count == 2
+
+
+class TestIPSetMode:
+    """Тесты IP блокировок в режиме ipset"""
+
+    mock_device = {
+        'id': 1,
+        'name': 'TestDevice',
+        'type': 'openwrt',
+        'ip': '192.168.1.1',
+        'username': 'admin',
+        'password': 'password'
+    }
+
+    ipset_save = """create fwmp_block_in hash:ip family inet hashsize 4096 maxelem 1048576
+add fwmp_block_in 192.168.1.100
+create fwmp_block_port_out hash:ip,port family inet hashsize 4096 maxelem 1048576
+add fwmp_block_port_out 192.168.1.101,tcp:443
+"""
+
+    @pytest.mark.asyncio
+    async def test_block_adds_to_set(self):
+        """Блокировка добавляет IP в множество, а не новое правило"""
+        mock_ssh = Mock()
+        
+        with patch('app.ipset_blocklist.IP_BLOCK_MODE', 'ipset'):
+            with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+                with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                    result = await api_add_ip_block(
+                        device_id=1,
+                        request_data={'ip': '192.168.1.100', 'direction': 'in'}
+                    )
+        
+        assert result['success'] is True
+        mock_ssh.send_command.assert_called_once()
+        command = mock_ssh.send_command.call_args[0][0]
+        assert 'ipset -exist add fwmp_block_in 192.168.1.100' in command
+        assert 'iptables -I FORWARD 1 -d 192.168.1.100' not in command
+
+    @pytest.mark.asyncio
+    async def test_list_from_sets(self):
+        """Список блокировок строится по содержимому множеств"""
+        mock_ssh = Mock()
+        mock_ssh.send_command.return_value = self.ipset_save
+        
+        with patch('app.ipset_blocklist.IP_BLOCK_MODE', 'ipset'):
+            with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+                with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                    result = await api_get_ip_rules(device_id=1, direction='out')
+        
+        assert result['mode'] == 'ipset'
+        assert result['ips'] == ['192.168.1.101:443 (исходящий)']
+
+    @pytest.mark.asyncio
+    async def test_unblock_and_clear(self):
+        """Разблокировка и очистка - операции над множествами"""
+        mock_ssh = Mock()
+        mock_ssh.send_command.return_value = self.ipset_save
+        
+        with patch('app.ipset_blocklist.IP_BLOCK_MODE', 'ipset'):
+            with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+                with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                    unblocked = await api_remove_ip_block(device_id=1, request_data={'ip': '192.168.1.100'})
+                    cleared = await api_clear_all_ip_blocks(device_id=1)
+        
+        assert 'удалено 1' in unblocked['message']
+        assert cleared['removed_count'] == 2
+        commands = [call[0][0] for call in mock_ssh.send_command.call_args_list]
+        assert not any('iptables -D' in command for command in commands)
+
+    @pytest.mark.asyncio
+    async def test_bulk_uses_ipset_restore(self):
+        """Пакетная блокировка применяется одной транзакцией ipset restore"""
+        mock_ssh = Mock()
+        mock_ssh.send_command.return_value = "IPTABLES_RESTORE_RC=0"
+        
+        with patch('app.ipset_blocklist.IP_BLOCK_MODE', 'ipset'):
+            with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=self.mock_device):
+                with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
+                    result = await api_add_ip_block_bulk(
+                        device_id=1,
+                        request_data={'ips': ['10.0.0.1', '10.0.0.2']}
+                    )
+        
+        assert result['success'] is True
+        assert result['mode'] == 'ipset'
+        assert result['rules_count'] == 4
+        restore_command = mock_ssh.send_command.call_args_list[-1][0][0]
+        assert 'ipset restore -exist' in restore_command
+        assert restore_command.count('add fwmp_block_') == 4
 
 
 class TestFirewallDevices:
@@ -460,13 +755,29 @@ class TestFirewallDevices:
         ]
         
         with patch('app.database.get_all_firewall_devices', return_value=mock_devices):
-            result = await api_get_devices()
+            result = await api_get_devices(refresh=True)
             
             # Проверяем результат (API возвращает список Pydantic моделей)
             assert len(result) == 2
             assert result[0].name == 'Router1'
             assert result[1].name == 'Router2'
 
+    @pytest.mark.asyncio
+    async def test_api_get_devices_cached(self):
+        """Без refresh устройства не опрашиваются, статусы берутся из БД"""
+        mock_devices = [
+            {'id': 1, 'name': 'Router1', 'ip': '192.168.1.1', 'type': 'cisco', 'username': 'admin', 'password': 'password', 'status': 'Онлайн'}
+        ]
+
+        with patch('app.firewall_devices_api.device_poller', DeviceStatusPoller()), \
+             patch('app.database.get_firewall_devices_list', return_value=mock_devices), \
+             patch('app.database.get_all_firewall_devices') as mock_poll:
+            result = await api_get_devices()
+
+            mock_poll.assert_not_called()
+            assert len(result) == 1
+            assert result[0].status == 'Онлайн'
+
     @pytest.mark.asyncio
     async def test_api_get_devices_raw_success(self):
         """Тест получения сырых данных устройств"""
@@ -563,17 +874,13 @@ class TestErrorHandling:
         }
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', side_effect=Exception("SSH error")):
-                with patch('app.firewall_devices_api.close_ssh_connection') as mock_close:
-                    with pytest.raises(HTTPException) as exc_info:
-                        await api_get_dns_rules(device_id=1)
-                    
-                    # Проверяем, что соединение закрыто
-                    mock_close.assert_called_once_with('192.168.1.1', 'admin')
-                    
-                    # Проверяем ошибку
-                    assert exc_info.value.status_code == 500
-                    assert "SSH error" in str(exc_info.value.detail)
+            with patch('app.ssh_executor.ssh_pool.lease', side_effect=Exception("SSH error")):
+                with pytest.raises(HTTPException) as exc_info:
+                    await api_get_dns_rules(device_id=1)
+                
+                # Проверяем ошибку
+                assert exc_info.value.status_code == 500
+                assert "SSH error" in str(exc_info.value.detail)
 
     @pytest.mark.asyncio
     async def test_database_error(self):
@@ -616,7 +923,7 @@ class TestIntegration:
         mock_ssh.send_command.return_value = "address=/example.com/0.0.0.0"
         
         with patch('app.firewall_devices_api.get_firewall_device_by_id', return_value=mock_device):
-            with patch('app.firewall_devices_api.get_ssh_connection', return_value=mock_ssh):
+            with patch('app.ssh_executor.ssh_pool.lease', return_value=lease_of(mock_ssh)):
                 # Получаем правила
                 rules = await api_get_dns_rules(device_id=1)
                 assert 'domains' in rules
@@ -0,0 +1,243 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.fleet_jobs import (
+    FleetJobManager,
+    api_create_fleet_job,
+    apply_ip_changes,
+    select_devices,
+    stream_job_events,
+    validate_changes,
+)
+from app.iptables_parser import rule_index_cache
+
+
+DEVICES = [
+    {'id': i, 'name': f'Router{i}', 'type': 'openwrt', 'ip': f'192.168.1.{i}', 'username': 'admin', 'password': 'password'}
+    for i in range(1, 5)
+] + [{'id': 5, 'name': 'Switch', 'type': 'cisco', 'ip': '192.168.1.5', 'username': 'admin', 'password': 'password'}]
+
+NETMIKO_DEVICE = {'device_type': 'linux', 'host': '192.168.1.1', 'username': 'admin', 'password': 'password'}
+
+IPTABLES_SAVE = """*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+-A INPUT -d 10.0.0.1/32 -m comment --comment blocked_ip:10.0.0.1:in -j DROP
+-A FORWARD -d 10.0.0.1/32 -m comment --comment blocked_ip:10.0.0.1:in -j DROP
+-A FORWARD -s 10.0.0.1/32 -m comment --comment blocked_ip:10.0.0.1:out -j DROP
+-A OUTPUT -d 10.0.0.1/32 -m comment --comment blocked_ip:10.0.0.1:out -j DROP
+-A FORWARD -d 10.0.0.9/32 -m comment --comment blocked_ip:10.0.0.9:in -j DROP
+COMMIT
+"""
+
+
+@pytest.fixture(autouse=True)
+def clear_rule_index_cache():
+    rule_index_cache.clear()
+    yield
+    rule_index_cache.clear()
+
+
+async def run_job(manager: FleetJobManager, selector: dict, changes: list, **kwargs):
+    with patch('app.database.get_firewall_devices_list', AsyncMock(return_value=DEVICES)):
+        job = await manager.submit(selector, changes, **kwargs)
+    await job.task
+    return job
+
+
+class TestJobValidation:
+    """Тесты выбора устройств и проверки изменений"""
+
+    def test_select_devices(self):
+        """Селектор по всем устройствам, по типу и по списку"""
+        assert len(select_devices(DEVICES, {'all': True})) == 5
+        assert [d['id'] for d in select_devices(DEVICES, {'type': 'cisco'})] == [5]
+        assert [d['id'] for d in select_devices(DEVICES, {'device_ids': [2, '3', 99]})] == [2, 3]
+        with pytest.raises(ValueError):
+            select_devices(DEVICES, {})
+
+    def test_validate_changes(self):
+        """Изменения нормализуются, некорректные отклоняются"""
+        changes = validate_changes([
+            {'action': 'dns_block', 'domain': 'Ads.Example.com'},
+            {'action': 'ip_block', 'ip': '10.0.0.1', 'port': 443, 'direction': 'in'},
+        ])
+        assert changes[0] == {'action': 'dns_block', 'domain': 'ads.example.com'}
+        assert changes[1] == {'action': 'ip_block', 'ip': '10.0.0.1', 'port': '443', 'direction': 'in'}
+        for bad in ([], [{'action': 'reboot'}], [{'action': 'dns_block', 'domain': 'a; reboot'}],
+                    [{'action': 'ip_block', 'ip': '999.1.1.1'}]):
+            with pytest.raises(ValueError):
+                validate_changes(bad)
+
+    @pytest.mark.asyncio
+    async def test_create_job_invalid_returns_400(self):
+        """Некорректная задача отклоняется до запуска"""
+        with patch('app.database.get_firewall_devices_list', AsyncMock(return_value=DEVICES)):
+            with pytest.raises(HTTPException) as exc:
+                await api_create_fleet_job({'selector': {'device_ids': [99]},
+                                            'changes': [{'action': 'dns_block', 'domain': 'a.com'}]})
+        assert exc.value.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_malformed_body_returns_400(self):
+        """Селектор и изменения не того типа - 400, а не 500"""
+        change = [{'action': 'dns_block', 'domain': 'a.com'}]
+        for body in ({'selector': ['all'], 'changes': change},
+                     {'selector': 'all', 'changes': change},
+                     {'selector': {'device_ids': 'abc'}, 'changes': change},
+                     {'selector': {'device_ids': [None]}, 'changes': change},
+                     {'selector': {'all': True}, 'changes': {'action': 'dns_block'}},
+                     {'selector': {'all': True}, 'changes': ['dns_block']},
+                     {'selector': {'all': True}, 'changes': change, 'concurrency': 'many'}):
+            with patch('app.database.get_firewall_devices_list', AsyncMock(return_value=DEVICES)):
+                with pytest.raises(HTTPException) as exc:
+                    await api_create_fleet_job(body)
+            assert exc.value.status_code == 400
+
+
+class TestJobExecution:
+    """Тесты выполнения задач по группе устройств"""
+
+    @pytest.mark.asyncio
+    async def test_bounded_concurrency(self):
+        """Одновременно обрабатывается не больше concurrency устройств"""
+        active, peak = 0, 0
+
+        async def apply(device, changes):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return {}
+
+        with patch('app.fleet_jobs.apply_device_changes', side_effect=apply) as mock_apply:
+            job = await run_job(FleetJobManager(), {'all': True},
+                                [{'action': 'dns_block', 'domain': 'a.com'}], concurrency=2)
+
+        assert job.status == 'completed'
+        assert mock_apply.call_count == 4
+        assert peak == 2
+        counts = job.counts()
+        assert (counts['succeeded'], counts['skipped']) == (4, 1)
+
+    @pytest.mark.asyncio
+    async def test_concurrency_capped(self):
+        """concurrency из запроса ограничен FLEET_JOB_MAX_CONCURRENCY, задач не больше воркеров"""
+        active, peak = 0, 0
+
+        async def apply(device, changes):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return {}
+
+        with patch('app.fleet_jobs.FLEET_JOB_MAX_CONCURRENCY', 3), \
+             patch('app.fleet_jobs.apply_device_changes', side_effect=apply):
+            job = await run_job(FleetJobManager(), {'all': True},
+                                [{'action': 'dns_block', 'domain': 'a.com'}], concurrency=10000)
+
+        assert job.concurrency == 3
+        assert peak == 3
+        assert job.counts()['succeeded'] == 4
+
+    @pytest.mark.asyncio
+    async def test_retry_with_backoff(self):
+        """Сбой устройства повторяется, исчерпание попыток помечает устройство"""
+        attempts = {}
+
+        async def apply(device, changes):
+            attempts[device['id']] = attempts.get(device['id'], 0) + 1
+            if device['id'] == 1 and attempts[1] < 2:
+                raise RuntimeError('SSH timeout')
+            if device['id'] == 2:
+                raise RuntimeError('Authentication failed')
+            return {}
+
+        with patch('app.fleet_jobs.apply_device_changes', side_effect=apply), \
+                patch('app.fleet_jobs.FLEET_JOB_RETRY_BACKOFF', 0.001):
+            job = await run_job(FleetJobManager(), {'device_ids': [1, 2]},
+                                [{'action': 'dns_block', 'domain': 'a.com'}], max_retries=2)
+
+        assert job.status == 'failed'
+        assert job.devices[1]['status'] == 'succeeded'
+        assert job.devices[1]['attempts'] == 2
+        assert job.devices[2]['status'] == 'failed'
+        assert job.devices[2]['attempts'] == 3
+        assert job.devices[2]['error'] == 'Authentication failed'
+        assert any(event['event'] == 'device_retry' for event in job.events)
+
+    @pytest.mark.asyncio
+    async def test_stream_events(self):
+        """Поток прогресса отдаёт события до завершения задачи"""
+        with patch('app.fleet_jobs.apply_device_changes', AsyncMock(return_value={})):
+            with patch('app.database.get_firewall_devices_list', AsyncMock(return_value=DEVICES)):
+                job = await FleetJobManager().submit({'device_ids': [1]}, [{'action': 'dns_block', 'domain': 'a.com'}])
+            chunks = [chunk async for chunk in stream_job_events(job)]
+
+        events = [json.loads(chunk.split('data: ', 1)[1]) for chunk in chunks if chunk.startswith('id:')]
+        assert [event['event'] for event in events] == ['job_started', 'device_started', 'device_finished', 'job_finished']
+        assert events[-1]['progress']['succeeded'] == 1
+
+    @pytest.mark.asyncio
+    async def test_cancel(self):
+        """Отмена задачи помечает необработанные устройства"""
+        async def apply(device, changes):
+            await asyncio.sleep(10)
+
+        manager = FleetJobManager()
+        with patch('app.fleet_jobs.apply_device_changes', side_effect=apply):
+            with patch('app.database.get_firewall_devices_list', AsyncMock(return_value=DEVICES)):
+                job = await manager.submit({'all': True}, [{'action': 'dns_block', 'domain': 'a.com'}], concurrency=1)
+            await asyncio.sleep(0.01)
+            assert manager.cancel(job.id) is True
+            await asyncio.gather(job.task, return_exceptions=True)
+
+        assert job.status == 'cancelled'
+        assert job.counts()['cancelled'] == 4
+
+
+class TestApplyIPChanges:
+    """Тесты применения IP изменений на устройстве"""
+
+    def test_block_is_idempotent(self):
+        """Существующие правила не добавляются повторно при повторе задачи"""
+        ssh = Mock()
+        ssh.send_command.side_effect = lambda command, **kwargs: (
+            IPTABLES_SAVE if command.startswith('iptables-save') else 'IPTABLES_RESTORE_RC=0'
+        )
+        result = apply_ip_changes(ssh, NETMIKO_DEVICE, [
+            {'ip': '10.0.0.1', 'port': '', 'direction': 'both'},
+            {'ip': '10.0.0.2', 'port': '', 'direction': 'in'},
+        ], [])
+
+        assert result == {'ip_added': 2, 'ip_removed': 0}
+        payload = ''.join(call[0][0] for call in ssh.send_command.call_args_list if 'printf' in call[0][0])
+        assert 'blocked_ip:10.0.0.2:in' in payload
+        assert 'blocked_ip:10.0.0.1' not in payload
+
+    def test_unblock_single_command(self):
+        """Удаление блокировки одной командой по спецификации правила"""
+        ssh = Mock()
+        ssh.send_command.return_value = IPTABLES_SAVE
+        result = apply_ip_changes(ssh, NETMIKO_DEVICE, [], ['10.0.0.9'])
+
+        assert result == {'ip_added': 0, 'ip_removed': 1}
+        commands = [call[0][0] for call in ssh.send_command.call_args_list]
+        assert 'iptables -D FORWARD -d 10.0.0.9/32 -m comment --comment blocked_ip:10.0.0.9:in -j DROP' in commands
+
+    def test_restore_failure_raises(self):
+        """Ошибка iptables-restore приводит к повтору"""
+        ssh = Mock()
+        ssh.send_command.side_effect = lambda command, **kwargs: (
+            IPTABLES_SAVE if command.startswith('iptables-save') else 'line 2 failed\nIPTABLES_RESTORE_RC=1'
+        )
+        with pytest.raises(RuntimeError):
+            apply_ip_changes(ssh, NETMIKO_DEVICE, [{'ip': '10.0.0.2', 'port': '', 'direction': 'in'}], [])
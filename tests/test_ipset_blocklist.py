@@ -0,0 +1,108 @@
+from unittest.mock import Mock, patch
+
+from app import ipset_blocklist
+from app.ipset_blocklist import (
+    SET_IN,
+    SET_OUT,
+    SET_PORT_IN,
+    SET_PORT_OUT,
+    build_ensure_command,
+    parse_ipset_save,
+    set_members_for,
+)
+
+
+IPSET_SAVE = f"""create {SET_IN} hash:ip family inet hashsize 4096 maxelem 1048576
+add {SET_IN} 10.0.0.1
+add {SET_IN} 10.0.0.2
+create {SET_OUT} hash:ip family inet hashsize 4096 maxelem 1048576
+add {SET_OUT} 10.0.0.1
+create {SET_PORT_IN} hash:ip,port family inet hashsize 4096 maxelem 1048576
+add {SET_PORT_IN} 10.0.0.3,tcp:443
+create {SET_PORT_OUT} hash:ip,port family inet hashsize 4096 maxelem 1048576
+create other_set hash:ip family inet hashsize 1024 maxelem 65536
+add other_set 10.9.9.9
+"""
+
+
+class TestIPSetCommands:
+    """Тесты формирования команд ipset"""
+
+    def test_set_mode_flag(self):
+        """Режим ipset включается настройкой"""
+        with patch('app.ipset_blocklist.IP_BLOCK_MODE', 'ipset'):
+            assert ipset_blocklist.is_set_mode() is True
+        with patch('app.ipset_blocklist.IP_BLOCK_MODE', 'rules'):
+            assert ipset_blocklist.is_set_mode() is False
+
+    def test_members_for_direction(self):
+        """Элементы множеств по направлению и порту"""
+        assert set_members_for('10.0.0.1') == [(SET_IN, '10.0.0.1'), (SET_OUT, '10.0.0.1')]
+        assert set_members_for('10.0.0.1', '443', 'in') == [(SET_PORT_IN, '10.0.0.1,tcp:443')]
+        assert set_members_for('10.0.0.1', '', 'out') == [(SET_OUT, '10.0.0.1')]
+
+    def test_ensure_command_idempotent(self):
+        """Подготовка устройства не дублирует множества и правила"""
+        command = build_ensure_command()
+        assert command.count('ipset -exist create') == 4
+        # Одно правило на цепочку и направление, добавляется только при отсутствии
+        assert command.count('iptables -C') == 6
+        assert command.count('|| iptables -I') == 6
+
+    def test_parse_ipset_save(self):
+        """Из вывода ipset save берутся только наши множества"""
+        sets = parse_ipset_save(IPSET_SAVE)
+        assert sets[SET_IN] == ['10.0.0.1', '10.0.0.2']
+        assert sets[SET_PORT_IN] == ['10.0.0.3,tcp:443']
+        assert sets[SET_PORT_OUT] == []
+        assert 'other_set' not in sets
+
+
+class TestIPSetOperations:
+    """Тесты операций со множествами на устройстве"""
+
+    def test_read_blocked(self):
+        """Список блокировок читается одной командой"""
+        ssh = Mock()
+        ssh.send_command.return_value = IPSET_SAVE
+        blocked = ipset_blocklist.read_blocked(ssh)
+
+        ssh.send_command.assert_called_once()
+        assert ('10.0.0.3', '443', 'in') in blocked
+        assert ('10.0.0.1', '', 'out') in blocked
+        assert len(blocked) == 4
+
+    def test_block_single_round_trip(self):
+        """Блокировка - одна команда: подготовка и добавление в множества"""
+        ssh = Mock()
+        assert ipset_blocklist.block(ssh, '10.0.0.5', '', 'both') == 2
+
+        ssh.send_command.assert_called_once()
+        command = ssh.send_command.call_args[0][0]
+        assert f'ipset -exist add {SET_IN} 10.0.0.5' in command
+        assert f'ipset -exist add {SET_OUT} 10.0.0.5' in command
+
+    def test_unblock(self):
+        """Разблокировка удаляет все элементы с данным IP"""
+        ssh = Mock()
+        ssh.send_command.return_value = IPSET_SAVE
+        assert ipset_blocklist.unblock(ssh, '10.0.0.1') == 2
+
+        command = ssh.send_command.call_args[0][0]
+        assert f'del {SET_IN} 10.0.0.1' in command
+        assert f'del {SET_OUT} 10.0.0.1' in command
+        assert '10.0.0.2' not in command
+
+    def test_unblock_not_found(self):
+        """Разблокировка отсутствующего IP не выполняет удаление"""
+        ssh = Mock()
+        ssh.send_command.return_value = IPSET_SAVE
+        assert ipset_blocklist.unblock(ssh, '10.0.0.99') == 0
+        ssh.send_command.assert_called_once()
+
+    def test_clear(self):
+        """Очистка сбрасывает множества целиком"""
+        ssh = Mock()
+        ssh.send_command.return_value = IPSET_SAVE
+        assert ipset_blocklist.clear(ssh) == 4
+        assert ssh.send_command.call_args[0][0].count('ipset flush') == 4
@@ -0,0 +1,124 @@
+from unittest.mock import Mock
+
+from app.iptables_parser import (
+    RuleIndexCache,
+    build_delete_command,
+    parse_iptables_save,
+)
+
+
+IPTABLES_SAVE = """# Generated by iptables-save v1.8.7
+*nat
+:PREROUTING ACCEPT [0:0]
+-A PREROUTING -d 10.0.0.1/32 -j DROP
+COMMIT
+*filter
+:INPUT ACCEPT [120:9000]
+:FORWARD DROP [0:0]
+:OUTPUT ACCEPT [80:6400]
+-A INPUT -d 10.0.0.1/32 -m comment --comment blocked_ip:10.0.0.1:in -j DROP
+-A INPUT -i lo -j ACCEPT
+-A FORWARD -d 10.0.0.2/32 -p tcp -m tcp --dport 443 -m comment --comment blocked_ip:10.0.0.2:443:in -j DROP
+-A FORWARD -d 10.0.0.1/32 -m comment --comment blocked_ip:10.0.0.1:in -j DROP
+-A FORWARD -s 10.0.0.3/32 -j DROP
+-A FORWARD ! -s 10.0.0.4/32 -m comment --comment "allow from lan" -j ACCEPT
+-A OUTPUT -d 10.0.0.1/32 -m comment --comment blocked_ip:10.0.0.1:out -j DROP
+COMMIT
+"""
+
+
+class TestParseIptablesSave:
+    """Тесты разбора вывода iptables-save"""
+
+    def test_chains_and_numbers(self):
+        """Правила нумеруются по порядку внутри цепочки, таблица nat пропускается"""
+        index = parse_iptables_save(IPTABLES_SAVE)
+
+        assert set(index.chains) == {'INPUT', 'FORWARD', 'OUTPUT'}
+        assert index.policies['FORWARD'] == 'DROP'
+        assert index.rule_count == 7
+        assert index.get('FORWARD', 2).destination == '10.0.0.1/32'
+        assert index.get('INPUT', 2).target == 'ACCEPT'
+
+    def test_rule_fields(self):
+        """Условия, цель и комментарий правила"""
+        rule = parse_iptables_save(IPTABLES_SAVE).get('FORWARD', 1)
+
+        assert rule.protocol == 'tcp'
+        assert rule.dport == '443'
+        assert rule.target == 'DROP'
+        assert rule.comment == 'blocked_ip:10.0.0.2:443:in'
+        assert (rule.blocked_ip, rule.blocked_port, rule.direction) == ('10.0.0.2', '443', 'in')
+
+    def test_quoted_comment_and_negation(self):
+        """Комментарий в кавычках и отрицание условия"""
+        rule = parse_iptables_save(IPTABLES_SAVE).get('FORWARD', 4)
+
+        assert rule.comment == 'allow from lan'
+        assert rule.source == '!10.0.0.4/32'
+        assert rule.addresses() == []
+        assert rule.blocked_ip is None
+
+    def test_rules_for_ip(self):
+        """Поиск правил блокировки по комментарию и по адресу"""
+        index = parse_iptables_save(IPTABLES_SAVE)
+
+        assert [(rule.chain, rule.number) for rule in index.rules_for_ip('10.0.0.1')] == [
+            ('INPUT', 1), ('FORWARD', 2), ('OUTPUT', 1)
+        ]
+        # Правило без комментария находится по адресу
+        assert [(rule.chain, rule.number) for rule in index.rules_for_ip('10.0.0.3')] == [('FORWARD', 3)]
+        assert index.rules_for_ip('10.0.0.9') == []
+
+    def test_delete_command_by_spec(self):
+        """Удаление по спецификации правила одной командой"""
+        index = parse_iptables_save(IPTABLES_SAVE)
+        command = build_delete_command(index.rules_for_ip('10.0.0.3'))
+        assert command == 'iptables -D FORWARD -s 10.0.0.3/32 -j DROP'
+
+
+class TestRuleIndexCache:
+    """Тесты кэша индексов правил"""
+
+    def test_cached_until_invalidated(self):
+        """Индекс читается с устройства один раз до собственного изменения правил"""
+        cache = RuleIndexCache(ttl=60)
+        ssh = Mock()
+        ssh.send_command.return_value = IPTABLES_SAVE
+
+        first = cache.get('dev', ssh)
+        assert cache.get('dev', ssh) is first
+        ssh.send_command.assert_called_once()
+
+        cache.invalidate('dev')
+        second = cache.get('dev', ssh)
+        assert second is not first
+        assert second.version == first.version + 1
+        assert cache.get_stats()['hits'] == 1
+
+    def test_ttl_expiry(self):
+        """Устаревший индекс перечитывается"""
+        cache = RuleIndexCache(ttl=0)
+        ssh = Mock()
+        ssh.send_command.return_value = IPTABLES_SAVE
+
+        cache.get('dev', ssh)
+        cache.get('dev', ssh)
+        assert ssh.send_command.call_count == 2
+
+    def test_stale_read_not_cached(self):
+        """Индекс, прочитанный до изменения правил, не попадает в кэш"""
+        cache = RuleIndexCache(ttl=60)
+        ssh = Mock()
+
+        def read_then_invalidate(*args, **kwargs):
+            # Параллельная запись правил во время чтения
+            cache.invalidate('dev')
+            return IPTABLES_SAVE
+
+        ssh.send_command.side_effect = read_then_invalidate
+        cache.get('dev', ssh)
+        ssh.send_command.side_effect = None
+        ssh.send_command.return_value = IPTABLES_SAVE
+        cache.get('dev', ssh)
+        assert ssh.send_command.call_count == 2
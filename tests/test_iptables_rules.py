@@ -0,0 +1,80 @@
+from app.iptables_rules import (
+    RESTORE_RC_MARKER,
+    build_block_rules,
+    build_restore_commands,
+    build_restore_payload,
+    parse_restore_result,
+    validate_block_entry,
+)
+
+
+class TestBlockRules:
+    """Тесты формирования правил блокировки"""
+
+    def test_validate_block_entry(self):
+        """Проверка параметров блокировки"""
+        assert validate_block_entry('10.0.0.1') is None
+        assert validate_block_entry('10.0.0.1', '443', 'in') is None
+        assert 'required' in validate_block_entry('')
+        assert 'Invalid IP address format' in validate_block_entry('example.com')
+        assert validate_block_entry('10.0.0.300') == 'Invalid IP address'
+        assert validate_block_entry('10.0.0.1', '70000') == 'Invalid port'
+        assert validate_block_entry('10.0.0.1', '80; reboot') == 'Invalid port'
+        assert 'Direction' in validate_block_entry('10.0.0.1', '', 'sideways')
+
+    def test_rules_without_port(self):
+        """Без порта блокируются FORWARD, INPUT и OUTPUT"""
+        rules = build_block_rules('10.0.0.1')
+        assert [chain for chain, _ in rules] == ['FORWARD', 'INPUT', 'FORWARD', 'OUTPUT']
+        assert all('--comment blocked_ip:10.0.0.1:' in spec for _, spec in rules)
+
+    def test_rules_with_port(self):
+        """С портом блокируется только FORWARD по нужному направлению"""
+        rules = build_block_rules('10.0.0.1', '443', 'in')
+        assert rules == [('FORWARD', '-d 10.0.0.1 -p tcp --dport 443 -j DROP -m comment --comment blocked_ip:10.0.0.1:443:in')]
+
+
+class TestRestorePayload:
+    """Тесты транзакции iptables-restore"""
+
+    def test_payload(self):
+        """Все правила попадают в одну транзакцию таблицы filter"""
+        payload = build_restore_payload(build_block_rules('10.0.0.1', '', 'in'))
+        assert payload.splitlines() == [
+            '*filter',
+            '-I FORWARD 1 -d 10.0.0.1 -j DROP -m comment --comment blocked_ip:10.0.0.1:in',
+            '-I INPUT 1 -d 10.0.0.1 -j DROP -m comment --comment blocked_ip:10.0.0.1:in',
+            'COMMIT',
+        ]
+
+    def test_single_command(self):
+        """Небольшой ruleset применяется одной командой"""
+        commands = build_restore_commands(build_restore_payload(build_block_rules('10.0.0.1')))
+        assert len(commands) == 1
+        assert 'iptables-restore --noflush' in commands[0]
+        assert RESTORE_RC_MARKER in commands[0]
+
+    def test_large_ruleset_chunked(self):
+        """Большой ruleset передаётся порциями через временный файл"""
+        rules = []
+        for i in range(500):
+            rules.extend(build_block_rules(f'10.0.{i // 256}.{i % 256}'))
+        commands = build_restore_commands(build_restore_payload(rules), tmp_path='/tmp/rules', chunk_size=4096)
+
+        assert len(commands) > 2
+        assert commands[0].endswith('> /tmp/rules')
+        assert all(command.endswith('>> /tmp/rules') for command in commands[1:-1])
+        assert commands[-1].startswith('iptables-restore --noflush < /tmp/rules')
+        # Каждая порция режется по границе строки
+        assert all(len(command) < 4096 + 200 for command in commands)
+        restored = ''.join(command.split("'")[1] for command in commands[:-1]).replace('\\n', '\n')
+        assert restored == build_restore_payload(rules)
+        assert restored.count('-I ') == len(rules)
+
+    def test_parse_restore_result(self):
+        """Разбор кода возврата iptables-restore"""
+        assert parse_restore_result(f'{RESTORE_RC_MARKER}0') == (True, '')
+        ok, message = parse_restore_result(f'iptables-restore: line 3 failed\n{RESTORE_RC_MARKER}1')
+        assert ok is False
+        assert message == 'iptables-restore: line 3 failed'
+        assert parse_restore_result('')[0] is False
@@ -0,0 +1,136 @@
+from unittest.mock import patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.latency import (
+    BUCKETS,
+    LatencyHistogram,
+    LatencyTracker,
+    WindowedLatencyHistogram,
+    bucket_index,
+    bucket_upper,
+    status_class,
+)
+from app.metrics import MetricsCollector
+from app.middleware import ActivityTrackingMiddleware
+
+
+class TestLatencyHistogram:
+    """Тесты гистограммы времени ответа"""
+
+    def test_bucket_bounds(self):
+        """Значение не больше верхней границы своей корзины, погрешность около 9%"""
+        for value in (0.00005, 0.0001, 0.0013, 0.05, 0.9, 12.0):
+            index = bucket_index(value)
+            assert value <= bucket_upper(index)
+            if index > 0:
+                assert bucket_upper(index) / value < 1.1
+        assert bucket_index(10 ** 6) == BUCKETS - 1
+
+    def test_percentiles(self):
+        """Перцентили с точностью корзины, хвост не теряется"""
+        histogram = LatencyHistogram()
+        for _ in range(990):
+            histogram.record(0.010)
+        for _ in range(10):
+            histogram.record(2.0)
+
+        assert abs(histogram.percentile(0.5) - 0.010) / 0.010 < 0.1
+        assert abs(histogram.percentile(0.99) - 0.010) / 0.010 < 0.1
+        assert histogram.percentile(0.999) == 2.0
+        assert histogram.to_dict()["max"] == 2.0
+        assert histogram.mean == pytest.approx((990 * 0.010 + 10 * 2.0) / 1000)
+
+    def test_empty(self):
+        """Пустая гистограмма - нули"""
+        assert LatencyHistogram().to_dict() == {"count": 0, "avg": 0.0, "max": 0.0,
+                                                "p50": 0.0, "p90": 0.0, "p99": 0.0, "p999": 0.0}
+
+    def test_merge(self):
+        """Слияние гистограмм суммирует корзины"""
+        first, second = LatencyHistogram(), LatencyHistogram()
+        first.record(0.01)
+        second.record(0.5)
+        first.merge(second)
+
+        assert first.count == 2
+        assert first.max == 0.5
+        assert first.percentile(1.0) == 0.5
+
+
+class TestWindowedLatencyHistogram:
+    """Тесты скользящего окна"""
+
+    def test_old_slots_expire(self):
+        """Запросы старше окна не учитываются"""
+        histogram = WindowedLatencyHistogram(window=60, slots=6)
+        histogram.record(1.0, now=1000.0)
+        histogram.record(0.01, now=1055.0)
+
+        assert histogram.snapshot(now=1055.0).count == 2
+        assert histogram.snapshot(now=1065.0).count == 1
+        assert histogram.snapshot(now=1200.0).count == 0
+
+    def test_slot_reused(self):
+        """Слот нового периода обнуляется перед записью"""
+        histogram = WindowedLatencyHistogram(window=60, slots=6)
+        histogram.record(1.0, now=1000.0)
+        histogram.record(0.01, now=1060.0)
+
+        snapshot = histogram.snapshot(now=1060.0)
+        assert snapshot.count == 1
+        assert snapshot.max == 0.01
+
+
+class TestLatencyTracker:
+    """Тесты гистограмм по маршрутам"""
+
+    def test_series_by_route_and_status(self):
+        """Ряды по маршруту и классу статуса, общая гистограмма по всем"""
+        tracker = LatencyTracker()
+        tracker.record(0.01, "GET /api/devices", "2xx", now=100.0)
+        tracker.record(0.02, "GET /api/devices", "2xx", now=100.0)
+        tracker.record(1.5, "GET /api/devices", "5xx", now=100.0)
+
+        routes = tracker.by_route(now=100.0)
+        assert [(item["route"], item["status_class"], item["count"]) for item in routes] == [
+            ("GET /api/devices", "2xx", 2), ("GET /api/devices", "5xx", 1)]
+        assert tracker.overall(now=100.0).count == 3
+
+    def test_series_bounded(self):
+        """Маршруты сверх лимита учитываются в общем ряду"""
+        tracker = LatencyTracker(max_series=2)
+        for index in range(10):
+            tracker.record(0.01, f"GET /route{index}", "2xx", now=100.0)
+
+        assert len(tracker.series) == 3
+        assert tracker.series[("other", "2xx")].snapshot(now=100.0).count == 8
+
+    def test_status_class(self):
+        assert status_class(404) == "4xx"
+        assert status_class(None) == "unknown"
+
+
+class TestLatencyMiddleware:
+    """Тесты записи времени ответа middleware"""
+
+    def test_route_template_recorded(self):
+        """Записывается шаблон маршрута, а не фактический путь"""
+        app = FastAPI()
+        app.add_middleware(ActivityTrackingMiddleware)
+
+        @app.get("/items/{item_id}")
+        async def get_item(item_id: int):
+            return {"id": item_id}
+
+        collector = MetricsCollector()
+        with patch('app.middleware.metrics_collector', collector):
+            client = TestClient(app)
+            client.get("/items/1")
+            client.get("/items/2")
+            client.get("/missing")
+
+        routes = {(item["route"], item["status_class"]): item["count"] for item in collector.latency.by_route()}
+        assert routes == {("GET /items/{item_id}", "2xx"): 2, ("unmatched", "4xx"): 1}
@@ -0,0 +1,108 @@
+import time
+from datetime import datetime
+
+from app.metric_store import MetricSeries, downsample, mean
+from app.metrics import MetricsCollector, SystemMetrics
+
+
+def system(timestamp: float, cpu: float) -> SystemMetrics:
+    return SystemMetrics(datetime.fromtimestamp(timestamp), cpu, cpu + 1, cpu + 2, int(cpu), int(cpu))
+
+
+class TestMetricSeries:
+    """Тесты колоночного кольцевого буфера метрик"""
+
+    def test_ring_buffer(self):
+        """Буфер хранит последние capacity записей, как deque(maxlen)"""
+        series = MetricSeries(SystemMetrics, 3)
+        for i in range(5):
+            series.append(system(1000 + i, float(i)))
+
+        assert len(series) == 3
+        assert [record.cpu_percent for record in series] == [2.0, 3.0, 4.0]
+        assert series[-1].network_bytes_sent == 4
+        assert series[0].timestamp == datetime.fromtimestamp(1002)
+
+    def test_select_window(self):
+        """Окно (start, end] по двоичному поиску, в том числе после переполнения"""
+        series = MetricSeries(SystemMetrics, 4)
+        for i in range(6):
+            series.append(system(1000 + i * 10, float(i)))
+
+        data = series.select(1025, 1045)
+        assert list(data["timestamp"]) == [1030.0, 1040.0]
+        assert list(data["cpu_percent"]) == [3.0, 4.0]
+        assert data["network_bytes_sent"].typecode == "q"
+        assert list(series.select(1045)["cpu_percent"]) == [5.0]
+        assert len(series.select(2000)["timestamp"]) == 0
+
+    def test_timestamps_not_decreasing(self):
+        """Запись с более ранним временем не нарушает порядок колонки времени"""
+        series = MetricSeries(SystemMetrics, 4)
+        series.append(system(1000, 1.0))
+        series.append(system(900, 2.0))
+
+        assert list(series.select()["timestamp"]) == [1000.0, 1000.0]
+
+    def test_rollup_for_long_ranges(self):
+        """Период старше заполненного буфера отвечает свёрнутый ряд средних"""
+        series = MetricSeries(SystemMetrics, 10, rollup_seconds=100, rollup_capacity=100)
+        for i in range(100):
+            series.append(system(i * 10, float(i % 10)))
+
+        assert len(series.rollup) == 9
+        assert list(series.rollup.select()["cpu_percent"]) == [4.5] * 9
+        assert list(series.select(900)["cpu_percent"]) == [float(i) for i in range(1, 10)]
+        assert len(series.select(0)["timestamp"]) == 8
+
+    def test_rollup_not_used_until_full(self):
+        """Пока буфер не заполнен, выборка берётся из него"""
+        series = MetricSeries(SystemMetrics, 100, rollup_seconds=100, rollup_capacity=100)
+        for i in range(30):
+            series.append(system(i * 10, 1.0))
+
+        assert len(series.select(-1)["timestamp"]) == 30
+
+    def test_downsample(self):
+        """Средние по равным корзинам, пустые корзины пропускаются"""
+        series = MetricSeries(SystemMetrics, 100)
+        for i in range(10):
+            series.append(system(i, float(i)))
+
+        result = downsample(series.select(-1), -1, 9, 5)
+        assert result["timestamp"] == [-1, 1, 3, 5, 7]
+        assert result["cpu_percent"] == [0.5, 2.5, 4.5, 6.5, 8.5]
+        assert result["network_bytes_sent"] == [0, 2, 4, 6, 8]
+
+        assert downsample(series.select(), 100, 200, 4)["timestamp"] == []
+        assert mean(series.select(100)["cpu_percent"]) == 0.0
+
+
+class TestChartData:
+    """Тесты данных графиков по колоночной истории"""
+
+    def test_long_range_downsampled(self):
+        """За длинный период точек не больше METRICS_CHART_POINTS"""
+        collector = MetricsCollector(max_history=5000)
+        now = time.time()
+        for i in range(2000):
+            collector.system_metrics.append(system(now - 7 * 86400 + i * 300, 10.0))
+
+        data = collector.get_chart_data(hours=168)
+
+        assert 0 < len(data["system"]["cpu"]) <= 288
+        assert set(data["system"]["cpu"]) == {10.0}
+        assert len(data["system"]["labels"]) == len(data["system"]["cpu"])
+        assert "." in data["system"]["labels"][0]
+
+    def test_short_range_raw_points(self):
+        """Короткий период - точки без усреднения"""
+        collector = MetricsCollector()
+        now = time.time()
+        for i in range(3):
+            collector.system_metrics.append(system(now - 60 * (3 - i), float(i)))
+
+        data = collector.get_chart_data(hours=1)
+
+        assert data["system"]["cpu"] == [0.0, 1.0, 2.0]
+        assert data["application"]["labels"] == []
@@ -8,6 +8,7 @@ from app.metrics import (
     SystemMetrics,
     ApplicationMetrics,
     SecurityMetrics,
+    WindowedCounter,
     start_metrics_collection
 )
 
@@ -177,8 +178,8 @@ class TestMetricsCollector:
         collector = MetricsCollector()
         
         # Добавляем время ответа
-        collector.response_times.append(0.1)
-        collector.response_times.append(0.2)
+        collector.latency.record(0.1)
+        collector.latency.record(0.2)
         collector.request_count = 100
         collector.error_count = 10
         
@@ -192,6 +193,8 @@ class TestMetricsCollector:
         assert metrics.total_requests == 100
         assert metrics.error_requests == 10
         assert metrics.avg_response_time == pytest.approx(0.15)  # (0.1 + 0.2) / 2
+        assert metrics.p50_response_time == pytest.approx(0.1, rel=0.1)
+        assert metrics.p99_response_time == pytest.approx(0.2)
         assert metrics.firewall_rules_count == 20
         assert metrics.active_sessions == 3
         assert len(collector.app_metrics) == 1
@@ -236,8 +239,8 @@ class TestMetricsCollector:
         
         assert collector.request_count == 1
         assert collector.error_count == 0
-        assert len(collector.response_times) == 1
-        assert collector.response_times[0] == 0.1
+        assert collector.latency.overall().count == 1
+        assert collector.latency.overall().sum == 0.1
     
     def test_record_request_error(self):
         """Тест записи запроса с ошибкой"""
@@ -247,10 +250,9 @@ class TestMetricsCollector:
         
         assert collector.request_count == 1
         assert collector.error_count == 1
-        assert len(collector.response_times) == 1
-        assert collector.response_times[0] == 0.5
-        assert len(collector.error_codes) == 1
-        assert collector.error_codes[0] == 500
+        assert collector.latency.overall().count == 1
+        assert collector.latency.by_route()[0]["status_class"] == "5xx"
+        assert collector.error_codes.totals() == {500: 1}
     
     def test_record_failed_login(self):
         """Тест записи неудачной попытки входа"""
@@ -330,8 +332,8 @@ class TestMetricsCollector:
         # Добавляем данные запросов
         collector.request_count = 100
         collector.error_count = 10
-        collector.response_times.append(0.1)
-        collector.response_times.append(0.2)
+        collector.latency.record(0.1)
+        collector.latency.record(0.2)
         
         # Добавляем данные безопасности
         collector.failed_logins = 5
@@ -350,6 +352,7 @@ class TestMetricsCollector:
         assert summary["application"]["total_requests"] == 100
         assert summary["application"]["error_rate"] == 10.0  # 10 / 100 * 100
         assert summary["application"]["avg_response_time"] == 0.15  # (0.1 + 0.2) / 2
+        assert summary["application"]["response_time_percentiles"]["p99"] == 0.2
         assert summary["application"]["failed_logins"] == 5
         assert summary["application"]["blocked_ips"] == 1
         assert summary["application"]["suspicious_activities"] == 2
@@ -410,6 +413,39 @@ class TestMetricsCollector:
         assert collector.system_metrics[-1].cpu_percent == 4.0
         assert collector.system_metrics[-2].cpu_percent == 3.0
 
+class TestWindowedCounter:
+    """Тесты счётчиков ошибок по корзинам времени"""
+
+    def test_counts_within_window(self):
+        """Суммы по кодам за окно, старые корзины не учитываются"""
+        counter = WindowedCounter(window=3600, slots=6)
+        counter.add(500, now=0.0)
+        counter.add(404, now=1000.0)
+        counter.add(404, now=3000.0)
+
+        assert counter.totals(now=3000.0) == {500: 1, 404: 2}
+        assert counter.totals(now=3700.0) == {404: 2}
+        assert counter.totals(seconds=600, now=3000.0) == {404: 1}
+
+    def test_memory_bounded(self):
+        """Память не растёт с числом ошибок: одна запись на код в корзине"""
+        counter = WindowedCounter(window=3600, slots=6)
+        for i in range(100000):
+            counter.add(429, now=i * 0.005)
+
+        assert sum(len(bucket) for bucket in counter.buckets) == 1
+        assert counter.totals(now=1000.0) == {429: 100000}
+
+    def test_summary_uses_counters(self):
+        """Сводка ошибок строится по счётчикам"""
+        collector = MetricsCollector()
+        collector.system_metrics.append(SystemMetrics(datetime.now(), 1.0, 1.0, 1.0, 0, 0))
+        for code in (500, 500, 404):
+            collector.record_request(0.1, True, code)
+
+        summary = collector.get_metrics_summary()
+        assert summary["errors_detail"] == [{"code": 500, "count": 2}, {"code": 404, "count": 1}]
+
 class TestStartMetricsCollection:
     """Тесты для функции start_metrics_collection"""
     
@@ -427,6 +463,34 @@ class TestStartMetricsCollection:
             # Проверяем, что sleep был вызван
             mock_sleep.assert_called_once()
 
+    @pytest.mark.asyncio
+    async def test_collection_does_not_block_event_loop(self):
+        """Медленное чтение системных метрик не задерживает event loop"""
+        def slow_collect():
+            time.sleep(0.3)
+
+        collector = MetricsCollector()
+        collector.collect_system_metrics = slow_collect
+        with patch('app.metrics.metrics_collector', collector):
+            task = asyncio.create_task(start_metrics_collection(interval=0.01))
+            max_lag = 0.0
+            for _ in range(40):
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                max_lag = max(max_lag, time.perf_counter() - started - 0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        assert max_lag < 0.1
+
+    @patch('app.metrics.psutil')
+    def test_cpu_percent_non_blocking(self, mock_psutil):
+        """CPU читается без ожидания: cpu_percent(interval=None)"""
+        mock_psutil.cpu_percent.return_value = 10.0
+        MetricsCollector().collect_system_metrics()
+        mock_psutil.cpu_percent.assert_called_once_with(interval=None)
+
 class TestMetricsIntegration:
     """Интеграционные тесты метрик"""
     
@@ -0,0 +1,134 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from app.metrics import MetricsCollector
+from app.metrics_aggregation import MultiprocessAggregator, bucket_quantile, read_samples, subtract, summarize
+
+ROOT = Path(__file__).resolve().parent.parent
+
+WORKER = """
+from app.metrics import MetricsCollector
+collector = MetricsCollector()
+for _ in range({ok}):
+    collector.record_request({seconds}, route="GET /api/devices", status_code=200)
+for _ in range({failed}):
+    collector.record_request(0.5, True, 500, route="POST /api/devices", status_code=500)
+collector.record_failed_login("10.0.0.{worker}")
+collector.record_firewall_block()
+"""
+
+
+def run_worker(path: str, worker: int, ok: int, failed: int, seconds: float):
+    """Отдельный процесс-воркер, пишущий метрики в общий каталог"""
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": path}
+    code = WORKER.format(ok=ok, failed=failed, seconds=seconds, worker=worker)
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True, timeout=60)
+
+
+@pytest.fixture
+def metrics_dir(tmp_path):
+    return str(tmp_path)
+
+
+class TestBucketQuantile:
+    """Тесты оценки перцентилей по корзинам"""
+
+    def test_interpolation(self):
+        """Линейная интерполяция внутри корзины"""
+        buckets = [(0.1, 50.0), (0.2, 100.0), (float("inf"), 100.0)]
+        assert bucket_quantile(0.5, buckets) == pytest.approx(0.1)
+        assert bucket_quantile(0.75, buckets) == pytest.approx(0.15)
+
+    def test_above_last_bound(self):
+        """Значения выше последней конечной границы - оценка этой границей"""
+        buckets = [(0.1, 10.0), (float("inf"), 20.0)]
+        assert bucket_quantile(0.99, buckets) == 0.1
+
+    def test_empty(self):
+        assert bucket_quantile(0.5, []) == 0.0
+        assert bucket_quantile(0.5, [(0.1, 0.0), (float("inf"), 0.0)]) == 0.0
+
+    def test_subtract_handles_restart(self):
+        """Счётчик уменьшился (воркер перезапущен) - берётся текущее значение"""
+        assert subtract({"a": 5.0, "b": 2.0}, {"a": 3.0, "b": 7.0}) == {"a": 2.0, "b": 2.0}
+
+
+class TestMultiprocessAggregation:
+    """Тесты слияния метрик нескольких воркеров"""
+
+    def test_merges_workers(self, metrics_dir):
+        """Запросы, ошибки, время ответа и события безопасности суммируются по воркерам"""
+        run_worker(metrics_dir, 1, ok=30, failed=2, seconds=0.01)
+        run_worker(metrics_dir, 2, ok=20, failed=3, seconds=0.01)
+
+        result = summarize(read_samples(metrics_dir))
+
+        assert result["requests"] == 55
+        assert result["errors"] == 5
+        assert result["error_codes"] == {500: 5}
+        assert result["latency"]["count"] == 55
+        assert 0.008 <= result["latency"]["p50"] <= 0.0114
+        assert result["latency"]["p99"] >= 0.35
+        assert result["security"] == {"failed_login": 2, "firewall_block": 2}
+        # Gauge уникальных IP не суммируется по воркерам
+        assert "blocked_ips" not in result
+        routes = {item["route"]: item for item in result["latency_by_route"]}
+        assert routes["GET /api/devices"]["count"] == 50
+        assert routes["POST /api/devices"]["status_class"] == "5xx"
+
+    def test_windowed_values(self, metrics_dir):
+        """Перцентили и коды ошибок за окно - разница со снимком, общие счётчики - за всё время"""
+        aggregator = MultiprocessAggregator(path=metrics_dir, window=3600, snapshot_interval=60)
+        run_worker(metrics_dir, 1, ok=10, failed=4, seconds=0.5)
+        aggregator.summary(now=1000)
+
+        run_worker(metrics_dir, 2, ok=10, failed=0, seconds=0.002)
+        result = aggregator.summary(now=1030)
+
+        assert result["requests"] == 24
+        assert result["window_seconds"] == 30
+        assert result["latency"]["count"] == 10
+        assert result["latency"]["p99"] < 0.003
+        assert result["error_codes"] == {}
+
+    def test_snapshot_keeps_window_counters_only(self, metrics_dir):
+        """В снимке только счётчики для значений за окно: ошибки и гистограмма времени ответа"""
+        run_worker(metrics_dir, 1, ok=5, failed=1, seconds=0.01)
+        aggregator = MultiprocessAggregator(path=metrics_dir)
+        aggregator.summary(now=1000)
+
+        names = {name for name, _ in aggregator.history[0][1]}
+        assert names <= {"firewall_http_requests_total", "firewall_http_request_duration_seconds_bucket",
+                         "firewall_http_request_duration_seconds_count", "firewall_http_request_duration_seconds_sum"}
+        statuses = {dict(labels)["status"] for name, labels in aggregator.history[0][1] if name == "firewall_http_requests_total"}
+        assert statuses == {"500"}
+
+    def test_old_snapshots_dropped(self, metrics_dir):
+        """Снимки старше окна удаляются"""
+        aggregator = MultiprocessAggregator(path=metrics_dir, window=300, snapshot_interval=60)
+        for now in range(0, 1000, 60):
+            aggregator.summary(now=now)
+        assert len(aggregator.history) <= 300 // 60 + 1
+        assert 960 - aggregator.history[0][0] >= 300
+
+    def test_summary_uses_workers(self, metrics_dir):
+        """Сводка MetricsCollector в многопроцессном режиме берёт значения всех воркеров"""
+        run_worker(metrics_dir, 1, ok=8, failed=2, seconds=0.01)
+        aggregator = MultiprocessAggregator(path=metrics_dir)
+        collector = MetricsCollector()
+
+        with patch('app.metrics.multiprocess_enabled', return_value=True), \
+             patch('app.metrics.multiprocess_aggregator', aggregator):
+            summary = collector.get_metrics_summary(hours=1)
+
+        assert summary["application"]["total_requests"] == 10
+        assert summary["application"]["error_rate"] == 20.0
+        assert summary["application"]["failed_logins"] == 1
+        assert summary["application"]["blocked_ips_scope"] == "worker"
+        assert summary["errors_detail"] == [{"code": 500, "count": 2}]
+        assert summary["trends"]["requests_per_hour"] == 10
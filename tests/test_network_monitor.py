@@ -27,7 +27,7 @@ Columns: NAME, TYPE, ACTUAL-MTU, L2MTU, MAX-L2MTU, MAC-ADDRESS, LAST-LINK-DOWN,
         mock_connect_handler = Mock()
         mock_connect_handler.return_value = mock_context
         
-        with patch('app.network_monitor.ConnectHandler', mock_connect_handler):
+        with patch('app.ssh_executor.ssh_pool.lease', mock_connect_handler):
             result = await device_bandwidth('192.168.1.1', 'admin', 'password', 'mikrotik_routeros')
             
             # Проверяем результат
@@ -52,7 +52,7 @@ GigabitEthernet0/0     0     0    0     0     1000000  567   500000  234   0
         mock_connect_handler = Mock()
         mock_connect_handler.return_value = mock_context
         
-        with patch('app.network_monitor.ConnectHandler', mock_connect_handler):
+        with patch('app.ssh_executor.ssh_pool.lease', mock_connect_handler):
             result = await device_bandwidth('192.168.1.1', 'admin', 'password', 'unknown_device')
             
             # Проверяем, что используется fallback команда
@@ -74,7 +74,7 @@ GigabitEthernet0/0     0     0    0     0     1000000  567   500000  234   0
         mock_connect_handler = Mock()
         mock_connect_handler.return_value = mock_context
         
-        with patch('app.network_monitor.ConnectHandler', mock_connect_handler):
+        with patch('app.ssh_executor.ssh_pool.lease', mock_connect_handler):
             result = await device_bandwidth('192.168.1.1', 'admin', 'password', 'cisco_ios')
             
             # Проверяем результат
@@ -99,7 +99,7 @@ Serial0/0/0           0     0    0     0     0     0     0     0     0
         mock_connect_handler = Mock()
         mock_connect_handler.return_value = mock_context
         
-        with patch('app.network_monitor.ConnectHandler', mock_connect_handler):
+        with patch('app.ssh_executor.ssh_pool.lease', mock_connect_handler):
             result = await device_bandwidth('192.168.1.1', 'admin', 'password', 'cisco_ios')
             
             # Проверяем результат
@@ -129,7 +129,7 @@ invalid_line_without_rx_tx_data
         mock_connect_handler = Mock()
         mock_connect_handler.return_value = mock_context
         
-        with patch('app.network_monitor.ConnectHandler', mock_connect_handler):
+        with patch('app.ssh_executor.ssh_pool.lease', mock_connect_handler):
             result = await device_bandwidth('192.168.1.1', 'admin', 'password', 'mikrotik_routeros')
             
             # Проверяем, что только валидные интерфейсы обработаны
@@ -148,7 +148,7 @@ invalid_line_without_rx_tx_data
         mock_connect_handler = Mock()
         mock_connect_handler.side_effect = Exception("Connection failed")
         
-        with patch('app.network_monitor.ConnectHandler', mock_connect_handler):
+        with patch('app.ssh_executor.ssh_pool.lease', mock_connect_handler):
             with pytest.raises(HTTPException) as exc_info:
                 await device_bandwidth('192.168.1.1', 'admin', 'password', 'cisco_ios')
             
@@ -170,7 +170,7 @@ invalid_line_without_rx_tx_data
         mock_connect_handler = Mock()
         mock_connect_handler.return_value = mock_context
         
-        with patch('app.network_monitor.ConnectHandler', mock_connect_handler):
+        with patch('app.ssh_executor.ssh_pool.lease', mock_connect_handler):
             with pytest.raises(HTTPException) as exc_info:
                 await device_bandwidth('192.168.1.1', 'admin', 'password', 'cisco_ios')
             
@@ -198,16 +198,16 @@ GigabitEthernet0/0     0     0    0     0     1234  567   8901  234   0
         mock_connect_handler = Mock()
         mock_connect_handler.return_value = mock_context
         
-        with patch('app.network_monitor.ConnectHandler', mock_connect_handler):
+        with patch('app.ssh_executor.ssh_pool.lease', mock_connect_handler):
             result = await device_bandwidth('192.168.1.1', 'admin', 'password')
             # device_type по умолчанию = 'cisco_ios'
             
             # Проверяем, что используется cisco_ios по умолчанию
-            mock_connect_handler.assert_called_once_with(
-                device_type="cisco_ios",
-                host="192.168.1.1",
-                username="admin",
-                password="password"
-            )
+            mock_connect_handler.assert_called_once_with({
+                "device_type": "cisco_ios",
+                "host": "192.168.1.1",
+                "username": "admin",
+                "password": "password"
+            })
             
             assert 'interfaces' in result 
@@ -0,0 +1,76 @@
+from collections import namedtuple
+from unittest.mock import Mock, patch
+
+import psutil
+
+from app.process_attribution import ProcessNameCache, SocketIndex
+
+Addr = namedtuple("Addr", "ip port")
+Conn = namedtuple("Conn", "laddr raddr pid")
+
+
+class TestSocketIndex:
+    """Тесты индекса сокетов для привязки conntrack к процессам"""
+
+    def test_lookup_by_address(self):
+        """Процесс находится по локальному адресу и порту"""
+        cache = Mock()
+        cache.get.side_effect = lambda pid: f"proc{pid}"
+        index = SocketIndex([
+            Conn(Addr("192.168.1.100", 12345), Addr("8.8.8.8", 53), 1234),
+            Conn(Addr("::ffff:192.168.1.100", 8080), None, 42),
+            Conn(Addr("0.0.0.0", 22), None, 7),
+            Conn(None, None, 99),
+            Conn(Addr("192.168.1.100", 5000), None, None),
+        ], cache)
+
+        assert index.process_name("192.168.1.100", "12345") == "proc1234"
+        assert index.process_name("192.168.1.100", 8080) == "proc42"
+        # Слушающий на всех интерфейсах сокет
+        assert index.process_name("10.0.0.5", "22") == "proc7"
+        assert index.process_name("192.168.1.100", "5000") == "unknown"
+        assert index.process_name("192.168.1.100", None) == "unknown"
+
+    def test_single_snapshot(self):
+        """Сокеты запрашиваются один раз на индекс"""
+        with patch("psutil.net_connections", return_value=[]) as mock_connections:
+            index = SocketIndex.snapshot()
+            for port in range(1000):
+                index.pid_for("192.168.1.1", port)
+        mock_connections.assert_called_once_with(kind="inet")
+
+    def test_snapshot_access_denied(self):
+        """Без прав на список сокетов индекс пустой"""
+        with patch("psutil.net_connections", side_effect=psutil.AccessDenied()):
+            assert len(SocketIndex.snapshot()) == 0
+
+
+class TestProcessNameCache:
+    """Тесты кэша имён процессов"""
+
+    def test_cached_within_ttl(self):
+        """Имя процесса запрашивается один раз за время жизни"""
+        cache = ProcessNameCache(ttl=60)
+        with patch("psutil.Process") as mock_process:
+            mock_process.return_value.name.return_value = "nginx"
+            assert cache.get(1) == "nginx"
+            assert cache.get(1) == "nginx"
+        mock_process.assert_called_once_with(1)
+        assert cache.get_stats()["hits"] == 1
+
+    def test_expired_and_dead_process(self):
+        """Устаревшее имя перечитывается, завершившийся процесс даёт None"""
+        cache = ProcessNameCache(ttl=0)
+        with patch("psutil.Process", side_effect=psutil.NoSuchProcess(1)) as mock_process:
+            assert cache.get(1) is None
+            assert cache.get(1) is None
+        assert mock_process.call_count == 2
+
+    def test_size_bound(self):
+        """При превышении max_size устаревшие записи убираются"""
+        cache = ProcessNameCache(ttl=0, max_size=3)
+        with patch("psutil.Process") as mock_process:
+            mock_process.return_value.name.return_value = "nginx"
+            for pid in range(10):
+                cache.get(pid)
+        assert cache.get_stats()["entries"] <= 3
@@ -0,0 +1,94 @@
+import inspect
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.device_probe import probe_device_reachability
+from app.metrics import MetricsCollector
+from app.prometheus_metrics import prometheus_metrics, registry, router
+from app.rate_limiting import rate_limit_middleware
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+def sample(name: str, labels: dict | None = None) -> float:
+    return registry.get_sample_value(name, labels or {}) or 0.0
+
+
+class TestPrometheusEndpoint:
+    """Тесты выдачи метрик в формате Prometheus"""
+
+    def test_exposition_format(self):
+        """Метрики запросов и состояния пулов в текстовом формате"""
+        before = sample("firewall_http_requests_total", {"route": "GET /api/devices", "status": "200"})
+        MetricsCollector().record_request(0.02, route="GET /api/devices", status_code=200)
+
+        response = client.get("/api/metrics/prometheus")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert sample("firewall_http_requests_total", {"route": "GET /api/devices", "status": "200"}) == before + 1
+        assert 'firewall_http_request_duration_seconds_bucket{le="0.022627",route="GET /api/devices",status_class="2xx"}' \
+            in response.text
+        for name in ("firewall_ssh_pool_sessions", "firewall_ssh_executor_queue_depth",
+                     "firewall_db_pool_in_use", "firewall_devices"):
+            assert f"\n{name} " in response.text
+
+    def test_scrape_without_db_and_processes(self):
+        """Сбор метрик не обращается к БД и не запускает процессы"""
+        with patch('app.db_pool.acquire_connection') as mock_acquire, \
+             patch('subprocess.run') as mock_run, \
+             patch('subprocess.Popen') as mock_popen:
+            response = client.get("/api/metrics/prometheus")
+
+        assert response.status_code == 200
+        mock_acquire.assert_not_called()
+        mock_run.assert_not_called()
+        mock_popen.assert_not_called()
+
+    def test_scrape_off_event_loop(self):
+        """Обработчик - обычная функция: FastAPI выполняет его в пуле потоков"""
+        assert not inspect.iscoroutinefunction(prometheus_metrics)
+
+    def test_token_required(self):
+        """При заданном токене без заголовка Authorization - ошибка 401"""
+        with patch('app.prometheus_metrics.PROMETHEUS_METRICS_TOKEN', 'secret'):
+            assert client.get("/api/metrics/prometheus").status_code == 401
+            assert client.get("/api/metrics/prometheus", headers={"Authorization": "Bearer wrong"}).status_code == 401
+            response = client.get("/api/metrics/prometheus", headers={"Authorization": "Bearer secret"})
+        assert response.status_code == 200
+
+
+class TestPrometheusInstrumentation:
+    """Тесты записи метрик опроса устройств и rate limiting"""
+
+    @pytest.mark.asyncio
+    async def test_device_probe_duration(self):
+        """Проверка доступности устройства попадает в гистограмму по результату"""
+        before = sample("firewall_device_probe_duration_seconds_count", {"result": "unreachable"})
+        await probe_device_reachability("")
+        assert sample("firewall_device_probe_duration_seconds_count", {"result": "unreachable"}) == before + 1
+
+    @pytest.mark.asyncio
+    async def test_rate_limit_decisions(self):
+        """Решения rate limiting считаются по типу"""
+        request = Mock()
+        request.client.host = "10.0.0.1"
+        request.state = Mock(spec=[])
+        call_next = AsyncMock(return_value=Mock(headers={}))
+        blocked = sample("firewall_rate_limit_decisions_total", {"decision": "blocked"})
+        allowed = sample("firewall_rate_limit_decisions_total", {"decision": "allowed"})
+        info = {"limit": 1, "remaining": 0, "reset": 0, "reset_time": "", "current_requests": 2}
+
+        with patch('app.rate_limiting.rate_limiter.is_allowed', new_callable=AsyncMock,
+                   side_effect=[(True, info), (False, info)]):
+            await rate_limit_middleware(request, call_next)
+            response = await rate_limit_middleware(request, call_next)
+
+        assert response.status_code == 429
+        assert sample("firewall_rate_limit_decisions_total", {"decision": "allowed"}) == allowed + 1
+        assert sample("firewall_rate_limit_decisions_total", {"decision": "blocked"}) == blocked + 1
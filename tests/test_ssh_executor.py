@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from unittest.mock import MagicMock, patch
+
+from app.ssh_executor import SSHExecutor
+from app.ssh_pool import SSHSessionPool
+
+
+def device(host):
+    return {'device_type': 'linux', 'host': host, 'username': 'admin', 'password': 'password'}
+
+
+@pytest.fixture
+def fake_lease():
+    """Фикстура для подмены аренды SSH-сессии"""
+    lease = MagicMock()
+    lease.__enter__.return_value = MagicMock()
+    lease.__exit__.return_value = False
+    with patch('app.ssh_executor.ssh_pool.lease', return_value=lease) as mock_lease:
+        yield mock_lease
+
+
+class TestSSHExecutor:
+    """Тесты исполнителя операций с устройствами"""
+
+    @pytest.mark.asyncio
+    async def test_event_loop_not_blocked(self, fake_lease):
+        """Медленная операция с устройством не блокирует event loop"""
+        executor = SSHExecutor(max_workers=2)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        await asyncio.gather(executor.run(device('10.0.0.1'), lambda ssh: time.sleep(0.2)), ticker())
+        assert ticks == 5
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_per_device_serialization(self, fake_lease):
+        """Операции с одним устройством не пересекаются, с разными - идут параллельно"""
+        executor = SSHExecutor(max_workers=4)
+        active: dict[str, int] = {}
+        max_active: dict[str, int] = {}
+        lock = threading.Lock()
+
+        def job(ssh, host):
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                max_active[host] = max(max_active.get(host, 0), active[host])
+            time.sleep(0.05)
+            with lock:
+                active[host] -= 1
+
+        start = time.monotonic()
+        await asyncio.gather(*(executor.run(device(h), job, h) for h in ['10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.2']))
+        elapsed = time.monotonic() - start
+
+        assert max_active == {'10.0.0.1': 1, '10.0.0.2': 1}
+        # Два устройства обрабатываются параллельно: ~2 операции подряд, а не 4
+        assert elapsed < 0.18
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_queue_stats(self, fake_lease):
+        """Глубина очереди и время ожидания учитываются"""
+        executor = SSHExecutor(max_workers=1)
+        await asyncio.gather(*(executor.run(device(f'10.0.0.{i}'), lambda ssh: time.sleep(0.02)) for i in range(3)))
+
+        stats = executor.get_stats()
+        assert stats['submitted'] == 3
+        assert stats['completed'] == 3
+        assert stats['queue_depth'] == 0
+        assert stats['running'] == 0
+        assert stats['max_queue_depth'] >= 2
+        assert stats['max_wait_ms'] >= 20
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_error_propagates(self, fake_lease):
+        """Ошибка операции возвращается вызывающему и учитывается"""
+        executor = SSHExecutor(max_workers=1)
+
+        def failing(ssh):
+            raise RuntimeError("command failed")
+
+        with pytest.raises(RuntimeError):
+            await executor.run(device('10.0.0.1'), failing)
+        assert executor.get_stats()['failed'] == 1
+        executor.shutdown()
+
+
+class TestSSHExecutorHealthCheck:
+    """Тесты проверки доступности вне очереди устройства"""
+
+    @pytest.mark.asyncio
+    async def test_check_not_queued_behind_job(self):
+        """Проверка получает свободную сессию, пока идёт долгая операция"""
+        executor = SSHExecutor(max_workers=4)
+        pool = SSHSessionPool(max_per_device=2)
+        with patch('app.ssh_pool.ConnectHandler', side_effect=lambda **kwargs: MagicMock()), \
+             patch('app.ssh_executor.ssh_pool', pool):
+            job = asyncio.create_task(executor.run(device('10.0.0.1'), lambda ssh: time.sleep(0.5)))
+            await asyncio.sleep(0.05)
+            start = time.monotonic()
+            assert await executor.check(device('10.0.0.1')) is True
+            assert time.monotonic() - start < 0.3
+            await job
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_check_busy_device(self):
+        """Все сессии заняты - результат None, а не ошибка"""
+        executor = SSHExecutor(max_workers=4)
+        pool = SSHSessionPool(max_per_device=1)
+        with patch('app.ssh_pool.ConnectHandler', side_effect=lambda **kwargs: MagicMock()), \
+             patch('app.ssh_executor.ssh_pool', pool):
+            job = asyncio.create_task(executor.run(device('10.0.0.1'), lambda ssh: time.sleep(0.3)))
+            await asyncio.sleep(0.05)
+            assert await executor.check(device('10.0.0.1'), lease_timeout=0.05) is None
+            await job
+        assert pool.get_health('10.0.0.1', 'admin')['consecutive_failures'] == 0
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_checks_do_not_occupy_job_workers(self):
+        """Массовые проверки не занимают потоки операций: операция с другим устройством не ждёт"""
+        executor = SSHExecutor(max_workers=2, health_workers=1)
+        release = threading.Event()
+
+        def slow_connect(**kwargs):
+            release.wait(1)
+            return MagicMock()
+
+        with patch('app.ssh_pool.ConnectHandler', side_effect=slow_connect), \
+             patch('app.ssh_executor.ssh_pool', SSHSessionPool(max_per_device=1)):
+            checks = [asyncio.create_task(executor.check(device(f'10.0.1.{i}'))) for i in range(4)]
+            await asyncio.sleep(0.05)
+            with patch('app.ssh_executor.ssh_pool.lease') as lease:
+                lease.return_value.__enter__.return_value = MagicMock()
+                lease.return_value.__exit__.return_value = False
+                assert await asyncio.wait_for(executor.run(device('10.0.0.2'), lambda ssh: 'ok'), 0.5) == 'ok'
+            release.set()
+            await asyncio.gather(*checks)
+        executor.shutdown()
+
+
+class TestSSHExecutorForgetDevice:
+    """Тесты очистки очередей удалённых устройств"""
+
+    @pytest.mark.asyncio
+    async def test_forget_device(self, fake_lease):
+        """Очередь удалённого устройства удаляется"""
+        executor = SSHExecutor(max_workers=2)
+        await executor.run(device('10.0.0.1'), lambda ssh: None)
+        assert len(executor._device_locks) == 1
+
+        executor.forget_device(device('10.0.0.1'))
+
+        assert executor._device_locks == {}
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_forget_busy_device_keeps_lock(self, fake_lease):
+        """Занятая очередь не удаляется: операции не выполнятся параллельно"""
+        executor = SSHExecutor(max_workers=2)
+        job = asyncio.create_task(executor.run(device('10.0.0.1'), lambda ssh: time.sleep(0.1)))
+        await asyncio.sleep(0.02)
+
+        executor.forget_device(device('10.0.0.1'))
+
+        assert len(executor._device_locks) == 1
+        await job
+        executor.shutdown()
@@ -0,0 +1,215 @@
+import threading
+import time
+
+import pytest
+from unittest.mock import Mock, patch
+from netmiko.exceptions import ReadTimeout
+
+from app.ssh_pool import (
+    HEALTH_DEGRADED,
+    HEALTH_HEALTHY,
+    HEALTH_UNREACHABLE,
+    SSHPoolTimeout,
+    SSHSessionPool,
+    device_key,
+)
+
+
+DEVICE = {
+    'device_type': 'linux',
+    'host': '192.168.1.1',
+    'username': 'admin',
+    'password': 'password'
+}
+
+
+@pytest.fixture
+def connect_handler():
+    """Фикстура для подмены ConnectHandler: каждый вызов - новый мок соединения"""
+    with patch('app.ssh_pool.ConnectHandler', side_effect=lambda **kwargs: Mock()) as mock_connect:
+        yield mock_connect
+
+
+class TestSSHSessionLease:
+    """Тесты аренды SSH-сессий"""
+
+    def test_device_key(self):
+        """Единый ключ устройства не зависит от модуля-вызывающего"""
+        assert device_key(DEVICE) == '192.168.1.1:22:admin'
+        assert device_key({**DEVICE, 'port': 2222}) == '192.168.1.1:2222:admin'
+
+    def test_session_reused_after_release(self, connect_handler):
+        """Возвращённая сессия переиспользуется без повторного логина"""
+        pool = SSHSessionPool(max_per_device=2)
+        with pool.lease(DEVICE) as first:
+            pass
+        with pool.lease(DEVICE) as second:
+            pass
+
+        assert first is second
+        connect_handler.assert_called_once()
+        assert pool.get_status()['reused'] == 1
+
+    def test_concurrent_leases_get_separate_sessions(self, connect_handler):
+        """Параллельные аренды никогда не делят один канал"""
+        pool = SSHSessionPool(max_per_device=2)
+        with pool.lease(DEVICE) as first, pool.lease(DEVICE) as second:
+            assert first is not second
+        assert connect_handler.call_count == 2
+
+    def test_max_sessions_per_device(self, connect_handler):
+        """Сверх лимита запрос ждёт освобождения сессии"""
+        pool = SSHSessionPool(max_per_device=1)
+        leased = []
+
+        with pool.lease(DEVICE) as first:
+            def worker():
+                with pool.lease(DEVICE, timeout=2) as ssh:
+                    leased.append(ssh)
+
+            thread = threading.Thread(target=worker)
+            thread.start()
+            time.sleep(0.05)
+            # Пока первая сессия занята, вторая не выдана
+            assert leased == []
+
+        thread.join(timeout=2)
+        assert leased == [first]
+        connect_handler.assert_called_once()
+
+    def test_lease_timeout(self, connect_handler):
+        """Таймаут ожидания свободной сессии"""
+        pool = SSHSessionPool(max_per_device=1)
+        with pool.lease(DEVICE):
+            with pytest.raises(SSHPoolTimeout):
+                with pool.lease(DEVICE, timeout=0.05):
+                    pass
+        assert pool.get_status()['lease_timeouts'] == 1
+
+    def test_error_discards_session(self, connect_handler):
+        """После ошибки канала в блоке with сессия закрывается и не возвращается в пул"""
+        pool = SSHSessionPool()
+        with pytest.raises(ReadTimeout):
+            with pool.lease(DEVICE) as ssh:
+                raise ReadTimeout("channel broken")
+
+        ssh.disconnect.assert_called_once()
+        assert pool.get_status()['total_connections'] == 0
+        assert pool.get_health('192.168.1.1', 'admin')['state'] == HEALTH_DEGRADED
+
+    def test_application_error_keeps_session(self, connect_handler):
+        """Ошибка кода вызывающего не закрывает сессию и не считается сбоем устройства"""
+        pool = SSHSessionPool()
+        with pytest.raises(ValueError):
+            with pool.lease(DEVICE) as first:
+                raise ValueError("unexpected command output")
+        with pool.lease(DEVICE) as second:
+            pass
+
+        assert second is first
+        first.disconnect.assert_not_called()
+        assert connect_handler.call_count == 1
+        assert pool.get_health('192.168.1.1', 'admin')['state'] == HEALTH_HEALTHY
+
+    def test_stale_session_validated(self, connect_handler):
+        """Долго простаивавшая мёртвая сессия заменяется новой"""
+        pool = SSHSessionPool(validate_after=0)
+        with pool.lease(DEVICE) as first:
+            first.is_alive.return_value = False
+        with pool.lease(DEVICE) as second:
+            pass
+
+        assert first is not second
+        first.disconnect.assert_called_once()
+
+
+class TestSSHSessionPoolMaintenance:
+    """Тесты обслуживания пула"""
+
+    def test_evict_idle(self, connect_handler):
+        """Простаивающие сессии закрываются"""
+        pool = SSHSessionPool(idle_timeout=0)
+        with pool.lease(DEVICE) as ssh:
+            pass
+
+        assert pool.evict_idle() == 1
+        ssh.disconnect.assert_called_once()
+        assert pool.get_status()['total_connections'] == 0
+
+    def test_close_device_while_leased(self, connect_handler):
+        """Занятая сессия закрывается после возврата"""
+        pool = SSHSessionPool()
+        with pool.lease(DEVICE) as ssh:
+            assert pool.close_device('192.168.1.1', 'admin') == 0
+            ssh.disconnect.assert_not_called()
+
+        ssh.disconnect.assert_called_once()
+        assert pool.get_status()['total_connections'] == 0
+
+    def test_health_unreachable_after_failures(self):
+        """Несколько неудачных подключений подряд - устройство недоступно"""
+        pool = SSHSessionPool()
+        with patch('app.ssh_pool.ConnectHandler', side_effect=ConnectionRefusedError("Connection refused")):
+            for _ in range(3):
+                with pytest.raises(ConnectionRefusedError):
+                    with pool.lease(DEVICE):
+                        pass
+
+        health = pool.get_health('192.168.1.1', 'admin')
+        assert health['state'] == HEALTH_UNREACHABLE
+        assert health['consecutive_failures'] == 3
+        assert health['last_error'] == "Connection refused"
+
+        with patch('app.ssh_pool.ConnectHandler', return_value=Mock()):
+            with pool.lease(DEVICE):
+                pass
+        assert pool.get_health('192.168.1.1', 'admin')['state'] == HEALTH_HEALTHY
+
+
+class TestSSHSessionPoolLocking:
+    """Тесты блокировок пула"""
+
+    def test_slow_device_does_not_block_others(self):
+        """Медленное подключение к одному устройству не задерживает другие"""
+        pool = SSHSessionPool()
+        slow_started = threading.Event()
+        release_slow = threading.Event()
+
+        def connect(**kwargs):
+            if kwargs['host'] == '10.0.0.1':
+                slow_started.set()
+                release_slow.wait(2)
+            return Mock()
+
+        with patch('app.ssh_pool.ConnectHandler', side_effect=connect):
+            def slow_worker():
+                with pool.lease({**DEVICE, 'host': '10.0.0.1'}):
+                    pass
+
+            thread = threading.Thread(target=slow_worker)
+            thread.start()
+            assert slow_started.wait(2)
+
+            start = time.monotonic()
+            with pool.lease({**DEVICE, 'host': '10.0.0.2'}):
+                pass
+            assert time.monotonic() - start < 0.5
+
+            # Статус отдаётся по кэшу, пока медленное подключение ещё идёт
+            status = pool.get_status()
+            assert {d['device']: d['connecting'] for d in status['connections']}['10.0.0.1:22:admin'] == 1
+
+            release_slow.set()
+            thread.join(timeout=2)
+
+    def test_status_does_not_probe_sessions(self, connect_handler):
+        """Статус пула не обращается к устройствам"""
+        pool = SSHSessionPool()
+        with pool.lease(DEVICE) as ssh:
+            pass
+
+        status = pool.get_status()
+        ssh.is_alive.assert_not_called()
+        ssh.send_command.assert_not_called()
+        assert status['connections'][0]['health']['state'] == HEALTH_HEALTHY
+        assert status['connections'][0]['health']['last_success_age'] is not None